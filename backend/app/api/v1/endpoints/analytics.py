@@ -1,28 +1,65 @@
 """Эндпоинты аналитики."""
 
+import json
+import numpy as np
+from decimal import Decimal
 from typing import Optional
 from datetime import datetime, date, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.security import get_current_user
 from app.core.database_sync import get_db
 from app.models.user import User
-from app.repositories.portfolio import PortfolioRepository
+from app.repositories.portfolio import (
+    ALLOCATION_DIMENSIONS, DEFAULT_MAX_POINTS, POSITION_SORT_KEYS, PortfolioRepository
+)
 from app.repositories.transaction import TransactionRepository
 from app.services.portfolio_analytics import (
     PortfolioAnalyticsService, 
     CashFlow, 
     PricePoint
 )
+from app.services.analytics_engine import iter_rolling_metrics
+from app.services.benchmark_service import BenchmarkSeriesService
+from app.services.metric_state import PortfolioMetricStateService, state_metrics
+from app.services.metrics_pipeline import period_cash_flows
+from app.services.series_store import SeriesStore
 
 router = APIRouter()
 
+# Периодов доходности в году для аннуализации волатильности по разрешению ряда
+PERIODS_PER_YEAR = {"daily": 252, "weekly": 52, "monthly": 12}
+
+
+def _performance_xirr(analytics_service: PortfolioAnalyticsService,
+                      transaction_repo: TransactionRepository,
+                      portfolio_id: int,
+                      first_point: PricePoint,
+                      last_point: PricePoint) -> Optional[Decimal]:
+    """XIRR интервала между двумя точками стоимости по внешним потокам портфеля"""
+    external_flows = transaction_repo.get_external_flows(
+        [portfolio_id],
+        end_date=datetime.combine(last_point.date, datetime.max.time()),
+        start_date=datetime.combine(first_point.date + timedelta(days=1), datetime.min.time())
+    )
+    return analytics_service.calculate_xirr_from_cash_flows(
+        [CashFlow(date=first_point.date, amount=-first_point.value, description="initial value")]
+        + [
+            CashFlow(date=ts.date(), amount=-amount, description="external flow")
+            for _, ts, amount in external_flows
+        ]
+        + [CashFlow(date=last_point.date, amount=last_point.value, description="final value")]
+    )
+
 
 @router.get("/performance")
 async def get_performance(
     portfolio_id: int,
-    period: Optional[str] = Query(None, description="1d, 1w, 1m, 3m, 6m, 1y, 3y, 5y, inception"),
+    period: Optional[str] = Query(None, description="1d, 1w, 1m, 3m, 6m, 1y, 3y, 5y, inception, all"),
+    resolution: str = Query("daily", description="Разрешение ряда снимков: daily, weekly, monthly, auto"),
+    max_points: int = Query(DEFAULT_MAX_POINTS, ge=10, le=5000, description="Бюджет точек для resolution=auto"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -59,7 +96,7 @@ async def get_performance(
             '5y': 365 * 5,
         }
         
-        if period == 'inception':
+        if period in ('inception', 'all'):
             start_date = portfolio.created_at.date()
         elif period in period_mapping:
             start_date = end_date - timedelta(days=period_mapping[period])
@@ -71,12 +108,42 @@ async def get_performance(
     else:
         start_date = portfolio.created_at.date()
     
-    # Получаем снимки портфеля для расчета TWR
-    snapshots = portfolio_repo.get_snapshots(
-        portfolio_id=portfolio_id,
-        start_date=datetime.combine(start_date, datetime.min.time()),
-        end_date=datetime.combine(end_date, datetime.max.time())
-    )
+    # С начала истории метрики берутся из накопленного состояния без чтения
+    # снимков, если оно учло последний снимок
+    if period in (None, 'inception'):
+        state = PortfolioMetricStateService(db).get(portfolio_id)
+        if (
+            state is not None
+            and state.count > 0
+            and state.last_snapshot_date == portfolio_repo.get_last_snapshot_date(portfolio_id)
+        ):
+            metrics = state_metrics(state)
+            return {
+                "portfolio_id": portfolio_id,
+                "period": "inception",
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+                "twr": float(metrics["twr_inception"]),
+                "xirr": float(portfolio.xirr) if portfolio.xirr else None,
+                "total_return": float(portfolio.total_pnl_percent) if portfolio.total_pnl_percent else None,
+                "volatility": float(metrics["volatility"]) if metrics["volatility"] else None,
+                "sharpe_ratio": float(metrics["sharpe_ratio"]) if metrics["sharpe_ratio"] else None,
+                "max_drawdown": float(metrics["max_drawdown"]) if metrics["max_drawdown"] else None,
+                "data_points": state.count + 1,
+                "calculated_at": state.updated_at.isoformat() if state.updated_at else None
+            }
+    
+    # Получаем снимки портфеля для расчета TWR (последний снимок интервала)
+    try:
+        resolution, snapshots = portfolio_repo.get_snapshot_buckets(
+            portfolio_id=portfolio_id,
+            start_date=datetime.combine(start_date, datetime.min.time()),
+            end_date=datetime.combine(end_date, datetime.max.time()),
+            resolution=resolution,
+            max_points=max_points
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
     if not snapshots:
         # Если нет снимков, возвращаем базовые метрики из портфеля
@@ -129,15 +196,27 @@ async def get_performance(
     # Рассчитываем метрики
     analytics_service = PortfolioAnalyticsService()
     
-    # TWR для указанного периода
-    period_days = (end_date - start_date).days
-    twr = analytics_service.calculate_twr(price_points, cash_flows, period_days)
-    
-    # XIRR
-    xirr = analytics_service.calculate_xirr(cash_flows)
+    # TWR для указанного периода; для 'all' - все горизонты за один проход
+    periods = None
+    if period == 'all':
+        periods = analytics_service.calculate_twr_horizons(price_points, cash_flows)
+        twr = periods['twr_inception']
+    else:
+        period_days = (end_date - start_date).days
+        twr = analytics_service.calculate_twr(price_points, cash_flows, period_days)
+    
+    # XIRR с точки зрения инвестора: стоимость на начало как вложение, только
+    # внешние потоки (пополнения и выводы, как get_external_flows) после первой
+    # точки и стоимость на конец как итоговое получение. Покупки и продажи -
+    # движения внутри портфеля и в XIRR не входят.
+    first_point = min(price_points, key=lambda p: p.date)
+    last_point = max(price_points, key=lambda p: p.date)
+    xirr = None
+    if first_point.date < last_point.date:
+        xirr = _performance_xirr(analytics_service, transaction_repo, portfolio_id, first_point, last_point)
     
     # Другие метрики
-    volatility = analytics_service.calculate_volatility(price_points)
+    volatility = analytics_service.calculate_volatility(price_points, PERIODS_PER_YEAR[resolution])
     max_drawdown = analytics_service.calculate_max_drawdown(price_points)
     
     # Коэффициент Шарпа
@@ -153,7 +232,7 @@ async def get_performance(
         if initial_value > 0:
             total_return = ((final_value - initial_value) / initial_value) * 100
     
-    return {
+    response = {
         "portfolio_id": portfolio_id,
         "period": period or "inception",
         "start_date": start_date.isoformat(),
@@ -165,8 +244,17 @@ async def get_performance(
         "sharpe_ratio": float(sharpe_ratio) if sharpe_ratio else None,
         "max_drawdown": float(max_drawdown) if max_drawdown else None,
         "data_points": len(price_points),
+        "resolution": resolution,
         "calculated_at": datetime.now().isoformat()
     }
+    
+    if periods is not None:
+        response["periods"] = {
+            name: float(value) if value is not None else None
+            for name, value in periods.items()
+        }
+    
+    return response
 
 
 @router.get("/allocation")
@@ -194,82 +282,29 @@ async def get_allocation(
             detail="Нет доступа к этому портфелю"
         )
     
-    # Получаем холдинги портфеля
-    from app.repositories.account import AccountRepository
-    from app.models.holding import Holding
-    from app.models.instrument import Instrument
-    from sqlalchemy.orm import selectinload
-    from sqlalchemy import select, and_
-    
-    account_repo = AccountRepository(db)
-    accounts = account_repo.get_portfolio_accounts(portfolio_id)
-    
-    if not accounts:
-        return {
-            "portfolio_id": portfolio_id,
-            "allocation_by": by,
-            "total_value": 0,
-            "allocation": {},
-            "calculated_at": datetime.now().isoformat()
-        }
-    
-    # Получаем все холдинги с инструментами
-    account_ids = [acc.id for acc in accounts]
-    holdings_stmt = (
-        select(Holding)
-        .options(selectinload(Holding.instrument))
-        .where(Holding.account_id.in_(account_ids))
-    )
-    
-    holdings_result = db.execute(holdings_stmt)
-    holdings = holdings_result.scalars().all()
-    
-    # Преобразуем в формат для аналитики
-    holdings_data = []
-    for holding in holdings:
-        market_value = holding.quantity * holding.avg_price  # Упрощенно, без текущих цен
-        
-        instrument_data = {
-            'market_value': float(market_value),
-            'instrument_type': holding.instrument.instrument_type.value if holding.instrument else 'unknown',
-            'sector': holding.instrument.sector if holding.instrument else 'unknown',
-            'country': holding.instrument.country if holding.instrument else 'unknown', 
-            'currency': holding.currency,
-        }
-        holdings_data.append(instrument_data)
-    
-    # Рассчитываем распределение
-    analytics_service = PortfolioAnalyticsService()
-    allocation = analytics_service.calculate_asset_allocation(holdings_data)
-    
-    # Выбираем нужное распределение
-    allocation_key_mapping = {
-        'asset_class': 'by_asset_class',
-        'sector': 'by_sector', 
-        'country': 'by_country',
-        'currency': 'by_currency'
-    }
-    
-    if by not in allocation_key_mapping:
+    if by not in ALLOCATION_DIMENSIONS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Поддерживаемые типы распределения: asset_class, sector, country, currency"
         )
     
-    selected_allocation = allocation.get(allocation_key_mapping[by], {})
+    # Все разрезы одним сгруппированным запросом по текущим ценам
+    total_value, breakdowns = portfolio_repo.get_allocation(portfolio_id)
     
-    # Конвертируем Decimal в float
-    formatted_allocation = {
-        k: float(v) for k, v in selected_allocation.items()
+    allocations = {
+        name: {
+            key: float(value / total_value * 100) if total_value > 0 else 0.0
+            for key, value in breakdown.items()
+        }
+        for name, breakdown in breakdowns.items()
     }
     
-    total_value = sum(h['market_value'] for h in holdings_data)
-    
     return {
         "portfolio_id": portfolio_id,
         "allocation_by": by,
-        "total_value": total_value,
-        "allocation": formatted_allocation,
+        "total_value": float(total_value),
+        "allocation": allocations[by],
+        "allocations": allocations,
         "calculated_at": datetime.now().isoformat()
     }
 
@@ -316,12 +351,284 @@ async def get_pnl_breakdown(
 @router.get("/top-positions")
 async def get_top_positions(
     portfolio_id: int,
-    limit: int = Query(10, description="Количество топ позиций"),
-    sort_by: str = Query("value", description="value, pnl_percent, weight"),
+    limit: int = Query(10, ge=1, le=500, description="Количество топ позиций"),
+    sort_by: str = Query("value", description="value, pnl, pnl_percent, weight"),
+    after: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor)"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Получение топ позиций портфеля."""
+    """Крупнейшие позиции портфеля по текущим ценам с keyset-пагинацией."""
+    
+    # Проверяем доступ к портфелю
+    portfolio_repo = PortfolioRepository(db)
+    portfolio = portfolio_repo.get_by_id(portfolio_id)
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Портфель не найден"
+        )
+    
+    if portfolio.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этому портфелю"
+        )
+    
+    if sort_by not in POSITION_SORT_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Поддерживаемые сортировки: value, pnl, pnl_percent, weight"
+        )
+    
+    cursor = None
+    if after:
+        try:
+            key, instrument_id = after.rsplit(":", 1)
+            cursor = (Decimal(key), int(instrument_id))
+        except (ValueError, ArithmeticError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Некорректный курсор"
+            )
+    
+    rows, total_positions = portfolio_repo.get_top_positions(
+        portfolio_id, sort_by=sort_by, limit=limit, after=cursor
+    )
+    
+    def as_float(value):
+        return float(value) if value is not None else None
+    
+    positions = [
+        {
+            "instrument_id": row["instrument_id"],
+            "ticker": row["ticker"],
+            "name": row["name"],
+            "quantity": float(row["quantity"]),
+            "avg_price": as_float(row["avg_price"]),
+            "market_price": as_float(row["market_price"]),
+            "market_value": as_float(row["market_value"]),
+            "cost_value": as_float(row["cost_value"]),
+            "pnl": as_float(row["pnl"]),
+            "pnl_percent": as_float(row["pnl_percent"]),
+            "weight": as_float(row["weight"]),
+            "currency": row["currency"]
+        }
+        for row in rows
+    ]
+    
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = f"{last['sort_key']}:{last['instrument_id']}"
+    
+    return {
+        "portfolio_id": portfolio_id,
+        "total_positions": total_positions,
+        "showing": len(positions),
+        "sorted_by": sort_by,
+        "positions": positions,
+        "next_cursor": next_cursor,
+        "calculated_at": datetime.now().isoformat()
+    }
+
+
+@router.get("/rolling")
+async def get_rolling_metrics(
+    portfolio_id: int,
+    window: int = Query(63, ge=5, le=1260, description="Размер окна в торговых днях (например, 63 или 252)"),
+    start_date: Optional[date] = Query(None, description="Начало выдачи ряда"),
+    end_date: Optional[date] = Query(None, description="Конец выдачи ряда"),
+    benchmark_id: Optional[int] = Query(None, description="Бенчмарк для беты и корреляции (по умолчанию - бенчмарк портфеля)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Скользящие волатильность, Шарп, бета и просадка портфеля.
+
+    Доходности очищены от пополнений и выводов (TWR), бенчмарк выравнивается
+    на даты ряда as-of. Весь ряд считается за один проход и отдается потоком
+    NDJSON (одна JSON-точка на строку).
+    """
+    
+    # Проверяем доступ к портфелю
+    portfolio_repo = PortfolioRepository(db)
+    portfolio = portfolio_repo.get_by_id(portfolio_id)
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Портфель не найден"
+        )
+    
+    if portfolio.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этому портфелю"
+        )
+    
+    # Ряд из хранилища рядов (без загрузки снимков), иначе из portfolio_snapshots
+    series_store = SeriesStore.from_settings()
+    days, values = series_store.values(portfolio_id, end=end_date) if series_store else (None, None)
+    if days is not None and len(days):
+        dates = days.tolist()
+    else:
+        snapshots = portfolio_repo.get_snapshots(
+            portfolio_id=portfolio_id,
+            end_date=datetime.combine(end_date, datetime.max.time()) if end_date else None,
+        )
+        values = [float(s.total_value) for s in snapshots]
+        dates = [s.snapshot_date.date() for s in snapshots]
+    
+    cash_flows = benchmark_returns = None
+    if len(dates) > 1:
+        flows = TransactionRepository(db).get_external_flows(
+            [portfolio_id], end_date=datetime.combine(dates[-1], datetime.max.time())
+        )
+        cash_flows = period_cash_flows(
+            np.array(dates, dtype="datetime64[D]"),
+            np.array([ts.date() for _, ts, _ in flows], dtype="datetime64[D]"),
+            np.array([float(amount) for _, _, amount in flows])
+        )
+        benchmarks = BenchmarkSeriesService(db)
+        if benchmark_id is not None:
+            benchmark_returns = benchmarks.aligned_returns({benchmark_id: 1.0}, dates)
+        else:
+            benchmark_returns = benchmarks.portfolio_returns(portfolio_id, dates)
+    
+    def stream():
+        # Окно прогревается на данных до start_date, в выдачу попадают точки с start_date
+        for point in iter_rolling_metrics(values, dates, window=window,
+                                          benchmark_returns=benchmark_returns, cash_flows=cash_flows):
+            if start_date and point.date < start_date:
+                continue
+            yield json.dumps(point.to_dict()) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.get("/history")
+async def get_value_history(
+    portfolio_id: int,
+    start_date: Optional[date] = Query(None, description="Начало ряда"),
+    end_date: Optional[date] = Query(None, description="Конец ряда"),
+    resolution: str = Query("auto", description="daily, weekly, monthly, auto"),
+    max_points: int = Query(DEFAULT_MAX_POINTS, ge=10, le=5000, description="Бюджет точек для resolution=auto"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    История стоимости портфеля для графиков: последний снимок каждого
+    интервала, не более max_points точек при resolution=auto.
+    """
+    
+    # Проверяем доступ к портфелю
+    portfolio_repo = PortfolioRepository(db)
+    portfolio = portfolio_repo.get_by_id(portfolio_id)
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Портфель не найден"
+        )
+    
+    if portfolio.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этому портфелю"
+        )
+    
+    try:
+        resolution, snapshots = portfolio_repo.get_snapshot_buckets(
+            portfolio_id=portfolio_id,
+            start_date=datetime.combine(start_date, datetime.min.time()) if start_date else None,
+            end_date=datetime.combine(end_date, datetime.max.time()) if end_date else None,
+            resolution=resolution,
+            max_points=max_points
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return {
+        "portfolio_id": portfolio_id,
+        "resolution": resolution,
+        "points": [
+            {
+                "date": s.snapshot_date.date().isoformat(),
+                "total_value": float(s.total_value),
+                "total_cost": float(s.total_cost),
+                "total_pnl": float(s.total_pnl),
+            }
+            for s in snapshots
+        ]
+    }
+
+
+@router.get("/stress/historical")
+async def get_historical_stress(
+    portfolio_id: int,
+    scenarios: Optional[str] = Query(
+        None, description="Ключи сценариев через запятую (gfc_2008, rub_2014, covid_2020, moex_2022)"
+    ),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Проигрывание исторических кризисных эпизодов на текущих весах портфеля."""
+    
+    # Проверяем доступ к портфелю
+    portfolio_repo = PortfolioRepository(db)
+    portfolio = portfolio_repo.get_by_id(portfolio_id)
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Портфель не найден"
+        )
+    
+    if portfolio.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этому портфелю"
+        )
+    
+    from app.services.quotes import QuoteService
+    from app.services.scenario_replay import HistoricalScenarioLibrary
+    
+    keys = [key.strip() for key in scenarios.split(",") if key.strip()] if scenarios else None
+    
+    holdings = _portfolio_holdings(db, portfolio_id)
+    
+    # Текущие веса: количество × последняя цена (средняя цена покупки, если котировок нет)
+    latest = QuoteService(db).get_prices({h.instrument_id for h in holdings})
+    values = {}
+    for instrument_id, quantity, avg_price in holdings:
+        price = latest.get(instrument_id, avg_price)
+        values[instrument_id] = values.get(instrument_id, 0.0) + float(quantity * price)
+    
+    total_value = sum(values.values())
+    weights = {instrument_id: value / total_value for instrument_id, value in values.items()} if total_value else {}
+    
+    try:
+        replay = HistoricalScenarioLibrary(db).replay(weights, keys) if weights else {}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return {
+        "portfolio_id": portfolio_id,
+        "total_value": total_value,
+        "scenarios": replay,
+        "calculated_at": datetime.now().isoformat()
+    }
+
+
+@router.get("/correlation")
+async def get_correlation_matrix(
+    portfolio_id: int,
+    method: str = Query("ewma", description="ewma или ledoit_wolf"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Корреляционная матрица инструментов портфеля (для тепловой карты)."""
     
     # Проверяем доступ к портфелю
     portfolio_repo = PortfolioRepository(db)
@@ -339,76 +646,109 @@ async def get_top_positions(
             detail="Нет доступа к этому портфелю"
         )
     
-    # Получаем холдинги с инструментами
-    from app.repositories.account import AccountRepository
-    from app.models.holding import Holding
     from app.models.instrument import Instrument
-    from sqlalchemy.orm import selectinload
+    from app.services.covariance_service import CovarianceService
     from sqlalchemy import select
     
-    account_repo = AccountRepository(db)
-    accounts = account_repo.get_portfolio_accounts(portfolio_id)
-    
-    if not accounts:
+    instrument_ids = sorted({h.instrument_id for h in _portfolio_holdings(db, portfolio_id)})
+    if len(instrument_ids) < 2:
         return {
             "portfolio_id": portfolio_id,
-            "positions": [],
+            "method": method,
+            "instruments": [],
+            "matrix": [],
             "calculated_at": datetime.now().isoformat()
         }
     
-    account_ids = [acc.id for acc in accounts]
-    holdings_stmt = (
-        select(Holding)
-        .options(selectinload(Holding.instrument))
-        .where(Holding.account_id.in_(account_ids))
-    )
+    try:
+        estimate = CovarianceService(db).get_or_build(instrument_ids, method)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    holdings_result = db.execute(holdings_stmt)
-    holdings = holdings_result.scalars().all()
+    tickers = dict(db.execute(
+        select(Instrument.id, Instrument.ticker).where(Instrument.id.in_(instrument_ids))
+    ).all())
     
-    # Формируем позиции
-    positions = []
-    total_portfolio_value = float(portfolio.total_value or 0)
+    return {
+        "portfolio_id": portfolio_id,
+        "method": estimate.method,
+        "as_of": estimate.as_of.isoformat(),
+        "observations": estimate.observations,
+        "instruments": [
+            {"id": instrument_id, "ticker": tickers.get(instrument_id)}
+            for instrument_id in estimate.instrument_ids
+        ],
+        "matrix": np.round(estimate.correlation(), 4).tolist(),
+        "calculated_at": datetime.now().isoformat()
+    }
+
+
+@router.get("/attribution")
+async def get_attribution(
+    portfolio_id: int,
+    benchmarks: str = Query(
+        ..., description="Политика бенчмарка: сегмент:вес:benchmark_id через запятую (equity:0.6:1,bond:0.4:2)"
+    ),
+    dimension: str = Query("asset_class", description="asset_class, sector, country, currency"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Атрибуция доходности по Бринсону (распределение, выбор, взаимодействие)."""
     
-    for holding in holdings:
-        market_value = float(holding.quantity * holding.avg_price)
-        cost_value = float(holding.quantity * holding.avg_price)  # Упрощение
-        pnl = market_value - cost_value
-        pnl_percent = (pnl / cost_value * 100) if cost_value > 0 else 0
-        weight = (market_value / total_portfolio_value * 100) if total_portfolio_value > 0 else 0
-        
-        position = {
-            "instrument_id": holding.instrument_id,
-            "ticker": holding.instrument.ticker if holding.instrument else "N/A",
-            "name": holding.instrument.name if holding.instrument else "Unknown",
-            "quantity": float(holding.quantity),
-            "avg_price": float(holding.avg_price),
-            "market_price": float(holding.avg_price),  # TODO: Получить текущую цену
-            "market_value": market_value,
-            "cost_value": cost_value,
-            "pnl": pnl,
-            "pnl_percent": pnl_percent,
-            "weight": weight,
-            "currency": holding.currency
-        }
-        positions.append(position)
+    # Проверяем доступ к портфелю
+    portfolio_repo = PortfolioRepository(db)
+    portfolio = portfolio_repo.get_by_id(portfolio_id)
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Портфель не найден"
+        )
+    
+    if portfolio.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этому портфелю"
+        )
+    
+    from app.services.attribution import AttributionService
     
-    # Сортируем
-    if sort_by == "value":
-        positions.sort(key=lambda x: x["market_value"], reverse=True)
-    elif sort_by == "pnl_percent":
-        positions.sort(key=lambda x: x["pnl_percent"], reverse=True)
-    elif sort_by == "weight":
-        positions.sort(key=lambda x: x["weight"], reverse=True)
+    try:
+        policy = {}
+        for item in benchmarks.split(","):
+            segment, weight, benchmark_id = item.strip().rsplit(":", 2)
+            policy[segment] = (float(weight), int(benchmark_id))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Формат бенчмарка: сегмент:вес:benchmark_id через запятую"
+        )
     
-    # Ограничиваем количество
-    positions = positions[:limit]
+    try:
+        result = AttributionService(db).attribute(portfolio_id, policy, dimension, start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
     return {
         "portfolio_id": portfolio_id,
-        "total_positions": len(holdings),
-        "showing": len(positions),
-        "sorted_by": sort_by,
-        "positions": positions,
+        **result.to_dict(),
         "calculated_at": datetime.now().isoformat()
     }
+
+
+def _portfolio_holdings(db: Session, portfolio_id: int):
+    """Ненулевые позиции всех счетов портфеля: (instrument_id, quantity, avg_price)."""
+    from app.repositories.account import AccountRepository
+    from app.models.holding import Holding
+    from sqlalchemy import select
+    
+    accounts = AccountRepository(db).get_portfolio_accounts(portfolio_id)
+    if not accounts:
+        return []
+    
+    return db.execute(
+        select(Holding.instrument_id, Holding.quantity, Holding.avg_price)
+        .where(Holding.account_id.in_([acc.id for acc in accounts]), Holding.quantity > 0)
+    ).all()
@@ -211,6 +211,9 @@ class Settings(BaseSettings):
     DEFAULT_TIMEZONE: str = "Europe/Moscow"
     DEFAULT_CURRENCY: str = "RUB"
     
+    # Колоночное хранилище рядов стоимости портфелей (каталог; None - выключено)
+    SERIES_STORE_DIR: Optional[str] = None
+    
     # Загрузка файлов
     MAX_FILE_SIZE_MB: int = 10
     ALLOWED_FILE_TYPES: List[str] = ["csv", "xlsx", "xls", "pdf"]
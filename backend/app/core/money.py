@@ -0,0 +1,96 @@
+"""
+Денежные суммы и количества в целых единицах с фиксированной точкой.
+
+Суммы хранятся в минимальных единицах 1e-4 (DECIMAL(20, 4) в БД),
+количества, цены и курсы - в 1e-8 (DECIMAL(20, 8)). Внутри горячих
+расчетов используются int (скаляры) и массивы int64 NumPy; в Decimal
+значения переводятся только на границе с API и БД. Все округления -
+банковские (half-even), как у Decimal по умолчанию.
+"""
+
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Iterable, List, Union
+
+import numpy as np
+
+
+MONEY_DIGITS = 4
+QUANTITY_DIGITS = 8
+PRICE_DIGITS = 8
+
+MONEY_SCALE = 10 ** MONEY_DIGITS
+QUANTITY_SCALE = 10 ** QUANTITY_DIGITS
+PRICE_SCALE = 10 ** PRICE_DIGITS
+
+# Количество * цена дает единицы 1e-16, сумма - 1e-4
+_VALUE_DIVISOR = QUANTITY_SCALE * PRICE_SCALE // MONEY_SCALE
+
+Number = Union[Decimal, int, float, str]
+
+
+def to_units(value: Number, digits: int) -> int:
+    """Значение в целые единицы 10^-digits (half-even)"""
+    if isinstance(value, int):
+        return value * 10 ** digits
+    if not isinstance(value, Decimal):
+        value = Decimal(repr(value) if isinstance(value, float) else value)
+    return int(value.scaleb(digits).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_units(units: int, digits: int) -> Decimal:
+    """Целые единицы 10^-digits обратно в Decimal"""
+    return Decimal(int(units)).scaleb(-digits)
+
+
+def to_units_array(values: Iterable[Number], digits: int) -> np.ndarray:
+    """Последовательность значений в массив int64; переполнение - OverflowError"""
+    return np.array([to_units(v, digits) for v in values], dtype=np.int64)
+
+
+def from_units_array(units: np.ndarray, digits: int) -> List[Decimal]:
+    return [from_units(u, digits) for u in np.asarray(units).tolist()]
+
+
+def round_div(numerator: int, denominator: int) -> int:
+    """Целочисленное деление с округлением half-even"""
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def mul_div(a: int, b: int, c: int) -> int:
+    """a * b / c с одним округлением (доля суммы пропорционально количеству)"""
+    return round_div(a * b, c)
+
+
+def value_units(quantity: int, price: int) -> int:
+    """Стоимость позиции в единицах суммы: количество (1e-8) * цена (1e-8)"""
+    return round_div(quantity * price, _VALUE_DIVISOR)
+
+
+def value_units_array(quantities: np.ndarray, prices: np.ndarray) -> np.ndarray:
+    """
+    Поэлементная стоимость для массивов int64 без переполнения.
+
+    Прямое произведение в единицах 1e-16 выходит за int64 уже на сотнях
+    рублей, поэтому множители делятся на целую и дробную части
+    q = qh * 1e8 + ql, p = ph * 1e8 + pl, и произведение собирается по
+    частям с точным переносом остатков. Результат совпадает с value_units,
+    пока сама стоимость помещается в int64.
+    """
+    q_high, q_low = np.divmod(np.asarray(quantities, dtype=np.int64), QUANTITY_SCALE)
+    p_high, p_low = np.divmod(np.asarray(prices, dtype=np.int64), PRICE_SCALE)
+
+    # Слагаемые в единицах 1e-16: qh*ph*1e16 + (qh*pl + ql*ph)*1e8 + ql*pl
+    middle_units, middle_rest = np.divmod(q_high * p_low + q_low * p_high, _VALUE_DIVISOR // QUANTITY_SCALE)
+    low_units, low_rest = np.divmod(q_low * p_low, _VALUE_DIVISOR)
+    carry, rest = np.divmod(middle_rest * QUANTITY_SCALE + low_rest, _VALUE_DIVISOR)
+    total = q_high * p_high * MONEY_SCALE + middle_units + low_units + carry
+
+    # Half-even по остатку и четности итога
+    twice = 2 * rest
+    return total + ((twice > _VALUE_DIVISOR) | ((twice == _VALUE_DIVISOR) & (total % 2 == 1)))
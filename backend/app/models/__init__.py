@@ -13,6 +13,7 @@ from .price import *
 from .transaction import *
 from .cashflow import *
 from .benchmark import *
+from .risk_model import *
 # custom_asset модели также используют UUID/ENUM Postgres — исключаем из SQLite
 # крипто-модели пропускаем для совместимости с SQLite
 
@@ -27,6 +28,7 @@ from . import (
     transaction,
     cashflow,
     benchmark,
+    risk_model,
     goal,
     alert,
     notification,
@@ -48,6 +50,7 @@ __all__ = [
     "transaction",
     "cashflow",
     "benchmark",
+    "risk_model",
     "goal",
     "alert",
     "notification",
@@ -2,7 +2,7 @@
 Модель бенчмарков (Benchmark).
 """
 
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, Text
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, Text, ForeignKey, Index
 from datetime import datetime
 
 from app.core.database_sync import Base
@@ -20,3 +20,20 @@ class Benchmark(Base):
     currency = Column(String(3), nullable=False, default="USD")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BenchmarkLevel(Base):
+    """Значение индекса-бенчмарка (IMOEX, RTSI, S&P 500) на дату."""
+    
+    __tablename__ = "benchmark_levels"
+    
+    benchmark_id = Column(Integer, ForeignKey("benchmarks.id"), primary_key=True)
+    ts = Column(DateTime, primary_key=True)
+    level = Column(Numeric(20, 8), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_benchmark_levels_ts', 'ts'),
+    )
+    
+    def __repr__(self) -> str:
+        return f"<BenchmarkLevel(benchmark_id={self.benchmark_id}, ts={self.ts}, level={self.level})>"
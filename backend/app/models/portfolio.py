@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import List, Optional, Dict, Any
 from decimal import Decimal
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, Text, DECIMAL,
+    Column, Integer, String, Boolean, DateTime, Text, DECIMAL, Float,
     ForeignKey, JSON, CheckConstraint, Index
 )
 from sqlalchemy.orm import relationship, Mapped, mapped_column
@@ -194,6 +194,44 @@ class PortfolioSnapshot(Base):
         return f"<PortfolioSnapshot(id={self.id}, portfolio_id={self.portfolio_id}, date={self.snapshot_date})>"
 
 
+
+class PortfolioMetricState(Base):
+    """
+    Накопленное состояние метрик портфеля по ряду снимков.
+
+    Позволяет обновлять волатильность, просадку и TWR при добавлении
+    снимка за O(1), без перечитывания всей истории.
+    """
+    
+    __tablename__ = "portfolio_metric_states"
+    
+    portfolio_id: Mapped[int] = mapped_column(Integer, ForeignKey("portfolios.id"), primary_key=True)
+    
+    # Дневные доходности: число, среднее и сумма квадратов отклонений (Welford)
+    count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    mean_return: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    m2: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    
+    # Индекс TWR (произведение 1 + r), его максимум и максимальная просадка (доля)
+    twr_product: Mapped[float] = mapped_column(Float, default=1.0, nullable=False)
+    peak: Mapped[float] = mapped_column(Float, default=1.0, nullable=False)
+    max_drawdown: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    
+    # Последний учтенный снимок
+    first_snapshot_date: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    last_snapshot_date: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    last_value: Mapped[Optional[Decimal]] = mapped_column(DECIMAL(20, 4))
+    
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False
+    )
+    
+    def __repr__(self) -> str:
+        return f"<PortfolioMetricState(portfolio_id={self.portfolio_id}, count={self.count}, last={self.last_snapshot_date})>"
+
 class PortfolioBenchmark(Base):
     """Связь портфеля с бенчмарками для сравнения."""
     
@@ -2,14 +2,23 @@
 
 from datetime import datetime
 from decimal import Decimal
-from sqlalchemy import Integer, DateTime, DECIMAL, ForeignKey, String, Index
+from sqlalchemy import DDL, Integer, DateTime, DECIMAL, ForeignKey, String, Index, event
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
 
 from app.core.database_sync import Base
 
 
 class Price(Base):
-    """Модель цены инструмента."""
+    """
+    Модель цены инструмента.
+    
+    В PostgreSQL таблица секционирована по месяцам (RANGE по ts, секции
+    prices_yYYYYmMM создаются при загрузке цен, prices_default - для
+    остального); выборка по инструменту идет по первичному ключу
+    (instrument_id, ts) в секциях периода, диапазоны по всем
+    инструментам - по BRIN-индексу ts.
+    """
     
     __tablename__ = "prices"
     
@@ -20,9 +29,38 @@ class Price(Base):
     source: Mapped[str] = mapped_column(String(50), nullable=False)
     
     __table_args__ = (
-        Index('ix_prices_ts', 'ts'),
-        Index('ix_prices_instrument_ts', 'instrument_id', 'ts'),
+        Index('ix_prices_ts_brin', 'ts', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (ts)'},
     )
     
     def __repr__(self) -> str:
         return f"<Price(instrument_id={self.instrument_id}, ts={self.ts}, close={self.close})>"
+
+
+event.listen(
+    Price.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS prices_default PARTITION OF prices DEFAULT").execute_if(dialect="postgresql")
+)
+
+
+class LastPrice(Base):
+    """
+    Последняя цена инструмента - материализация последней строки prices.
+    
+    Обновляется при каждой загрузке цен; текущие котировки читаются по
+    первичному ключу без поиска по истории.
+    """
+    
+    __tablename__ = "last_prices"
+    
+    instrument_id: Mapped[int] = mapped_column(Integer, ForeignKey("instruments.id"), primary_key=True)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    close: Mapped[Decimal] = mapped_column(DECIMAL(20, 8), nullable=False)
+    currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+    
+    def __repr__(self) -> str:
+        return f"<LastPrice(instrument_id={self.instrument_id}, ts={self.ts}, close={self.close})>"
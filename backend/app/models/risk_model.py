@@ -0,0 +1,48 @@
+"""
+Модель сохраненных ковариационных матриц инструментов.
+"""
+
+from datetime import datetime, date
+from typing import Any, Dict, List, Optional
+from sqlalchemy import Integer, String, Date, DateTime, JSON, LargeBinary, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.core.database_sync import Base
+
+
+class CovarianceMatrix(Base):
+    """Состояние оценки ковариации для вселенной инструментов."""
+
+    __tablename__ = "covariance_matrices"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+
+    # Вселенная: sha1 от отсортированных id инструментов и сам список
+    universe_hash: Mapped[str] = mapped_column(String(40), nullable=False)
+    instrument_ids: Mapped[List[int]] = mapped_column(JSON, nullable=False)
+
+    # Метод оценки (ewma, ledoit_wolf) и его параметры
+    method: Mapped[str] = mapped_column(String(20), nullable=False)
+    params: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON)
+
+    # Последняя учтенная дата и число наблюдений
+    as_of: Mapped[date] = mapped_column(Date, nullable=False)
+    observations: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    # Массивы состояния (float32, формат np.savez)
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False
+    )
+
+    __table_args__ = (
+        Index('ix_covariance_matrices_universe_method', 'universe_hash', 'method', unique=True),
+    )
+
+    def __repr__(self) -> str:
+        return f"<CovarianceMatrix(universe_hash='{self.universe_hash}', method='{self.method}', as_of={self.as_of})>"
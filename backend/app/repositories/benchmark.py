@@ -0,0 +1,107 @@
+"""
+Репозиторий для работы с бенчмарками и их историей.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from decimal import Decimal
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import select, and_
+
+from app.models.benchmark import Benchmark, BenchmarkLevel
+from app.models.portfolio import PortfolioBenchmark
+from app.core.logging import logger
+
+
+class BenchmarkRepository:
+    """Репозиторий для работы с бенчмарками."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_by_symbol(self, symbol: str) -> Optional[Benchmark]:
+        """Получение бенчмарка по тикеру (IMOEX, RTSI, SPX...)."""
+        stmt = select(Benchmark).where(Benchmark.symbol == symbol)
+        result = self.db.execute(stmt)
+        return result.scalar_one_or_none()
+
+    def create(
+        self,
+        name: str,
+        symbol: str,
+        currency: str = "RUB",
+        description: Optional[str] = None
+    ) -> Benchmark:
+        """Создание бенчмарка."""
+        benchmark = Benchmark(name=name, symbol=symbol, currency=currency, description=description)
+        self.db.add(benchmark)
+        self.db.flush()
+        return benchmark
+
+    def upsert_levels(self, benchmark_id: int, levels: Iterable[Tuple[datetime, Decimal]]) -> int:
+        """
+        Сохранение значений индекса пачкой.
+
+        Повторная загрузка той же даты перезаписывает значение.
+        """
+        rows = [
+            {"benchmark_id": benchmark_id, "ts": ts, "level": level}
+            for ts, level in levels
+        ]
+        if not rows:
+            return 0
+
+        dialect = self.db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+
+        if insert is not None:
+            stmt = insert(BenchmarkLevel).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[BenchmarkLevel.benchmark_id, BenchmarkLevel.ts],
+                set_={"level": stmt.excluded.level}
+            )
+            self.db.execute(stmt)
+        else:
+            for row in rows:
+                self.db.merge(BenchmarkLevel(**row))
+
+        self.db.flush()
+        logger.info(f"Сохранено {len(rows)} значений бенчмарка {benchmark_id}")
+        return len(rows)
+
+    def get_levels(
+        self,
+        benchmark_ids: Iterable[int],
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[Tuple[int, datetime, Decimal]]:
+        """Значения индексов за период одним запросом, упорядоченные по дате."""
+        benchmark_ids = list(benchmark_ids)
+        if not benchmark_ids:
+            return []
+
+        stmt = select(BenchmarkLevel.benchmark_id, BenchmarkLevel.ts, BenchmarkLevel.level).where(
+            BenchmarkLevel.benchmark_id.in_(benchmark_ids)
+        )
+        if start_date:
+            stmt = stmt.where(BenchmarkLevel.ts >= start_date)
+        if end_date:
+            stmt = stmt.where(BenchmarkLevel.ts <= end_date)
+
+        stmt = stmt.order_by(BenchmarkLevel.ts)
+        return [tuple(row) for row in self.db.execute(stmt).all()]
+
+    def get_portfolio_composition(self, portfolio_id: int) -> Dict[int, Decimal]:
+        """Состав (составного) бенчмарка портфеля: {benchmark_id: вес}."""
+        stmt = select(PortfolioBenchmark.benchmark_id, PortfolioBenchmark.weight).where(
+            and_(
+                PortfolioBenchmark.portfolio_id == portfolio_id,
+                PortfolioBenchmark.is_active == True
+            )
+        )
+        return {benchmark_id: weight for benchmark_id, weight in self.db.execute(stmt).all()}
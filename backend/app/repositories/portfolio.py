@@ -2,18 +2,41 @@
 Репозиторий для работы с портфелями.
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Tuple
 from decimal import Decimal
 from datetime import datetime
 from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import select, update, delete, and_, func
+from sqlalchemy import (
+    select, update, delete, and_, or_, func, cast, column, values, case, literal, tuple_, union_all,
+    Integer, String
+)
 
 from app.models.portfolio import Portfolio, PortfolioSnapshot
 from app.schemas.portfolio import PortfolioCreate, PortfolioUpdate
 from app.models.account import Account
+from app.models.holding import Holding
+from app.models.instrument import Instrument, InstrumentType
+from app.repositories.price import PriceRepository
+from app.core.config import settings
 from app.core.logging import logger
 
 
+# Разрешения выборки снимков: единица date_trunc и средняя длина интервала в днях
+SNAPSHOT_RESOLUTIONS = {
+    "daily": ("day", 1.0),
+    "weekly": ("week", 7.0),
+    "monthly": ("month", 30.4375),
+}
+DEFAULT_MAX_POINTS = 500
+
+# Разрезы распределения активов
+ALLOCATION_DIMENSIONS = ("asset_class", "sector", "country", "currency")
+UNKNOWN_GROUP = "unknown"
+
+# Ключи сортировки позиций (вес пропорционален стоимости)
+POSITION_SORT_KEYS = {"value": "market_value", "weight": "market_value", "pnl": "pnl", "pnl_percent": "pnl_percent"}
+
+
 class PortfolioRepository:
     """Репозиторий для работы с портфелями."""
     
@@ -142,6 +165,89 @@ class PortfolioRepository:
         self.db.execute(stmt)
         self.db.commit()
     
+    def get_stale_portfolio_ids(
+        self,
+        calculated_before: datetime,
+        limit: Optional[int] = None
+    ) -> List[int]:
+        """
+        Активные портфели, метрики которых не пересчитывались с calculated_before
+        (по индексу ix_portfolios_metrics_calculated). Сначала никогда не
+        считавшиеся, затем самые давние.
+        """
+        stmt = (
+            select(Portfolio.id)
+            .where(
+                and_(
+                    Portfolio.is_active == True,
+                    or_(
+                        Portfolio.metrics_calculated_at.is_(None),
+                        Portfolio.metrics_calculated_at < calculated_before
+                    )
+                )
+            )
+            .order_by(Portfolio.metrics_calculated_at.asc().nulls_first(), Portfolio.id)
+            .limit(limit)
+        )
+        return list(self.db.execute(stmt).scalars())
+    
+    def get_snapshot_series(
+        self,
+        portfolio_ids: Iterable[int],
+        include_cost: bool = False
+    ) -> List[Tuple]:
+        """
+        Стоимость нескольких портфелей по датам снимков одним запросом:
+        (portfolio_id, snapshot_date, total_value[, total_cost]).
+        """
+        portfolio_ids = list(portfolio_ids)
+        if not portfolio_ids:
+            return []
+        
+        columns = [PortfolioSnapshot.portfolio_id, PortfolioSnapshot.snapshot_date, PortfolioSnapshot.total_value]
+        if include_cost:
+            columns.append(PortfolioSnapshot.total_cost)
+        stmt = (
+            select(*columns)
+            .where(PortfolioSnapshot.portfolio_id.in_(portfolio_ids))
+            .order_by(PortfolioSnapshot.portfolio_id, PortfolioSnapshot.snapshot_date)
+        )
+        return [tuple(row) for row in self.db.execute(stmt)]
+    
+    def bulk_update_metrics(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Запись кэшированных метрик нескольких портфелей.
+        
+        В PostgreSQL - одним UPDATE ... FROM (VALUES ...); в остальных СУБД -
+        пакетным UPDATE по первичному ключу. Все строки должны содержать
+        одинаковый набор ключей, включая id.
+        """
+        if not rows:
+            return 0
+        
+        fields = [key for key in rows[0] if key != 'id']
+        if self.db.get_bind().dialect.name == "postgresql":
+            source = values(
+                column('id', Integer),
+                *(column(name, Portfolio.__table__.c[name].type) for name in fields),
+                name='v'
+            ).data([tuple(row[key] for key in ['id', *fields]) for row in rows])
+            # Явные приведения: столбец VALUES из одних NULL PostgreSQL считает text
+            stmt = (
+                update(Portfolio)
+                .where(Portfolio.id == source.c.id)
+                .values({
+                    name: cast(source.c[name], Portfolio.__table__.c[name].type) for name in fields
+                })
+                .execution_options(synchronize_session=False)
+            )
+            self.db.execute(stmt)
+        else:
+            self.db.execute(update(Portfolio), rows)
+        
+        self.db.flush()
+        return len(rows)
+    
     def get_portfolio_summary(self, portfolio_id: int) -> Dict[str, Any]:
         """Получение сводки по портфелю."""
         portfolio = self.get_by_id(portfolio_id)
@@ -189,6 +295,204 @@ class PortfolioRepository:
             'updated_at': portfolio.updated_at
         }
     
+    def get_allocation(
+        self,
+        portfolio_id: int,
+        quote_currency: str = settings.DEFAULT_CURRENCY
+    ) -> Tuple[Decimal, Dict[str, Dict[str, Decimal]]]:
+        """
+        Стоимость позиций портфеля по всем разрезам ALLOCATION_DIMENSIONS
+        одним запросом: GROUP BY GROUPING SETS по классу актива, сектору,
+        стране и валюте плюс общий итог. Позиции оцениваются по текущей
+        цене из last_prices (без цены - по средней цене покупки) в базовой
+        валюте портфеля.
+        В SQLite наборы группировок заменяются UNION ALL в том же запросе.
+        
+        Returns:
+            (общая стоимость, {разрез: {значение: стоимость}})
+        """
+        positions = self._allocation_positions(portfolio_id, quote_currency)
+        dimensions = [positions.c[name] for name in ALLOCATION_DIMENSIONS]
+        total = func.sum(positions.c.value)
+        
+        if self.db.get_bind().dialect.name == "sqlite":
+            empty = {name: literal(None, String).label(name) for name in ALLOCATION_DIMENSIONS}
+            stmt = union_all(
+                *[
+                    select(*[dimension if dimension.name == name else empty[name]
+                             for name in ALLOCATION_DIMENSIONS], total)
+                    .group_by(dimension)
+                    for dimension in dimensions
+                ],
+                select(*empty.values(), total)
+            )
+        else:
+            stmt = select(*dimensions, total).group_by(
+                func.grouping_sets(*[tuple_(dimension) for dimension in dimensions], tuple_())
+            )
+        
+        total_value = Decimal("0")
+        breakdowns: Dict[str, Dict[str, Decimal]] = {name: {} for name in ALLOCATION_DIMENSIONS}
+        for *keys, value in self.db.execute(stmt):
+            if value is None:
+                continue
+            grouped = [(name, key) for name, key in zip(ALLOCATION_DIMENSIONS, keys) if key is not None]
+            if grouped:
+                name, key = grouped[0]
+                breakdowns[name][key] = Decimal(value)
+            else:
+                total_value = Decimal(value)
+        return total_value, breakdowns
+    
+    def _allocation_positions(self, portfolio_id: int, quote_currency: str):
+        """Подзапрос позиций портфеля: разрезы и стоимость в базовой валюте"""
+        price_repo = PriceRepository(self.db)
+        held = (
+            select(Holding.instrument_id)
+            .join(Account, Account.id == Holding.account_id)
+            .where(and_(Account.portfolio_id == portfolio_id, Holding.quantity > 0))
+        )
+        latest = price_repo.last_price_subquery(held)
+        fx = price_repo.fx_rate_cte(quote_currency)
+        fx_price, fx_cost, fx_base = fx.alias("fx_price"), fx.alias("fx_cost"), fx.alias("fx_base")
+        
+        asset_class = case(
+            *[
+                (Instrument.instrument_type == instrument_type, instrument_type.value)
+                for instrument_type in InstrumentType
+            ],
+            else_=UNKNOWN_GROUP
+        )
+        value = Holding.quantity * func.coalesce(
+            latest.c.close * fx_price.c.rate,
+            Holding.avg_price * fx_cost.c.rate
+        ) / fx_base.c.rate
+        
+        return (
+            select(
+                asset_class.label("asset_class"),
+                func.coalesce(Instrument.sector, UNKNOWN_GROUP).label("sector"),
+                func.coalesce(Instrument.country, UNKNOWN_GROUP).label("country"),
+                func.coalesce(Holding.currency, UNKNOWN_GROUP).label("currency"),
+                value.label("value"),
+            )
+            .select_from(Holding)
+            .join(Account, Account.id == Holding.account_id)
+            .join(Portfolio, Portfolio.id == Account.portfolio_id)
+            .join(Instrument, Instrument.id == Holding.instrument_id)
+            .outerjoin(latest, latest.c.instrument_id == Holding.instrument_id)
+            .outerjoin(fx_price, fx_price.c.currency == latest.c.currency)
+            .outerjoin(fx_cost, fx_cost.c.currency == Holding.currency)
+            .outerjoin(fx_base, fx_base.c.currency == Portfolio.base_currency)
+            .where(
+                and_(
+                    Account.portfolio_id == portfolio_id,
+                    Account.is_active == True,
+                    Holding.quantity > 0
+                )
+            )
+            .subquery("positions")
+        )
+    
+    def get_top_positions(
+        self,
+        portfolio_id: int,
+        sort_by: str = "value",
+        limit: int = 10,
+        after: Optional[Tuple[Decimal, int]] = None,
+        quote_currency: str = settings.DEFAULT_CURRENCY
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Крупнейшие позиции портфеля (по инструменту, все активные счета).
+        
+        Стоимость по текущей цене из last_prices (без цены - по цене
+        покупки), P&L и вес считаются в БД в базовой валюте портфеля;
+        сортировка и LIMIT тоже в БД. Позиции без оценки (нет цены и
+        курса) сортируются с ключом 0.
+        
+        Args:
+            sort_by: ключ POSITION_SORT_KEYS, по убыванию
+            after: курсор (sort_key, instrument_id) последней позиции
+                предыдущей страницы - keyset-пагинация без OFFSET
+        
+        Returns:
+            (позиции с ключом сортировки sort_key, общее число позиций)
+        """
+        if sort_by not in POSITION_SORT_KEYS:
+            raise ValueError(f"Неподдерживаемая сортировка: {sort_by}")
+        
+        price_repo = PriceRepository(self.db)
+        fx = price_repo.fx_rate_cte(quote_currency)
+        fx_price, fx_cost, fx_base = fx.alias("fx_price"), fx.alias("fx_cost"), fx.alias("fx_base")
+        
+        positions = (
+            select(
+                Holding.instrument_id,
+                func.sum(Holding.quantity).label("quantity"),
+                (func.sum(Holding.quantity * Holding.avg_price) / func.sum(Holding.quantity)).label("avg_price"),
+                func.sum(Holding.quantity * Holding.avg_price * fx_cost.c.rate / fx_base.c.rate).label("cost_value"),
+                func.max(fx_base.c.rate).label("base_rate"),
+            )
+            .join(Account, Account.id == Holding.account_id)
+            .join(Portfolio, Portfolio.id == Account.portfolio_id)
+            .outerjoin(fx_cost, fx_cost.c.currency == Holding.currency)
+            .outerjoin(fx_base, fx_base.c.currency == Portfolio.base_currency)
+            .where(
+                and_(
+                    Account.portfolio_id == portfolio_id,
+                    Account.is_active == True,
+                    Holding.quantity > 0
+                )
+            )
+            .group_by(Holding.instrument_id)
+            .subquery("positions")
+        )
+        
+        latest = price_repo.last_price_subquery()
+        
+        market_value = func.coalesce(
+            positions.c.quantity * latest.c.close * fx_price.c.rate / positions.c.base_rate,
+            positions.c.cost_value
+        )
+        pnl = market_value - positions.c.cost_value
+        ranked = (
+            select(
+                positions.c.instrument_id,
+                Instrument.ticker,
+                Instrument.name,
+                Instrument.currency,
+                positions.c.quantity,
+                positions.c.avg_price,
+                latest.c.close.label("market_price"),
+                market_value.label("market_value"),
+                positions.c.cost_value,
+                pnl.label("pnl"),
+                case(
+                    (positions.c.cost_value > 0, pnl / positions.c.cost_value * 100),
+                    else_=0
+                ).label("pnl_percent"),
+                (market_value * 100 / func.nullif(func.sum(market_value).over(), 0)).label("weight"),
+                func.count().over().label("total_positions"),
+            )
+            .select_from(positions)
+            .join(Instrument, Instrument.id == positions.c.instrument_id)
+            .outerjoin(latest, latest.c.instrument_id == positions.c.instrument_id)
+            .outerjoin(fx_price, fx_price.c.currency == latest.c.currency)
+            .subquery("ranked")
+        )
+        
+        # Без NULL в ключе: курсор всегда числовой, порядок одинаков во всех СУБД
+        key = func.coalesce(ranked.c[POSITION_SORT_KEYS[sort_by]], 0)
+        stmt = select(ranked, key.label("sort_key")).order_by(key.desc(), ranked.c.instrument_id.desc()).limit(limit)
+        if after is not None:
+            stmt = stmt.where(tuple_(key, ranked.c.instrument_id) < tuple_(*after))
+        
+        rows = [dict(row._mapping) for row in self.db.execute(stmt)]
+        total_positions = rows[0]["total_positions"] if rows else 0
+        for row in rows:
+            del row["total_positions"]
+        return rows, total_positions
+    
     def create_snapshot(
         self,
         portfolio_id: int,
@@ -226,29 +530,176 @@ class PortfolioRepository:
             logger.error(f"Ошибка создания снимка портфеля {portfolio_id}: {e}")
             raise
     
+    def upsert_snapshots(self, rows: List[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """
+        Сохранение снимков нескольких портфелей пачками.
+        
+        Повторный снимок на ту же дату перезаписывает значения
+        (INSERT ... ON CONFLICT (portfolio_id, snapshot_date)).
+        """
+        if not rows:
+            return 0
+        
+        dialect = self.db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            if insert is not None:
+                stmt = insert(PortfolioSnapshot).values(batch)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[PortfolioSnapshot.portfolio_id, PortfolioSnapshot.snapshot_date],
+                    set_={
+                        key: stmt.excluded[key] for key in batch[0]
+                        if key not in ("portfolio_id", "snapshot_date")
+                    }
+                )
+                self.db.execute(stmt)
+            else:
+                for row in batch:
+                    self.db.execute(
+                        delete(PortfolioSnapshot).where(
+                            and_(
+                                PortfolioSnapshot.portfolio_id == row["portfolio_id"],
+                                PortfolioSnapshot.snapshot_date == row["snapshot_date"]
+                            )
+                        )
+                    )
+                self.db.add_all([PortfolioSnapshot(**row) for row in batch])
+        
+        self.db.flush()
+        logger.info(f"Сохранено {len(rows)} снимков портфелей")
+        return len(rows)
+    
     def get_snapshots(
         self,
         portfolio_id: int,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
-        limit: int = 365
+        limit: Optional[int] = None
     ) -> List[PortfolioSnapshot]:
-        """Получение снимков портфеля за период."""
-        stmt = (
-            select(PortfolioSnapshot)
+        """
+        Получение снимков портфеля за период по возрастанию даты.
+        При заданном limit возвращаются limit последних снимков.
+        """
+        stmt = self._snapshots_in_range(
+            select(PortfolioSnapshot), portfolio_id, start_date, end_date
+        )
+        
+        if limit is None:
+            stmt = stmt.order_by(PortfolioSnapshot.snapshot_date)
+            return list(self.db.execute(stmt).scalars())
+        
+        stmt = stmt.order_by(PortfolioSnapshot.snapshot_date.desc()).limit(limit)
+        return list(reversed(self.db.execute(stmt).scalars().all()))
+    
+    def get_last_snapshot_date(self, portfolio_id: int) -> Optional[datetime]:
+        """Дата последнего снимка портфеля"""
+        return self.db.execute(
+            select(func.max(PortfolioSnapshot.snapshot_date))
             .where(PortfolioSnapshot.portfolio_id == portfolio_id)
+        ).scalar()
+    
+    def resolve_snapshot_resolution(
+        self,
+        portfolio_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        max_points: int = DEFAULT_MAX_POINTS
+    ) -> str:
+        """
+        Самое подробное разрешение, при котором ряд снимков за период
+        укладывается в max_points точек (по числу снимков и длине периода).
+        """
+        stmt = self._snapshots_in_range(
+            select(
+                func.count(PortfolioSnapshot.id),
+                func.min(PortfolioSnapshot.snapshot_date),
+                func.max(PortfolioSnapshot.snapshot_date)
+            ),
+            portfolio_id, start_date, end_date
         )
+        count, first, last = self.db.execute(stmt).one()
+        if count <= max_points:
+            return "daily"
         
+        span_days = (last - first).days
+        for resolution, (_, bucket_days) in SNAPSHOT_RESOLUTIONS.items():
+            if span_days / bucket_days + 1 <= max_points:
+                return resolution
+        return "monthly"
+    
+    def get_snapshot_buckets(
+        self,
+        portfolio_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        resolution: str = "auto",
+        max_points: int = DEFAULT_MAX_POINTS
+    ) -> Tuple[str, List[PortfolioSnapshot]]:
+        """
+        Прореженный ряд снимков: последний снимок каждого интервала
+        (день, неделя с понедельника, календарный месяц) по возрастанию даты.
+        Прореживание выполняется в БД оконной функцией, клиенту передается
+        по строке на интервал. resolution="auto" выбирает разрешение по
+        бюджету max_points. Возвращает (разрешение, снимки).
+        """
+        if resolution == "auto":
+            resolution = self.resolve_snapshot_resolution(
+                portfolio_id, start_date, end_date, max_points
+            )
+        if resolution not in SNAPSHOT_RESOLUTIONS:
+            raise ValueError(f"Неподдерживаемое разрешение: {resolution}")
+        
+        bucket = self._snapshot_bucket(resolution)
+        ranked = self._snapshots_in_range(
+            select(
+                PortfolioSnapshot.id,
+                func.row_number().over(
+                    partition_by=bucket,
+                    order_by=PortfolioSnapshot.snapshot_date.desc()
+                ).label("bucket_rank")
+            ),
+            portfolio_id, start_date, end_date
+        ).subquery()
+        
+        stmt = (
+            select(PortfolioSnapshot)
+            .join(ranked, ranked.c.id == PortfolioSnapshot.id)
+            .where(ranked.c.bucket_rank == 1)
+            .order_by(PortfolioSnapshot.snapshot_date)
+        )
+        return resolution, list(self.db.execute(stmt).scalars())
+    
+    def _snapshot_bucket(self, resolution: str):
+        """Начало интервала снимка: date_trunc в PostgreSQL, date/strftime в SQLite"""
+        column_ = PortfolioSnapshot.snapshot_date
+        if self.db.get_bind().dialect.name == "sqlite":
+            if resolution == "weekly":
+                return func.date(column_, "weekday 0", "-6 days")
+            if resolution == "monthly":
+                return func.strftime("%Y-%m", column_)
+            return func.date(column_)
+        return func.date_trunc(SNAPSHOT_RESOLUTIONS[resolution][0], column_)
+    
+    @staticmethod
+    def _snapshots_in_range(
+        stmt,
+        portfolio_id: int,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime]
+    ):
+        stmt = stmt.where(PortfolioSnapshot.portfolio_id == portfolio_id)
         if start_date:
             stmt = stmt.where(PortfolioSnapshot.snapshot_date >= start_date)
-        
         if end_date:
             stmt = stmt.where(PortfolioSnapshot.snapshot_date <= end_date)
-        
-        stmt = stmt.order_by(PortfolioSnapshot.snapshot_date.desc()).limit(limit)
-        
-        result = self.db.execute(stmt)
-        return result.scalars().all()
+        return stmt
     
     def get_public_portfolios(
         self,
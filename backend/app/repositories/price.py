@@ -0,0 +1,392 @@
+"""
+Репозиторий для работы с ценами инструментов.
+"""
+
+import csv
+import io
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from decimal import Decimal
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import (
+    DECIMAL, DateTime, Integer, String, select, and_, or_, func, literal, true, union_all, text, column, table
+)
+
+from app.models.instrument import Instrument, InstrumentType
+from app.models.price import LastPrice, Price
+from app.core.logging import logger
+
+
+PRICE_COLUMNS = ("instrument_id", "ts", "close", "currency", "source")
+
+# Временная таблица для COPY: строки удаляются при фиксации транзакции
+PRICES_STAGE = table(
+    "prices_stage",
+    column("instrument_id", Integer),
+    column("ts", DateTime(timezone=True)),
+    column("close", DECIMAL(20, 8)),
+    column("currency", String),
+    column("source", String),
+)
+
+# Месячные секции prices, созданные или проверенные в этом процессе в уже
+# зафиксированных транзакциях (пополняется remember_partitions после commit)
+_known_partitions: Set[str] = set()
+
+
+def price_partition_name(year: int, month: int) -> str:
+    return f"prices_y{year:04d}m{month:02d}"
+
+
+class PriceRepository:
+    """Репозиторий для работы с ценами."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_closes(
+        self,
+        instrument_ids: Iterable[int],
+        ranges: Sequence[Tuple[datetime, datetime]]
+    ) -> List[Tuple[int, datetime, Decimal]]:
+        """
+        Цены закрытия инструментов в нескольких диапазонах дат одним запросом.
+
+        Returns:
+            Строки (instrument_id, ts, close), упорядоченные по ts
+        """
+        instrument_ids = list(instrument_ids)
+        if not instrument_ids or not ranges:
+            return []
+
+        stmt = (
+            select(Price.instrument_id, Price.ts, Price.close)
+            .where(
+                and_(
+                    Price.instrument_id.in_(instrument_ids),
+                    or_(*[Price.ts.between(start, end) for start, end in ranges])
+                )
+            )
+            .order_by(Price.ts)
+        )
+
+        return [tuple(row) for row in self.db.execute(stmt).all()]
+
+    def latest_price_subquery(
+        self,
+        as_of: Optional[datetime] = None,
+        instrument_ids: Optional[Any] = None
+    ):
+        """
+        Подзапрос (instrument_id, ts, close, currency) с последней ценой
+        каждого инструмента на дату as_of.
+
+        Args:
+            instrument_ids: список id или select с колонкой id - ограничивает
+                выборку нужными инструментами (индекс instrument_id, ts)
+        """
+        latest = select(Price.instrument_id, func.max(Price.ts).label("ts"))
+        if instrument_ids is not None:
+            latest = latest.where(Price.instrument_id.in_(instrument_ids))
+        if as_of:
+            latest = latest.where(Price.ts <= as_of)
+        latest = latest.group_by(Price.instrument_id).subquery()
+
+        return (
+            select(Price.instrument_id, Price.ts, Price.close, Price.currency)
+            .join(
+                latest,
+                and_(Price.instrument_id == latest.c.instrument_id, Price.ts == latest.c.ts)
+            )
+            .subquery()
+        )
+
+    def last_price_subquery(self, instrument_ids: Optional[Any] = None):
+        """
+        Подзапрос (instrument_id, ts, close, currency) из last_prices - текущие
+        цены с поиском по первичному ключу, без обращения к истории prices.
+        """
+        stmt = select(LastPrice.instrument_id, LastPrice.ts, LastPrice.close, LastPrice.currency)
+        if instrument_ids is not None:
+            stmt = stmt.where(LastPrice.instrument_id.in_(instrument_ids))
+        return stmt.subquery()
+
+    def fx_rate_cte(self, quote_currency: str, as_of: Optional[datetime] = None):
+        """
+        CTE fx_rates (currency, rate): курс валюты в quote_currency по последней
+        цене валютного инструмента. Код валюты - первые три символа тикера
+        (USD000UTSTOM, CNYRUB_TOM, EUR_RUB__TOM); сама quote_currency - курс 1.
+        Без as_of курсы берутся из last_prices, иначе - из истории на as_of.
+        """
+        currency_instruments = select(Instrument.id).where(
+            and_(
+                Instrument.instrument_type == InstrumentType.CURRENCY,
+                Instrument.currency == quote_currency
+            )
+        )
+        if as_of is None:
+            latest = self.last_price_subquery(currency_instruments)
+        else:
+            latest = self.latest_price_subquery(as_of, currency_instruments)
+        code = func.substr(Instrument.ticker, 1, 3)
+
+        rates = (
+            select(code.label("currency"), func.max(latest.c.close).label("rate"))
+            .join(latest, latest.c.instrument_id == Instrument.id)
+            .where(code != quote_currency)
+            .group_by(code)
+        )
+        pivot = select(
+            literal(quote_currency).label("currency"),
+            literal(Decimal("1"), DECIMAL(20, 8)).label("rate")
+        )
+        return union_all(rates, pivot).cte("fx_rates")
+
+    def get_fx_closes(
+        self,
+        currencies: Iterable[str],
+        quote_currency: str,
+        start_date: datetime,
+        end_date: datetime
+    ) -> List[Tuple[str, datetime, Decimal]]:
+        """
+        История курсов валют в quote_currency по ценам валютных инструментов
+        (код валюты - первые три символа тикера, как в fx_rate_cte).
+
+        Returns:
+            Строки (currency, ts, rate), упорядоченные по ts
+        """
+        currencies = [c for c in set(currencies) if c != quote_currency]
+        if not currencies:
+            return []
+
+        code = func.substr(Instrument.ticker, 1, 3)
+        stmt = (
+            select(code, Price.ts, Price.close)
+            .join(Instrument, Instrument.id == Price.instrument_id)
+            .where(
+                and_(
+                    Instrument.instrument_type == InstrumentType.CURRENCY,
+                    Instrument.currency == quote_currency,
+                    code.in_(currencies),
+                    Price.ts.between(start_date, end_date)
+                )
+            )
+            .order_by(Price.ts)
+        )
+        return [tuple(row) for row in self.db.execute(stmt)]
+
+    def get_latest_closes(
+        self,
+        instrument_ids: Iterable[int],
+        as_of: Optional[datetime] = None
+    ) -> Dict[int, Decimal]:
+        """Последняя известная цена закрытия каждого инструмента (на дату as_of)."""
+        instrument_ids = list(instrument_ids)
+        if not instrument_ids:
+            return {}
+
+        latest = self.latest_price_subquery(as_of, instrument_ids)
+        stmt = select(latest.c.instrument_id, latest.c.close)
+
+        return {instrument_id: close for instrument_id, close in self.db.execute(stmt).all()}
+
+    def get_last_prices(self, instrument_ids: Iterable[int]) -> List[LastPrice]:
+        """Текущие цены инструментов из last_prices."""
+        instrument_ids = list(instrument_ids)
+        if not instrument_ids:
+            return []
+
+        stmt = select(LastPrice).where(LastPrice.instrument_id.in_(instrument_ids))
+        return list(self.db.execute(stmt).scalars())
+
+    def upsert_prices(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Сохранение цен (instrument_id, ts, close, currency, source) пачкой.
+
+        Повторная загрузка той же точки перезаписывает цену.
+        """
+        if not rows:
+            return 0
+
+        insert = self._dialect_insert()
+        if insert is not None:
+            stmt = insert(Price).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Price.instrument_id, Price.ts],
+                set_={
+                    "close": stmt.excluded.close,
+                    "currency": stmt.excluded.currency,
+                    "source": stmt.excluded.source,
+                }
+            )
+            self.db.execute(stmt)
+        else:
+            for row in rows:
+                self.db.merge(Price(**row))
+
+        self.db.flush()
+        logger.info(f"Сохранено {len(rows)} цен")
+        return len(rows)
+
+    def ensure_partitions(self, months: Iterable[Tuple[int, int]]) -> List[str]:
+        """
+        Создание недостающих месячных секций prices (PostgreSQL) для
+        месяцев (год, месяц) в UTC в текущей транзакции. Секции из
+        _known_partitions не проверяются; возвращает имена остальных - их
+        нужно передать в remember_partitions после commit (при откате
+        секции не создаются, и следующая пачка проверит их снова).
+        """
+        pending = []
+        for year, month in sorted(set(months)):
+            name = price_partition_name(year, month)
+            if name in _known_partitions:
+                continue
+            start = datetime(year, month, 1, tzinfo=timezone.utc)
+            end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            self.db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF prices "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            pending.append(name)
+        return pending
+
+    @staticmethod
+    def remember_partitions(names: Iterable[str]) -> None:
+        """Запомнить секции, создание которых зафиксировано"""
+        _known_partitions.update(names)
+
+    def copy_prices(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Загрузка цен в PostgreSQL через COPY: строки копируются во временную
+        таблицу prices_stage и переносятся в prices одним INSERT ... SELECT
+        ON CONFLICT DO UPDATE (неизменившиеся строки не перезаписываются),
+        затем last_prices обновляется последней ценой каждого инструмента.
+        Строки должны быть уникальны по (instrument_id, ts), секции - созданы.
+        """
+        if not rows:
+            return 0
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row["instrument_id"], row["ts"].isoformat(), row["close"], row["currency"], row["source"]])
+        buffer.seek(0)
+
+        self.db.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS prices_stage "
+            "(LIKE prices INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        ))
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY prices_stage ({', '.join(PRICE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        finally:
+            cursor.close()
+
+        from sqlalchemy.dialects.postgresql import insert
+
+        stage = PRICES_STAGE.c
+        stmt = insert(Price).from_select(list(PRICE_COLUMNS), select(*[stage[name] for name in PRICE_COLUMNS]))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Price.instrument_id, Price.ts],
+            set_={"close": stmt.excluded.close, "currency": stmt.excluded.currency, "source": stmt.excluded.source},
+            where=or_(
+                Price.close.is_distinct_from(stmt.excluded.close),
+                Price.currency.is_distinct_from(stmt.excluded.currency),
+                Price.source.is_distinct_from(stmt.excluded.source)
+            )
+        )
+        self.db.execute(stmt)
+
+        latest = (
+            select(stage.instrument_id, stage.ts, stage.close, stage.currency)
+            .distinct(stage.instrument_id)
+            .order_by(stage.instrument_id, stage.ts.desc())
+        )
+        self.db.execute(self._on_newer_price(
+            insert(LastPrice).from_select(["instrument_id", "ts", "close", "currency"], latest)
+        ))
+        return len(rows)
+
+    def upsert_last_prices(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Обновление last_prices строками (instrument_id, ts, close, currency):
+        по последней строке каждого инструмента; цена заменяется, только если
+        она не старше сохраненной (поздняя загрузка истории не откатывает
+        текущую котировку).
+        """
+        latest: Dict[int, Dict[str, Any]] = {}
+        for row in rows:
+            current = latest.get(row["instrument_id"])
+            if current is None or row["ts"] >= current["ts"]:
+                latest[row["instrument_id"]] = {
+                    key: row[key] for key in ("instrument_id", "ts", "close", "currency")
+                }
+        if not latest:
+            return 0
+
+        insert = self._dialect_insert()
+        if insert is not None:
+            stmt = insert(LastPrice).values(list(latest.values()))
+            self.db.execute(self._on_newer_price(stmt))
+        else:
+            for row in latest.values():
+                existing = self.db.get(LastPrice, row["instrument_id"])
+                if existing is None:
+                    self.db.add(LastPrice(**row))
+                elif _as_naive(row["ts"]) >= _as_naive(existing.ts):
+                    existing.ts, existing.close, existing.currency = row["ts"], row["close"], row["currency"]
+
+        self.db.flush()
+        return len(latest)
+
+    def refresh_last_prices(self, instrument_ids: Optional[Iterable[int]] = None) -> None:
+        """
+        Пересчет last_prices из истории prices одним INSERT ... SELECT
+        (первичное заполнение, восстановление после ручных правок).
+        """
+        if instrument_ids is not None:
+            instrument_ids = list(instrument_ids)
+        latest = self.latest_price_subquery(instrument_ids=instrument_ids)
+        source = select(latest.c.instrument_id, latest.c.ts, latest.c.close, latest.c.currency).where(true())
+
+        insert = self._dialect_insert()
+        if insert is None:
+            self.upsert_last_prices([dict(row._mapping) for row in self.db.execute(source)])
+            return
+
+        stmt = insert(LastPrice).from_select(["instrument_id", "ts", "close", "currency"], source)
+        self.db.execute(self._on_newer_price(stmt))
+        self.db.flush()
+
+    @staticmethod
+    def _on_newer_price(stmt):
+        return stmt.on_conflict_do_update(
+            index_elements=[LastPrice.instrument_id],
+            set_={
+                "ts": stmt.excluded.ts,
+                "close": stmt.excluded.close,
+                "currency": stmt.excluded.currency,
+                "updated_at": func.now(),
+            },
+            where=LastPrice.ts <= stmt.excluded.ts
+        )
+
+    def _dialect_insert(self):
+        dialect = self.db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        return insert
+
+
+def _as_naive(moment: datetime) -> datetime:
+    """Момент без часового пояса (UTC) для сравнения значений из разных драйверов"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
@@ -2,11 +2,11 @@
 Репозиторий для работы с транзакциями.
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from decimal import Decimal
 from datetime import datetime, date
 from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import select, update, delete, and_, func, or_
+from sqlalchemy import select, update, delete, and_, func, or_, case
 
 from app.models.transaction import Transaction, TransactionType
 from app.models.holding import Holding
@@ -231,6 +231,42 @@ class TransactionRepository:
         result = self.db.execute(stmt)
         return result.scalars().all()
     
+    def get_position_changes(
+        self,
+        portfolio_id: int,
+        end_date: Optional[datetime] = None
+    ) -> List[Tuple[int, datetime, Decimal]]:
+        """
+        Изменения количества по инструментам портфеля (покупки со знаком +,
+        продажи со знаком -) для восстановления истории позиций.
+
+        Returns:
+            Строки (instrument_id, ts, quantity), упорядоченные по ts
+        """
+        from app.models.account import Account
+
+        signed_quantity = case(
+            (Transaction.transaction_type == TransactionType.SELL, -Transaction.quantity),
+            else_=Transaction.quantity
+        )
+        stmt = (
+            select(Transaction.instrument_id, Transaction.ts, signed_quantity)
+            .join(Account, Account.id == Transaction.account_id)
+            .where(
+                and_(
+                    Account.portfolio_id == portfolio_id,
+                    Transaction.instrument_id.is_not(None),
+                    Transaction.quantity.is_not(None),
+                    Transaction.transaction_type.in_([TransactionType.BUY, TransactionType.SELL])
+                )
+            )
+            .order_by(Transaction.ts)
+        )
+        if end_date:
+            stmt = stmt.where(Transaction.ts <= end_date)
+
+        return [tuple(row) for row in self.db.execute(stmt).all()]
+    
     def update(self, transaction_id: int, **kwargs) -> Optional[Transaction]:
         """Обновление транзакции."""
         # Исключаем поля, которые нельзя обновлять
@@ -275,6 +311,73 @@ class TransactionRepository:
             logger.error(f"Ошибка удаления транзакции {transaction_id}: {e}")
             raise
     
+    def get_cash_ledger(
+        self,
+        portfolio_id: int,
+        end_date: Optional[datetime] = None
+    ) -> List[Tuple[datetime, TransactionType, str, Decimal, Optional[Decimal], Optional[Decimal]]]:
+        """
+        Все операции портфеля, влияющие на денежный остаток.
+        
+        Returns:
+            Строки (ts, transaction_type, currency, gross, fee, tax), упорядоченные по ts
+        """
+        from app.models.account import Account
+        
+        stmt = (
+            select(
+                Transaction.ts, Transaction.transaction_type, Transaction.currency,
+                Transaction.gross, Transaction.fee, Transaction.tax
+            )
+            .join(Account, Account.id == Transaction.account_id)
+            .where(Account.portfolio_id == portfolio_id)
+            .order_by(Transaction.ts)
+        )
+        if end_date:
+            stmt = stmt.where(Transaction.ts <= end_date)
+        
+        return [tuple(row) for row in self.db.execute(stmt)]
+    
+    def get_external_flows(
+        self,
+        portfolio_ids: List[int],
+        end_date: Optional[datetime] = None,
+        start_date: Optional[datetime] = None
+    ) -> List[Tuple[int, datetime, Decimal]]:
+        """
+        Внешние потоки нескольких портфелей одним запросом: пополнения со
+        знаком +, выводы со знаком - (с точки зрения портфеля).
+        
+        Returns:
+            Строки (portfolio_id, ts, amount), упорядоченные по портфелю и ts
+        """
+        from app.models.account import Account
+        
+        if not portfolio_ids:
+            return []
+        
+        signed_amount = case(
+            (Transaction.transaction_type == TransactionType.WITHDRAWAL, -Transaction.gross),
+            else_=Transaction.gross
+        )
+        stmt = (
+            select(Account.portfolio_id, Transaction.ts, signed_amount)
+            .join(Account, Account.id == Transaction.account_id)
+            .where(
+                and_(
+                    Account.portfolio_id.in_(portfolio_ids),
+                    Transaction.transaction_type.in_([TransactionType.DEPOSIT, TransactionType.WITHDRAWAL])
+                )
+            )
+            .order_by(Account.portfolio_id, Transaction.ts)
+        )
+        if start_date:
+            stmt = stmt.where(Transaction.ts >= start_date)
+        if end_date:
+            stmt = stmt.where(Transaction.ts <= end_date)
+        
+        return [tuple(row) for row in self.db.execute(stmt)]
+    
     def get_portfolio_cashflows(
         self,
         portfolio_id: int,
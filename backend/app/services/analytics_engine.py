@@ -12,13 +12,13 @@
 
 import numpy as np
 import pandas as pd
+from collections import deque
 from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Dict, List, Optional, Tuple, Any, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Any, Union
 from dataclasses import dataclass
 from enum import Enum
 import logging
-from scipy import stats
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -149,37 +149,500 @@ class BacktestResult:
     yearly_returns: Dict[str, float] = None
 
 
+TRADING_DAYS = 252
+DEFAULT_RISK_FREE_RATE = 0.045  # Ключевая ставка ЦБ РФ, используемая по умолчанию
+BATCH_CHUNK_BYTES = 256 * 1024 * 1024  # Бюджет памяти на блок в пакетном режиме
+
+
+def _as_float_array(values: Union[List[float], np.ndarray]) -> np.ndarray:
+    """Привести список или массив к одномерному float64 (без копирования, если возможно)"""
+    return np.asarray(values, dtype=np.float64).reshape(-1)
+
+
+def _percentile_indices(n: int, q: float) -> Tuple[int, int]:
+    """Индексы порядковых статистик, нужных для перцентиля q (линейная интерполяция)"""
+    position = q / 100.0 * (n - 1)
+    lower = int(np.floor(position))
+    return lower, min(lower + 1, n - 1)
+
+
+def _percentile_from_partition(partitioned: np.ndarray, q: float) -> float:
+    """
+    Перцентиль, совпадающий с np.percentile(method='linear'), по частично
+    упорядоченному массиву. Массив должен быть получен через np.partition
+    с kth, включающими индексы из _percentile_indices для того же q.
+    """
+    n = partitioned.shape[0]
+    lower, upper = _percentile_indices(n, q)
+    fraction = q / 100.0 * (n - 1) - lower
+    low_value = partitioned[lower]
+    return float(low_value + (partitioned[upper] - low_value) * fraction)
+
+
 class RiskCalculator:
-    """Калькулятор риск-метрик"""
+    """
+    Калькулятор риск-метрик.
+
+    Все расчеты выполняются векторно над numpy-массивами (см. calculate_metrics_array);
+    методы со списками сохранены как тонкие обертки для совместимости.
+    """
+    
+    # ---- Векторные примитивы (ndarray) ----
     
     @staticmethod
-    def calculate_returns(prices: List[float]) -> List[float]:
-        """Рассчитать доходности из цен"""
-        if len(prices) < 2:
+    def returns_array(prices: Union[List[float], np.ndarray]) -> np.ndarray:
+        """Простые доходности r[i] = p[i+1] / p[i] - 1 через np.diff"""
+        prices = _as_float_array(prices)
+        if prices.shape[0] < 2:
+            return np.empty(0, dtype=np.float64)
+        return np.diff(prices) / prices[:-1]
+    
+    @staticmethod
+    def drawdown_array(prices: Union[List[float], np.ndarray]) -> np.ndarray:
+        """Серия просадок от исторического максимума за O(n) (np.maximum.accumulate)"""
+        prices = _as_float_array(prices)
+        if prices.shape[0] == 0:
+            return np.empty(0, dtype=np.float64)
+        peaks = np.maximum.accumulate(prices)
+        return (peaks - prices) / peaks
+    
+    @staticmethod
+    def calculate_metrics_array(values: Union[List[float], np.ndarray],
+                                period_days: int,
+                                benchmark_returns: Optional[Union[List[float], np.ndarray]] = None,
+                                risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> Optional[RiskMetrics]:
+        """
+        Рассчитать все поля RiskMetrics за один проход по массиву стоимостей.
+        
+        Args:
+            values: Стоимость портфеля по дням (ndarray или список)
+            period_days: Длина периода в календарных днях
+            benchmark_returns: Доходности бенчмарка той же длины, что и доходности портфеля
+            risk_free_rate: Годовая безрисковая ставка
+        
+        Returns:
+            RiskMetrics или None, если данных недостаточно
+        """
+        values = _as_float_array(values)
+        if values.shape[0] < 2:
+            return None
+        
+        returns = np.diff(values) / values[:-1]
+        n = returns.shape[0]
+        sqrt_days = np.sqrt(TRADING_DAYS)
+        
+        # Доходность
+        first_value = values[0]
+        last_value = values[-1]
+        total_return = (last_value - first_value) / first_value
+        mean_return = returns.mean()
+        
+        if period_days == 0:
+            annualized_return = 0.0
+            cagr = 0.0
+        else:
+            years = period_days / 365.25
+            annualized_return = mean_return * TRADING_DAYS
+            cagr = (last_value / first_value) ** (1 / years) - 1
+        
+        # Волатильность и нисходящая волатильность
+        std_return = returns.std(ddof=1) if n > 1 else 0.0
+        volatility = std_return * sqrt_days
+        
+        negative_mask = returns < 0
+        positive_mask = returns > 0
+        negative_returns = returns[negative_mask]
+        negative_periods = int(negative_returns.shape[0])
+        positive_periods = int(np.count_nonzero(positive_mask))
+        downside_std = negative_returns.std(ddof=1) if negative_periods > 1 else 0.0
+        downside_volatility = downside_std * sqrt_days
+        
+        # Просадки: один проход накопленного максимума
+        drawdowns = RiskCalculator.drawdown_array(values)
+        max_drawdown = float(drawdowns.max())
+        average_drawdown = float(drawdowns.mean())
+        
+        # Риск-скорректированные метрики
+        if n < 2 or std_return == 0:
+            sharpe_ratio = 0.0
+        else:
+            sharpe_ratio = (mean_return * TRADING_DAYS - risk_free_rate) / volatility
+        
+        if n < 2:
+            sortino_ratio = 0.0
+        elif negative_periods == 0:
+            sortino_ratio = float('inf')  # Нет отрицательных доходностей
+        elif downside_std == 0:
+            sortino_ratio = 0.0
+        else:
+            sortino_ratio = (mean_return * TRADING_DAYS - risk_free_rate) / downside_volatility
+        
+        calmar_ratio = cagr / max_drawdown if max_drawdown > 0 else 0.0
+        
+        # VaR/CVaR: одна частичная сортировка для всех уровней
+        kth = sorted(set(_percentile_indices(n, 5.0) + _percentile_indices(n, 1.0)))
+        partitioned = np.partition(returns, kth)
+        var_95 = _percentile_from_partition(partitioned, 5.0)
+        var_99 = _percentile_from_partition(partitioned, 1.0)
+        tail = partitioned[partitioned <= var_95]
+        cvar_95 = float(tail.mean()) if tail.shape[0] else var_95
+        
+        # Дополнительные статистики
+        win_rate = positive_periods / n
+        positive_sum = returns[positive_mask].sum()
+        negative_sum = -negative_returns.sum()
+        profit_factor = positive_sum / negative_sum if negative_sum > 0 else float('inf')
+        
+        # Метрики относительно бенчмарка
+        beta = None
+        alpha = None
+        treynor_ratio = None
+        information_ratio = None
+        correlation = None
+        
+        if benchmark_returns is not None and n > 1:
+            bench = _as_float_array(benchmark_returns)
+            if bench.shape[0] == n:
+                # Периоды без котировок бенчмарка (NaN после as-of выравнивания) не учитываются
+                valid = np.isfinite(bench)
+                if valid.all():
+                    beta, alpha, treynor_ratio, information_ratio, correlation = (
+                        RiskCalculator._benchmark_stats(returns, bench, risk_free_rate)
+                    )
+                elif valid.sum() > 1:
+                    beta, alpha, treynor_ratio, information_ratio, correlation = (
+                        RiskCalculator._benchmark_stats(returns[valid], bench[valid], risk_free_rate)
+                    )
+        
+        return RiskMetrics(
+            total_return=float(total_return),
+            annualized_return=float(annualized_return),
+            cagr=float(cagr),
+            volatility=float(volatility),
+            downside_volatility=float(downside_volatility),
+            max_drawdown=max_drawdown,
+            average_drawdown=average_drawdown,
+            sharpe_ratio=float(sharpe_ratio),
+            sortino_ratio=float(sortino_ratio),
+            calmar_ratio=float(calmar_ratio),
+            beta=beta,
+            alpha=alpha,
+            treynor_ratio=treynor_ratio,
+            information_ratio=information_ratio,
+            correlation=correlation,
+            var_95=var_95,
+            var_99=var_99,
+            cvar_95=cvar_95,
+            win_rate=float(win_rate),
+            profit_factor=float(profit_factor),
+            maximum_gain=float(returns.max()),
+            maximum_loss=float(returns.min()),
+            period_days=period_days,
+            positive_periods=positive_periods,
+            negative_periods=negative_periods
+        )
+    
+    @staticmethod
+    def _benchmark_stats(returns: np.ndarray,
+                         benchmark: np.ndarray,
+                         risk_free_rate: float) -> Tuple[Optional[float], ...]:
+        """Бета, альфа, Трейнор, информационный коэффициент и корреляция за один проход"""
+        n = returns.shape[0]
+        mean_p = returns.mean()
+        mean_b = benchmark.mean()
+        dev_p = returns - mean_p
+        dev_b = benchmark - mean_b
+        
+        cov_pb = float(dev_p @ dev_b) / (n - 1)
+        var_p = float(dev_p @ dev_p) / (n - 1)
+        var_b = float(dev_b @ dev_b) / (n - 1)
+        
+        beta = alpha = treynor_ratio = information_ratio = correlation = None
+        
+        if var_b != 0:
+            beta = cov_pb / var_b
+            alpha = float(mean_p * TRADING_DAYS
+                          - (risk_free_rate + beta * (mean_b * TRADING_DAYS - risk_free_rate)))
+            if beta != 0:
+                treynor_ratio = float((mean_p * TRADING_DAYS - risk_free_rate) / beta)
+        
+        excess = returns - benchmark
+        excess_std = excess.std(ddof=1)
+        if excess_std > 0:
+            information_ratio = float(excess.mean() / excess_std * np.sqrt(TRADING_DAYS))
+        
+        if var_p > 0 and var_b > 0:
+            correlation = float(cov_pb / np.sqrt(var_p * var_b))
+        
+        return beta, alpha, treynor_ratio, information_ratio, correlation
+    
+    # ---- Пакетный режим (портфели × даты) ----
+    
+    @staticmethod
+    def calculate_metrics_matrix(values: np.ndarray,
+                                 mask: np.ndarray,
+                                 day_numbers: np.ndarray,
+                                 benchmark_values: Optional[np.ndarray] = None,
+                                 risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> List[Optional[RiskMetrics]]:
+        """
+        Рассчитать RiskMetrics для блока портфелей векторно по оси дат.
+        
+        Строка матрицы - портфель, столбец - дата. Пропуски в истории (разная дата
+        начала, паузы) задаются маской: доходность считается между соседними
+        валидными точками строки, поэтому результат совпадает с
+        calculate_metrics_array по сжатой строке values[i, mask[i]].
+        
+        Args:
+            values: Матрица стоимостей формы (P, T)
+            mask: Булева матрица валидности формы (P, T)
+            day_numbers: Номера дней (ordinal) для каждого столбца, форма (T,)
+            benchmark_values: Уровни бенчмарка на те же даты, форма (T,)
+            risk_free_rate: Годовая безрисковая ставка
+        
+        Returns:
+            Список RiskMetrics (None для строк, где меньше двух валидных точек)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        mask = np.asarray(mask, dtype=bool)
+        rows, cols = values.shape
+        if rows == 0:
             return []
+        if cols < 2:
+            return [None] * rows
+        
+        col_index = np.arange(cols)
+        sqrt_days = np.sqrt(TRADING_DAYS)
+        
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # Индекс предыдущей валидной точки для каждой позиции (forward-fill индексов)
+            last_valid = np.maximum.accumulate(np.where(mask, col_index, -1), axis=1)
+            prev_valid = np.empty_like(last_valid)
+            prev_valid[:, 0] = -1
+            prev_valid[:, 1:] = last_valid[:, :-1]
+            
+            return_mask = mask & (prev_valid >= 0)
+            prev_values = np.take_along_axis(values, np.maximum(prev_valid, 0), axis=1)
+            returns = np.where(return_mask, values / prev_values - 1.0, 0.0)
+            
+            n = return_mask.sum(axis=1)
+            n_safe = np.maximum(n, 1)
+            n_minus_one = np.maximum(n - 1, 1)
+            
+            # Первая и последняя валидные точки
+            has_values = mask.any(axis=1)
+            first_idx = np.argmax(mask, axis=1)
+            last_idx = cols - 1 - np.argmax(mask[:, ::-1], axis=1)
+            first_value = values[np.arange(rows), first_idx]
+            last_value = values[np.arange(rows), last_idx]
+            day_numbers = np.asarray(day_numbers, dtype=np.int64)
+            period_days = day_numbers[last_idx] - day_numbers[first_idx]
+            
+            total_return = (last_value - first_value) / first_value
+            mean_return = returns.sum(axis=1) / n_safe
+            years = period_days / 365.25
+            annualized_return = np.where(period_days == 0, 0.0, mean_return * TRADING_DAYS)
+            cagr = np.where(
+                period_days == 0, 0.0,
+                (last_value / first_value) ** (1.0 / np.where(years == 0, 1.0, years)) - 1.0
+            )
+            
+            # Волатильность
+            deviations = np.where(return_mask, returns - mean_return[:, None], 0.0)
+            std_return = np.where(n > 1, np.sqrt((deviations ** 2).sum(axis=1) / n_minus_one), 0.0)
+            volatility = std_return * sqrt_days
+            
+            negative_mask = return_mask & (returns < 0)
+            positive_mask = return_mask & (returns > 0)
+            negative_periods = negative_mask.sum(axis=1)
+            positive_periods = positive_mask.sum(axis=1)
+            negative_sum = -np.where(negative_mask, returns, 0.0).sum(axis=1)
+            positive_sum = np.where(positive_mask, returns, 0.0).sum(axis=1)
+            negative_mean = -negative_sum / np.maximum(negative_periods, 1)
+            negative_dev = np.where(negative_mask, returns - negative_mean[:, None], 0.0)
+            downside_std = np.where(
+                negative_periods > 1,
+                np.sqrt((negative_dev ** 2).sum(axis=1) / np.maximum(negative_periods - 1, 1)),
+                0.0
+            )
+            downside_volatility = downside_std * sqrt_days
+            
+            # Просадки от накопленного максимума по валидным точкам
+            peaks = np.maximum.accumulate(np.where(mask, values, -np.inf), axis=1)
+            drawdowns = np.where(mask, (peaks - values) / peaks, 0.0)
+            valid_points = np.maximum(mask.sum(axis=1), 1)
+            max_drawdown = drawdowns.max(axis=1)
+            average_drawdown = drawdowns.sum(axis=1) / valid_points
+            
+            # Риск-скорректированные метрики
+            excess_annual = mean_return * TRADING_DAYS - risk_free_rate
+            sharpe_ratio = np.where((n < 2) | (std_return == 0), 0.0, excess_annual / volatility)
+            sortino_ratio = np.where(
+                n < 2, 0.0,
+                np.where(negative_periods == 0, np.inf,
+                         np.where(downside_std == 0, 0.0, excess_annual / downside_volatility))
+            )
+            calmar_ratio = np.where(max_drawdown > 0, cagr / max_drawdown, 0.0)
+            
+            # VaR/CVaR: одна сортировка по оси дат, невалидные значения уходят в конец
+            sorted_returns = np.sort(np.where(return_mask, returns, np.inf), axis=1)
+            var_95 = RiskCalculator._row_percentiles(sorted_returns, n, 5.0)
+            var_99 = RiskCalculator._row_percentiles(sorted_returns, n, 1.0)
+            tail_mask = sorted_returns <= var_95[:, None]
+            tail_count = tail_mask.sum(axis=1)
+            cvar_95 = np.where(
+                tail_count > 0,
+                np.where(tail_mask, sorted_returns, 0.0).sum(axis=1) / np.maximum(tail_count, 1),
+                var_95
+            )
+            
+            win_rate = positive_periods / n_safe
+            profit_factor = np.where(negative_sum > 0, positive_sum / negative_sum, np.inf)
+            maximum_gain = np.where(return_mask, returns, -np.inf).max(axis=1)
+            maximum_loss = sorted_returns[:, 0]
+            
+            # Метрики относительно общего бенчмарка
+            benchmark_stats = None
+            if benchmark_values is not None:
+                benchmark_values = np.asarray(benchmark_values, dtype=np.float64).reshape(-1)
+                if benchmark_values.shape[0] == cols:
+                    prev_bench = benchmark_values[np.maximum(prev_valid, 0)]
+                    bench_returns = np.where(return_mask, benchmark_values[None, :] / prev_bench - 1.0, 0.0)
+                    benchmark_stats = RiskCalculator._benchmark_stats_matrix(
+                        deviations, bench_returns, returns, return_mask,
+                        n, mean_return, std_return, risk_free_rate
+                    )
+        
+        columns = [
+            total_return, annualized_return, cagr, volatility, downside_volatility,
+            max_drawdown, average_drawdown, sharpe_ratio, sortino_ratio, calmar_ratio,
+            var_95, var_99, cvar_95, win_rate, profit_factor, maximum_gain, maximum_loss,
+        ]
+        columns = [column.tolist() for column in columns]
+        period_list = period_days.tolist()
+        positive_list = positive_periods.tolist()
+        negative_list = negative_periods.tolist()
+        valid_rows = (has_values & (n >= 1)).tolist()
+        if benchmark_stats is not None:
+            benchmark_lists = [
+                [None if not ok or np.isnan(x) else float(x) for x, ok in zip(stat, stat_ok)]
+                for stat, stat_ok in benchmark_stats
+            ]
         
-        returns = []
-        for i in range(1, len(prices)):
-            ret = (prices[i] - prices[i-1]) / prices[i-1]
-            returns.append(ret)
+        results: List[Optional[RiskMetrics]] = []
+        for i in range(rows):
+            if not valid_rows[i]:
+                results.append(None)
+                continue
+            row = [column[i] for column in columns]
+            beta = alpha = treynor_ratio = information_ratio = correlation = None
+            if benchmark_stats is not None:
+                beta, alpha, treynor_ratio, information_ratio, correlation = (
+                    stat[i] for stat in benchmark_lists
+                )
+            results.append(RiskMetrics(
+                total_return=row[0],
+                annualized_return=row[1],
+                cagr=row[2],
+                volatility=row[3],
+                downside_volatility=row[4],
+                max_drawdown=row[5],
+                average_drawdown=row[6],
+                sharpe_ratio=row[7],
+                sortino_ratio=row[8],
+                calmar_ratio=row[9],
+                beta=beta,
+                alpha=alpha,
+                treynor_ratio=treynor_ratio,
+                information_ratio=information_ratio,
+                correlation=correlation,
+                var_95=row[10],
+                var_99=row[11],
+                cvar_95=row[12],
+                win_rate=row[13],
+                profit_factor=row[14],
+                maximum_gain=row[15],
+                maximum_loss=row[16],
+                period_days=period_list[i],
+                positive_periods=positive_list[i],
+                negative_periods=negative_list[i]
+            ))
         
-        return returns
+        return results
+    
+    @staticmethod
+    def _row_percentiles(sorted_rows: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+        """Перцентиль с линейной интерполяцией для каждой строки отсортированной матрицы"""
+        last = np.maximum(counts - 1, 0)
+        position = q / 100.0 * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        low_value = np.take_along_axis(sorted_rows, lower[:, None], axis=1)[:, 0]
+        high_value = np.take_along_axis(sorted_rows, upper[:, None], axis=1)[:, 0]
+        return low_value + (high_value - low_value) * fraction
+    
+    @staticmethod
+    def _benchmark_stats_matrix(deviations: np.ndarray,
+                                bench_returns: np.ndarray,
+                                returns: np.ndarray,
+                                return_mask: np.ndarray,
+                                n: np.ndarray,
+                                mean_return: np.ndarray,
+                                std_return: np.ndarray,
+                                risk_free_rate: float) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Построчные бета, альфа, Трейнор, IR и корреляция; пары (значения, маска валидности)"""
+        n_safe = np.maximum(n, 1)
+        n_minus_one = np.maximum(n - 1, 1)
+        mean_b = bench_returns.sum(axis=1) / n_safe
+        dev_b = np.where(return_mask, bench_returns - mean_b[:, None], 0.0)
+        
+        cov_pb = (deviations * dev_b).sum(axis=1) / n_minus_one
+        var_b = (dev_b ** 2).sum(axis=1) / n_minus_one
+        var_p = std_return ** 2
+        enough = n > 1
+        
+        beta_ok = enough & (var_b != 0)
+        beta = cov_pb / np.where(beta_ok, var_b, 1.0)
+        alpha = mean_return * TRADING_DAYS - (
+            risk_free_rate + beta * (mean_b * TRADING_DAYS - risk_free_rate)
+        )
+        treynor_ok = beta_ok & (beta != 0)
+        treynor = (mean_return * TRADING_DAYS - risk_free_rate) / np.where(treynor_ok, beta, 1.0)
+        
+        excess = np.where(return_mask, returns - bench_returns, 0.0)
+        excess_mean = excess.sum(axis=1) / n_safe
+        excess_dev = np.where(return_mask, excess - excess_mean[:, None], 0.0)
+        excess_std = np.sqrt((excess_dev ** 2).sum(axis=1) / n_minus_one)
+        ir_ok = enough & (excess_std > 0)
+        information_ratio = excess_mean / np.where(ir_ok, excess_std, 1.0) * np.sqrt(TRADING_DAYS)
+        
+        corr_ok = enough & (var_p > 0) & (var_b > 0)
+        correlation = cov_pb / np.sqrt(np.where(corr_ok, var_p * var_b, 1.0))
+        
+        return [
+            (beta, beta_ok),
+            (alpha, beta_ok),
+            (treynor, treynor_ok),
+            (information_ratio, ir_ok),
+            (correlation, corr_ok),
+        ]
+    
+    # ---- Списочный API (тонкие обертки над векторными примитивами) ----
+    
+    @staticmethod
+    def calculate_returns(prices: List[float]) -> List[float]:
+        """Рассчитать доходности из цен"""
+        return RiskCalculator.returns_array(prices).tolist()
     
     @staticmethod
     def calculate_cumulative_returns(returns: List[float]) -> List[float]:
         """Рассчитать кумулятивные доходности"""
-        cumulative = []
-        cum_return = 1.0
-        
-        for ret in returns:
-            cum_return *= (1 + ret)
-            cumulative.append(cum_return - 1)
-        
-        return cumulative
+        returns = _as_float_array(returns)
+        return (np.cumprod(1.0 + returns) - 1.0).tolist()
     
     @staticmethod
     def calculate_sharpe_ratio(returns: List[float], 
-                             risk_free_rate: float = 0.045) -> float:
+                             risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> float:
         """
         Рассчитать коэффициент Шарпа
         
@@ -187,254 +650,415 @@ class RiskCalculator:
             returns: Список доходностей
             risk_free_rate: Безрисковая ставка (по умолчанию 4.5% - ставка ЦБ РФ)
         """
-        if not returns or len(returns) < 2:
+        returns = _as_float_array(returns)
+        if returns.shape[0] < 2:
             return 0.0
         
-        mean_return = np.mean(returns)
-        std_return = np.std(returns, ddof=1)
-        
+        std_return = returns.std(ddof=1)
         if std_return == 0:
             return 0.0
         
         # Аннуализируем (предполагаем дневные доходности)
-        annualized_return = mean_return * 252
-        annualized_volatility = std_return * np.sqrt(252)
+        annualized_return = returns.mean() * TRADING_DAYS
+        annualized_volatility = std_return * np.sqrt(TRADING_DAYS)
         
-        sharpe = (annualized_return - risk_free_rate) / annualized_volatility
-        return float(sharpe)
+        return float((annualized_return - risk_free_rate) / annualized_volatility)
     
     @staticmethod
     def calculate_sortino_ratio(returns: List[float], 
-                              risk_free_rate: float = 0.045) -> float:
+                              risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> float:
         """Рассчитать коэффициент Сортино"""
-        if not returns or len(returns) < 2:
+        returns = _as_float_array(returns)
+        if returns.shape[0] < 2:
             return 0.0
         
-        mean_return = np.mean(returns)
-        negative_returns = [r for r in returns if r < 0]
-        
-        if not negative_returns:
+        negative_returns = returns[returns < 0]
+        if negative_returns.shape[0] == 0:
             return float('inf')  # Нет отрицательных доходностей
         
-        downside_deviation = np.std(negative_returns, ddof=1)
-        
+        downside_deviation = negative_returns.std(ddof=1) if negative_returns.shape[0] > 1 else 0.0
         if downside_deviation == 0:
             return 0.0
         
-        annualized_return = mean_return * 252
-        annualized_downside_deviation = downside_deviation * np.sqrt(252)
+        annualized_return = returns.mean() * TRADING_DAYS
+        annualized_downside_deviation = downside_deviation * np.sqrt(TRADING_DAYS)
         
-        sortino = (annualized_return - risk_free_rate) / annualized_downside_deviation
-        return float(sortino)
+        return float((annualized_return - risk_free_rate) / annualized_downside_deviation)
     
     @staticmethod
     def calculate_beta(portfolio_returns: List[float], 
                       market_returns: List[float]) -> Optional[float]:
         """Рассчитать бету портфеля относительно рынка"""
-        if (len(portfolio_returns) != len(market_returns) or 
-            len(portfolio_returns) < 2):
+        portfolio_array = _as_float_array(portfolio_returns)
+        market_array = _as_float_array(market_returns)
+        if (portfolio_array.shape[0] != market_array.shape[0] or
+                portfolio_array.shape[0] < 2):
             return None
         
-        try:
-            portfolio_array = np.array(portfolio_returns)
-            market_array = np.array(market_returns)
-            
-            covariance = np.cov(portfolio_array, market_array)[0][1]
-            market_variance = np.var(market_array, ddof=1)
-            
-            if market_variance == 0:
-                return None
-            
-            beta = covariance / market_variance
-            return float(beta)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при расчете беты: {e}")
-            return None
+        beta, *_ = RiskCalculator._benchmark_stats(
+            portfolio_array, market_array, DEFAULT_RISK_FREE_RATE
+        )
+        return beta
     
     @staticmethod
     def calculate_alpha(portfolio_returns: List[float], 
                        market_returns: List[float],
-                       risk_free_rate: float = 0.045) -> Optional[float]:
+                       risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> Optional[float]:
         """Рассчитать альфу по модели CAPM"""
-        beta = RiskCalculator.calculate_beta(portfolio_returns, market_returns)
-        if beta is None:
+        portfolio_array = _as_float_array(portfolio_returns)
+        market_array = _as_float_array(market_returns)
+        if (portfolio_array.shape[0] != market_array.shape[0] or
+                portfolio_array.shape[0] < 2):
             return None
         
-        portfolio_return = np.mean(portfolio_returns) * 252
-        market_return = np.mean(market_returns) * 252
-        
-        alpha = portfolio_return - (risk_free_rate + beta * (market_return - risk_free_rate))
-        return float(alpha)
+        _, alpha, *_ = RiskCalculator._benchmark_stats(
+            portfolio_array, market_array, risk_free_rate
+        )
+        return alpha
     
     @staticmethod
     def calculate_max_drawdown(prices: List[float]) -> float:
         """Рассчитать максимальную просадку"""
-        if len(prices) < 2:
+        prices = _as_float_array(prices)
+        if prices.shape[0] < 2:
             return 0.0
         
-        peak = prices[0]
-        max_dd = 0.0
-        
-        for price in prices:
-            if price > peak:
-                peak = price
-            
-            drawdown = (peak - price) / peak
-            max_dd = max(max_dd, drawdown)
-        
-        return float(max_dd)
+        return float(RiskCalculator.drawdown_array(prices).max())
     
     @staticmethod
     def calculate_var(returns: List[float], confidence_level: float = 0.95) -> float:
         """Рассчитать Value at Risk"""
-        if not returns:
+        returns = _as_float_array(returns)
+        if returns.shape[0] == 0:
             return 0.0
         
-        return float(np.percentile(returns, (1 - confidence_level) * 100))
+        q = (1 - confidence_level) * 100
+        partitioned = np.partition(returns, _percentile_indices(returns.shape[0], q))
+        return _percentile_from_partition(partitioned, q)
     
     @staticmethod
     def calculate_cvar(returns: List[float], confidence_level: float = 0.95) -> float:
         """Рассчитать Conditional Value at Risk"""
-        if not returns:
+        returns = _as_float_array(returns)
+        if returns.shape[0] == 0:
             return 0.0
         
-        var_threshold = RiskCalculator.calculate_var(returns, confidence_level)
-        tail_losses = [r for r in returns if r <= var_threshold]
+        q = (1 - confidence_level) * 100
+        partitioned = np.partition(returns, _percentile_indices(returns.shape[0], q))
+        var_threshold = _percentile_from_partition(partitioned, q)
+        tail_losses = partitioned[partitioned <= var_threshold]
         
-        if not tail_losses:
+        if tail_losses.shape[0] == 0:
             return var_threshold
         
-        return float(np.mean(tail_losses))
+        return float(tail_losses.mean())
+
+
+@dataclass
+class RollingMetricsPoint:
+    """Значения скользящих метрик на дату"""
+    date: datetime
+    value: float
+    window_return: float
+    volatility: float
+    sharpe_ratio: float
+    drawdown: float
+    beta: Optional[float] = None
+    correlation: Optional[float] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'date': self.date.isoformat() if hasattr(self.date, 'isoformat') else self.date,
+            'value': self.value,
+            'window_return': self.window_return,
+            'volatility': self.volatility,
+            'sharpe_ratio': self.sharpe_ratio,
+            'drawdown': self.drawdown,
+            'beta': self.beta,
+            'correlation': self.correlation,
+        }
+
+
+class RollingMoments:
+    """
+    Скользящие моменты окна за O(1) на шаг.
+    
+    Среднее и M2 обновляются по Уэлфорду при добавлении и удалении
+    наблюдения; для пары рядов дополнительно ведется совместный момент
+    (running covariance).
+    """
+    
+    __slots__ = ('n', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy')
+    
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+    
+    def add(self, x: float, y: float = 0.0) -> None:
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.n
+        self.mean_y += dy / self.n
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+    
+    def remove(self, x: float, y: float = 0.0) -> None:
+        if self.n <= 1:
+            self.__init__()
+            return
+        self.n -= 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x -= dx / self.n
+        self.mean_y -= dy / self.n
+        self.m2_x -= dx * (x - self.mean_x)
+        self.m2_y -= dy * (y - self.mean_y)
+        self.c_xy -= (x - self.mean_x) * dy
+    
+    def variance_x(self) -> float:
+        return max(self.m2_x, 0.0) / (self.n - 1) if self.n > 1 else 0.0
+    
+    def variance_y(self) -> float:
+        return max(self.m2_y, 0.0) / (self.n - 1) if self.n > 1 else 0.0
+    
+    def covariance(self) -> float:
+        return self.c_xy / (self.n - 1) if self.n > 1 else 0.0
+
+
+def iter_rolling_metrics(values: Union[List[float], np.ndarray],
+                         dates: List[datetime],
+                         window: int = 63,
+                         benchmark_values: Optional[Union[List[float], np.ndarray]] = None,
+                         risk_free_rate: float = DEFAULT_RISK_FREE_RATE,
+                         benchmark_returns: Optional[Union[List[float], np.ndarray]] = None,
+                         cash_flows: Optional[Union[List[float], np.ndarray]] = None) -> Iterator[RollingMetricsPoint]:
+    """
+    Скользящие волатильность, Шарп, бета и просадка за один проход.
+    
+    Каждый шаг стоит O(1): моменты окна обновляются добавлением новой и
+    удалением выпавшей доходности, максимум окна для просадки ведется
+    монотонной декой. Генератор отдает точки по мере расчета, поэтому
+    результат можно стримить клиенту.
+    
+    Args:
+        values: Стоимость портфеля по датам (по возрастанию дат)
+        dates: Соответствующие даты
+        window: Размер окна в доходностях (например, 63 или 252)
+        benchmark_values: Уровни бенчмарка на те же даты (для беты и корреляции)
+        risk_free_rate: Годовая безрисковая ставка
+        benchmark_returns: Доходности бенчмарка между соседними датами (вместо
+            benchmark_values, например из BenchmarkSeriesService); NaN - нет данных
+        cash_flows: Внешние потоки подпериодов (len(values) - 1, пополнения
+            положительные): доходность V_i / (V_{i-1} + CF_i) - 1, доходность
+            окна и просадка - по индексу TWR, как в metric_state
+    """
+    values = _as_float_array(values)
+    if window < 2:
+        raise ValueError("Окно должно содержать минимум 2 доходности")
+    if len(dates) != values.shape[0]:
+        raise ValueError("Количество дат не совпадает с количеством значений")
+    
+    bench_returns = None
+    if benchmark_values is not None:
+        bench = _as_float_array(benchmark_values)
+        if bench.shape[0] != values.shape[0]:
+            raise ValueError("Ряд бенчмарка должен быть выровнен по датам портфеля")
+        bench_returns = RiskCalculator.returns_array(bench)
+    elif benchmark_returns is not None:
+        bench_returns = _as_float_array(benchmark_returns)
+        if bench_returns.shape[0] != max(values.shape[0] - 1, 0):
+            raise ValueError("Ряд бенчмарка должен быть выровнен по датам портфеля")
+        # Период без данных бенчмарка считается нулевой доходностью
+        bench_returns = np.nan_to_num(bench_returns, nan=0.0)
+    
+    if cash_flows is None:
+        returns = RiskCalculator.returns_array(values)
+        index = values
+    else:
+        flows = _as_float_array(cash_flows)
+        if flows.shape[0] != max(values.shape[0] - 1, 0):
+            raise ValueError("Потоки должны быть заданы на каждый период между датами")
+        base = values[:-1] + flows
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.where(base > 0, values[1:] / base - 1.0, 0.0)
+        index = np.concatenate(([1.0], np.cumprod(1.0 + returns)))
+    sqrt_days = np.sqrt(TRADING_DAYS)
+    
+    moments = RollingMoments()
+    peaks: deque = deque()  # Индексы кандидатов в максимум окна (значения убывают)
+    
+    for i in range(values.shape[0]):
+        value = values[i]
+        level = index[i]
+        
+        # Монотонная дека: окно цен [i - window, i]
+        while peaks and index[peaks[-1]] <= level:
+            peaks.pop()
+        peaks.append(i)
+        if peaks[0] < i - window:
+            peaks.popleft()
+        
+        if i == 0:
+            continue
+        
+        r = returns[i - 1]
+        b = bench_returns[i - 1] if bench_returns is not None else 0.0
+        moments.add(r, b)
+        if moments.n > window:
+            moments.remove(returns[i - 1 - window],
+                           bench_returns[i - 1 - window] if bench_returns is not None else 0.0)
+        
+        if moments.n < window:
+            continue
+        
+        std = np.sqrt(moments.variance_x())
+        volatility = std * sqrt_days
+        sharpe = (moments.mean_x * TRADING_DAYS - risk_free_rate) / volatility if std > 0 else 0.0
+        peak = index[peaks[0]]
+        
+        beta = None
+        correlation = None
+        if bench_returns is not None:
+            var_b = moments.variance_y()
+            if var_b > 0:
+                beta = float(moments.covariance() / var_b)
+                var_p = moments.variance_x()
+                if var_p > 0:
+                    correlation = float(moments.covariance() / np.sqrt(var_p * var_b))
+        
+        yield RollingMetricsPoint(
+            date=dates[i],
+            value=float(value),
+            window_return=float(level / index[i - window] - 1.0),
+            volatility=float(volatility),
+            sharpe_ratio=float(sharpe),
+            drawdown=float((peak - level) / peak) if peak > 0 else 0.0,
+            beta=beta,
+            correlation=correlation
+        )
 
 
 class AnalyticsEngine:
     """Основной аналитический движок"""
     
     def __init__(self):
+        from app.services.benchmark_service import BENCHMARK_RETURNS_CACHE
+        
         self.risk_calculator = RiskCalculator()
-        self._benchmark_cache = {}
+        # Выровненные доходности бенчмарков: общий LRU+TTL кэш процесса
+        self._benchmark_cache = BENCHMARK_RETURNS_CACHE
     
     async def calculate_portfolio_metrics(self,
-                                        portfolio_values: List[float],
+                                        portfolio_values: Union[List[float], np.ndarray],
                                         dates: List[datetime],
-                                        benchmark_returns: Optional[List[float]] = None) -> RiskMetrics:
+                                        benchmark_returns: Optional[Union[List[float], np.ndarray, pd.Series]] = None) -> RiskMetrics:
         """
         Рассчитать полный набор риск-метрик для портфеля
         
         Args:
-            portfolio_values: Стоимость портфеля по дням
+            portfolio_values: Стоимость портфеля по дням (список или ndarray)
             dates: Соответствующие даты
-            benchmark_returns: Доходности бенчмарка (опционально)
+            benchmark_returns: Доходности бенчмарка между соседними датами или
+                pd.Series значений индекса с датами в индексе (выравнивается as-of)
         """
         if len(portfolio_values) < 2:
             return self._empty_metrics()
         
-        # Рассчитываем доходности
-        returns = self.risk_calculator.calculate_returns(portfolio_values)
+        if isinstance(benchmark_returns, pd.Series):
+            benchmark_returns = self.align_benchmark_levels(benchmark_returns, dates)
+        elif benchmark_returns is not None and len(benchmark_returns) != len(portfolio_values) - 1:
+            logger.warning(
+                f"Длина ряда бенчмарка ({len(benchmark_returns)}) не совпадает с числом "
+                f"доходностей портфеля ({len(portfolio_values) - 1}), бенчмарк не учитывается"
+            )
+            benchmark_returns = None
         
-        if not returns:
-            return self._empty_metrics()
-        
-        # Базовые метрики доходности
-        total_return = (portfolio_values[-1] - portfolio_values[0]) / portfolio_values[0]
         period_days = (dates[-1] - dates[0]).days
+        metrics = self.risk_calculator.calculate_metrics_array(
+            portfolio_values, period_days, benchmark_returns
+        )
         
-        if period_days == 0:
-            annualized_return = 0.0
-            cagr = 0.0
-        else:
-            years = period_days / 365.25
-            annualized_return = np.mean(returns) * 252
-            cagr = (portfolio_values[-1] / portfolio_values[0]) ** (1 / years) - 1
-        
-        # Риск-метрики
-        volatility = np.std(returns, ddof=1) * np.sqrt(252)
-        
-        negative_returns = [r for r in returns if r < 0]
-        downside_volatility = (np.std(negative_returns, ddof=1) * np.sqrt(252) 
-                             if negative_returns else 0.0)
+        return metrics if metrics is not None else self._empty_metrics()
+    
+    @staticmethod
+    def align_benchmark_levels(levels: pd.Series, dates: List[datetime]) -> np.ndarray:
+        """Доходности бенчмарка между датами портфеля по ряду значений индекса (as-of)"""
+        from app.services.benchmark_service import align_as_of, composite_returns, to_day_array
+        
+        levels = levels.dropna().sort_index()
+        aligned = align_as_of(
+            to_day_array(pd.DatetimeIndex(levels.index).to_pydatetime()),
+            levels.to_numpy(dtype=np.float64),
+            to_day_array(dates)
+        )
+        return composite_returns(aligned, np.ones(1))
+    
+    async def portfolio_benchmark_returns(self, db, portfolio_id: int, dates: List[datetime]) -> Optional[np.ndarray]:
+        """
+        Доходности назначенного портфелю (составного) бенчмарка, выровненные
+        на даты снимков. Повторные вызовы обслуживаются из кэша.
+        """
+        from app.services.benchmark_service import BenchmarkSeriesService
         
-        max_drawdown = self.risk_calculator.calculate_max_drawdown(portfolio_values)
+        return BenchmarkSeriesService(db, cache=self._benchmark_cache).portfolio_returns(portfolio_id, dates)
+    
+    async def calculate_batch_metrics(self,
+                                      values_matrix: np.ndarray,
+                                      dates: List[datetime],
+                                      mask: Optional[np.ndarray] = None,
+                                      benchmark_values: Optional[np.ndarray] = None,
+                                      max_chunk_bytes: int = BATCH_CHUNK_BYTES) -> List[RiskMetrics]:
+        """
+        Рассчитать риск-метрики для множества портфелей за один вызов
         
-        # Риск-скорректированные метрики
-        sharpe_ratio = self.risk_calculator.calculate_sharpe_ratio(returns)
-        sortino_ratio = self.risk_calculator.calculate_sortino_ratio(returns)
-        calmar_ratio = cagr / max_drawdown if max_drawdown > 0 else 0.0
+        Args:
+            values_matrix: Выровненная матрица стоимостей (портфели × даты)
+            dates: Даты столбцов матрицы
+            mask: Маска валидных значений для рваных историй
+                  (по умолчанию - все конечные значения)
+            benchmark_values: Уровни общего бенчмарка на те же даты
+            max_chunk_bytes: Ограничение памяти на обработку одного блока портфелей
+        
+        Returns:
+            Список RiskMetrics в порядке строк матрицы
+        """
+        values_matrix = np.asarray(values_matrix, dtype=np.float64)
+        if values_matrix.ndim != 2:
+            raise ValueError("Ожидается матрица стоимостей формы (портфели, даты)")
         
-        # VaR метрики
-        var_95 = self.risk_calculator.calculate_var(returns, 0.95)
-        var_99 = self.risk_calculator.calculate_var(returns, 0.99)
-        cvar_95 = self.risk_calculator.calculate_cvar(returns, 0.95)
+        rows, cols = values_matrix.shape
+        if len(dates) != cols:
+            raise ValueError("Количество дат не совпадает с числом столбцов матрицы")
         
-        # Дополнительные статистики
-        positive_periods = len([r for r in returns if r > 0])
-        negative_periods = len([r for r in returns if r < 0])
-        win_rate = positive_periods / len(returns) if returns else 0.0
+        if mask is None:
+            mask = np.isfinite(values_matrix)
+        else:
+            mask = np.asarray(mask, dtype=bool) & np.isfinite(values_matrix)
         
-        positive_sum = sum([r for r in returns if r > 0])
-        negative_sum = abs(sum([r for r in returns if r < 0]))
-        profit_factor = positive_sum / negative_sum if negative_sum > 0 else float('inf')
+        day_numbers = np.array([d.toordinal() for d in dates], dtype=np.int64)
         
-        # Метрики относительно бенчмарка
-        beta = None
-        alpha = None
-        treynor_ratio = None
-        information_ratio = None
-        correlation = None
+        # Около дюжины временных матриц float64 формы (chunk, T) на блок
+        bytes_per_row = max(cols, 1) * 8 * 12
+        chunk_rows = max(1, max_chunk_bytes // bytes_per_row)
         
-        if benchmark_returns and len(benchmark_returns) == len(returns):
-            beta = self.risk_calculator.calculate_beta(returns, benchmark_returns)
-            alpha = self.risk_calculator.calculate_alpha(returns, benchmark_returns)
-            
-            if beta and beta != 0:
-                treynor_ratio = (annualized_return - 0.045) / beta
-            
-            # Information Ratio
-            excess_returns = [p - b for p, b in zip(returns, benchmark_returns)]
-            if excess_returns and np.std(excess_returns, ddof=1) > 0:
-                information_ratio = np.mean(excess_returns) / np.std(excess_returns, ddof=1) * np.sqrt(252)
-            
-            # Корреляция
-            if len(returns) > 1:
-                correlation, _ = stats.pearsonr(returns, benchmark_returns)
+        results: List[RiskMetrics] = []
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            chunk_metrics = self.risk_calculator.calculate_metrics_matrix(
+                values_matrix[start:stop],
+                mask[start:stop],
+                day_numbers,
+                benchmark_values
+            )
+            results.extend(m if m is not None else self._empty_metrics() for m in chunk_metrics)
         
-        return RiskMetrics(
-            total_return=float(total_return),
-            annualized_return=float(annualized_return),
-            cagr=float(cagr),
-            volatility=float(volatility),
-            downside_volatility=float(downside_volatility),
-            max_drawdown=float(max_drawdown),
-            average_drawdown=float(np.mean([self._calculate_drawdown_at_point(portfolio_values, i) 
-                                          for i in range(len(portfolio_values))])),
-            sharpe_ratio=float(sharpe_ratio),
-            sortino_ratio=float(sortino_ratio),
-            calmar_ratio=float(calmar_ratio),
-            beta=beta,
-            alpha=alpha,
-            treynor_ratio=treynor_ratio,
-            information_ratio=information_ratio,
-            correlation=correlation,
-            var_95=float(var_95),
-            var_99=float(var_99),
-            cvar_95=float(cvar_95),
-            win_rate=float(win_rate),
-            profit_factor=float(profit_factor),
-            maximum_gain=float(max(returns)) if returns else 0.0,
-            maximum_loss=float(min(returns)) if returns else 0.0,
-            period_days=period_days,
-            positive_periods=positive_periods,
-            negative_periods=negative_periods
-        )
-    
-    def _calculate_drawdown_at_point(self, prices: List[float], index: int) -> float:
-        """Рассчитать просадку на конкретную дату"""
-        if index == 0:
-            return 0.0
-        
-        peak = max(prices[:index + 1])
-        return (peak - prices[index]) / peak
+        return results
     
     def _empty_metrics(self) -> RiskMetrics:
         """Пустые метрики для случая недостатка данных"""
@@ -461,6 +1085,10 @@ class AnalyticsEngine:
         """
         Провести бектестинг торговой стратегии
         
+        Прогон выполняет BacktestEngine (app.services.backtest_engine). Стратегии
+        старого формата strategy(data, positions, cash) поддерживаются через
+        адаптер, но получают DataFrame-префикс на каждом баре.
+        
         Args:
             strategy_func: Функция стратегии
             price_data: Исторические данные цен
@@ -469,241 +1097,79 @@ class AnalyticsEngine:
             end_date: Дата окончания тестирования
             benchmark_data: Данные бенчмарка
         """
-        # Фильтруем данные по датам
+        from app.services.backtest_engine import (
+            BacktestEngine, is_window_strategy, legacy_strategy
+        )
+        
         if start_date:
             price_data = price_data[price_data.index >= start_date]
         if end_date:
             price_data = price_data[price_data.index <= end_date]
         
-        if price_data.empty:
-            raise ValueError("Нет данных для бектестинга в указанном периоде")
-        
-        # Инициализация
-        portfolio_values = [initial_capital]
-        positions = {}
-        trades = []
-        cash = initial_capital
-        
-        # Прогоняем стратегию по историческим данным
-        for i, (date, row) in enumerate(price_data.iterrows()):
-            # Получаем сигналы от стратегии
-            signals = strategy_func(price_data.iloc[:i+1], positions, cash)
-            
-            # Исполняем торговые сигналы
-            for symbol, signal in signals.items():
-                if signal['action'] == 'BUY' and cash >= signal['amount']:
-                    # Покупка
-                    shares = signal['amount'] / row[symbol]
-                    positions[symbol] = positions.get(symbol, 0) + shares
-                    cash -= signal['amount']
-                    trades.append({
-                        'date': date,
-                        'symbol': symbol,
-                        'action': 'BUY',
-                        'shares': shares,
-                        'price': row[symbol],
-                        'amount': signal['amount']
-                    })
-                
-                elif signal['action'] == 'SELL' and symbol in positions and positions[symbol] > 0:
-                    # Продажа
-                    shares_to_sell = min(signal.get('shares', positions[symbol]), positions[symbol])
-                    amount = shares_to_sell * row[symbol]
-                    positions[symbol] -= shares_to_sell
-                    cash += amount
-                    trades.append({
-                        'date': date,
-                        'symbol': symbol,
-                        'action': 'SELL',
-                        'shares': shares_to_sell,
-                        'price': row[symbol],
-                        'amount': amount
-                    })
-            
-            # Рассчитываем текущую стоимость портфеля
-            portfolio_value = cash
-            for symbol, shares in positions.items():
-                if shares > 0:
-                    portfolio_value += shares * row[symbol]
-            
-            portfolio_values.append(portfolio_value)
-        
-        # Анализируем результаты
-        dates = [price_data.index[0]] + list(price_data.index)
-        returns = self.risk_calculator.calculate_returns(portfolio_values)
-        cumulative_returns = self.risk_calculator.calculate_cumulative_returns(returns)
-        
-        equity_curve = ReturnSeries(
-            dates=dates,
-            returns=[0] + returns,
-            cumulative_returns=[0] + cumulative_returns,
-            portfolio_values=portfolio_values
-        )
-        
-        # Рассчитываем основные метрики
-        total_return = (portfolio_values[-1] - initial_capital) / initial_capital
-        period_days = (dates[-1] - dates[0]).days
-        years = period_days / 365.25 if period_days > 0 else 1
-        cagr = (portfolio_values[-1] / initial_capital) ** (1 / years) - 1
-        
-        volatility = np.std(returns, ddof=1) * np.sqrt(252) if len(returns) > 1 else 0
-        sharpe_ratio = self.risk_calculator.calculate_sharpe_ratio(returns)
-        max_drawdown = self.risk_calculator.calculate_max_drawdown(portfolio_values)
-        
-        # Анализ сделок
-        buy_trades = [t for t in trades if t['action'] == 'BUY']
-        sell_trades = [t for t in trades if t['action'] == 'SELL']
-        
-        # Упрощенный анализ прибыльности сделок
-        winning_trades = 0
-        losing_trades = 0
-        
-        # Группируем покупки и продажи по символам для анализа
-        for symbol in set(t['symbol'] for t in trades):
-            symbol_trades = [t for t in trades if t['symbol'] == symbol]
-            symbol_trades.sort(key=lambda x: x['date'])
-            
-            # Простой FIFO анализ
-            position = 0
-            avg_price = 0
-            
-            for trade in symbol_trades:
-                if trade['action'] == 'BUY':
-                    if position == 0:
-                        avg_price = trade['price']
-                    else:
-                        avg_price = (avg_price * position + trade['price'] * trade['shares']) / (position + trade['shares'])
-                    position += trade['shares']
-                
-                elif trade['action'] == 'SELL' and position > 0:
-                    pnl = (trade['price'] - avg_price) * trade['shares']
-                    if pnl > 0:
-                        winning_trades += 1
-                    else:
-                        losing_trades += 1
-                    position -= trade['shares']
-        
-        total_trades = winning_trades + losing_trades
-        win_rate = winning_trades / total_trades if total_trades > 0 else 0
-        
-        # Сравнение с бенчмарком
-        benchmark_return = None
-        excess_return = None
-        beta = None
-        alpha = None
+        strategy = strategy_func
+        if not is_window_strategy(strategy_func):
+            strategy = legacy_strategy(strategy_func, price_data)
         
-        if benchmark_data is not None:
-            # Приводим бенчмарк к тому же периоду
-            benchmark_period = benchmark_data[
-                (benchmark_data.index >= dates[0]) & 
-                (benchmark_data.index <= dates[-1])
-            ]
-            
-            if not benchmark_period.empty:
-                benchmark_values = benchmark_period.iloc[:, 0].values
-                benchmark_returns = self.risk_calculator.calculate_returns(benchmark_values.tolist())
-                benchmark_return = (benchmark_values[-1] - benchmark_values[0]) / benchmark_values[0]
-                excess_return = total_return - benchmark_return
-                
-                if len(benchmark_returns) == len(returns):
-                    beta = self.risk_calculator.calculate_beta(returns, benchmark_returns)
-                    alpha = self.risk_calculator.calculate_alpha(returns, benchmark_returns)
-        
-        # Расчет просадок
-        drawdown_series = []
-        peak = portfolio_values[0]
-        for value in portfolio_values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak
-            drawdown_series.append(drawdown)
-        
-        return BacktestResult(
-            strategy_name="Custom Strategy",
-            start_date=dates[0],
-            end_date=dates[-1],
+        return BacktestEngine().run(
+            strategy,
+            price_data,
             initial_capital=initial_capital,
-            final_capital=portfolio_values[-1],
-            total_return=total_return,
-            cagr=cagr,
-            volatility=volatility,
-            sharpe_ratio=sharpe_ratio,
-            max_drawdown=max_drawdown,
-            total_trades=total_trades,
-            winning_trades=winning_trades,
-            losing_trades=losing_trades,
-            win_rate=win_rate,
-            equity_curve=equity_curve,
-            drawdown_series=drawdown_series,
-            benchmark_return=benchmark_return,
-            excess_return=excess_return,
-            beta=beta,
-            alpha=alpha
+            benchmark_data=benchmark_data
         )
     
     async def stress_test_portfolio(self,
                                   portfolio_weights: Dict[str, float],
                                   historical_data: pd.DataFrame,
-                                  stress_scenarios: List[Dict]) -> Dict[str, Any]:
+                                  stress_scenarios: List[Dict],
+                                  n_paths: int = 100_000,
+                                  seed: Optional[int] = None,
+                                  confidence_levels: Tuple[float, ...] = (0.95, 0.99, 0.999),
+                                  max_workers: int = 1,
+                                  scenario_matrix: Optional[Any] = None) -> Dict[str, Any]:
         """
         Провести стресс-тестирование портфеля
         
+        Сценарии типа 'historical' ({'name', 'type': 'historical', 'scenario': 'covid_2020'})
+        проигрывают реальный эпизод из библиотеки scenario_replay, остальные
+        моделируются методом Monte Carlo.
+        
         Args:
             portfolio_weights: Веса активов в портфеле
             historical_data: Исторические данные
             stress_scenarios: Сценарии стресс-тестирования
+            n_paths: Число Monte Carlo путей на сценарий
+            seed: Зерно генератора для воспроизводимости
+            confidence_levels: Уровни доверия для VaR/CVaR
+            max_workers: Число процессов для генерации блоков путей
+            scenario_matrix: Заранее построенная ScenarioMatrix с теми же ключами,
+                что и portfolio_weights (иначе строится по historical_data)
         """
-        results = {}
-        
-        for scenario in stress_scenarios:
-            scenario_name = scenario['name']
-            shocked_returns = self._apply_stress_scenario(historical_data, scenario)
-            
-            # Рассчитываем воздействие на портфель
-            portfolio_impact = 0
-            for asset, weight in portfolio_weights.items():
-                if asset in shocked_returns:
-                    portfolio_impact += weight * shocked_returns[asset]
-            
-            results[scenario_name] = {
-                'portfolio_impact': portfolio_impact,
-                'individual_impacts': {asset: shocked_returns.get(asset, 0) 
-                                     for asset in portfolio_weights.keys()},
-                'scenario_description': scenario.get('description', '')
-            }
+        from app.services.scenario_replay import build_scenario_matrix, resolve_scenarios
+        from app.services.stress_engine import MonteCarloStressEngine
         
-        return results
-    
-    def _apply_stress_scenario(self, data: pd.DataFrame, scenario: Dict) -> Dict[str, float]:
-        """Применить сценарий стресс-тестирования"""
-        shocked_returns = {}
+        replayed = [s for s in stress_scenarios if s.get('type') == 'historical']
+        simulated = [s for s in stress_scenarios if s.get('type') != 'historical']
         
-        for asset in data.columns:
-            base_return = 0  # Базовая доходность
-            
-            # Применяем шоки в зависимости от типа сценария
-            if scenario['type'] == 'market_crash':
-                # Рыночный крах - все активы падают
-                shock = scenario.get('magnitude', -0.20)  # -20% по умолчанию
-                shocked_returns[asset] = shock
-            
-            elif scenario['type'] == 'volatility_spike':
-                # Рост волатильности
-                historical_vol = data[asset].pct_change().std()
-                vol_multiplier = scenario.get('multiplier', 2.0)
-                shocked_returns[asset] = -historical_vol * vol_multiplier
-            
-            elif scenario['type'] == 'correlation_breakdown':
-                # Разрыв корреляций - активы движутся независимо
-                import random
-                shocked_returns[asset] = random.uniform(-0.15, 0.15)
-            
-            elif scenario['type'] == 'custom':
-                # Пользовательский сценарий
-                asset_shocks = scenario.get('asset_shocks', {})
-                shocked_returns[asset] = asset_shocks.get(asset, 0)
-        
-        return shocked_returns
+        results = {}
+        if simulated:
+            engine = MonteCarloStressEngine(
+                n_paths=n_paths,
+                seed=seed,
+                confidence_levels=confidence_levels,
+                max_workers=max_workers
+            )
+            results.update(engine.run(portfolio_weights, historical_data, simulated))
+        
+        if replayed:
+            if scenario_matrix is None:
+                scenario_matrix = build_scenario_matrix(
+                    historical_data, resolve_scenarios(s['scenario'] for s in replayed)
+                )
+            replay = scenario_matrix.evaluate(portfolio_weights)
+            for scenario in replayed:
+                results[scenario['name']] = replay[scenario['scenario']]
+        
+        return {s['name']: results[s['name']] for s in stress_scenarios}
     
     async def generate_analytics_report(self,
                                       portfolio_metrics: RiskMetrics,
@@ -846,41 +1312,19 @@ CAGR: {result.cagr:.2%}
 
 
 # Фабричные функции для создания стандартных стратегий
+# (реализации работают с MarketWindow, см. app.services.backtest_engine)
 def create_buy_and_hold_strategy(symbols: List[str], weights: Dict[str, float]):
     """Создать стратегию 'купи и держи'"""
-    def strategy(data, positions, cash):
-        signals = {}
-        if len(data) == 1:  # Первый день - покупаем
-            for symbol in symbols:
-                if symbol in data.columns:
-                    target_amount = cash * weights.get(symbol, 0)
-                    signals[symbol] = {'action': 'BUY', 'amount': target_amount}
-        return signals
-    return strategy
+    from app.services import backtest_engine
+    return backtest_engine.create_buy_and_hold_strategy(symbols, weights)
 
 
 def create_rebalancing_strategy(symbols: List[str], 
                               weights: Dict[str, float], 
-                              rebalance_frequency: int = 60):
+                              rebalance_frequency: int = 60,
+                              threshold: float = 0.05):
     """Создать стратегию с периодическим ребалансированием"""
-    def strategy(data, positions, cash):
-        signals = {}
-        if len(data) % rebalance_frequency == 1 or len(data) == 1:
-            total_value = cash + sum(positions.get(s, 0) * data.iloc[-1][s] 
-                                   for s in symbols if s in data.columns)
-            
-            for symbol in symbols:
-                if symbol in data.columns:
-                    target_value = total_value * weights.get(symbol, 0)
-                    current_value = positions.get(symbol, 0) * data.iloc[-1][symbol]
-                    
-                    if target_value > current_value:
-                        # Покупаем
-                        signals[symbol] = {'action': 'BUY', 'amount': target_value - current_value}
-                    elif current_value > target_value * 1.05:  # 5% допуск
-                        # Продаем
-                        shares_to_sell = (current_value - target_value) / data.iloc[-1][symbol]
-                        signals[symbol] = {'action': 'SELL', 'shares': shares_to_sell}
-        
-        return signals
-    return strategy
+    from app.services import backtest_engine
+    return backtest_engine.create_rebalancing_strategy(
+        symbols, weights, rebalance_frequency, threshold
+    )
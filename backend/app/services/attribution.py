@@ -0,0 +1,385 @@
+"""
+Атрибуция доходности по Бринсону.
+
+Разложение активной доходности портфеля относительно бенчмарка на эффекты
+распределения (allocation), выбора (selection) и взаимодействия
+(interaction) по сегментам: классу актива, сектору, стране или валюте
+инструмента. Эффекты считаются за каждый подпериод (Brinson-Fachler) сразу
+на массивах (периоды × сегменты) и связываются по методу Карино, так что
+сумма связанных эффектов равна разнице накопленных доходностей.
+
+Бенчмарк задается политикой: для каждого сегмента вес и индекс
+(benchmark_levels), доходность сегмента бенчмарка - доходность индекса.
+Интервал начинается с первого дня с позициями; подпериоды, в которых
+портфель не вложен (все позиции закрыты), учитываются как сегмент cash
+с нулевой доходностью, чтобы веса портфеля всегда давали в сумме 1.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import LRUTTLCache
+from app.core.logging import logger
+from app.models.account import Account
+from app.models.instrument import Instrument
+from app.models.portfolio import PortfolioSnapshot
+from app.models.price import Price
+from app.models.transaction import Transaction
+from app.repositories.price import PriceRepository
+from app.repositories.transaction import TransactionRepository
+from app.services.benchmark_service import BenchmarkSeriesService
+
+
+ATTRIBUTION_DIMENSIONS = ("asset_class", "sector", "country", "currency")
+UNKNOWN_SEGMENT = "unknown"
+CASH_SEGMENT = "cash"
+ATTRIBUTION_CACHE = LRUTTLCache(maxsize=256, ttl=6 * 3600)
+
+
+@dataclass
+class AttributionResult:
+    """Связанные за весь интервал эффекты по сегментам (доли, не проценты)"""
+    dimension: str
+    segments: List[str]
+    start_date: date
+    end_date: date
+    periods: int
+    portfolio_return: float
+    benchmark_return: float
+    allocation: np.ndarray
+    selection: np.ndarray
+    interaction: np.ndarray
+    average_portfolio_weights: np.ndarray = field(repr=False, default=None)
+    average_benchmark_weights: np.ndarray = field(repr=False, default=None)
+
+    @property
+    def active_return(self) -> float:
+        return self.portfolio_return - self.benchmark_return
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "dimension": self.dimension,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "periods": self.periods,
+            "portfolio_return": self.portfolio_return,
+            "benchmark_return": self.benchmark_return,
+            "active_return": self.active_return,
+            "totals": {
+                "allocation": float(self.allocation.sum()),
+                "selection": float(self.selection.sum()),
+                "interaction": float(self.interaction.sum()),
+            },
+            "segments": [
+                {
+                    "segment": segment,
+                    "portfolio_weight": float(self.average_portfolio_weights[i]),
+                    "benchmark_weight": float(self.average_benchmark_weights[i]),
+                    "allocation": float(self.allocation[i]),
+                    "selection": float(self.selection[i]),
+                    "interaction": float(self.interaction[i]),
+                }
+                for i, segment in enumerate(self.segments)
+            ],
+        }
+
+
+def segment_membership(labels: Sequence[Optional[str]],
+                       segments: Optional[Sequence[str]] = None) -> Tuple[List[str], np.ndarray]:
+    """Матрица принадлежности (инструменты × сегменты) из меток сегментов"""
+    labels = [label or UNKNOWN_SEGMENT for label in labels]
+    segments = list(segments) if segments is not None else sorted(set(labels))
+    index = {segment: i for i, segment in enumerate(segments)}
+    membership = np.zeros((len(labels), len(segments)))
+    membership[np.arange(len(labels)), [index[label] for label in labels]] = 1.0
+    return segments, membership
+
+
+def portfolio_segments(values: np.ndarray,
+                       returns: np.ndarray,
+                       membership: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Веса и доходности сегментов портфеля по подпериодам.
+
+    Args:
+        values: (T, N) стоимость позиций на начало подпериодов
+        returns: (T, N) доходности инструментов за подпериоды
+        membership: (N, S) принадлежность инструментов сегментам
+
+    Returns:
+        (веса (T, S), доходности (T, S)); у сегмента без позиций доходность NaN
+    """
+    totals = values.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(totals > 0, values / totals, 0.0)
+    segment_weights = weights @ membership
+    contributions = (weights * np.nan_to_num(returns)) @ membership
+    with np.errstate(divide="ignore", invalid="ignore"):
+        segment_returns = np.where(segment_weights > 0, contributions / segment_weights, np.nan)
+    return segment_weights, segment_returns
+
+
+def add_cash_segment(segments: Sequence[str],
+                     weights: np.ndarray,
+                     returns: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Дополнить веса сегментов (T, S) до 1 сегментом cash с нулевой
+    доходностью (подпериоды без позиций). Без невложенных подпериодов
+    массивы возвращаются без изменений.
+    """
+    uninvested = np.clip(1.0 - weights.sum(axis=1), 0.0, None)
+    if not np.any(uninvested > 1e-12):
+        return list(segments), weights, returns
+
+    segments = list(segments)
+    if CASH_SEGMENT not in segments:
+        segments.append(CASH_SEGMENT)
+        weights = np.hstack([weights, np.zeros((weights.shape[0], 1))])
+        returns = np.hstack([returns, np.full((returns.shape[0], 1), np.nan)])
+    else:
+        weights, returns = weights.copy(), returns.copy()
+    cash = segments.index(CASH_SEGMENT)
+    weights[:, cash] += uninvested
+    returns[:, cash] = np.where(uninvested > 1e-12, 0.0, returns[:, cash])
+    return segments, weights, returns
+
+
+def brinson_fachler(portfolio_weights: np.ndarray,
+                    portfolio_returns: np.ndarray,
+                    benchmark_weights: np.ndarray,
+                    benchmark_returns: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Эффекты Brinson-Fachler за каждый подпериод, все массивы (T, S).
+
+    Доходность сегмента, которого нет в портфеле, принимается равной
+    бенчмарку, а сегмента без бенчмарка - общей доходности бенчмарка:
+    тогда выбор и взаимодействие по ним нулевые, а сумма эффектов
+    совпадает с R_p - R_b.
+
+    Returns:
+        (allocation, selection, interaction, R_p (T,), R_b (T,))
+    """
+    benchmark_total = (benchmark_weights * np.nan_to_num(benchmark_returns)).sum(axis=1)
+    rb = np.where(np.isnan(benchmark_returns), benchmark_total[:, None], benchmark_returns)
+    rp = np.where(np.isnan(portfolio_returns), rb, portfolio_returns)
+    portfolio_total = (portfolio_weights * rp).sum(axis=1)
+
+    active_weights = portfolio_weights - benchmark_weights
+    allocation = active_weights * (rb - benchmark_total[:, None])
+    selection = benchmark_weights * (rp - rb)
+    interaction = active_weights * (rp - rb)
+    return allocation, selection, interaction, portfolio_total, benchmark_total
+
+
+def _log_ratio(portfolio: np.ndarray, benchmark: np.ndarray) -> np.ndarray:
+    """(ln(1+R_p) - ln(1+R_b)) / (R_p - R_b) с пределом 1/(1+R) при R_p = R_b"""
+    difference = portfolio - benchmark
+    same = np.abs(difference) < 1e-12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = (np.log1p(portfolio) - np.log1p(benchmark)) / np.where(same, 1.0, difference)
+    return np.where(same, 1.0 / (1.0 + portfolio), ratio)
+
+
+def carino_link(effects: np.ndarray,
+                portfolio_returns: np.ndarray,
+                benchmark_returns: np.ndarray) -> np.ndarray:
+    """
+    Связать эффекты подпериодов (T, S) в эффекты интервала (S,) по Карино:
+    вес подпериода k_t / K, где k - логарифмический коэффициент сглаживания.
+    """
+    total_portfolio = np.prod(1.0 + portfolio_returns) - 1.0
+    total_benchmark = np.prod(1.0 + benchmark_returns) - 1.0
+    k = _log_ratio(portfolio_returns, benchmark_returns)
+    K = float(_log_ratio(np.array([total_portfolio]), np.array([total_benchmark]))[0])
+    return (k / K) @ effects
+
+
+def attribute(portfolio_weights: np.ndarray,
+              portfolio_returns: np.ndarray,
+              benchmark_weights: np.ndarray,
+              benchmark_returns: np.ndarray) -> Dict[str, Any]:
+    """Связанная атрибуция по массивам сегментов (T, S)"""
+    benchmark_weights = np.broadcast_to(benchmark_weights, portfolio_weights.shape)
+    allocation, selection, interaction, rp, rb = brinson_fachler(
+        portfolio_weights, portfolio_returns, benchmark_weights, benchmark_returns
+    )
+    return {
+        "portfolio_return": float(np.prod(1.0 + rp) - 1.0),
+        "benchmark_return": float(np.prod(1.0 + rb) - 1.0),
+        "allocation": carino_link(allocation, rp, rb),
+        "selection": carino_link(selection, rp, rb),
+        "interaction": carino_link(interaction, rp, rb),
+    }
+
+
+class AttributionService:
+    """Атрибуция портфеля по данным позиций, цен и индексов сегментов"""
+
+    def __init__(self, db: Session, cache: Optional[LRUTTLCache] = None):
+        self.db = db
+        self.cache = cache if cache is not None else ATTRIBUTION_CACHE
+        self.prices = PriceRepository(db)
+        self.transactions = TransactionRepository(db)
+
+    def attribute(self,
+                  portfolio_id: int,
+                  segment_benchmarks: Mapping[str, Tuple[float, int]],
+                  dimension: str = "asset_class",
+                  start_date: Optional[date] = None,
+                  end_date: Optional[date] = None) -> AttributionResult:
+        """
+        Атрибуция за интервал по дневным подпериодам.
+
+        Args:
+            segment_benchmarks: {сегмент: (вес в бенчмарке, benchmark_id индекса сегмента)}
+            dimension: asset_class, sector, country или currency
+
+        Результат кэшируется по версии данных портфеля (транзакции, цены,
+        снимки), поэтому повторный запрос без новых данных не пересчитывается.
+        """
+        if dimension not in ATTRIBUTION_DIMENSIONS:
+            raise ValueError(f"Неизвестный разрез атрибуции: {dimension}")
+
+        end_date = end_date or date.today()
+        start_date = start_date or end_date - timedelta(days=365)
+        policy = tuple(sorted((segment, float(weight), int(bid)) for segment, (weight, bid) in segment_benchmarks.items()))
+        key = ("attribution", portfolio_id, dimension, policy, start_date, end_date, self.data_version(portfolio_id))
+
+        return self.cache.get_or_set(key, lambda: self._compute(portfolio_id, policy, dimension, start_date, end_date))
+
+    def data_version(self, portfolio_id: int) -> Tuple:
+        """Версия данных портфеля: изменения транзакций, цен его инструментов и снимков"""
+        accounts = select(Account.id).where(Account.portfolio_id == portfolio_id)
+        tx_count, tx_max_id = self.db.execute(
+            select(func.count(Transaction.id), func.max(Transaction.id)).where(Transaction.account_id.in_(accounts))
+        ).one()
+        instruments = select(Transaction.instrument_id).where(Transaction.account_id.in_(accounts))
+        last_price = self.db.execute(
+            select(func.max(Price.ts)).where(Price.instrument_id.in_(instruments))
+        ).scalar()
+        last_snapshot = self.db.execute(
+            select(func.max(PortfolioSnapshot.created_at)).where(PortfolioSnapshot.portfolio_id == portfolio_id)
+        ).scalar()
+        return tx_count, tx_max_id, last_price, last_snapshot
+
+    def _compute(self,
+                 portfolio_id: int,
+                 policy: Tuple[Tuple[str, float, int], ...],
+                 dimension: str,
+                 start_date: date,
+                 end_date: date) -> AttributionResult:
+        values, returns, labels, days = self._position_arrays(portfolio_id, dimension, start_date, end_date)
+
+        segments = sorted(set(labels) | {segment for segment, _, _ in policy})
+        segments, membership = segment_membership(labels, segments)
+        wp, rp = portfolio_segments(values, returns, membership)
+        segments, wp, rp = add_cash_segment(segments, wp, rp)
+
+        index = {segment: i for i, segment in enumerate(segments)}
+        wb = np.zeros(len(segments))
+        rb = np.full((len(days) - 1, len(segments)), np.nan)
+        if CASH_SEGMENT in index:
+            # Невложенная доля без индекса в политике сравнивается с нулевой доходностью (эффект распределения)
+            rb[:, index[CASH_SEGMENT]] = 0.0
+        benchmarks = BenchmarkSeriesService(self.db)
+        for segment, weight, benchmark_id in policy:
+            wb[index[segment]] = weight
+            rb[:, index[segment]] = benchmarks.aligned_returns({benchmark_id: 1.0}, days)
+        if wb.sum() > 0:
+            wb = wb / wb.sum()
+
+        linked = attribute(wp, rp, wb, rb)
+        logger.debug(f"Атрибуция портфеля {portfolio_id}: {wp.shape[0]} периодов × {len(segments)} сегментов")
+        return AttributionResult(
+            dimension=dimension,
+            segments=segments,
+            start_date=days[0],
+            end_date=end_date,
+            periods=wp.shape[0],
+            average_portfolio_weights=wp.mean(axis=0) if wp.shape[0] else np.zeros(len(segments)),
+            average_benchmark_weights=wb,
+            **linked
+        )
+
+    def _position_arrays(self,
+                         portfolio_id: int,
+                         dimension: str,
+                         start_date: date,
+                         end_date: date) -> Tuple[np.ndarray, np.ndarray, List[str], List[date]]:
+        """
+        Стоимости позиций на начало дневных подпериодов и доходности
+        инструментов (T, N), метки сегментов (N,) и даты (T + 1).
+        """
+        end = datetime.combine(end_date, time.max)
+        changes = self.transactions.get_position_changes(portfolio_id, end)
+        if not changes:
+            raise ValueError("У портфеля нет сделок для атрибуции")
+
+        instrument_ids = sorted({instrument_id for instrument_id, _, _ in changes})
+        # Цены до начала интервала нужны, чтобы протянуть последнюю известную цену
+        rows = self.prices.get_closes(
+            instrument_ids, [(datetime.combine(start_date - timedelta(days=31), time.min), end)]
+        )
+        closes = pd.DataFrame(rows, columns=["instrument_id", "ts", "close"])
+        closes["day"] = pd.to_datetime(closes["ts"]).dt.tz_localize(None).dt.normalize()
+        prices = (
+            closes.pivot_table(index="day", columns="instrument_id", values="close", aggfunc="last")
+            .reindex(columns=instrument_ids)
+            .astype(np.float64)
+            .ffill()
+        )
+        prices = prices[prices.index >= pd.Timestamp(start_date)]
+        if prices.shape[0] < 2:
+            raise ValueError("Недостаточно истории цен для атрибуции")
+
+        moves = pd.DataFrame(changes, columns=["instrument_id", "ts", "quantity"])
+        moves["day"] = pd.to_datetime(moves["ts"]).dt.tz_localize(None).dt.normalize()
+        moves["quantity"] = moves["quantity"].astype(np.float64)
+        # Позиция на конец дня: накопленная сумма сделок, выровненная as-of на дни цен
+        quantities = (
+            moves.pivot_table(index="day", columns="instrument_id", values="quantity", aggfunc="sum")
+            .reindex(columns=instrument_ids, fill_value=0.0)
+            .fillna(0.0)
+            .cumsum()
+            .reindex(prices.index.union(moves["day"].unique()))
+            .ffill()
+            .fillna(0.0)
+            .reindex(prices.index)
+        )
+
+        price_matrix = prices.to_numpy()
+        values = np.nan_to_num(quantities.to_numpy()[:-1] * price_matrix[:-1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = price_matrix[1:] / price_matrix[:-1] - 1.0
+
+        # Подпериоды до первой позиции (окно начинается раньше первой сделки) не учитываются
+        invested = np.flatnonzero(values.sum(axis=1) > 0)
+        if invested.size == 0:
+            raise ValueError("В интервале у портфеля нет позиций для атрибуции")
+        first = int(invested[0])
+
+        labels = self._labels(instrument_ids, dimension)
+        days = [timestamp.date() for timestamp in prices.index[first:]]
+        return values[first:], returns[first:], labels, days
+
+    def _labels(self, instrument_ids: List[int], dimension: str) -> List[str]:
+        column = {
+            "asset_class": Instrument.instrument_type,
+            "sector": Instrument.sector,
+            "country": Instrument.country,
+            "currency": Instrument.currency,
+        }[dimension]
+        found = dict(self.db.execute(
+            select(Instrument.id, column).where(Instrument.id.in_(instrument_ids))
+        ).all())
+        labels = []
+        for instrument_id in instrument_ids:
+            label = found.get(instrument_id)
+            labels.append(getattr(label, "value", label) or UNKNOWN_SEGMENT)
+        return labels
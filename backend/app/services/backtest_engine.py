@@ -0,0 +1,470 @@
+"""
+Событийный движок бектестинга на numpy-массивах.
+
+Позиции и денежные средства хранятся в массивах, стратегия на каждом баре
+получает read-only окно (view без копирования) на матрицу цен. Кривая
+капитала, просадки и статистика сделок по FIFO считаются векторно после
+прогона, поэтому время бектеста линейно по числу баров.
+
+Стратегия - вызываемый объект, принимающий MarketWindow и возвращающий:
+- None или пустой словарь - ничего не делать;
+- словарь сигналов {symbol: {'action': 'BUY', 'amount': ...} |
+  {'action': 'SELL', 'shares': ...}} (формат AnalyticsEngine.backtest_strategy);
+- вектор целевых весов (ndarray длины n_symbols) - ребалансировка к весам.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.services.analytics_engine import (
+    BacktestResult,
+    ReturnSeries,
+    RiskCalculator,
+    TRADING_DAYS,
+)
+
+
+Signals = Union[None, Dict[str, Dict[str, Any]], np.ndarray]
+WindowStrategy = Callable[["MarketWindow"], Signals]
+
+
+@dataclass(frozen=True)
+class MarketWindow:
+    """Read-only окно рынка, передаваемое стратегии на текущем баре"""
+    index: int                 # Номер текущего бара (0-based)
+    date: datetime             # Дата текущего бара
+    symbols: Tuple[str, ...]   # Порядок столбцов матрицы цен
+    prices: np.ndarray         # View (index+1, n_symbols) на цены до текущего бара включительно
+    positions: np.ndarray      # View (n_symbols,) на текущие позиции в штуках
+    cash: float                # Свободные денежные средства
+
+    @property
+    def current_prices(self) -> np.ndarray:
+        """Цены текущего бара"""
+        return self.prices[-1]
+
+    @property
+    def total_value(self) -> float:
+        """Стоимость портфеля по ценам текущего бара"""
+        prices = self.prices[-1]
+        held = (self.positions > 0) & np.isfinite(prices)
+        return float(self.cash + np.dot(self.positions[held], prices[held]))
+
+    def __len__(self) -> int:
+        return self.index + 1
+
+
+def window_strategy(func: WindowStrategy) -> WindowStrategy:
+    """Пометить функцию как стратегию, работающую с MarketWindow"""
+    func.uses_market_window = True
+    return func
+
+
+def is_window_strategy(func: Callable) -> bool:
+    """Проверить, что стратегия принимает MarketWindow, а не DataFrame"""
+    return bool(getattr(func, "uses_market_window", False))
+
+
+def legacy_strategy(func: Callable, price_data: pd.DataFrame) -> WindowStrategy:
+    """
+    Адаптер для стратегий старого формата strategy(data, positions, cash).
+
+    Такие стратегии получают DataFrame-префикс на каждом баре, поэтому
+    сохраняют квадратичную сложность - используйте только для совместимости.
+    """
+    @window_strategy
+    def strategy(window: MarketWindow) -> Signals:
+        positions = {
+            symbol: float(shares)
+            for symbol, shares in zip(window.symbols, window.positions)
+            if shares != 0
+        }
+        return func(price_data.iloc[:window.index + 1], positions, window.cash)
+    return strategy
+
+
+class BacktestEngine:
+    """Движок бектестинга с позициями и кэшем в numpy-массивах"""
+
+    def __init__(self, risk_free_rate: float = 0.045):
+        self.risk_free_rate = risk_free_rate
+        self.risk_calculator = RiskCalculator()
+
+    def run(self,
+            strategy: WindowStrategy,
+            price_data: pd.DataFrame,
+            initial_capital: float = 1000000,
+            start_date: Optional[datetime] = None,
+            end_date: Optional[datetime] = None,
+            benchmark_data: Optional[pd.DataFrame] = None,
+            strategy_name: str = "Custom Strategy") -> BacktestResult:
+        """
+        Провести бектестинг стратегии
+
+        Args:
+            strategy: Стратегия, принимающая MarketWindow
+            price_data: Цены закрытия (индекс - даты, столбцы - инструменты)
+            initial_capital: Начальный капитал
+            start_date: Дата начала тестирования
+            end_date: Дата окончания тестирования
+            benchmark_data: Данные бенчмарка (первый столбец - уровни)
+            strategy_name: Название стратегии для отчета
+        """
+        if start_date:
+            price_data = price_data[price_data.index >= start_date]
+        if end_date:
+            price_data = price_data[price_data.index <= end_date]
+
+        if price_data.empty:
+            raise ValueError("Нет данных для бектестинга в указанном периоде")
+
+        return self.run_arrays(
+            strategy,
+            price_data.to_numpy(dtype=np.float64),
+            list(price_data.index),
+            tuple(str(column) for column in price_data.columns),
+            initial_capital=initial_capital,
+            benchmark_data=benchmark_data,
+            strategy_name=strategy_name
+        )
+
+    def run_arrays(self,
+                   strategy: WindowStrategy,
+                   prices: np.ndarray,
+                   dates: List[datetime],
+                   symbols: Tuple[str, ...],
+                   initial_capital: float = 1000000,
+                   benchmark_data: Optional[pd.DataFrame] = None,
+                   strategy_name: str = "Custom Strategy") -> BacktestResult:
+        """
+        Провести бектестинг над готовой матрицей цен (n_bars × n_symbols).
+
+        Матрица не копируется: стратегия получает read-only срезы исходного массива.
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        n_bars, n_symbols = prices.shape
+        if n_bars == 0:
+            raise ValueError("Нет данных для бектестинга в указанном периоде")
+
+        price_view = prices.view()
+        price_view.flags.writeable = False
+        symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+
+        positions = np.zeros(n_symbols, dtype=np.float64)
+        positions_view = positions.view()
+        positions_view.flags.writeable = False
+        cash = float(initial_capital)
+
+        position_history = np.empty((n_bars, n_symbols), dtype=np.float64)
+        cash_history = np.empty(n_bars, dtype=np.float64)
+        trades: List[Tuple[int, int, float, float]] = []  # (бар, инструмент, штуки со знаком, цена)
+
+        for i in range(n_bars):
+            window = MarketWindow(
+                index=i,
+                date=dates[i],
+                symbols=symbols,
+                prices=price_view[:i + 1],
+                positions=positions_view,
+                cash=cash
+            )
+            signals = strategy(window)
+
+            if signals is not None:
+                row = prices[i]
+                if isinstance(signals, np.ndarray):
+                    cash = self._execute_target_weights(i, signals, row, positions, cash, trades)
+                elif signals:
+                    cash = self._execute_signals(i, signals, row, symbol_index, positions, cash, trades)
+
+            position_history[i] = positions
+            cash_history[i] = cash
+
+        return self._summarize(
+            strategy_name, prices, dates, initial_capital,
+            position_history, cash_history, trades, benchmark_data
+        )
+
+    @staticmethod
+    def _execute_signals(bar: int,
+                         signals: Dict[str, Dict[str, Any]],
+                         row: np.ndarray,
+                         symbol_index: Dict[str, int],
+                         positions: np.ndarray,
+                         cash: float,
+                         trades: List[Tuple[int, int, float, float]]) -> float:
+        """Исполнить посимвольные сигналы в порядке словаря"""
+        for symbol, signal in signals.items():
+            j = symbol_index.get(symbol)
+            if j is None:
+                continue
+            price = row[j]
+            if not np.isfinite(price) or price <= 0:
+                continue
+
+            if signal['action'] == 'BUY' and cash >= signal['amount']:
+                shares = signal['amount'] / price
+                positions[j] += shares
+                cash -= signal['amount']
+                trades.append((bar, j, shares, price))
+
+            elif signal['action'] == 'SELL' and positions[j] > 0:
+                shares_to_sell = min(signal.get('shares', positions[j]), positions[j])
+                positions[j] -= shares_to_sell
+                cash += shares_to_sell * price
+                trades.append((bar, j, -shares_to_sell, price))
+
+        return cash
+
+    @staticmethod
+    def _execute_target_weights(bar: int,
+                                weights: np.ndarray,
+                                row: np.ndarray,
+                                positions: np.ndarray,
+                                cash: float,
+                                trades: List[Tuple[int, int, float, float]]) -> float:
+        """Ребалансировать позиции к вектору целевых весов (сначала продажи, затем покупки)"""
+        tradable = np.isfinite(row) & (row > 0)
+        weights = np.where(tradable, np.nan_to_num(np.asarray(weights, dtype=np.float64)), 0.0)
+
+        held_value = np.where(tradable, positions * np.where(tradable, row, 0.0), 0.0)
+        total_value = cash + held_value.sum()
+        if total_value <= 0:
+            return cash
+
+        safe_row = np.where(tradable, row, 1.0)
+        target = np.where(tradable, weights * total_value / safe_row, positions)
+        delta = target - positions
+
+        sells = np.nonzero(delta < 0)[0]
+        if sells.size:
+            positions[sells] += delta[sells]
+            cash += float(-(delta[sells] * row[sells]).sum())
+            trades.extend(zip([bar] * sells.size, sells.tolist(), delta[sells].tolist(), row[sells].tolist()))
+
+        buys = np.nonzero(delta > 0)[0]
+        if buys.size:
+            cost = delta[buys] * row[buys]
+            total_cost = float(cost.sum())
+            if total_cost > cash:
+                # Не уходим в минус по кэшу: пропорционально урезаем покупки
+                scale = max(cash, 0.0) / total_cost
+                delta[buys] *= scale
+                total_cost = float((delta[buys] * row[buys]).sum())
+            positions[buys] += delta[buys]
+            cash -= total_cost
+            trades.extend(zip([bar] * buys.size, buys.tolist(), delta[buys].tolist(), row[buys].tolist()))
+
+        return cash
+
+    @staticmethod
+    def fifo_trade_stats(trades: np.ndarray) -> Tuple[int, int]:
+        """
+        Посчитать прибыльные и убыточные продажи по FIFO.
+
+        Args:
+            trades: Массив (N, 4) со столбцами (бар, инструмент, штуки со знаком, цена),
+                    упорядоченный по времени
+
+        Returns:
+            (winning_trades, losing_trades)
+        """
+        winning = 0
+        losing = 0
+        if trades.shape[0] == 0:
+            return winning, losing
+
+        instruments = trades[:, 1].astype(np.int64)
+        for j in np.unique(instruments):
+            symbol_trades = trades[instruments == j]
+            shares = symbol_trades[:, 2]
+            prices = symbol_trades[:, 3]
+            is_buy = shares > 0
+            is_sell = shares < 0
+            if not is_sell.any():
+                continue
+
+            # Кусочно-линейная функция стоимости первых x купленных штук
+            buy_shares = shares[is_buy]
+            cum_shares = np.concatenate(([0.0], np.cumsum(buy_shares)))
+            cum_cost = np.concatenate(([0.0], np.cumsum(buy_shares * prices[is_buy])))
+
+            sold = -shares[is_sell]
+            sold_before = np.concatenate(([0.0], np.cumsum(sold)[:-1]))
+            sold_after = sold_before + sold
+
+            cost = (BacktestEngine._fifo_cost(cum_shares, cum_cost, prices[is_buy], sold_after)
+                    - BacktestEngine._fifo_cost(cum_shares, cum_cost, prices[is_buy], sold_before))
+            pnl = sold * prices[is_sell] - cost
+            wins = int(np.count_nonzero(pnl > 0))
+            winning += wins
+            losing += int(pnl.shape[0]) - wins
+
+        return winning, losing
+
+    @staticmethod
+    def _fifo_cost(cum_shares: np.ndarray,
+                   cum_cost: np.ndarray,
+                   buy_prices: np.ndarray,
+                   quantity: np.ndarray) -> np.ndarray:
+        """Стоимость первых quantity штук в порядке покупок"""
+        quantity = np.minimum(quantity, cum_shares[-1])
+        lot = np.clip(np.searchsorted(cum_shares, quantity, side='left') - 1, 0, buy_prices.shape[0] - 1)
+        return cum_cost[lot] + (quantity - cum_shares[lot]) * buy_prices[lot]
+
+    def _summarize(self,
+                   strategy_name: str,
+                   prices: np.ndarray,
+                   bar_dates: List[datetime],
+                   initial_capital: float,
+                   position_history: np.ndarray,
+                   cash_history: np.ndarray,
+                   trades: List[Tuple[int, int, float, float]],
+                   benchmark_data: Optional[pd.DataFrame]) -> BacktestResult:
+        """Векторно собрать кривую капитала, просадки и метрики"""
+        valuation_prices = np.where(np.isfinite(prices), prices, 0.0)
+        held = np.where(position_history > 0, position_history, 0.0)
+        bar_values = cash_history + np.einsum('ij,ij->i', held, valuation_prices)
+
+        portfolio_values = np.concatenate(([float(initial_capital)], bar_values))
+        dates = [bar_dates[0]] + list(bar_dates)
+
+        returns = self.risk_calculator.returns_array(portfolio_values)
+        cumulative_returns = np.cumprod(1.0 + returns) - 1.0
+
+        equity_curve = ReturnSeries(
+            dates=dates,
+            returns=[0] + returns.tolist(),
+            cumulative_returns=[0] + cumulative_returns.tolist(),
+            portfolio_values=portfolio_values.tolist()
+        )
+
+        final_capital = float(portfolio_values[-1])
+        total_return = (final_capital - initial_capital) / initial_capital
+        period_days = (dates[-1] - dates[0]).days
+        years = period_days / 365.25 if period_days > 0 else 1
+        cagr = (final_capital / initial_capital) ** (1 / years) - 1
+
+        volatility = float(returns.std(ddof=1) * np.sqrt(TRADING_DAYS)) if returns.shape[0] > 1 else 0
+        sharpe_ratio = self.risk_calculator.calculate_sharpe_ratio(returns, self.risk_free_rate)
+        drawdown_series = self.risk_calculator.drawdown_array(portfolio_values)
+        max_drawdown = float(drawdown_series.max())
+
+        trade_array = np.array(trades, dtype=np.float64).reshape(-1, 4)
+        winning_trades, losing_trades = self.fifo_trade_stats(trade_array)
+        total_trades = winning_trades + losing_trades
+        win_rate = winning_trades / total_trades if total_trades > 0 else 0
+
+        benchmark_return = None
+        excess_return = None
+        beta = None
+        alpha = None
+
+        if benchmark_data is not None:
+            benchmark_period = benchmark_data[
+                (benchmark_data.index >= dates[0]) &
+                (benchmark_data.index <= dates[-1])
+            ]
+
+            if not benchmark_period.empty:
+                benchmark_values = benchmark_period.iloc[:, 0].to_numpy(dtype=np.float64)
+                benchmark_returns = self.risk_calculator.returns_array(benchmark_values)
+                benchmark_return = float(
+                    (benchmark_values[-1] - benchmark_values[0]) / benchmark_values[0]
+                )
+                excess_return = total_return - benchmark_return
+
+                if benchmark_returns.shape[0] == returns.shape[0]:
+                    beta = self.risk_calculator.calculate_beta(returns, benchmark_returns)
+                    alpha = self.risk_calculator.calculate_alpha(
+                        returns, benchmark_returns, self.risk_free_rate
+                    )
+
+        return BacktestResult(
+            strategy_name=strategy_name,
+            start_date=dates[0],
+            end_date=dates[-1],
+            initial_capital=initial_capital,
+            final_capital=final_capital,
+            total_return=total_return,
+            cagr=cagr,
+            volatility=volatility,
+            sharpe_ratio=sharpe_ratio,
+            max_drawdown=max_drawdown,
+            total_trades=total_trades,
+            winning_trades=winning_trades,
+            losing_trades=losing_trades,
+            win_rate=win_rate,
+            equity_curve=equity_curve,
+            drawdown_series=drawdown_series.tolist(),
+            benchmark_return=benchmark_return,
+            excess_return=excess_return,
+            beta=beta,
+            alpha=alpha
+        )
+
+
+# Стандартные стратегии
+def create_buy_and_hold_strategy(symbols: List[str], weights: Dict[str, float]) -> WindowStrategy:
+    """Создать стратегию 'купи и держи' (покупка по целевым весам на первом баре)"""
+    cache: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    @window_strategy
+    def strategy(window: MarketWindow) -> Signals:
+        if window.index != 0:
+            return None
+        if window.symbols not in cache:
+            cache[window.symbols] = _weight_vector(window.symbols, symbols, weights)
+        return cache[window.symbols]
+    return strategy
+
+
+def create_rebalancing_strategy(symbols: List[str],
+                                weights: Dict[str, float],
+                                rebalance_frequency: int = 60,
+                                threshold: float = 0.05) -> WindowStrategy:
+    """
+    Создать стратегию с периодическим ребалансированием
+
+    Args:
+        symbols: Инструменты стратегии
+        weights: Целевые веса
+        rebalance_frequency: Период ребалансировки в барах
+        threshold: Допуск превышения целевой доли перед продажей (0.05 = 5%)
+    """
+    cache: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    @window_strategy
+    def strategy(window: MarketWindow) -> Signals:
+        if window.index % rebalance_frequency != 0:
+            return None
+        if window.symbols not in cache:
+            cache[window.symbols] = _weight_vector(window.symbols, symbols, weights)
+        target_weights = cache[window.symbols]
+
+        total_value = window.total_value
+        if total_value <= 0:
+            return None
+
+        prices = np.nan_to_num(window.current_prices)
+        current_weights = window.positions * prices / total_value
+        # Позиции выше цели, но в пределах допуска, не трогаем
+        within_band = ((current_weights > target_weights) &
+                       (current_weights <= target_weights * (1 + threshold)))
+        return np.where(within_band, current_weights, target_weights)
+    return strategy
+
+
+def _weight_vector(columns: Tuple[str, ...],
+                   symbols: List[str],
+                   weights: Dict[str, float]) -> np.ndarray:
+    """Вектор весов в порядке столбцов матрицы цен"""
+    selected = set(symbols)
+    return np.array(
+        [weights.get(column, 0.0) if column in selected else 0.0 for column in columns],
+        dtype=np.float64
+    )
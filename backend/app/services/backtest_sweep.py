@@ -0,0 +1,301 @@
+"""
+Параллельный перебор параметров и walk-forward анализ для бектестов.
+
+Матрица цен один раз копируется в multiprocessing.shared_memory; воркеры
+ProcessPoolExecutor получают в initializer имя блока и общие данные, а
+в задачах - только пачки параметров, а не DataFrame. На каждую пачку
+воркер подключается к блоку и в finally закрывает подключение. Каждая
+задача прогоняет create_rebalancing_strategy через BacktestEngine на
+срезе баров и возвращает компактную сводку результата.
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.logging import logger
+from app.services.analytics_engine import BacktestResult
+from app.services.backtest_engine import BacktestEngine, create_rebalancing_strategy
+
+
+# Метрики, для которых меньшее значение лучше
+_LOWER_IS_BETTER = {"max_drawdown", "volatility"}
+
+
+@dataclass(frozen=True)
+class RebalancingParams:
+    """Набор параметров стратегии ребалансировки"""
+    weights: Tuple[Tuple[str, float], ...]
+    rebalance_frequency: int
+    threshold: float
+
+    @property
+    def weights_dict(self) -> Dict[str, float]:
+        return dict(self.weights)
+
+    def label(self) -> str:
+        weights = ", ".join(f"{symbol}:{weight:g}" for symbol, weight in self.weights)
+        return f"freq={self.rebalance_frequency} thr={self.threshold:g} [{weights}]"
+
+
+@dataclass
+class BacktestSummary:
+    """Сводка результата бектеста (без временных рядов) для таблицы перебора"""
+    params: str
+    fold: Optional[int]
+    split: str                 # full / in_sample / out_of_sample
+    start_date: datetime
+    end_date: datetime
+    final_capital: float
+    total_return: float
+    cagr: float
+    volatility: float
+    sharpe_ratio: float
+    max_drawdown: float
+    total_trades: int
+    win_rate: float
+    rebalance_frequency: int = 0
+    threshold: float = 0.0
+    weights: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def from_result(cls,
+                    result: BacktestResult,
+                    params: RebalancingParams,
+                    fold: Optional[int],
+                    split: str) -> "BacktestSummary":
+        return cls(
+            params=params.label(),
+            fold=fold,
+            split=split,
+            start_date=result.start_date,
+            end_date=result.end_date,
+            final_capital=float(result.final_capital),
+            total_return=float(result.total_return),
+            cagr=float(result.cagr),
+            volatility=float(result.volatility),
+            sharpe_ratio=float(result.sharpe_ratio),
+            max_drawdown=float(result.max_drawdown),
+            total_trades=int(result.total_trades),
+            win_rate=float(result.win_rate),
+            rebalance_frequency=params.rebalance_frequency,
+            threshold=params.threshold,
+            weights=params.weights_dict
+        )
+
+
+def build_parameter_grid(weight_sets: Sequence[Dict[str, float]],
+                         rebalance_frequencies: Iterable[int],
+                         thresholds: Iterable[float]) -> List[RebalancingParams]:
+    """Декартово произведение наборов весов, частот ребалансировки и порогов"""
+    return [
+        RebalancingParams(
+            weights=tuple(sorted(weights.items())),
+            rebalance_frequency=int(frequency),
+            threshold=float(threshold)
+        )
+        for weights, frequency, threshold in itertools.product(
+            weight_sets, list(rebalance_frequencies), list(thresholds)
+        )
+    ]
+
+
+def walk_forward_splits(n_bars: int,
+                        in_sample: int,
+                        out_of_sample: int,
+                        step: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    Скользящие окна walk-forward анализа.
+
+    Returns:
+        Список (начало in-sample, начало out-of-sample, конец out-of-sample)
+        в индексах баров, конец не включается
+    """
+    if in_sample < 2 or out_of_sample < 1:
+        raise ValueError("Окна in-sample/out-of-sample слишком короткие")
+
+    step = step or out_of_sample
+    splits = []
+    start = 0
+    while start + in_sample + out_of_sample <= n_bars:
+        splits.append((start, start + in_sample, start + in_sample + out_of_sample))
+        start += step
+    return splits
+
+
+# ---- Состояние воркера (заполняется в initializer) ----
+
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(shm_name: str,
+                 shape: Tuple[int, int],
+                 dates: List[datetime],
+                 symbols: Tuple[str, ...],
+                 initial_capital: float) -> None:
+    """Запомнить блок общей памяти с матрицей цен и общие данные"""
+    _worker_state.update(
+        shm_name=shm_name,
+        shape=shape,
+        dates=dates,
+        symbols=symbols,
+        initial_capital=initial_capital,
+        engine=BacktestEngine()
+    )
+
+
+def _run_tasks(tasks: List[Tuple[RebalancingParams, int, int, Optional[int], str]]) -> List[BacktestSummary]:
+    """Подключиться к матрице цен и прогнать пачку задач"""
+    shm = shared_memory.SharedMemory(name=_worker_state["shm_name"])
+    try:
+        prices = np.ndarray(_worker_state["shape"], dtype=np.float64, buffer=shm.buf)
+        prices.flags.writeable = False
+        _worker_state["prices"] = prices
+        del prices
+        return [_run_task(task) for task in tasks]
+    finally:
+        # Представления буфера должны быть освобождены до close()
+        _worker_state.pop("prices", None)
+        shm.close()
+
+
+def _run_task(task: Tuple[RebalancingParams, int, int, Optional[int], str]) -> BacktestSummary:
+    """Прогнать одну конфигурацию на срезе баров [start, stop)"""
+    params, start, stop, fold, split = task
+    strategy = create_rebalancing_strategy(
+        [symbol for symbol, _ in params.weights],
+        params.weights_dict,
+        params.rebalance_frequency,
+        params.threshold
+    )
+    result = _worker_state["engine"].run_arrays(
+        strategy,
+        _worker_state["prices"][start:stop],
+        _worker_state["dates"][start:stop],
+        _worker_state["symbols"],
+        initial_capital=_worker_state["initial_capital"],
+        strategy_name=params.label()
+    )
+    return BacktestSummary.from_result(result, params, fold, split)
+
+
+class BacktestSweepRunner:
+    """Параллельный прогон сетки параметров и walk-forward анализа"""
+
+    def __init__(self,
+                 price_data: pd.DataFrame,
+                 initial_capital: float = 1000000,
+                 max_workers: Optional[int] = None):
+        if price_data.empty:
+            raise ValueError("Нет данных для бектестинга")
+
+        self.prices = np.ascontiguousarray(price_data.to_numpy(dtype=np.float64))
+        self.dates = list(price_data.index)
+        self.symbols = tuple(str(column) for column in price_data.columns)
+        self.initial_capital = initial_capital
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def run_grid(self,
+                 grid: List[RebalancingParams],
+                 rank_by: str = "sharpe_ratio") -> pd.DataFrame:
+        """Прогнать сетку параметров на всей истории и вернуть ранжированную таблицу"""
+        tasks = [(params, 0, len(self.dates), None, "full") for params in grid]
+        return self._rank(self._execute(tasks), rank_by)
+
+    def run_walk_forward(self,
+                         grid: List[RebalancingParams],
+                         in_sample: int,
+                         out_of_sample: int,
+                         step: Optional[int] = None,
+                         rank_by: str = "sharpe_ratio") -> pd.DataFrame:
+        """
+        Walk-forward: на каждом in-sample окне выбирается лучшая конфигурация,
+        затем она проверяется на следующем out-of-sample окне.
+
+        Returns:
+            Таблица out-of-sample результатов (по строке на фолд) с колонкой
+            in_sample_<rank_by> для сравнения с оптимизированным значением
+        """
+        splits = walk_forward_splits(len(self.dates), in_sample, out_of_sample, step)
+        if not splits:
+            raise ValueError("История короче одного окна walk-forward")
+
+        # Все in-sample прогоны всех фолдов - одной пачкой задач
+        in_sample_tasks = [
+            (params, is_start, oos_start, fold, "in_sample")
+            for fold, (is_start, oos_start, _) in enumerate(splits)
+            for params in grid
+        ]
+        in_sample_results = self._execute(in_sample_tasks)
+
+        best_by_fold: Dict[int, Tuple[RebalancingParams, BacktestSummary]] = {}
+        for (params, *_), summary in zip(in_sample_tasks, in_sample_results):
+            current = best_by_fold.get(summary.fold)
+            if current is None or self._better(summary, current[1], rank_by):
+                best_by_fold[summary.fold] = (params, summary)
+
+        oos_tasks = [
+            (best_by_fold[fold][0], oos_start, oos_end, fold, "out_of_sample")
+            for fold, (_, oos_start, oos_end) in enumerate(splits)
+        ]
+        oos_results = self._execute(oos_tasks)
+
+        table = pd.DataFrame([asdict(summary) for summary in oos_results])
+        table[f"in_sample_{rank_by}"] = [
+            getattr(best_by_fold[summary.fold][1], rank_by) for summary in oos_results
+        ]
+        return table.sort_values("fold").reset_index(drop=True)
+
+    def _execute(self, tasks: List[Tuple]) -> List[BacktestSummary]:
+        """Выполнить задачи в пуле процессов, разделяя матрицу цен через shared memory"""
+        if not tasks:
+            return []
+
+        shm = shared_memory.SharedMemory(create=True, size=max(self.prices.nbytes, 1))
+        shared = np.ndarray(self.prices.shape, dtype=np.float64, buffer=shm.buf)
+        try:
+            shared[:] = self.prices
+            init_args = (shm.name, self.prices.shape, self.dates, self.symbols, self.initial_capital)
+
+            workers = min(self.max_workers, len(tasks))
+            if workers <= 1:
+                _init_worker(*init_args)
+                return _run_tasks(tasks)
+
+            chunksize = max(1, len(tasks) // (workers * 4))
+            chunks = [tasks[offset:offset + chunksize] for offset in range(0, len(tasks), chunksize)]
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=init_args
+            ) as executor:
+                results = [summary for chunk in executor.map(_run_tasks, chunks) for summary in chunk]
+
+            logger.info(f"Перебор бектестов: {len(tasks)} задач на {workers} процессах")
+            return results
+        finally:
+            del shared
+            shm.close()
+            shm.unlink()
+
+    @staticmethod
+    def _better(candidate: BacktestSummary, current: BacktestSummary, rank_by: str) -> bool:
+        if rank_by in _LOWER_IS_BETTER:
+            return getattr(candidate, rank_by) < getattr(current, rank_by)
+        return getattr(candidate, rank_by) > getattr(current, rank_by)
+
+    @staticmethod
+    def _rank(results: List[BacktestSummary], rank_by: str) -> pd.DataFrame:
+        table = pd.DataFrame([asdict(summary) for summary in results])
+        if table.empty:
+            return table
+        table = table.sort_values(rank_by, ascending=rank_by in _LOWER_IS_BETTER)
+        table.insert(0, "rank", range(1, len(table) + 1))
+        return table.reset_index(drop=True)
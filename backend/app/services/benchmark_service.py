@@ -0,0 +1,155 @@
+"""
+Ряды бенчмарков, выровненные по датам снимков портфеля.
+
+Значения индексов (IMOEX, RTSI, S&P 500) хранятся в benchmark_levels.
+Для портфеля берется последнее известное значение каждого индекса на
+дату снимка (as-of), составной бенчмарк строится по весам
+PortfolioBenchmark.weight, а готовый вектор доходностей кладется в
+LRU+TTL кэш процесса с ключом «состав бенчмарка + даты снимков».
+"""
+
+import hashlib
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.cache import LRUTTLCache
+from app.core.logging import logger
+from app.repositories.benchmark import BenchmarkRepository
+
+
+MAX_STALENESS_DAYS = 7       # Значение индекса старше этого срока не выравнивается на дату
+BENCHMARK_CACHE_SIZE = 512
+BENCHMARK_CACHE_TTL = 6 * 3600
+
+# Общий для процесса кэш выровненных доходностей
+BENCHMARK_RETURNS_CACHE = LRUTTLCache(maxsize=BENCHMARK_CACHE_SIZE, ttl=BENCHMARK_CACHE_TTL)
+
+DateLike = Union[date, datetime, np.datetime64]
+
+
+def to_day_array(dates: Iterable[DateLike]) -> np.ndarray:
+    """Привести даты к datetime64[D] (время и часовой пояс отбрасываются)"""
+    days = [d.date() if isinstance(d, datetime) else d for d in dates]
+    return np.array(days, dtype="datetime64[D]")
+
+
+def align_as_of(level_dates: np.ndarray,
+                levels: np.ndarray,
+                target_dates: np.ndarray,
+                max_staleness_days: int = MAX_STALENESS_DAYS) -> np.ndarray:
+    """
+    Значение ряда на каждую целевую дату: последнее значение не позже даты.
+
+    level_dates должны быть отсортированы. Где значения нет или оно старше
+    max_staleness_days, возвращается NaN.
+    """
+    if level_dates.shape[0] == 0:
+        return np.full(target_dates.shape[0], np.nan)
+
+    positions = np.searchsorted(level_dates, target_dates, side="right") - 1
+    found = positions >= 0
+    positions = np.clip(positions, 0, None)
+    fresh = target_dates - level_dates[positions] <= np.timedelta64(max_staleness_days, "D")
+    return np.where(found & fresh, np.asarray(levels, dtype=np.float64)[positions], np.nan)
+
+
+def composite_returns(aligned_levels: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Доходности составного бенчмарка с ребалансировкой к весам на каждом периоде.
+
+    Args:
+        aligned_levels: (n_benchmarks, n_dates) выровненные значения индексов
+        weights: (n_benchmarks,) веса компонентов
+
+    Returns:
+        (n_dates - 1,) доходности; если у части компонентов нет данных в периоде,
+        веса остальных перенормируются, если данных нет ни у одного - NaN
+    """
+    levels = np.atleast_2d(aligned_levels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = levels[:, 1:] / levels[:, :-1] - 1.0
+
+    valid = np.isfinite(returns)
+    w = np.asarray(weights, dtype=np.float64)[:, None]
+    weight_sum = (w * valid).sum(axis=0)
+    weighted = (np.where(valid, returns, 0.0) * w).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(weight_sum > 0, weighted / weight_sum, np.nan)
+
+
+def dates_fingerprint(days: np.ndarray) -> Tuple[int, str]:
+    """Компактный ключ набора дат для кэша"""
+    return days.shape[0], hashlib.blake2b(days.tobytes(), digest_size=16).hexdigest()
+
+
+class BenchmarkSeriesService:
+    """Загрузка, выравнивание и кэширование рядов бенчмарков"""
+
+    def __init__(self, db: Session, cache: Optional[LRUTTLCache] = None):
+        self.db = db
+        self.repository = BenchmarkRepository(db)
+        self.cache = cache if cache is not None else BENCHMARK_RETURNS_CACHE
+
+    def store_levels(self, benchmark_id: int, levels: Iterable[Tuple[datetime, float]]) -> int:
+        """Сохранить значения индекса и сбросить зависящие от него записи кэша"""
+        count = self.repository.upsert_levels(benchmark_id, levels)
+        self.cache.invalidate(
+            lambda key: key[0] == "benchmark" and any(bid == benchmark_id for bid, _ in key[1])
+        )
+        return count
+
+    def portfolio_returns(self,
+                          portfolio_id: int,
+                          dates: Sequence[DateLike]) -> Optional[np.ndarray]:
+        """
+        Доходности бенчмарка портфеля между соседними датами снимков.
+
+        Returns:
+            Вектор длины len(dates) - 1 или None, если бенчмарк не назначен
+        """
+        composition = self.repository.get_portfolio_composition(portfolio_id)
+        if not composition:
+            return None
+        return self.aligned_returns(composition, dates)
+
+    def aligned_returns(self,
+                        composition: Dict[int, float],
+                        dates: Sequence[DateLike]) -> np.ndarray:
+        """Доходности (составного) бенчмарка {benchmark_id: вес}, выровненные на даты"""
+        days = to_day_array(dates)
+        components = tuple(sorted((int(bid), float(weight)) for bid, weight in composition.items()))
+        key = ("benchmark", components, dates_fingerprint(days))
+
+        return self.cache.get_or_set(key, lambda: self._build(components, days))
+
+    def _build(self, components: Tuple[Tuple[int, float], ...], days: np.ndarray) -> np.ndarray:
+        """Загрузить значения всех компонентов одним запросом и выровнять их"""
+        if days.shape[0] < 2:
+            return np.empty(0, dtype=np.float64)
+
+        benchmark_ids = [bid for bid, _ in components]
+        start = days.min().astype(object) - timedelta(days=MAX_STALENESS_DAYS)
+        end = days.max().astype(object)
+        rows = self.repository.get_levels(
+            benchmark_ids,
+            datetime.combine(start, time.min),
+            datetime.combine(end, time.max)
+        )
+
+        aligned = np.full((len(components), days.shape[0]), np.nan)
+        for i, benchmark_id in enumerate(benchmark_ids):
+            series = [(ts, level) for bid, ts, level in rows if bid == benchmark_id]
+            if series:
+                level_dates = to_day_array(ts for ts, _ in series)
+                levels = np.array([float(level) for _, level in series])
+                aligned[i] = align_as_of(level_dates, levels, days)
+
+        returns = composite_returns(aligned, np.array([weight for _, weight in components]))
+        # Неизменяемый вектор можно безопасно отдавать из кэша нескольким потребителям
+        returns.flags.writeable = False
+
+        logger.debug(f"Бенчмарк {components}: выровнено {len(rows)} значений на {days.shape[0]} дат")
+        return returns
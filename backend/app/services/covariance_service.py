@@ -0,0 +1,400 @@
+"""
+Ковариационные матрицы инструментов с инкрементальным обновлением.
+
+Поддерживаются две оценки по дневным доходностям из таблицы prices:
+- ewma: экспоненциально взвешенная ковариация (RiskMetrics, decay=0.94);
+- ledoit_wolf: выборочная ковариация со сжатием Ledoit-Wolf к
+  масштабированной единичной матрице.
+
+Состояние каждой оценки обновляется новым днем за одно rank-1 обновление
+O(n²) без пересчета по всей истории: для EWMA это экспоненциальный
+Welford, для Ledoit-Wolf - накопленные суммы x, x xᵀ, |x|² x и |x|⁴,
+которых достаточно и для выборочной ковариации, и для коэффициента сжатия.
+Состояние хранится в covariance_matrices как float32-массивы с ключом
+«хеш вселенной + метод». build и update_daily фиксируют свою транзакцию
+сами: матрица, построенная по запросу, сохраняется и дальше обновляется
+ежедневной загрузкой цен; кэш процесса заполняется только после commit.
+"""
+
+import hashlib
+import io
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.cache import LRUTTLCache
+from app.core.logging import logger
+from app.models.risk_model import CovarianceMatrix
+from app.repositories.price import PriceRepository
+
+
+DEFAULT_DECAY = 0.94
+DEFAULT_LOOKBACK_DAYS = 730
+COVARIANCE_CACHE = LRUTTLCache(maxsize=64, ttl=3600)
+
+
+def universe_hash(instrument_ids: Iterable[int]) -> str:
+    """Ключ вселенной инструментов (не зависит от порядка id)"""
+    return hashlib.sha1(",".join(str(i) for i in sorted(set(instrument_ids))).encode()).hexdigest()
+
+
+class EwmaCovarianceState:
+    """Экспоненциально взвешенные среднее и ковариация"""
+
+    method = "ewma"
+
+    def __init__(self, n_assets: int, decay: float = DEFAULT_DECAY):
+        if not 0 < decay < 1:
+            raise ValueError("Коэффициент затухания должен быть в интервале (0, 1)")
+
+        self.decay = decay
+        self.observations = 0
+        self.mean = np.zeros(n_assets)
+        self.cov = np.zeros((n_assets, n_assets))
+
+    @property
+    def params(self) -> Dict[str, float]:
+        return {"decay": self.decay}
+
+    def update(self, returns: np.ndarray) -> None:
+        """Учесть доходности одного дня (rank-1 обновление)"""
+        if self.observations == 0:
+            self.mean = returns.astype(np.float64)
+        else:
+            delta = returns - self.mean
+            self.mean += (1 - self.decay) * delta
+            self.cov *= self.decay
+            self.cov += self.decay * (1 - self.decay) * np.outer(delta, delta)
+        self.observations += 1
+
+    def update_many(self, returns: np.ndarray) -> None:
+        for row in returns:
+            self.update(row)
+
+    def mean_returns(self) -> np.ndarray:
+        return self.mean.copy()
+
+    def covariance(self) -> np.ndarray:
+        if self.observations < 2:
+            return np.zeros_like(self.cov)
+        # Поправка на недостающий вес первых наблюдений
+        return self.cov / (1 - self.decay ** (self.observations - 1))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"mean": self.mean.astype(np.float32), "cov": self.cov.astype(np.float32)}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], observations: int, params: Dict) -> "EwmaCovarianceState":
+        state = cls(arrays["mean"].shape[0], params.get("decay", DEFAULT_DECAY))
+        state.mean = arrays["mean"].astype(np.float64)
+        state.cov = arrays["cov"].astype(np.float64)
+        state.observations = observations
+        return state
+
+
+class LedoitWolfCovarianceState:
+    """Выборочная ковариация со сжатием Ledoit-Wolf на накопленных суммах"""
+
+    method = "ledoit_wolf"
+
+    def __init__(self, n_assets: int):
+        self.observations = 0
+        self.s1 = np.zeros(n_assets)                 # Σ x
+        self.s2 = np.zeros((n_assets, n_assets))     # Σ x xᵀ
+        self.v3 = np.zeros(n_assets)                 # Σ |x|² x
+        self.a4 = 0.0                                # Σ |x|⁴
+
+    @property
+    def params(self) -> Dict[str, float]:
+        return {}
+
+    def update(self, returns: np.ndarray) -> None:
+        """Учесть доходности одного дня (rank-1 обновление)"""
+        norm2 = float(returns @ returns)
+        self.s1 += returns
+        self.s2 += np.outer(returns, returns)
+        self.v3 += norm2 * returns
+        self.a4 += norm2 * norm2
+        self.observations += 1
+
+    def update_many(self, returns: np.ndarray) -> None:
+        """Сумма rank-1 обновлений одним матричным умножением"""
+        norms = np.einsum("ij,ij->i", returns, returns)
+        self.s1 += returns.sum(axis=0)
+        self.s2 += returns.T @ returns
+        self.v3 += norms @ returns
+        self.a4 += float(norms @ norms)
+        self.observations += returns.shape[0]
+
+    def sample_covariance(self) -> np.ndarray:
+        """Смещенная выборочная ковариация (делитель n), как в оценке Ledoit-Wolf"""
+        n = self.observations
+        mean = self.s1 / n
+        return self.s2 / n - np.outer(mean, mean)
+
+    def shrinkage(self) -> float:
+        n = self.observations
+        p = self.s1.shape[0]
+        mean = self.s1 / n
+        sample = self.sample_covariance()
+
+        mu = np.trace(sample) / p
+        delta = (np.sum(sample * sample) - 2 * mu * np.trace(sample) + p * mu * mu) / p
+
+        # Σ_k |y_k|⁴ для центрированных y_k = x_k - mean через накопленные суммы
+        m2 = float(mean @ mean)
+        centered_a4 = (
+            self.a4
+            - 4 * float(mean @ self.v3)
+            + 2 * m2 * float(np.trace(self.s2))
+            + 4 * float(mean @ self.s2 @ mean)
+            - 3 * n * m2 * m2
+        )
+        beta = (centered_a4 / n - np.sum(sample * sample)) / (n * p)
+        beta = min(beta, delta)
+        return 0.0 if beta <= 0 or delta == 0 else float(beta / delta)
+
+    def mean_returns(self) -> np.ndarray:
+        return self.s1 / max(self.observations, 1)
+
+    def covariance(self) -> np.ndarray:
+        if self.observations < 2:
+            return np.zeros_like(self.s2)
+        sample = self.sample_covariance()
+        shrinkage = self.shrinkage()
+        mu = np.trace(sample) / sample.shape[0]
+        shrunk = (1 - shrinkage) * sample
+        shrunk[np.diag_indices_from(shrunk)] += shrinkage * mu
+        return shrunk
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "s1": self.s1.astype(np.float32),
+            "s2": self.s2.astype(np.float32),
+            "v3": self.v3.astype(np.float32),
+            "a4": np.array([self.a4], dtype=np.float32),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], observations: int, params: Dict) -> "LedoitWolfCovarianceState":
+        state = cls(arrays["s1"].shape[0])
+        state.s1 = arrays["s1"].astype(np.float64)
+        state.s2 = arrays["s2"].astype(np.float64)
+        state.v3 = arrays["v3"].astype(np.float64)
+        state.a4 = float(arrays["a4"][0])
+        state.observations = observations
+        return state
+
+
+CovarianceState = Union[EwmaCovarianceState, LedoitWolfCovarianceState]
+STATE_CLASSES = {cls.method: cls for cls in (EwmaCovarianceState, LedoitWolfCovarianceState)}
+
+
+def new_state(method: str, n_assets: int, **params) -> CovarianceState:
+    if method not in STATE_CLASSES:
+        raise ValueError(f"Неизвестный метод оценки ковариации: {method}")
+    return STATE_CLASSES[method](n_assets, **params)
+
+
+@dataclass(frozen=True)
+class CovarianceEstimate:
+    """Ковариационная матрица дневных доходностей вселенной инструментов"""
+    instrument_ids: Tuple[int, ...]
+    method: str
+    as_of: date
+    observations: int
+    covariance: np.ndarray          # (n, n) float32, read-only
+    mean: np.ndarray                # (n,) средние дневные доходности той же оценки
+
+    def correlation(self) -> np.ndarray:
+        std = np.sqrt(np.diag(self.covariance).astype(np.float64))
+        safe = np.where(std > 0, std, 1.0)
+        corr = self.covariance / np.outer(safe, safe)
+        np.fill_diagonal(corr, 1.0)
+        return np.clip(corr, -1.0, 1.0)
+
+    def subset(self, instrument_ids: Sequence[int]) -> np.ndarray:
+        """Подматрица для части инструментов в заданном порядке"""
+        index = {instrument_id: i for i, instrument_id in enumerate(self.instrument_ids)}
+        positions = [index[instrument_id] for instrument_id in instrument_ids]
+        return self.covariance[np.ix_(positions, positions)]
+
+
+def _pack(state: CovarianceState, last_prices: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, last_prices=last_prices, **state.to_arrays())
+    return buffer.getvalue()
+
+
+def _unpack(record: CovarianceMatrix) -> Tuple[CovarianceState, np.ndarray]:
+    with np.load(io.BytesIO(record.payload)) as arrays:
+        arrays = dict(arrays)
+    state = STATE_CLASSES[record.method].from_arrays(arrays, record.observations, record.params or {})
+    return state, arrays["last_prices"]
+
+
+class CovarianceService:
+    """Построение, инкрементальное обновление и выдача ковариационных матриц"""
+
+    def __init__(self, db: Session, cache: Optional[LRUTTLCache] = None):
+        self.db = db
+        self.prices = PriceRepository(db)
+        self.cache = cache if cache is not None else COVARIANCE_CACHE
+
+    def get(self, instrument_ids: Iterable[int], method: str = "ewma") -> Optional[CovarianceEstimate]:
+        """Сохраненная матрица для вселенной (из кэша процесса, если есть)"""
+        key = (universe_hash(instrument_ids), method)
+        estimate = self.cache.get(key)
+        if estimate is not None:
+            return estimate
+
+        record = self._record(*key)
+        if record is None:
+            return None
+        estimate = self._estimate(record, _unpack(record)[0])
+        self.cache.set(key, estimate)
+        return estimate
+
+    def get_or_build(self,
+                     instrument_ids: Iterable[int],
+                     method: str = "ewma",
+                     **params) -> CovarianceEstimate:
+        instrument_ids = sorted(set(instrument_ids))
+        return self.get(instrument_ids, method) or self.build(instrument_ids, method, **params)
+
+    def build(self,
+              instrument_ids: Iterable[int],
+              method: str = "ewma",
+              end_date: Optional[date] = None,
+              lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+              **params) -> CovarianceEstimate:
+        """Построить оценку по истории цен и сохранить ее состояние"""
+        ids = sorted(set(instrument_ids))
+        if not ids:
+            raise ValueError("Пустая вселенная инструментов")
+
+        state = new_state(method, len(ids), **params)
+        end_date = end_date or date.today()
+        frame = self._close_frame(ids, end_date - timedelta(days=lookback_days), end_date)
+        if frame.shape[0] < 2:
+            raise ValueError("Недостаточно истории цен для оценки ковариации")
+
+        values = frame.to_numpy()
+        state.update_many(self._returns(values))
+
+        record = self._record(universe_hash(ids), method) or CovarianceMatrix(
+            universe_hash=universe_hash(ids), method=method
+        )
+        self._save(record, ids, state, values[-1], frame.index[-1])
+        self.db.commit()
+
+        estimate = self._estimate(record, state)
+        self.cache.set((record.universe_hash, record.method), estimate)
+        return estimate
+
+    def update_daily(self, as_of: Optional[date] = None) -> int:
+        """
+        Дописать в сохраненные оценки дни, появившиеся в prices после их as_of
+        (не позже as_of), и зафиксировать транзакцию. Вызывается после
+        загрузки цен (PriceIngestService).
+
+        Returns:
+            Число обновленных матриц
+        """
+        as_of = as_of or date.today()
+        records = self.db.execute(
+            select(CovarianceMatrix).where(CovarianceMatrix.as_of < as_of)
+        ).scalars().all()
+
+        updated: List[Tuple[CovarianceMatrix, CovarianceState]] = []
+        for record in records:
+            frame = self._close_frame(record.instrument_ids, record.as_of + timedelta(days=1), as_of)
+            if frame.empty:
+                continue
+
+            state, last_prices = _unpack(record)
+            values = np.vstack([last_prices, frame.to_numpy()])
+            # Инструменты без новых котировок сохраняют последнюю цену (доходность 0)
+            values = pd.DataFrame(values).ffill().to_numpy()
+            for returns in self._returns(values):
+                state.update(returns)
+
+            self._save(record, record.instrument_ids, state, values[-1], frame.index[-1])
+            updated.append((record, state))
+
+        self.db.commit()
+        for record, state in updated:
+            self.cache.set((record.universe_hash, record.method), self._estimate(record, state))
+
+        logger.info(f"Обновлено ковариационных матриц: {len(updated)}")
+        return len(updated)
+
+    # ---- Внутренние методы ----
+
+    def _record(self, key_hash: str, method: str) -> Optional[CovarianceMatrix]:
+        stmt = select(CovarianceMatrix).where(
+            CovarianceMatrix.universe_hash == key_hash,
+            CovarianceMatrix.method == method
+        )
+        return self.db.execute(stmt).scalar_one_or_none()
+
+    def _save(self,
+              record: CovarianceMatrix,
+              instrument_ids: List[int],
+              state: CovarianceState,
+              last_prices: np.ndarray,
+              as_of: date) -> None:
+        record.instrument_ids = list(instrument_ids)
+        record.params = state.params
+        record.as_of = as_of
+        record.observations = state.observations
+        record.payload = _pack(state, np.asarray(last_prices, dtype=np.float64))
+        self.db.add(record)
+        self.db.flush()
+
+    @staticmethod
+    def _estimate(record: CovarianceMatrix, state: CovarianceState) -> CovarianceEstimate:
+        covariance = state.covariance().astype(np.float32)
+        covariance.flags.writeable = False
+        mean = state.mean_returns()
+        mean.flags.writeable = False
+        return CovarianceEstimate(
+            instrument_ids=tuple(record.instrument_ids),
+            method=record.method,
+            as_of=record.as_of,
+            observations=record.observations,
+            covariance=covariance,
+            mean=mean
+        )
+
+    def _close_frame(self, instrument_ids: Sequence[int], start: date, end: date) -> pd.DataFrame:
+        """Дневные цены закрытия (даты × инструменты) с переносом последней цены"""
+        rows = self.prices.get_closes(
+            instrument_ids,
+            [(datetime.combine(start, time.min), datetime.combine(end, time.max))]
+        )
+        if not rows:
+            return pd.DataFrame(columns=list(instrument_ids), dtype=np.float64)
+
+        frame = pd.DataFrame(rows, columns=["instrument_id", "ts", "close"])
+        frame["day"] = pd.to_datetime(frame["ts"]).dt.date
+        frame["close"] = frame["close"].astype(np.float64)
+        wide = (
+            frame.pivot_table(index="day", columns="instrument_id", values="close", aggfunc="last")
+            .reindex(columns=list(instrument_ids))
+            .sort_index()
+            .ffill()
+        )
+        return wide
+
+    @staticmethod
+    def _returns(values: np.ndarray) -> np.ndarray:
+        """Дневные доходности; пропуски (нет цены в начале истории) считаются нулевыми"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = values[1:] / values[:-1] - 1.0
+        return np.where(np.isfinite(returns), returns, 0.0)
@@ -0,0 +1,251 @@
+"""
+Инкрементальные метрики портфеля.
+
+Вместо пересчета волатильности, просадки и TWR по всей истории снимков
+для каждого портфеля хранится накопленное состояние (PortfolioMetricState):
+число, среднее и M2 дневных доходностей, индекс TWR с максимумом и
+максимальной просадкой, дата последнего снимка. Добавление снимка
+обновляет состояние за O(1), после чего кэшированные метрики Portfolio
+(volatility, max_drawdown, twr_inception, sharpe_ratio) пересчитываются
+из него. Остальные метрики и metrics_calculated_at ведет MetricsMaterializer.
+
+Внешний поток относится к первому снимку не раньше дня потока (подпериод
+(d_i, d_{i+1}]), как в series_metrics.
+"""
+
+import bisect
+import math
+from datetime import datetime, timedelta, timezone
+from datetime import time as day_time
+from decimal import Decimal
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.models.portfolio import Portfolio, PortfolioMetricState, PortfolioSnapshot
+from app.repositories.transaction import TransactionRepository
+
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.04   # Годовая безрисковая ставка, как в PortfolioAnalyticsService
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite возвращает naive datetime даже для DateTime(timezone=True)
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def snapshot_cash_flows(snapshot_dates: Sequence[datetime],
+                        flows: Iterable[Tuple[datetime, Decimal]]) -> Dict[datetime, Decimal]:
+    """
+    Сумма внешних потоков по снимкам: поток дня D относится к первому
+    снимку с датой не раньше D; потоки до второго снимка и после
+    последнего не учитываются.
+
+    Args:
+        snapshot_dates: даты снимков по возрастанию
+        flows: пары (ts, amount), пополнения положительные
+    """
+    days = [moment.date() for moment in snapshot_dates]
+    result: Dict[datetime, Decimal] = {}
+    for ts, amount in flows:
+        index = bisect.bisect_left(days, _as_utc(ts).date())
+        if 0 < index < len(days):
+            moment = snapshot_dates[index]
+            result[moment] = result.get(moment, Decimal("0")) + amount
+    return result
+
+
+def apply_snapshot(state: PortfolioMetricState,
+                   snapshot_date: datetime,
+                   total_value: Decimal,
+                   cash_flow: Decimal = Decimal("0")) -> Optional[float]:
+    """
+    Учесть следующий снимок в состоянии за O(1).
+
+    Доходность периода r = V_t / (V_{t-1} + CF_t) - 1, где CF_t - чистый
+    внешний поток (пополнения положительные), пришедший после предыдущего
+    снимка. Просадка считается по индексу TWR, чтобы пополнения и выводы
+    не выглядели как рост и падение.
+
+    Returns:
+        Доходность периода или None для первого снимка / нулевой базы
+    """
+    period_return = None
+    if state.last_value is not None:
+        base = float(state.last_value) + float(cash_flow)
+        if base > 0:
+            period_return = float(total_value) / base - 1.0
+
+            # Welford
+            state.count += 1
+            delta = period_return - state.mean_return
+            state.mean_return += delta / state.count
+            state.m2 += delta * (period_return - state.mean_return)
+
+            state.twr_product *= 1.0 + period_return
+            state.peak = max(state.peak, state.twr_product)
+            state.max_drawdown = max(state.max_drawdown, 1.0 - state.twr_product / state.peak)
+    else:
+        state.first_snapshot_date = snapshot_date
+
+    state.last_snapshot_date = snapshot_date
+    state.last_value = total_value
+    return period_return
+
+
+def state_metrics(state: PortfolioMetricState, risk_free_rate: float = RISK_FREE_RATE) -> Dict[str, Optional[Decimal]]:
+    """
+    Метрики в единицах колонок Portfolio (проценты, TWR с начала
+    аннуализируется для истории длиннее года - как calculate_twr).
+    """
+    metrics: Dict[str, Optional[Decimal]] = {
+        "volatility": None,
+        "max_drawdown": None,
+        "twr_inception": None,
+        "sharpe_ratio": None,
+    }
+    if state.count == 0:
+        return metrics
+
+    twr = state.twr_product - 1.0
+    days = (_as_utc(state.last_snapshot_date) - _as_utc(state.first_snapshot_date)).days
+    if days > 365 and state.twr_product > 0:
+        twr = state.twr_product ** (365.25 / days) - 1.0
+
+    metrics["twr_inception"] = Decimal(str(round(twr * 100, 6)))
+    metrics["max_drawdown"] = Decimal(str(round(state.max_drawdown * 100, 6)))
+
+    if state.count >= 2:
+        daily_volatility = math.sqrt(state.m2 / (state.count - 1))
+        annual_volatility = daily_volatility * math.sqrt(TRADING_DAYS)
+        metrics["volatility"] = Decimal(str(round(annual_volatility * 100, 6)))
+        if annual_volatility > 0:
+            sharpe = (state.mean_return * TRADING_DAYS - risk_free_rate) / annual_volatility
+            metrics["sharpe_ratio"] = Decimal(str(round(sharpe, 6)))
+
+    return metrics
+
+
+class PortfolioMetricStateService:
+    """Ведение накопленного состояния метрик и кэшированных колонок портфеля"""
+
+    def __init__(self, db: Session, risk_free_rate: float = RISK_FREE_RATE):
+        self.db = db
+        self.risk_free_rate = risk_free_rate
+
+    def get(self, portfolio_id: int) -> Optional[PortfolioMetricState]:
+        return self.db.get(PortfolioMetricState, portfolio_id)
+
+    def append_snapshot(self,
+                        portfolio_id: int,
+                        snapshot_date: datetime,
+                        total_value: Decimal,
+                        cash_flow: Decimal = Decimal("0")) -> PortfolioMetricState:
+        """
+        Учесть новый снимок портфеля и обновить метрики Portfolio.
+        Вызывается после сохранения снимка. Снимок не позже уже учтенного
+        (повторная оценка, правка истории) и первый снимок портфеля без
+        состояния приводят к полному пересчету по снимкам.
+        """
+        state = self.get(portfolio_id)
+        if state is None or (
+            state.last_snapshot_date is not None and _as_utc(snapshot_date) <= _as_utc(state.last_snapshot_date)
+        ):
+            if state is not None:
+                logger.info(f"Снимок {snapshot_date} портфеля {portfolio_id} вне порядка, пересчет состояния")
+            state = self.rebuild(portfolio_id)
+            if state.last_snapshot_date is not None and _as_utc(snapshot_date) <= _as_utc(state.last_snapshot_date):
+                return state
+
+        apply_snapshot(state, snapshot_date, total_value, cash_flow)
+        self._refresh_portfolio(state)
+        return state
+
+    def append_snapshots(self, snapshot_date: datetime, totals: Sequence[Tuple[int, Decimal]]) -> int:
+        """
+        Учесть снимки ежедневной оценки за snapshot_date: [(portfolio_id,
+        total_value)]. Внешние потоки после последнего учтенного снимка
+        читаются одним запросом по всем портфелям.
+        """
+        if not totals:
+            return 0
+
+        portfolio_ids = [portfolio_id for portfolio_id, _ in totals]
+        states = {
+            state.portfolio_id: state
+            for state in self.db.execute(
+                select(PortfolioMetricState).where(PortfolioMetricState.portfolio_id.in_(portfolio_ids))
+            ).scalars()
+        }
+        last_dates = [
+            _as_utc(state.last_snapshot_date) for state in states.values() if state.last_snapshot_date is not None
+        ]
+        flows: Dict[int, List[Tuple[datetime, Decimal]]] = {}
+        if last_dates:
+            since = datetime.combine(min(last_dates).date() + timedelta(days=1), day_time.min, tzinfo=timezone.utc)
+            until = datetime.combine(snapshot_date.date(), day_time.max, tzinfo=timezone.utc)
+            for portfolio_id, ts, amount in TransactionRepository(self.db).get_external_flows(
+                portfolio_ids, end_date=until, start_date=since
+            ):
+                flows.setdefault(portfolio_id, []).append((ts, amount))
+
+        for portfolio_id, total_value in totals:
+            state = states.get(portfolio_id)
+            cash_flow = Decimal("0")
+            if state is not None and state.last_snapshot_date is not None:
+                last_day = _as_utc(state.last_snapshot_date).date()
+                cash_flow = sum(
+                    (amount for ts, amount in flows.get(portfolio_id, ()) if _as_utc(ts).date() > last_day),
+                    Decimal("0")
+                )
+            self.append_snapshot(portfolio_id, snapshot_date, total_value, cash_flow)
+        return len(totals)
+
+    def rebuild(self,
+                portfolio_id: int,
+                cash_flows: Optional[Mapping[datetime, Decimal]] = None) -> PortfolioMetricState:
+        """
+        Построить состояние заново по всем снимкам портфеля (однократная
+        инициализация или исправление истории).
+
+        Args:
+            cash_flows: чистые внешние потоки по датам снимков, к которым они
+                относятся; по умолчанию - пополнения и выводы портфеля
+                (get_external_flows) за всю историю
+        """
+        state = self.get(portfolio_id)
+        if state is None:
+            state = PortfolioMetricState(portfolio_id=portfolio_id)
+            self.db.add(state)
+
+        state.count, state.mean_return, state.m2 = 0, 0.0, 0.0
+        state.twr_product, state.peak, state.max_drawdown = 1.0, 1.0, 0.0
+        state.first_snapshot_date = state.last_snapshot_date = state.last_value = None
+
+        rows = self.db.execute(
+            select(PortfolioSnapshot.snapshot_date, PortfolioSnapshot.total_value)
+            .where(PortfolioSnapshot.portfolio_id == portfolio_id)
+            .order_by(PortfolioSnapshot.snapshot_date)
+        ).all()
+        if cash_flows is None:
+            cash_flows = snapshot_cash_flows(
+                [_as_utc(snapshot_date) for snapshot_date, _ in rows],
+                [(ts, amount) for _, ts, amount in TransactionRepository(self.db).get_external_flows([portfolio_id])]
+            )
+        cash_flows = {_as_utc(moment): amount for moment, amount in cash_flows.items()}
+        for snapshot_date, total_value in rows:
+            apply_snapshot(state, snapshot_date, total_value, cash_flows.get(_as_utc(snapshot_date), Decimal("0")))
+
+        self._refresh_portfolio(state)
+        return state
+
+    def _refresh_portfolio(self, state: PortfolioMetricState) -> None:
+        self.db.execute(
+            update(Portfolio)
+            .where(Portfolio.id == state.portfolio_id)
+            .values(**state_metrics(state, self.risk_free_rate))
+        )
+        self.db.flush()
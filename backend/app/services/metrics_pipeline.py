@@ -0,0 +1,326 @@
+"""
+Пакетный пересчет кэшированных метрик портфелей (ночная материализация).
+
+Устаревшие портфели выбираются по индексу metrics_calculated_at и
+обрабатываются блоками: снимки и внешние потоки блока загружаются двумя
+set-based запросами, метрики считаются в пуле процессов векторно на
+NumPy (XIRR - одним пакетным Ньютоном на блок), результат записывается
+одним UPDATE ... FROM (VALUES ...) на блок. Записываются только TWR по
+горизонтам и XIRR: волатильность, Шарп, просадку и TWR с начала ведет
+metric_state, учитывающий и потоки, восстановленные при дозаполнении
+истории. Пропускная способность публикуется метриками Prometheus.
+
+Потоки считаются с точки зрения портфеля: пополнения положительные,
+выводы отрицательные; дивиденды и купоны - внутренний доход, уже
+отраженный в стоимости снимков.
+"""
+
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.repositories.portfolio import PortfolioRepository
+from app.repositories.transaction import TransactionRepository
+from app.services.metric_state import RISK_FREE_RATE, TRADING_DAYS
+from app.services.portfolio_analytics import TWR_HORIZONS
+from app.services.xirr import DAYS_IN_YEAR, xirr_batch
+
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_STALE_AFTER = timedelta(hours=20)
+
+# Горизонты, для которых в Portfolio есть кэшированные колонки
+METRIC_HORIZONS = {
+    name: days for name, days in TWR_HORIZONS.items()
+    if name not in ("twr_1d", "twr_1w")
+}
+METRIC_FIELDS = (*METRIC_HORIZONS, "twr_inception", "xirr", "volatility", "sharpe_ratio", "max_drawdown")
+# Колонки Portfolio, которые пишет материализация (остальные - metric_state)
+MATERIALIZED_FIELDS = (*METRIC_HORIZONS, "xirr")
+
+# Предел DECIMAL(10, 6)
+_COLUMN_LIMIT = 10 ** 4
+
+PORTFOLIOS_MATERIALIZED = Counter(
+    'investment_metrics_portfolios_total',
+    'Portfolios with materialized metrics',
+    ['status']
+)
+MATERIALIZATION_DURATION = Histogram(
+    'investment_metrics_stage_duration_seconds',
+    'Metrics materialization stage duration per chunk',
+    ['stage']
+)
+MATERIALIZATION_THROUGHPUT = Gauge(
+    'investment_metrics_portfolios_per_second',
+    'Throughput of the last metrics materialization run'
+)
+
+# (portfolio_id, дни снимков, стоимости, дни потоков, суммы потоков)
+SeriesTask = Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+@dataclass
+class MaterializationReport:
+    """Итог прогона материализации"""
+    portfolios: int
+    with_history: int
+    chunks: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.portfolios / self.seconds if self.seconds > 0 else 0.0
+
+
+def period_cash_flows(days: np.ndarray, flow_days: np.ndarray, flow_amounts: np.ndarray) -> np.ndarray:
+    """
+    Сумма внешних потоков по подпериодам (d_i, d_{i+1}] ряда снимков:
+    вектор длины len(days) - 1; потоки вне ряда не учитываются.
+    """
+    n = len(days)
+    if n < 2:
+        return np.zeros(0)
+    period = np.searchsorted(days, flow_days, side="left") - 1
+    inside = (period >= 0) & (period < n - 1)
+    return np.bincount(period[inside], weights=np.asarray(flow_amounts, dtype=np.float64)[inside], minlength=n - 1)
+
+
+def series_metrics(days: np.ndarray,
+                   values: np.ndarray,
+                   flow_days: np.ndarray,
+                   flow_amounts: np.ndarray,
+                   risk_free_rate: float = RISK_FREE_RATE) -> Dict[str, Optional[float]]:
+    """
+    TWR по горизонтам, волатильность, Шарп и просадка одного ряда снимков.
+
+    Определения совпадают с PortfolioAnalyticsService.calculate_twr_horizons
+    и metric_state: поток относится к подпериоду (d_i, d_{i+1}], доходность
+    подпериода V_{i+1} / (V_i + CF) - 1, горизонты длиннее года - в годовых.
+
+    Args:
+        days: дни снимков (по возрастанию)
+        values: стоимости портфеля в эти дни
+        flow_days, flow_amounts: внешние потоки (пополнения положительные)
+    """
+    metrics: Dict[str, Optional[float]] = {name: None for name in METRIC_FIELDS if name != "xirr"}
+    n = len(values)
+    if n < 2:
+        return metrics
+
+    cash_flow = period_cash_flows(days, flow_days, flow_amounts)
+
+    base = values[:-1] + cash_flow
+    valid = base > 0
+    factor = np.where(valid, values[1:] / np.where(valid, base, 1.0), 1.0)
+
+    # Префиксы роста без нулевых множителей и их число
+    zero = factor == 0
+    growth = np.concatenate(([1.0], np.cumprod(np.where(zero, 1.0, factor))))
+    zeros = np.concatenate(([0], np.cumsum(zero)))
+
+    horizons = dict(METRIC_HORIZONS, twr_inception=int(days[-1] - days[0]))
+    starts = np.searchsorted(days, days[-1] - np.array(list(horizons.values())), side="left")
+    for (name, period_days), start in zip(horizons.items(), starts):
+        if start >= n - 1:
+            continue
+        twr = 0.0 if zeros[-1] > zeros[start] else growth[-1] / growth[start]
+        if period_days > 365 and twr > 0:
+            metrics[name] = (twr ** (DAYS_IN_YEAR / period_days) - 1) * 100
+        else:
+            metrics[name] = (twr - 1) * 100
+
+    # Просадка по индексу TWR, чтобы потоки не выглядели как рост и падение
+    index = np.cumprod(factor)
+    peak = np.maximum.accumulate(np.concatenate(([1.0], index)))[1:]
+    metrics["max_drawdown"] = float(np.max(1 - index / peak, initial=0.0)) * 100
+
+    returns = factor[valid] - 1
+    if returns.size >= 2:
+        annual_volatility = float(np.std(returns, ddof=1)) * math.sqrt(TRADING_DAYS)
+        metrics["volatility"] = annual_volatility * 100
+        if annual_volatility > 0:
+            metrics["sharpe_ratio"] = (float(returns.mean()) * TRADING_DAYS - risk_free_rate) / annual_volatility
+
+    return metrics
+
+
+def compute_chunk(tasks: Sequence[SeriesTask], risk_free_rate: float = RISK_FREE_RATE) -> List[Dict[str, Any]]:
+    """
+    Метрики блока портфелей (выполняется в процессе пула).
+
+    XIRR окна наблюдения: начальная стоимость как вложение, потоки после
+    первого снимка с обратным знаком (это деньги инвестора), итоговая
+    стоимость как получение; все портфели блока решаются одним xirr_batch.
+    """
+    results = []
+    width = max((int(((fd > d[0]) & (fd <= d[-1])).sum()) + 2 for _, d, _, fd, _ in tasks if len(d)), default=0)
+    amounts = np.zeros((len(tasks), width))
+    times = np.zeros((len(tasks), width))
+
+    for row, (portfolio_id, days, values, flow_days, flow_amounts) in enumerate(tasks):
+        metrics = series_metrics(days, values, flow_days, flow_amounts, risk_free_rate)
+        metrics["id"] = portfolio_id
+        results.append(metrics)
+        if len(values) < 2:
+            continue
+
+        window = (flow_days > days[0]) & (flow_days <= days[-1])
+        k = int(window.sum())
+        amounts[row, 0] = -values[0]
+        amounts[row, 1:k + 1] = -flow_amounts[window]
+        amounts[row, k + 1] = values[-1]
+        times[row, 1:k + 1] = (flow_days[window] - days[0]) / DAYS_IN_YEAR
+        times[row, k + 1] = (days[-1] - days[0]) / DAYS_IN_YEAR
+
+    rates = xirr_batch(amounts, times) if width else np.full(len(tasks), np.nan)
+    for metrics, rate in zip(results, rates):
+        metrics["xirr"] = float(rate) * 100 if np.isfinite(rate) and -1 <= rate <= 10 else None
+    return results
+
+
+def _to_column(value: Optional[float]) -> Optional[Decimal]:
+    """Значение для колонки DECIMAL(10, 6); вне диапазона - None"""
+    if value is None or not math.isfinite(value) or abs(value) >= _COLUMN_LIMIT:
+        return None
+    return Decimal(str(round(value, 6)))
+
+
+def _day_numbers(moments: Iterable[datetime]) -> np.ndarray:
+    return np.array([m.date() for m in moments], dtype="datetime64[D]").astype(np.int64)
+
+
+def build_tasks(portfolio_ids: Sequence[int],
+                snapshots: Sequence[Tuple[int, datetime, Decimal]],
+                flows: Sequence[Tuple[int, datetime, Decimal]]) -> List[SeriesTask]:
+    """Разложить строки set-based запросов (упорядоченные по портфелю) на ряды портфелей"""
+    def group(rows):
+        grouped: Dict[int, Tuple[List[datetime], List[float]]] = {}
+        for portfolio_id, moment, amount in rows:
+            moments, amounts = grouped.setdefault(portfolio_id, ([], []))
+            moments.append(moment)
+            amounts.append(float(amount))
+        return grouped
+
+    series, cash_flows = group(snapshots), group(flows)
+    tasks = []
+    for portfolio_id in portfolio_ids:
+        moments, amounts = series.get(portfolio_id, ([], []))
+        flow_moments, flow_amounts = cash_flows.get(portfolio_id, ([], []))
+        tasks.append((
+            portfolio_id,
+            _day_numbers(moments),
+            np.array(amounts, dtype=np.float64),
+            _day_numbers(flow_moments),
+            np.array(flow_amounts, dtype=np.float64),
+        ))
+    return tasks
+
+
+class MetricsMaterializer:
+    """Пересчет кэшированных метрик устаревших портфелей"""
+
+    def __init__(self,
+                 db: Session,
+                 max_workers: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 stale_after: timedelta = DEFAULT_STALE_AFTER,
+                 risk_free_rate: float = RISK_FREE_RATE):
+        if chunk_size < 1:
+            raise ValueError("Размер блока должен быть положительным")
+
+        self.db = db
+        self.portfolio_repo = PortfolioRepository(db)
+        self.transaction_repo = TransactionRepository(db)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.stale_after = stale_after
+        self.risk_free_rate = risk_free_rate
+
+    def run(self, now: Optional[datetime] = None, limit: Optional[int] = None) -> MaterializationReport:
+        """
+        Пересчитать метрики портфелей, не обновлявшихся дольше stale_after.
+
+        Блоки загружаются и записываются в основном процессе, расчет идет
+        в пуле: пока пул считает один блок, загружается следующий.
+        """
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+
+        with MATERIALIZATION_DURATION.labels(stage="select").time():
+            portfolio_ids = self.portfolio_repo.get_stale_portfolio_ids(now - self.stale_after, limit)
+        chunks = [portfolio_ids[i:i + self.chunk_size] for i in range(0, len(portfolio_ids), self.chunk_size)]
+
+        with_history = 0
+        if len(chunks) > 1 and self.max_workers > 1:
+            workers = min(self.max_workers, len(chunks))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Не больше двух блоков на процесс в работе: память ограничена
+                pending: Deque[Future] = deque()
+                for chunk in chunks:
+                    if len(pending) >= 2 * workers:
+                        with_history += self._write(pending.popleft().result(), now)
+                    pending.append(executor.submit(compute_chunk, self._load(chunk), self.risk_free_rate))
+                while pending:
+                    with_history += self._write(pending.popleft().result(), now)
+        else:
+            for chunk in chunks:
+                with MATERIALIZATION_DURATION.labels(stage="compute").time():
+                    results = compute_chunk(self._load(chunk), self.risk_free_rate)
+                with_history += self._write(results, now)
+
+        report = MaterializationReport(
+            portfolios=len(portfolio_ids),
+            with_history=with_history,
+            chunks=len(chunks),
+            seconds=time.perf_counter() - started
+        )
+        MATERIALIZATION_THROUGHPUT.set(report.per_second)
+        logger.info(
+            f"Материализация метрик: {report.portfolios} портфелей, {report.chunks} блоков "
+            f"за {report.seconds:.2f} с ({report.per_second:.0f} портфелей/с)"
+        )
+        return report
+
+    def _load(self, portfolio_ids: List[int]) -> List[SeriesTask]:
+        with MATERIALIZATION_DURATION.labels(stage="load").time():
+            snapshots = self.portfolio_repo.get_snapshot_series(portfolio_ids)
+            flows = self.transaction_repo.get_external_flows(portfolio_ids)
+            return build_tasks(portfolio_ids, snapshots, flows)
+
+    def _write(self, results: List[Dict[str, Any]], now: datetime) -> int:
+        """Записать блок одним UPDATE; возвращает число портфелей с историей"""
+        rows = [
+            {"id": metrics["id"], "metrics_calculated_at": now,
+             **{name: _to_column(metrics[name]) for name in MATERIALIZED_FIELDS}}
+            for metrics in results
+        ]
+        with MATERIALIZATION_DURATION.labels(stage="write").time():
+            self.portfolio_repo.bulk_update_metrics(rows)
+            self.db.commit()
+
+        with_history = sum(1 for metrics in results if metrics["twr_inception"] is not None)
+        PORTFOLIOS_MATERIALIZED.labels(status="computed").inc(with_history)
+        PORTFOLIOS_MATERIALIZED.labels(status="empty").inc(len(results) - with_history)
+        return with_history
+
+
+if __name__ == "__main__":
+    from app.core.database_sync import SessionLocal
+
+    session = SessionLocal()
+    try:
+        MetricsMaterializer(session).run()
+    finally:
+        session.close()
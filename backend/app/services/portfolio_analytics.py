@@ -3,40 +3,55 @@
 """
 
 import math
+from bisect import bisect_left, bisect_right
 from typing import List, Dict, Any, Optional, Tuple
 from decimal import Decimal
 from datetime import datetime, timedelta, date
 from dataclasses import dataclass
 
 import numpy as np
-from scipy.optimize import fsolve
 import pandas as pd
 
 from app.core.logging import logger
+from app.core.money import (
+    MONEY_DIGITS,
+    PRICE_DIGITS,
+    QUANTITY_DIGITS,
+    from_units,
+    to_units_array,
+    value_units_array,
+)
+from app.services.xirr import xirr
 
 
 # Module-level helper so tests can patch 'app.services.portfolio_analytics.calculate_xirr'
 def calculate_xirr(cash_flows: List[Dict[str, Any]]) -> Optional[float]:
-    """Lightweight XIRR stub for tests; returns annual rate as fraction.
-    Real implementation is provided via tests patch; this is a safe fallback.
-    """
+    """XIRR по потокам вида {"date": ..., "amount": ...}; годовая ставка как доля."""
+    if not cash_flows or len(cash_flows) < 2:
+        return None
     try:
-        # Trivial fallback: if two cash flows (invest and final), compute simple rate
-        if not cash_flows or len(cash_flows) < 2:
-            return None
-        start = cash_flows[0]
-        end = cash_flows[-1]
-        invest = float(start.get("amount", 0) or 0)
-        final = float(end.get("amount", 0) or 0)
-        if invest == 0:
-            return None
-        # assume 1 year for fallback
-        rate = (final - abs(invest)) / abs(invest)
-        return rate
-    except Exception:
+        return xirr(
+            [float(cf["amount"]) for cf in cash_flows],
+            [cf["date"] for cf in cash_flows]
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Ошибка расчета XIRR: {e}")
         return None
 
 
+# Горизонты TWR в днях (поля PerformanceMetrics)
+TWR_HORIZONS = {
+    'twr_1d': 1,
+    'twr_1w': 7,
+    'twr_1m': 30,
+    'twr_3m': 90,
+    'twr_6m': 180,
+    'twr_1y': 365,
+    'twr_3y': 365 * 3,
+    'twr_5y': 365 * 5,
+}
+
+
 @dataclass
 class CashFlow:
     """Денежный поток для расчета XIRR."""
@@ -91,13 +106,19 @@ class PortfolioAnalyticsService:
     def calculate_portfolio_value(self, portfolio_id: int) -> float:
         """Calculate total market value as sum(quantity * current_price)."""
         holdings = self.get_portfolio_holdings(portfolio_id)
-        total = 0.0
+        quantities, prices, values = [], [], []
         for h in holdings:
             if "quantity" in h and "current_price" in h:
-                total += float(h["quantity"]) * float(h["current_price"])
+                quantities.append(h["quantity"])
+                prices.append(h["current_price"])
             elif "value" in h:
-                total += float(h["value"])
-        return total
+                values.append(h["value"])
+        # Суммирование в целых единицах без накопления ошибки float
+        total = int(value_units_array(
+            to_units_array(quantities, QUANTITY_DIGITS),
+            to_units_array(prices, PRICE_DIGITS)
+        ).sum()) + int(to_units_array(values, MONEY_DIGITS).sum())
+        return float(from_units(total, MONEY_DIGITS))
 
     def calculate_allocation_by_sector(self, portfolio_id: int) -> Dict[str, float]:
         """Return sector allocation percentages rounded to 2 decimals."""
@@ -165,60 +186,82 @@ class PortfolioAnalyticsService:
         Расчет Time-Weighted Return (TWR).
         TWR исключает влияние притоков/оттоков капитала.
         """
+        return self.calculate_twr_horizons(
+            price_points, cash_flows, {'twr': period_days}, include_inception=False
+        )['twr']
+    
+    def calculate_twr_horizons(
+        self,
+        price_points: List[PricePoint],
+        cash_flows: List[CashFlow],
+        horizons: Optional[Dict[str, int]] = None,
+        include_inception: bool = True
+    ) -> Dict[str, Optional[Decimal]]:
+        """
+        TWR сразу для нескольких горизонтов (в процентах, больше года - годовые).
+        
+        Точки и потоки сливаются одним проходом двумя указателями: поток
+        относится к подпериоду (d_i, d_{i+1}], доходность подпериода
+        V_{i+1} / (V_i + CF). По префиксному произведению TWR любого
+        горизонта - отношение двух префиксов, найти начало горизонта -
+        бинарный поиск по датам.
+        """
+        horizons = TWR_HORIZONS if horizons is None else horizons
+        result: Dict[str, Optional[Decimal]] = {name: None for name in horizons}
+        if include_inception:
+            result['twr_inception'] = None
+        
         if len(price_points) < 2:
-            return None
+            return result
         
         try:
-            # Сортируем данные по дате
-            price_points = sorted(price_points, key=lambda x: x.date)
-            cash_flows = sorted(cash_flows, key=lambda x: x.date)
-            
-            # Фильтруем по периоду
-            end_date = price_points[-1].date
-            start_date = end_date - timedelta(days=period_days)
-            
-            filtered_prices = [p for p in price_points if p.date >= start_date]
-            filtered_cashflows = [cf for cf in cash_flows if start_date <= cf.date <= end_date]
-            
-            if len(filtered_prices) < 2:
-                return None
-            
-            # Создаем серию цен с учетом денежных потоков
-            twr = Decimal('1.0')
-            
-            for i in range(len(filtered_prices) - 1):
-                current_value = filtered_prices[i].value
-                next_value = filtered_prices[i + 1].value
-                current_date = filtered_prices[i].date
-                next_date = filtered_prices[i + 1].date
+            points = sorted(price_points, key=lambda x: x.date)
+            flows = sorted(cash_flows, key=lambda x: x.date)
+            dates = [p.date for p in points]
+            
+            # Префиксы: произведение ненулевых множителей и число нулевых,
+            # чтобы обнуление стоимости не ломало деление префиксов
+            growth = [Decimal('1')]
+            zeros = [0]
+            j = bisect_right([cf.date for cf in flows], dates[0])
+            for i in range(len(points) - 1):
+                total_cashflow = Decimal('0')
+                while j < len(flows) and flows[j].date <= dates[i + 1]:
+                    total_cashflow += flows[j].amount
+                    j += 1
                 
-                # Находим денежные потоки между датами
-                period_cashflows = [
-                    cf for cf in filtered_cashflows 
-                    if current_date < cf.date <= next_date
-                ]
-                
-                # Корректируем на денежные потоки
-                total_cashflow = sum(cf.amount for cf in period_cashflows)
-                adjusted_current_value = current_value + total_cashflow
+                adjusted_current_value = points[i].value + total_cashflow
+                factor = points[i + 1].value / adjusted_current_value if adjusted_current_value > 0 else Decimal('1')
+                if factor == 0:
+                    growth.append(growth[-1])
+                    zeros.append(zeros[-1] + 1)
+                else:
+                    growth.append(growth[-1] * factor)
+                    zeros.append(zeros[-1])
+            
+            last = len(points) - 1
+            periods = dict(horizons)
+            if include_inception:
+                periods['twr_inception'] = (dates[-1] - dates[0]).days
+            
+            for name, period_days in periods.items():
+                start = bisect_left(dates, dates[-1] - timedelta(days=period_days))
+                if start >= last:
+                    continue
+                twr = Decimal('0') if zeros[last] > zeros[start] else growth[last] / growth[start]
                 
-                if adjusted_current_value > 0:
-                    period_return = next_value / adjusted_current_value
-                    twr *= period_return
-            
-            # Конвертируем в процентную доходность
-            twr_percent = (twr - 1) * 100
-            
-            # Аннуализируем если период больше года
-            if period_days > 365:
-                years = period_days / 365.25
-                twr_percent = ((1 + twr_percent / 100) ** (1 / years) - 1) * 100
+                # Конвертируем в процентную доходность, аннуализируем если период больше года
+                if period_days > 365 and twr > 0:
+                    years = period_days / 365.25
+                    result[name] = Decimal(str(float(twr) ** (1 / years) - 1)) * 100
+                else:
+                    result[name] = (twr - 1) * 100
             
-            return twr_percent
+            return result
             
         except Exception as e:
             logger.error(f"Ошибка расчета TWR: {e}")
-            return None
+            return result
     
     def calculate_xirr_from_cash_flows(self, cash_flows: List[CashFlow]) -> Optional[Decimal]:
         """
@@ -228,43 +271,16 @@ class PortfolioAnalyticsService:
         if len(cash_flows) < 2:
             return None
         
-        try:
-            # Сортируем по дате
-            cash_flows = sorted(cash_flows, key=lambda x: x.date)
-            
-            # Конвертируем в numpy массивы
-            dates = [cf.date for cf in cash_flows]
-            amounts = [float(cf.amount) for cf in cash_flows]
-            
-            # Базовая дата (первая дата)
-            base_date = dates[0]
-            
-            # Конвертируем даты в количество дней от базовой даты
-            days = [(d - base_date).days for d in dates]
-            
-            # Функция для поиска XIRR
-            def xirr_equation(rate):
-                return sum(
-                    amount / ((1 + rate) ** (day / 365.25))
-                    for amount, day in zip(amounts, days)
-                )
-            
-            # Ищем корень уравнения
-            try:
-                rate = fsolve(xirr_equation, 0.1)[0]  # Начальное приближение 10%
-                
-                # Проверяем разумность результата (-100% < XIRR < 1000%)
-                if -1 <= rate <= 10:
-                    return Decimal(str(rate * 100))  # Конвертируем в проценты
-                else:
-                    return None
-                    
-            except:
-                return None
-                
-        except Exception as e:
-            logger.error(f"Ошибка расчета XIRR: {e}")
+        rate = xirr(
+            [float(cf.amount) for cf in cash_flows],
+            [cf.date for cf in cash_flows]
+        )
+        
+        # Проверяем разумность результата (-100% < XIRR < 1000%)
+        if rate is None or not -1 <= rate <= 10:
             return None
+        
+        return Decimal(str(rate * 100))  # Конвертируем в проценты
     
     def calculate_volatility(
         self,
@@ -363,27 +379,10 @@ class PortfolioAnalyticsService:
         
         metrics = PerformanceMetrics()
         
-        # Расчет TWR для разных периодов
-        periods = {
-            'twr_1d': 1,
-            'twr_1w': 7,
-            'twr_1m': 30,
-            'twr_3m': 90,
-            'twr_6m': 180,
-            'twr_1y': 365,
-            'twr_3y': 365 * 3,
-            'twr_5y': 365 * 5,
-        }
-        
-        for metric_name, days in periods.items():
-            twr = self.calculate_twr(price_points, cash_flows, days)
+        # TWR для всех периодов и с начала истории за один проход
+        for metric_name, twr in self.calculate_twr_horizons(price_points, cash_flows).items():
             setattr(metrics, metric_name, twr)
         
-        # TWR с момента создания портфеля
-        if len(price_points) >= 2:
-            inception_days = (price_points[-1].date - price_points[0].date).days
-            metrics.twr_inception = self.calculate_twr(price_points, cash_flows, inception_days)
-        
         # XIRR
         metrics.xirr = self.calculate_xirr_from_cash_flows(cash_flows)
         
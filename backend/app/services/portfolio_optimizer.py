@@ -0,0 +1,342 @@
+"""
+Оптимизатор эффективной границы (mean-variance).
+
+Задача для уровня неприятия риска λ:
+
+    min  ½ wᵀΣw - λ μᵀw
+    при  Σw = 1, 0 <= w_i <= cap_i, lo_c <= Σ_{i∈c} w_i <= hi_c
+
+Граница строится параметрическим проходом по λ: матрица задачи и
+ограничения от λ не зависят, меняется только линейный член. Поэтому
+решатель ADMM (схема OSQP) один раз факторизует KKT-матрицу и на каждой
+следующей точке стартует с решения предыдущей. Точка, не сошедшаяся с
+теплого старта, решается заново с нуля; граница с несошедшимися точками
+не кэшируется. Готовые границы кэшируются по (вселенная, набор
+ограничений); при обновлении входных данных новая граница строится с
+теплого старта от закэшированных решений.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+from app.core.cache import LRUTTLCache
+from app.core.logging import logger
+
+
+TRADING_DAYS = 252
+DEFAULT_FRONTIER_POINTS = 30
+FRONTIER_CACHE = LRUTTLCache(maxsize=128, ttl=24 * 3600)
+
+# Положение на границе (доля диапазона волатильности) по профилю риска
+RISK_TOLERANCE_POSITIONS = {
+    "conservative": 0.15,
+    "moderate": 0.5,
+    "aggressive": 0.85,
+}
+
+
+@dataclass(frozen=True)
+class OptimizationConstraints:
+    """Ограничения long-only оптимизации"""
+    max_weight: float = 1.0                                     # Потолок веса одного инструмента
+    asset_class_bounds: Tuple[Tuple[str, float, float], ...] = ()  # (класс, min, max) доли класса
+
+    def key(self) -> Tuple:
+        return (round(self.max_weight, 10), tuple(sorted(self.asset_class_bounds)))
+
+
+@dataclass
+class FrontierPoint:
+    """Точка эффективной границы (годовые доходность и волатильность)"""
+    risk_aversion: float
+    expected_return: float
+    volatility: float
+    sharpe_ratio: float
+    weights: np.ndarray
+
+    def to_dict(self, instrument_ids: Sequence[int]) -> Dict[str, Any]:
+        return {
+            "expected_return": self.expected_return,
+            "volatility": self.volatility,
+            "sharpe_ratio": self.sharpe_ratio,
+            "weights": {
+                int(instrument_id): float(weight)
+                for instrument_id, weight in zip(instrument_ids, self.weights)
+                if weight > 1e-6
+            },
+        }
+
+
+@dataclass
+class EfficientFrontier:
+    """Эффективная граница, упорядоченная по возрастанию волатильности"""
+    instrument_ids: Tuple[int, ...]
+    points: List[FrontierPoint]
+    data_version: Any = None
+    iterations: int = 0
+    converged: bool = True
+    warm_states: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = field(default_factory=list, repr=False)
+
+    def min_variance(self) -> FrontierPoint:
+        return self.points[0]
+
+    def max_sharpe(self) -> FrontierPoint:
+        return max(self.points, key=lambda point: point.sharpe_ratio)
+
+    def for_risk_tolerance(self, risk_tolerance: str = "moderate", investment_horizon: int = 5) -> FrontierPoint:
+        """
+        Точка границы для профиля риска: доля диапазона волатильности от
+        минимальной дисперсии до максимальной доходности. Длинный горизонт
+        (больше 10 лет) сдвигает выбор в сторону риска, как и в модельных
+        распределениях сервиса ребалансировки.
+        """
+        if risk_tolerance not in RISK_TOLERANCE_POSITIONS:
+            raise ValueError(f"Неизвестный профиль риска: {risk_tolerance}")
+
+        position = RISK_TOLERANCE_POSITIONS[risk_tolerance]
+        if investment_horizon > 10:
+            position = min(1.0, position + 0.1)
+
+        low, high = self.points[0].volatility, self.points[-1].volatility
+        target = low + position * (high - low)
+        return min(self.points, key=lambda point: abs(point.volatility - target))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "instrument_ids": list(self.instrument_ids),
+            "points": [point.to_dict(self.instrument_ids) for point in self.points],
+        }
+
+
+class ParametricQP:
+    """
+    ADMM-решатель QP вида min ½xᵀPx + qᵀx при l <= Ax <= u (схема OSQP).
+
+    KKT-матрица факторизуется один раз и переиспользуется для всех q;
+    повторная факторизация нужна только при адаптации штрафа ρ, которое
+    сохраняется между решениями и на соседних точках границы почти не
+    меняется.
+    """
+
+    def __init__(self,
+                 P: np.ndarray,
+                 A: np.ndarray,
+                 lower: np.ndarray,
+                 upper: np.ndarray,
+                 rho: float = 0.1,
+                 sigma: float = 1e-6,
+                 alpha: float = 1.6):
+        self.P = P
+        self.A = A
+        self.lower = lower
+        self.upper = upper
+        self.sigma = sigma
+        self.alpha = alpha
+        # Для строк-равенств штраф выше, как в OSQP
+        self._equality_scale = np.where(lower == upper, 1e3, 1.0)
+        self.factorizations = 0
+        self._factorize(rho)
+
+    def _factorize(self, rho: float) -> None:
+        self.rho_base = rho
+        self.rho = rho * self._equality_scale
+        kkt = self.P + self.sigma * np.eye(self.P.shape[0]) + self.A.T @ (self.rho[:, None] * self.A)
+        # Для плотных задач умеренного размера явная обратная матрица дешевле
+        # двух треугольных решений на каждой итерации
+        self.kkt_inverse = cho_solve(cho_factor(kkt), np.eye(kkt.shape[0]))
+        self.factorizations += 1
+
+    def solve(self,
+              q: np.ndarray,
+              warm: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+              tolerance: float = 1e-7,
+              max_iterations: int = 10000,
+              check_every: int = 25) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, bool]:
+        """
+        Returns:
+            (x, z, y, число итераций, достигнута ли точность tolerance);
+            x, z, y пригодны как теплый старт
+        """
+        n, m = self.P.shape[0], self.A.shape[0]
+        if warm is None:
+            x, z, y = np.zeros(n), np.zeros(m), np.zeros(m)
+        else:
+            x, z, y = (array.copy() for array in warm)
+
+        A, alpha = self.A, self.alpha
+        converged = False
+        for iteration in range(1, max_iterations + 1):
+            x_tilde = self.kkt_inverse @ (self.sigma * x - q + A.T @ (self.rho * z - y))
+            z_tilde = A @ x_tilde
+
+            x = alpha * x_tilde + (1 - alpha) * x
+            z_relaxed = alpha * z_tilde + (1 - alpha) * z
+            z_next = np.clip(z_relaxed + y / self.rho, self.lower, self.upper)
+            y = y + self.rho * (z_relaxed - z_next)
+            z = z_next
+
+            if iteration % check_every:
+                continue
+
+            Ax, Px, ATy = A @ x, self.P @ x, A.T @ y
+            primal = np.abs(Ax - z).max()
+            dual = np.abs(Px + q + ATy).max()
+            primal_scale = max(np.abs(Ax).max(), np.abs(z).max(), 1e-12)
+            dual_scale = max(np.abs(Px).max(), np.abs(ATy).max(), np.abs(q).max(), 1e-12)
+            if primal <= tolerance * (1 + primal_scale) and dual <= tolerance * (1 + dual_scale):
+                converged = True
+                break
+
+            # Адаптация ρ по отношению нормированных невязок
+            ratio = np.sqrt((primal / primal_scale) / max(dual / dual_scale, 1e-30))
+            if ratio > 5 or ratio < 0.2:
+                self._factorize(float(np.clip(self.rho_base * ratio, 1e-6, 1e6)))
+
+        return x, z, y, iteration, converged
+
+
+def constraint_matrix(asset_classes: Sequence[Optional[str]],
+                      constraints: OptimizationConstraints) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Строки ограничений: бюджет, границы весов, доли классов активов"""
+    n = len(asset_classes)
+    if constraints.max_weight * n < 1 - 1e-12:
+        raise ValueError("Потолок веса слишком мал: сумма весов не может быть равна 1")
+
+    rows = [np.ones((1, n)), np.eye(n)]
+    lower = [np.ones(1), np.zeros(n)]
+    upper = [np.ones(1), np.full(n, constraints.max_weight)]
+
+    classes = np.array([asset_class or "" for asset_class in asset_classes])
+    for asset_class, class_min, class_max in constraints.asset_class_bounds:
+        members = (classes == asset_class).astype(np.float64)
+        if not members.any():
+            if class_min > 0:
+                raise ValueError(f"Нет инструментов класса {asset_class} для минимальной доли {class_min}")
+            continue
+        rows.append(members[None, :])
+        lower.append(np.array([class_min]))
+        upper.append(np.array([class_max]))
+
+    return np.vstack(rows), np.concatenate(lower), np.concatenate(upper)
+
+
+class EfficientFrontierOptimizer:
+    """Построение эффективной границы с кэшем и теплым стартом"""
+
+    def __init__(self, cache: Optional[LRUTTLCache] = None, risk_free_rate: float = 0.0):
+        self.cache = cache if cache is not None else FRONTIER_CACHE
+        self.risk_free_rate = risk_free_rate
+
+    def frontier(self,
+                 instrument_ids: Sequence[int],
+                 mean_returns: np.ndarray,
+                 covariance: np.ndarray,
+                 asset_classes: Optional[Sequence[Optional[str]]] = None,
+                 constraints: OptimizationConstraints = OptimizationConstraints(),
+                 n_points: int = DEFAULT_FRONTIER_POINTS,
+                 data_version: Any = None,
+                 annualize: bool = True) -> EfficientFrontier:
+        """
+        Эффективная граница для вселенной инструментов.
+
+        Args:
+            mean_returns, covariance: оценки дневных доходностей (annualize=True)
+                или уже годовые
+            asset_classes: класс актива каждого инструмента (для ограничений по классам)
+            data_version: версия входных данных (например, дата оценки ковариации);
+                при совпадении граница берется из кэша без пересчета
+        """
+        instrument_ids = tuple(int(i) for i in instrument_ids)
+        asset_classes = list(asset_classes) if asset_classes is not None else [None] * len(instrument_ids)
+        universe = hashlib.sha1(",".join(map(str, instrument_ids)).encode()).hexdigest()
+        key = ("frontier", universe, constraints.key(), n_points)
+
+        cached = self.cache.get(key)
+        if cached is not None and data_version is not None and cached.data_version == data_version:
+            return cached
+
+        factor = TRADING_DAYS if annualize else 1
+        mu = np.asarray(mean_returns, dtype=np.float64) * factor
+        sigma = np.asarray(covariance, dtype=np.float64) * factor
+
+        frontier = self._sweep(
+            instrument_ids, mu, sigma, asset_classes, constraints, n_points,
+            warm_states=cached.warm_states if cached is not None else None
+        )
+        frontier.data_version = data_version
+        if frontier.converged:
+            self.cache.set(key, frontier)
+        return frontier
+
+    def _sweep(self,
+               instrument_ids: Tuple[int, ...],
+               mu: np.ndarray,
+               sigma: np.ndarray,
+               asset_classes: List[Optional[str]],
+               constraints: OptimizationConstraints,
+               n_points: int,
+               warm_states: Optional[List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = None) -> EfficientFrontier:
+        """Проход по λ от минимальной дисперсии к максимальной доходности"""
+        A, lower, upper = constraint_matrix(asset_classes, constraints)
+
+        # Масштабирование: единичная средняя дисперсия, λ в сопоставимых единицах
+        scale = float(np.mean(np.diag(sigma))) or 1.0
+        P = sigma / scale
+        mu_scale = float(np.abs(mu).max()) or 1.0
+        qp = ParametricQP(P, A, lower, upper)
+
+        lambdas = np.concatenate([[0.0], np.logspace(-3, 3, n_points - 1)]) / mu_scale
+        use_cached = warm_states is not None and len(warm_states) == len(lambdas)
+
+        points: List[FrontierPoint] = []
+        states = []
+        total_iterations = 0
+        unconverged = 0
+        warm = None
+        for i, risk_aversion in enumerate(lambdas):
+            if use_cached:
+                warm = warm_states[i]
+            x, z, y, iterations, converged = qp.solve(-risk_aversion * mu, warm)
+            total_iterations += iterations
+            if not converged and warm is not None:
+                # Теплый старт мог оказаться неудачным - решаем с нуля
+                x, z, y, iterations, converged = qp.solve(-risk_aversion * mu)
+                total_iterations += iterations
+            if not converged:
+                unconverged += 1
+            warm = (x, z, y)
+            states.append(warm)
+
+            weights = np.clip(x, 0.0, None)
+            weights /= weights.sum()
+            expected_return = float(mu @ weights)
+            volatility = float(np.sqrt(max(weights @ sigma @ weights, 0.0)))
+            sharpe = (expected_return - self.risk_free_rate) / volatility if volatility > 0 else 0.0
+            points.append(FrontierPoint(float(risk_aversion), expected_return, volatility, float(sharpe), weights))
+
+        logger.debug(f"Эффективная граница: {len(points)} точек, {total_iterations} итераций ADMM")
+        if unconverged:
+            logger.warning(
+                f"Эффективная граница: {unconverged} из {len(points)} точек не сошлись "
+                f"до заданной точности, граница не кэшируется"
+            )
+        return EfficientFrontier(
+            instrument_ids=instrument_ids,
+            points=self._deduplicate(points),
+            iterations=total_iterations,
+            converged=not unconverged,
+            warm_states=states
+        )
+
+    @staticmethod
+    def _deduplicate(points: List[FrontierPoint]) -> List[FrontierPoint]:
+        """Убрать совпадающие точки (в зоне насыщения ограничений λ не меняет решение)"""
+        unique = [points[0]]
+        for point in points[1:]:
+            if np.abs(point.weights - unique[-1].weights).max() > 1e-4:
+                unique.append(point)
+        return unique
@@ -0,0 +1,198 @@
+"""
+Пакетная загрузка цен инструментов (дневные и внутридневные бары).
+
+Строки (instrument_id, ts, close, currency, source) читаются потоком и
+загружаются пачками по batch_size; каждая пачка - отдельная транзакция,
+повторная загрузка файла идемпотентна (upsert по (instrument_id, ts),
+внутри пачки побеждает последняя строка).
+
+В PostgreSQL пачка создает недостающие месячные секции prices, копируется
+COPY во временную таблицу и переносится в prices и last_prices двумя
+INSERT ... SELECT ON CONFLICT (PriceRepository.copy_prices). В остальных
+СУБД (SQLite в тестах) - многострочные upsert по FALLBACK_BATCH_SIZE строк.
+После каждой пачки меняется версия кэша котировок процесса, после
+загрузки в сохраненные ковариационные матрицы дописываются новые дни
+(CovarianceService.update_daily по последний загруженный день) и
+сбрасывается кэш матриц исторических сценариев.
+"""
+
+import csv
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.models.instrument import Instrument
+from app.repositories.price import PriceRepository
+from app.services.covariance_service import CovarianceService
+from app.services.quotes import invalidate_quotes
+from app.services.scenario_replay import clear_scenario_cache
+
+
+DEFAULT_BATCH_SIZE = 50_000
+# Многострочный INSERT без COPY: 5 параметров на строку в пределах лимита SQLite
+FALLBACK_BATCH_SIZE = 5_000
+
+PRICES_INGESTED = Counter(
+    'investment_prices_ingested_total',
+    'Price rows loaded by bulk ingestion',
+    ['method']
+)
+INGEST_BATCH_DURATION = Histogram(
+    'investment_prices_ingest_batch_seconds',
+    'Price ingestion batch duration'
+)
+
+
+@dataclass
+class IngestReport:
+    """Итог загрузки цен"""
+    rows: int
+    batches: int
+    skipped: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+class PriceIngestService:
+    """Загрузка цен пачками: COPY в PostgreSQL, upsert в остальных СУБД"""
+
+    def __init__(self, db: Session, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.price_repo = PriceRepository(db)
+
+    def ingest(self, rows: Iterable[Dict[str, Any]]) -> IngestReport:
+        """Загрузить строки цен; ts без часового пояса считается UTC"""
+        started = time.perf_counter()
+        copy = self.db.get_bind().dialect.name == "postgresql"
+        method = "copy" if copy else "upsert"
+        total = batches = 0
+        last_day: Optional[date] = None
+
+        for batch in _batches(rows, self.batch_size):
+            with INGEST_BATCH_DURATION.time():
+                batch = _last_per_key(batch)
+                partitions: List[str] = []
+                if copy:
+                    partitions = self.price_repo.ensure_partitions({(row["ts"].year, row["ts"].month) for row in batch})
+                    self.price_repo.copy_prices(batch)
+                else:
+                    for offset in range(0, len(batch), FALLBACK_BATCH_SIZE):
+                        chunk = batch[offset:offset + FALLBACK_BATCH_SIZE]
+                        self.price_repo.upsert_prices(chunk)
+                        self.price_repo.upsert_last_prices(chunk)
+                self.db.commit()
+                self.price_repo.remember_partitions(partitions)
+                invalidate_quotes()
+            batch_day = max(row["ts"] for row in batch).date()
+            last_day = batch_day if last_day is None else max(last_day, batch_day)
+            PRICES_INGESTED.labels(method).inc(len(batch))
+            total += len(batch)
+            batches += 1
+
+        if last_day is not None:
+            CovarianceService(self.db).update_daily(last_day)
+            clear_scenario_cache()
+
+        report = IngestReport(rows=total, batches=batches, skipped=0, seconds=time.perf_counter() - started)
+        logger.info(
+            f"Загрузка цен ({method}): {total} строк, {batches} пачек "
+            f"за {report.seconds:.2f} с ({report.per_second:.0f} строк/с)"
+        )
+        return report
+
+    def ingest_csv(self, stream: TextIO, source: str) -> IngestReport:
+        """
+        Загрузить CSV с заголовком: instrument_id или ticker, ts (дата или
+        момент ISO 8601), close и необязательная currency (по умолчанию -
+        валюта инструмента). Строки с неизвестным тикером пропускаются.
+        """
+        reader = csv.DictReader(stream)
+        by_ticker = {}
+        currencies = {}
+        for instrument_id, ticker, currency in self.db.execute(
+            select(Instrument.id, Instrument.ticker, Instrument.currency)
+            .where(Instrument.is_active == True)
+            .order_by(Instrument.id)
+        ):
+            by_ticker.setdefault(ticker, instrument_id)
+            currencies[instrument_id] = currency
+
+        unknown: Dict[str, int] = {}
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for record in reader:
+                if record.get("instrument_id"):
+                    instrument_id = int(record["instrument_id"])
+                else:
+                    instrument_id = by_ticker.get(record["ticker"])
+                if instrument_id not in currencies:
+                    key = record.get("ticker") or record["instrument_id"]
+                    unknown[key] = unknown.get(key, 0) + 1
+                    continue
+                yield {
+                    "instrument_id": instrument_id,
+                    "ts": _parse_ts(record["ts"]),
+                    "close": Decimal(record["close"]),
+                    "currency": record.get("currency") or currencies[instrument_id],
+                    "source": source,
+                }
+
+        report = self.ingest(rows())
+        report.skipped = sum(unknown.values())
+        if unknown:
+            logger.warning(f"Загрузка цен: пропущено {report.skipped} строк неизвестных инструментов {sorted(unknown)[:20]}")
+        return report
+
+
+def _parse_ts(value: str) -> datetime:
+    moment = datetime.fromisoformat(value.strip())
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def _batches(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _last_per_key(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки пачки, уникальные по (instrument_id, ts); повтор заменяет строку"""
+    unique: Dict[Any, Dict[str, Any]] = {}
+    for row in batch:
+        ts = row["ts"]
+        if ts.tzinfo is None:
+            row = {**row, "ts": ts.replace(tzinfo=timezone.utc)}
+        unique[(row["instrument_id"], row["ts"])] = row
+    return list(unique.values())
+
+
+if __name__ == "__main__":
+    import sys
+
+    from app.core.database_sync import SessionLocal
+
+    session = SessionLocal()
+    try:
+        for path in sys.argv[1:]:
+            with open(path, newline="", encoding="utf-8") as f:
+                PriceIngestService(session).ingest_csv(f, source=path)
+    finally:
+        session.close()
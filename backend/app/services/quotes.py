@@ -0,0 +1,101 @@
+"""
+Текущие котировки инструментов.
+
+Единая точка чтения "текущей цены" для оценки, ребалансировки, топа
+позиций и оповещений. Источник - таблица last_prices (последняя строка
+prices каждого инструмента, обновляется при загрузке цен), перед ней -
+процессный кэш LRUTTLCache со сквозным чтением: повторные запросы
+обслуживаются из памяти за O(1), промахи дочитываются одним запросом по
+первичному ключу.
+
+Ключ кэша содержит версию котировок. Загрузка цен (PriceIngestService)
+меняет версию, и все прежние записи процесса перестают читаться без обхода
+кэша. Цены, загруженные другими процессами, видны не позже чем через
+QUOTE_CACHE_TTL секунд.
+"""
+
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.cache import LRUTTLCache
+from app.repositories.price import PriceRepository
+
+
+QUOTE_CACHE_SIZE = 100_000
+QUOTE_CACHE_TTL = 15.0
+QUOTE_CACHE = LRUTTLCache(maxsize=QUOTE_CACHE_SIZE, ttl=QUOTE_CACHE_TTL)
+
+_version_lock = threading.Lock()
+_quotes_version = 0
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class Quote:
+    """Текущая цена инструмента"""
+    instrument_id: int
+    close: Decimal
+    currency: str
+    ts: datetime
+
+
+def quotes_version() -> int:
+    return _quotes_version
+
+
+def invalidate_quotes() -> int:
+    """Сменить версию котировок процесса; возвращает новую версию"""
+    global _quotes_version
+    with _version_lock:
+        _quotes_version += 1
+        return _quotes_version
+
+
+class QuoteService:
+    """Чтение текущих котировок через кэш"""
+
+    def __init__(self, db: Session, cache: Optional[LRUTTLCache] = None):
+        self.db = db
+        self.cache = cache if cache is not None else QUOTE_CACHE
+        self.price_repo = PriceRepository(db)
+
+    def get_quotes(self, instrument_ids: Iterable[int]) -> Dict[int, Quote]:
+        """Котировки инструментов; инструменты без цены в результат не попадают"""
+        version = quotes_version()
+        quotes: Dict[int, Quote] = {}
+        missing: List[int] = []
+
+        for instrument_id in set(instrument_ids):
+            quote = self.cache.get((version, instrument_id), _MISSING)
+            if quote is _MISSING:
+                missing.append(instrument_id)
+            elif quote is not None:
+                quotes[instrument_id] = quote
+
+        if missing:
+            found = {
+                row.instrument_id: Quote(row.instrument_id, row.close, row.currency, row.ts)
+                for row in self.price_repo.get_last_prices(missing)
+            }
+            # Отсутствие цены тоже кэшируется, чтобы не повторять запрос
+            for instrument_id in missing:
+                self.cache.set((version, instrument_id), found.get(instrument_id))
+            quotes.update(found)
+
+        return quotes
+
+    def get_quote(self, instrument_id: int) -> Optional[Quote]:
+        return self.get_quotes([instrument_id]).get(instrument_id)
+
+    def get_prices(self, instrument_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """Текущие цены закрытия {instrument_id: close}"""
+        return {instrument_id: quote.close for instrument_id, quote in self.get_quotes(instrument_ids).items()}
+
+    def get_price(self, instrument_id: int) -> Optional[Decimal]:
+        quote = self.get_quote(instrument_id)
+        return quote.close if quote is not None else None
@@ -17,6 +17,15 @@ from ..models.instrument import Instrument
 from ..models.transaction import Transaction
 from ..models.custom_asset import CustomAsset
 from ..services.portfolio_service import PortfolioService
+from ..services.quotes import QuoteService
+from ..services.covariance_service import CovarianceService
+from ..services.risk_parity import RiskParityEngine
+from ..services.portfolio_optimizer import (
+    EfficientFrontier,
+    EfficientFrontierOptimizer,
+    OptimizationConstraints,
+)
+from ..core.logging import logger
 
 
 class RebalancingStrategy(str, Enum):
@@ -26,6 +35,8 @@ class RebalancingStrategy(str, Enum):
     MOMENTUM = "momentum"            # С учетом трендов
     CONSERVATIVE = "conservative"     # Консервативная
     AGGRESSIVE = "aggressive"        # Агрессивная
+    RISK_PARITY = "risk_parity"      # Равный вклад в риск
+    HRP = "hrp"                      # Иерархический risk parity
 
 
 class RebalancingAction(str, Enum):
@@ -105,6 +116,7 @@ class RebalancingService:
     def __init__(self, db: Session):
         self.db = db
         self.portfolio_service = PortfolioService(db)
+        self.quotes = QuoteService(db)
     
     def create_rebalancing_plan(
         self,
@@ -199,7 +211,7 @@ class RebalancingService:
             if position_data["shares"] > 0:
                 instrument = position_data["instrument"]
                 avg_price = position_data["total_cost"] / position_data["shares"]
-                current_price = self._get_current_price(instrument)
+                current_price = self._get_current_price(instrument, avg_price)
                 current_value = position_data["shares"] * current_price
                 
                 holdings.append(CurrentHolding(
@@ -328,11 +340,10 @@ class RebalancingService:
         recommendations.sort(key=lambda x: x.priority, reverse=True)
         return recommendations[:max_trades]
     
-    def _get_current_price(self, instrument: Instrument) -> Decimal:
-        """Получить текущую цену инструмента"""
-        # TODO: Интеграция с источниками котировок
-        # Временная заглушка
-        return Decimal("100.0")
+    def _get_current_price(self, instrument: Instrument, fallback: Decimal) -> Decimal:
+        """Текущая цена инструмента; без котировки - fallback (средняя цена покупки)"""
+        price = self.quotes.get_price(instrument.id)
+        return price if price is not None else fallback
     
     def _estimate_commission(self, amount: Decimal, instrument_id: Optional[int]) -> Decimal:
         """Оценить комиссию за сделку"""
@@ -396,9 +407,110 @@ class RebalancingService:
         self,
         portfolio_id: int,
         risk_tolerance: str = "moderate",
-        investment_horizon: int = 5
+        investment_horizon: int = 5,
+        max_weight: Optional[Decimal] = None,
+        asset_class_bounds: Optional[Dict[str, Tuple[Decimal, Decimal]]] = None
     ) -> List[TargetAllocation]:
-        """Предложить оптимальные распределения на основе современной портфельной теории"""
+        """
+        Предложить оптимальные распределения на основе современной портфельной теории.
+
+        Веса берутся с эффективной границы по инструментам портфеля (long-only,
+        max_weight - потолок доли одного инструмента в процентах,
+        asset_class_bounds - {класс: (min %, max %)}). Если инструментов меньше
+        двух или нет истории цен, возвращаются модельные распределения по классам.
+        """
+        holdings = [h for h in self._get_current_holdings(portfolio_id) if h.instrument_id is not None]
+
+        if len(holdings) >= 2:
+            try:
+                frontier = self.get_efficient_frontier(portfolio_id, max_weight, asset_class_bounds, holdings)
+                point = frontier.for_risk_tolerance(risk_tolerance, investment_horizon)
+            except ValueError as e:
+                logger.warning(f"Эффективная граница для портфеля {portfolio_id} не построена: {e}")
+            else:
+                holding_by_id = {h.instrument_id: h for h in holdings}
+                return [
+                    TargetAllocation(
+                        instrument_id=instrument_id,
+                        asset_class=holding_by_id[instrument_id].asset_class,
+                        sector=holding_by_id[instrument_id].sector,
+                        currency=holding_by_id[instrument_id].currency,
+                        target_percent=Decimal(str(round(float(weight) * 100, 2))),
+                        max_percent=max_weight
+                    )
+                    for instrument_id, weight in zip(frontier.instrument_ids, point.weights)
+                ]
+
+        return self._model_allocations(risk_tolerance, investment_horizon)
+
+    def get_efficient_frontier(
+        self,
+        portfolio_id: int,
+        max_weight: Optional[Decimal] = None,
+        asset_class_bounds: Optional[Dict[str, Tuple[Decimal, Decimal]]] = None,
+        holdings: Optional[List[CurrentHolding]] = None
+    ) -> EfficientFrontier:
+        """Эффективная граница по инструментам портфеля (для графика риск/доходность)"""
+        if holdings is None:
+            holdings = [h for h in self._get_current_holdings(portfolio_id) if h.instrument_id is not None]
+
+        estimate = CovarianceService(self.db).get_or_build([h.instrument_id for h in holdings], "ledoit_wolf")
+        class_by_id = {h.instrument_id: h.asset_class for h in holdings}
+        constraints = OptimizationConstraints(
+            max_weight=float(max_weight) / 100 if max_weight is not None else 1.0,
+            asset_class_bounds=tuple(
+                (asset_class, float(low) / 100, float(high) / 100)
+                for asset_class, (low, high) in (asset_class_bounds or {}).items()
+            )
+        )
+
+        return EfficientFrontierOptimizer().frontier(
+            estimate.instrument_ids,
+            estimate.mean,
+            estimate.covariance,
+            asset_classes=[class_by_id.get(instrument_id) for instrument_id in estimate.instrument_ids],
+            constraints=constraints,
+            data_version=(estimate.as_of, estimate.observations)
+        )
+
+    def suggest_risk_based_allocations(
+        self,
+        portfolio_id: int,
+        strategy: RebalancingStrategy = RebalancingStrategy.HRP
+    ) -> List[TargetAllocation]:
+        """
+        Целевые распределения по риску для инструментов портфеля:
+        RISK_PARITY - равный вклад в риск, HRP - иерархический risk parity.
+        Результат передается в create_rebalancing_plan как есть.
+        """
+        if strategy not in (RebalancingStrategy.RISK_PARITY, RebalancingStrategy.HRP):
+            raise ValueError(f"Стратегия {strategy} не является стратегией распределения по риску")
+
+        holdings = [h for h in self._get_current_holdings(portfolio_id) if h.instrument_id is not None]
+        if len(holdings) < 2:
+            raise ValueError("Для распределения по риску нужно не меньше двух инструментов")
+
+        estimate = CovarianceService(self.db).get_or_build([h.instrument_id for h in holdings], "ledoit_wolf")
+        engine = RiskParityEngine()
+        if strategy == RebalancingStrategy.HRP:
+            weights = engine.hrp(estimate.instrument_ids, estimate.covariance)
+        else:
+            weights = engine.risk_parity(estimate.covariance)
+
+        holding_by_id = {h.instrument_id: h for h in holdings}
+        return [
+            TargetAllocation(
+                instrument_id=instrument_id,
+                asset_class=holding_by_id[instrument_id].asset_class,
+                sector=holding_by_id[instrument_id].sector,
+                currency=holding_by_id[instrument_id].currency,
+                target_percent=Decimal(str(round(float(weight) * 100, 2)))
+            )
+            for instrument_id, weight in zip(estimate.instrument_ids, weights)
+        ]
+
+    def _model_allocations(self, risk_tolerance: str, investment_horizon: int) -> List[TargetAllocation]:
+        """Модельные распределения по классам активов для профиля риска"""
         
         allocations = []
         
@@ -0,0 +1,157 @@
+"""
+Распределения на основе риска: равный вклад в риск (risk parity) и
+иерархический risk parity (HRP).
+
+HRP: инструменты упорядочиваются по дереву single-linkage кластеризации
+корреляционной матрицы (квази-диагонализация), затем веса распределяются
+рекурсивной бисекцией обратно пропорционально дисперсии половин. Дерево
+меняется медленно, поэтому кэшируется по вселенной инструментов;
+ежедневный пересчет весов повторяет только дешевую бисекцию на свежей
+ковариации.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+
+from app.core.cache import LRUTTLCache
+
+
+DEFAULT_TREE_TTL = 7 * 24 * 3600
+HRP_TREE_CACHE = LRUTTLCache(maxsize=256, ttl=DEFAULT_TREE_TTL)
+
+
+@dataclass(frozen=True)
+class ClusterTree:
+    """Дерево single-linkage кластеризации вселенной инструментов"""
+    instrument_ids: Tuple[int, ...]
+    linkage: np.ndarray             # (n-1, 4) матрица scipy linkage
+    order: np.ndarray               # квази-диагональный порядок индексов
+
+
+def correlation_distance(correlation: np.ndarray) -> np.ndarray:
+    """Метрика d_ij = sqrt((1 - ρ_ij) / 2)"""
+    distance = np.sqrt(np.clip((1.0 - correlation) / 2.0, 0.0, 1.0))
+    np.fill_diagonal(distance, 0.0)
+    return distance
+
+
+def cluster_tree(instrument_ids: Sequence[int], covariance: np.ndarray) -> ClusterTree:
+    """Single-linkage кластеризация по корреляционному расстоянию"""
+    covariance = np.asarray(covariance, dtype=np.float64)
+    std = np.sqrt(np.diag(covariance))
+    safe = np.where(std > 0, std, 1.0)
+    correlation = covariance / np.outer(safe, safe)
+
+    if len(instrument_ids) < 2:
+        return ClusterTree(tuple(instrument_ids), np.empty((0, 4)), np.arange(len(instrument_ids)))
+
+    distance = correlation_distance(correlation)
+    tree = linkage(squareform(distance, checks=False), method="single")
+    return ClusterTree(tuple(int(i) for i in instrument_ids), tree, leaves_list(tree))
+
+
+def recursive_bisection(covariance: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """
+    Веса HRP: отрезок упорядоченных инструментов делится пополам, доли
+    половин обратно пропорциональны дисперсии их портфелей с весами
+    обратно пропорциональными дисперсии инструментов.
+    """
+    # В квази-диагональном порядке кластеры - непрерывные блоки матрицы
+    ordered = np.asarray(covariance, dtype=np.float64)[np.ix_(order, order)]
+    inverse_variance = 1.0 / np.maximum(np.diag(ordered), 1e-18)
+    weights = np.ones(len(order))
+
+    def cluster_variance(start: int, end: int) -> float:
+        ivp = inverse_variance[start:end] / inverse_variance[start:end].sum()
+        return float(ivp @ ordered[start:end, start:end] @ ivp)
+
+    segments: List[Tuple[int, int]] = [(0, len(order))]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        middle = (start + end) // 2
+        left_variance, right_variance = cluster_variance(start, middle), cluster_variance(middle, end)
+        alpha = 1.0 - left_variance / (left_variance + right_variance)
+        weights[start:middle] *= alpha
+        weights[middle:end] *= 1.0 - alpha
+        segments.extend([(start, middle), (middle, end)])
+
+    result = np.empty_like(weights)
+    result[order] = weights
+    return result
+
+
+def risk_contributions(weights: np.ndarray, covariance: np.ndarray) -> np.ndarray:
+    """Доли инструментов в дисперсии портфеля (в сумме 1)"""
+    marginal = covariance @ weights
+    contributions = weights * marginal
+    return contributions / contributions.sum()
+
+
+def risk_parity_weights(covariance: np.ndarray,
+                        budgets: Optional[np.ndarray] = None,
+                        tolerance: float = 1e-10,
+                        max_iterations: int = 100) -> np.ndarray:
+    """
+    Веса с заданными вкладами в риск (по умолчанию равными).
+
+    Решается выпуклая задача min ½yᵀΣy - Σ b_i ln y_i, у которой вклады
+    y_i (Σy)_i равны b_i; веса - нормированное y. Метод Ньютона с
+    демпфированием по ньютоновскому декременту сохраняет y > 0 и сходится
+    за десяток итераций.
+    """
+    covariance = np.asarray(covariance, dtype=np.float64)
+    n = covariance.shape[0]
+    budgets = np.full(n, 1.0 / n) if budgets is None else np.asarray(budgets, dtype=np.float64)
+    if budgets.shape != (n,) or (budgets <= 0).any():
+        raise ValueError("Бюджеты риска должны быть положительными для каждого инструмента")
+    budgets = budgets / budgets.sum()
+
+    # Нормировка дисперсий улучшает обусловленность гессиана
+    scale = float(np.mean(np.diag(covariance))) or 1.0
+    sigma = covariance / scale
+    y = np.sqrt(budgets) / np.sqrt(np.maximum(np.diag(sigma), 1e-18))
+
+    for _ in range(max_iterations):
+        gradient = sigma @ y - budgets / y
+        hessian = sigma + np.diag(budgets / y ** 2)
+        step = np.linalg.solve(hessian, gradient)
+        decrement = float(np.sqrt(max(gradient @ step, 0.0)))
+        if decrement < tolerance:
+            break
+        y = y - (step / (1.0 + decrement) if decrement > 0.25 else step)
+
+    return y / y.sum()
+
+
+class RiskParityEngine:
+    """Расчет risk parity и HRP весов с кэшем дерева кластеров"""
+
+    def __init__(self, cache: Optional[LRUTTLCache] = None, tree_ttl: Optional[float] = DEFAULT_TREE_TTL):
+        self.cache = cache if cache is not None else HRP_TREE_CACHE
+        self.tree_ttl = tree_ttl
+
+    def risk_parity(self, covariance: np.ndarray, budgets: Optional[np.ndarray] = None) -> np.ndarray:
+        return risk_parity_weights(covariance, budgets)
+
+    def hrp(self,
+            instrument_ids: Sequence[int],
+            covariance: np.ndarray,
+            refresh_tree: bool = False) -> np.ndarray:
+        """
+        Веса HRP. Дерево берется из кэша, если оно построено для той же
+        вселенной не раньше tree_ttl назад (refresh_tree - перестроить).
+        """
+        # Порядок в дереве - позиции в переданном списке, поэтому ключ учитывает порядок
+        key = ("hrp_tree", tuple(int(i) for i in instrument_ids))
+        tree = None if refresh_tree else self.cache.get(key)
+        if tree is None:
+            tree = cluster_tree(instrument_ids, covariance)
+            self.cache.set(key, tree, ttl=self.tree_ttl)
+
+        return recursive_bisection(covariance, tree.order)
@@ -0,0 +1,261 @@
+"""
+Библиотека исторических стресс-сценариев.
+
+Для каждого эпизода (кризис 2008, девальвация рубля в декабре 2014,
+март 2020, приостановка торгов на MOEX в феврале 2022) доходность
+инструмента считается по ценам закрытия as-of: последняя цена до начала
+эпизода против последней цены на его конец. Матрица доходностей
+«сценарии × инструменты» строится один раз по таблице prices, хранится
+компактно (float32) в LRU-кэше процесса с ключом «набор сценариев +
+вселенная инструментов», а оценка всех сценариев для портфеля сводится
+к одному умножению матрицы на вектор весов.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.repositories.price import PriceRepository
+
+
+MAX_STALENESS_DAYS = 31      # Цена старше этого срока на дату сценария считается отсутствующей
+MATRIX_CACHE_SIZE = 128      # Число матриц в кэше процесса
+
+
+@dataclass(frozen=True)
+class HistoricalScenario:
+    """Исторический эпизод для стресс-теста"""
+    key: str
+    name: str
+    start: date
+    end: date
+    description: str = ""
+
+
+HISTORICAL_SCENARIOS: Dict[str, HistoricalScenario] = {
+    scenario.key: scenario for scenario in (
+        HistoricalScenario(
+            key="gfc_2008",
+            name="Мировой финансовый кризис 2008",
+            start=date(2008, 5, 19),
+            end=date(2009, 1, 23),
+            description="От пика рынка в мае 2008 до дна в январе 2009"
+        ),
+        HistoricalScenario(
+            key="rub_2014",
+            name="Девальвация рубля, декабрь 2014",
+            start=date(2014, 12, 1),
+            end=date(2014, 12, 31),
+            description="Обвал рубля и повышение ключевой ставки до 17%"
+        ),
+        HistoricalScenario(
+            key="covid_2020",
+            name="Пандемия COVID-19, март 2020",
+            start=date(2020, 2, 20),
+            end=date(2020, 3, 23),
+            description="Распродажа на мировых рынках и обвал нефти"
+        ),
+        HistoricalScenario(
+            key="moex_2022",
+            name="Приостановка торгов на MOEX, февраль 2022",
+            start=date(2022, 2, 18),
+            end=date(2022, 3, 24),
+            description="Обвал 24 февраля и возобновление торгов 24 марта"
+        ),
+    )
+}
+
+
+@dataclass(frozen=True)
+class ScenarioMatrix:
+    """Доходности инструментов в исторических сценариях"""
+    scenarios: Tuple[HistoricalScenario, ...]
+    labels: Tuple[Hashable, ...]           # Инструменты (столбцы)
+    returns: np.ndarray                    # (n_scenarios, n_labels) float32, 0 где нет данных
+    covered: np.ndarray                    # (n_scenarios, n_labels) bool - есть цены на обе даты
+
+    def weight_vector(self, weights: Dict[Hashable, float]) -> np.ndarray:
+        """Вектор весов в порядке столбцов матрицы"""
+        return np.array([weights.get(label, 0.0) for label in self.labels], dtype=np.float64)
+
+    def evaluate(self, weights: Dict[Hashable, float]) -> Dict[str, Dict[str, Any]]:
+        """
+        Оценить все сценарии для портфеля.
+
+        Returns:
+            {ключ сценария: {'portfolio_impact', 'coverage', 'individual_impacts', ...}}.
+            coverage - доля веса портфеля, по которой есть история в эпизоде;
+            инструменты без истории входят в результат с нулевой доходностью.
+        """
+        w = self.weight_vector(weights)
+        impacts = self.returns @ w
+        total_weight = float(sum(weights.values()))
+        coverage = (self.covered @ w) / total_weight if total_weight else np.zeros(len(self.scenarios))
+
+        columns = [i for i, label in enumerate(self.labels) if label in weights]
+        individual = self.returns[:, columns].tolist()
+
+        results = {}
+        for i, scenario in enumerate(self.scenarios):
+            impacts_by_label = dict.fromkeys(weights, 0.0)
+            impacts_by_label.update(zip((self.labels[j] for j in columns), individual[i]))
+            results[scenario.key] = {
+                "name": scenario.name,
+                "start_date": scenario.start.isoformat(),
+                "end_date": scenario.end.isoformat(),
+                "portfolio_impact": float(impacts[i]),
+                "coverage": float(coverage[i]),
+                "individual_impacts": impacts_by_label,
+                "scenario_description": scenario.description
+            }
+        return results
+
+
+def resolve_scenarios(keys: Optional[Iterable[str]] = None) -> Tuple[HistoricalScenario, ...]:
+    """Сценарии библиотеки по ключам (все, если ключи не заданы)"""
+    if keys is None:
+        return tuple(HISTORICAL_SCENARIOS.values())
+
+    scenarios = []
+    for key in keys:
+        if key not in HISTORICAL_SCENARIOS:
+            raise ValueError(f"Неизвестный исторический сценарий: {key}")
+        scenarios.append(HISTORICAL_SCENARIOS[key])
+    return tuple(scenarios)
+
+
+def build_scenario_matrix(prices: pd.DataFrame,
+                          scenarios: Sequence[HistoricalScenario],
+                          max_staleness_days: int = MAX_STALENESS_DAYS) -> ScenarioMatrix:
+    """
+    Построить матрицу доходностей сценариев по широкой таблице цен
+    (индекс - даты, столбцы - инструменты, NaN - нет котировки).
+    """
+    index = pd.DatetimeIndex(prices.index)
+    if index.tz is not None:
+        index = index.tz_convert(None)
+    order = np.argsort(index.values, kind="stable")
+    dates = index.values[order]
+    values = prices.to_numpy(dtype=np.float64)[order]
+
+    n_scenarios, n_labels = len(scenarios), values.shape[1]
+    if dates.shape[0] == 0 or n_scenarios == 0:
+        return ScenarioMatrix(
+            scenarios=tuple(scenarios),
+            labels=tuple(prices.columns),
+            returns=np.zeros((n_scenarios, n_labels), dtype=np.float32),
+            covered=np.zeros((n_scenarios, n_labels), dtype=bool)
+        )
+
+    # Индекс последней валидной строки по каждому столбцу (as-of без копирования цен)
+    rows = np.arange(dates.shape[0])[:, None]
+    last_valid = np.maximum.accumulate(np.where(np.isfinite(values), rows, -1), axis=0)
+    staleness = np.timedelta64(max_staleness_days, "D")
+
+    def as_of(targets: np.ndarray, side_dates: np.ndarray) -> np.ndarray:
+        # targets - строка таблицы на дату сценария (-1 если данных до нее нет)
+        safe = np.clip(targets, 0, None)
+        source = last_valid[safe]                                   # (n_scenarios, n_labels)
+        found = (targets[:, None] >= 0) & (source >= 0)
+        source = np.clip(source, 0, None)
+        fresh = side_dates[:, None] - dates[source] <= staleness
+        return np.where(found & fresh, values[source, np.arange(n_labels)], np.nan)
+
+    starts = np.array([np.datetime64(s.start, "ns") for s in scenarios])
+    ends = np.array([np.datetime64(s.end + timedelta(days=1), "ns") for s in scenarios])
+
+    base = as_of(np.searchsorted(dates, starts, side="left") - 1, starts)
+    final = as_of(np.searchsorted(dates, ends, side="left") - 1, ends)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = final / base - 1.0
+    covered = np.isfinite(returns)
+
+    return ScenarioMatrix(
+        scenarios=tuple(scenarios),
+        labels=tuple(prices.columns),
+        returns=np.where(covered, returns, 0.0).astype(np.float32),
+        covered=covered
+    )
+
+
+# ---- Кэш матриц процесса ----
+
+_matrix_cache: "OrderedDict[Tuple, ScenarioMatrix]" = OrderedDict()
+_matrix_cache_lock = threading.Lock()
+
+
+def clear_scenario_cache() -> None:
+    """Сбросить кэш матриц (например, после загрузки исторических цен)"""
+    with _matrix_cache_lock:
+        _matrix_cache.clear()
+
+
+class HistoricalScenarioLibrary:
+    """Исторические сценарии по ценам из таблицы prices"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_matrix(self,
+                   instrument_ids: Iterable[int],
+                   keys: Optional[Iterable[str]] = None) -> ScenarioMatrix:
+        """Матрица доходностей сценариев для вселенной инструментов (из кэша, если есть)"""
+        scenarios = resolve_scenarios(keys)
+        universe = tuple(sorted(set(instrument_ids)))
+        cache_key = (tuple(s.key for s in scenarios), universe)
+
+        with _matrix_cache_lock:
+            matrix = _matrix_cache.get(cache_key)
+            if matrix is not None:
+                _matrix_cache.move_to_end(cache_key)
+                return matrix
+
+        matrix = self._load(scenarios, universe)
+
+        with _matrix_cache_lock:
+            _matrix_cache[cache_key] = matrix
+            if len(_matrix_cache) > MATRIX_CACHE_SIZE:
+                _matrix_cache.popitem(last=False)
+        return matrix
+
+    def replay(self,
+               weights: Dict[int, float],
+               keys: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Прогнать исторические сценарии на текущих весах портфеля {instrument_id: вес}"""
+        return self.get_matrix(weights.keys(), keys).evaluate(weights)
+
+    def _load(self, scenarios: Sequence[HistoricalScenario], universe: Tuple[int, ...]) -> ScenarioMatrix:
+        """Загрузить цены всех эпизодов одним запросом и построить матрицу"""
+        ranges = [
+            (
+                datetime.combine(s.start - timedelta(days=MAX_STALENESS_DAYS), datetime.min.time()),
+                datetime.combine(s.end, datetime.max.time())
+            )
+            for s in scenarios
+        ]
+        rows = PriceRepository(self.db).get_closes(universe, ranges)
+
+        frame = pd.DataFrame(rows, columns=["instrument_id", "ts", "close"])
+        if frame.empty:
+            prices = pd.DataFrame(columns=list(universe), index=pd.DatetimeIndex([]), dtype=np.float64)
+        else:
+            frame["ts"] = pd.to_datetime(frame["ts"], utc=True)
+            frame["close"] = frame["close"].astype(np.float64)
+            prices = (
+                frame.pivot_table(index="ts", columns="instrument_id", values="close", aggfunc="last")
+                .reindex(columns=list(universe))
+            )
+
+        logger.info(
+            f"Матрица исторических сценариев: {len(scenarios)} сценариев, "
+            f"{len(universe)} инструментов, {len(rows)} цен"
+        )
+        return build_scenario_matrix(prices, scenarios)
@@ -0,0 +1,208 @@
+"""
+Колоночное хранилище рядов стоимости портфелей на локальном диске.
+
+Ряд портфеля - файл <root>/<portfolio_id>.series: заголовок SERIES_MAGIC
+и непрерывный массив записей SERIES_DTYPE (номер дня от 1970-01-01,
+стоимость и вложения в целых единицах 1e-4 app.core.money) по возрастанию
+дня. P&L = стоимость - вложения не хранится. Запись занимает 20 байт,
+20 лет дневной истории - около 150 КБ.
+
+Чтение отображает файл в память (np.memmap): аналитика получает массивы
+NumPy без загрузки строк PortfolioSnapshot и их JSON-полей. Ежедневная
+запись - дозапись в конец файла (запись за последний день заменяется на
+месте); точки раньше последнего дня (восстановление истории) сливаются
+с перезаписью файла через временный файл и os.replace, поэтому уже
+открытые отображения остаются согласованными. Недописанный хвост после
+сбоя отбрасывается при чтении и следующей записи.
+
+Источник истины - portfolio_snapshots: хранилище пополняют оценка и
+восстановление истории, а sync_from_snapshots пересобирает его из БД.
+"""
+
+import os
+import tempfile
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.money import MONEY_DIGITS, MONEY_SCALE, to_units_array
+from app.repositories.portfolio import PortfolioRepository
+
+
+SERIES_MAGIC = b"PFSER\x00\x00\x01"
+SERIES_DTYPE = np.dtype([("day", "<i4"), ("value", "<i8"), ("cost", "<i8")])
+SERIES_SUFFIX = ".series"
+
+_EPOCH = date(1970, 1, 1)
+
+
+def day_number(day: date) -> int:
+    """Номер дня от 1970-01-01 (datetime - по его дате)"""
+    if isinstance(day, datetime):
+        day = day.date()
+    return (day - _EPOCH).days
+
+
+def series_records(days: Sequence[date], values: Sequence, costs: Sequence) -> np.ndarray:
+    """Записи ряда из дат и денежных сумм (Decimal/float) в порядке дат"""
+    records = np.empty(len(days), dtype=SERIES_DTYPE)
+    records["day"] = [day_number(day) for day in days]
+    records["value"] = to_units_array(values, MONEY_DIGITS)
+    records["cost"] = to_units_array(costs, MONEY_DIGITS)
+    return _last_per_day(records)
+
+
+def _last_per_day(records: np.ndarray) -> np.ndarray:
+    """Записи по возрастанию дня; из повторов дня остается последняя"""
+    records = records[np.argsort(records["day"], kind="stable")]
+    keep = np.ones(len(records), dtype=bool)
+    keep[:-1] = records["day"][1:] != records["day"][:-1]
+    return records[keep]
+
+
+class SeriesStore:
+    """Файловое хранилище рядов стоимости портфелей"""
+
+    def __init__(self, root: Optional[str] = None):
+        root = root or settings.SERIES_STORE_DIR
+        if not root:
+            raise ValueError("Не задан каталог хранилища рядов (SERIES_STORE_DIR)")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls) -> Optional["SeriesStore"]:
+        """Хранилище из настроек или None, если оно не включено"""
+        return cls() if settings.SERIES_STORE_DIR else None
+
+    def path(self, portfolio_id: int) -> Path:
+        return self.root / f"{portfolio_id}{SERIES_SUFFIX}"
+
+    def read(self,
+             portfolio_id: int,
+             start: Optional[date] = None,
+             end: Optional[date] = None) -> np.ndarray:
+        """
+        Записи ряда за [start, end] - отображение файла только для чтения
+        (без копирования); пустой массив, если ряда нет.
+        """
+        path = self.path(portfolio_id)
+        count = self._count(path)
+        if not count:
+            return np.empty(0, dtype=SERIES_DTYPE)
+
+        records = np.memmap(path, dtype=SERIES_DTYPE, mode="r", offset=len(SERIES_MAGIC), shape=(count,))
+        days = records["day"]
+        lo = int(np.searchsorted(days, day_number(start), side="left")) if start else 0
+        hi = int(np.searchsorted(days, day_number(end), side="right")) if end else count
+        return records[lo:hi]
+
+    def values(self,
+               portfolio_id: int,
+               start: Optional[date] = None,
+               end: Optional[date] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(даты datetime64[D], стоимость float64) ряда за [start, end]"""
+        records = self.read(portfolio_id, start, end)
+        return records["day"].astype("datetime64[D]"), records["value"] / MONEY_SCALE
+
+    def append(self, portfolio_id: int, records: np.ndarray) -> int:
+        """
+        Добавить записи в ряд; записи за уже сохраненные дни заменяются.
+        Возвращает число записей после слияния.
+        """
+        records = _last_per_day(np.asarray(records, dtype=SERIES_DTYPE))
+        path = self.path(portfolio_id)
+        count = self._count(path)
+        if not len(records):
+            return count
+        if not count:
+            self._replace(path, records)
+            return len(records)
+
+        existing = self.read(portfolio_id)
+        first_day = records["day"][0]
+        if first_day >= existing["day"][-1]:
+            # Новые дни не раньше последнего: дозапись с заменой последней записи
+            position = count - 1 if first_day == existing["day"][-1] else count
+            del existing
+            with open(path, "r+b") as f:
+                f.seek(len(SERIES_MAGIC) + position * SERIES_DTYPE.itemsize)
+                f.write(records.tobytes())
+                f.truncate()
+            return position + len(records)
+
+        merged = _last_per_day(np.concatenate([np.array(existing), records]))
+        del existing
+        self._replace(path, merged)
+        return len(merged)
+
+    def write(self, portfolio_id: int, records: np.ndarray) -> int:
+        """Заменить ряд целиком"""
+        records = _last_per_day(np.asarray(records, dtype=SERIES_DTYPE))
+        self._replace(self.path(portfolio_id), records)
+        return len(records)
+
+    def delete(self, portfolio_id: int) -> None:
+        self.path(portfolio_id).unlink(missing_ok=True)
+
+    def sync_from_snapshots(self, db: Session, portfolio_ids: Iterable[int], chunk_size: int = 500) -> int:
+        """Пересобрать ряды портфелей из portfolio_snapshots; возвращает число записей"""
+        portfolio_repo = PortfolioRepository(db)
+        portfolio_ids = list(portfolio_ids)
+        written = 0
+        for offset in range(0, len(portfolio_ids), chunk_size):
+            chunk = portfolio_ids[offset:offset + chunk_size]
+            series = {portfolio_id: [] for portfolio_id in chunk}
+            for portfolio_id, snapshot_date, value, cost in portfolio_repo.get_snapshot_series(
+                chunk, include_cost=True
+            ):
+                series[portfolio_id].append((snapshot_date, value, cost))
+            for portfolio_id, rows in series.items():
+                if rows:
+                    written += self.write(portfolio_id, series_records(*zip(*rows)))
+                else:
+                    self.delete(portfolio_id)
+        logger.info(f"Хранилище рядов: пересобрано {len(portfolio_ids)} портфелей, {written} записей")
+        return written
+
+    @staticmethod
+    def _count(path: Path) -> int:
+        """Число полных записей в файле ряда (0, если файла нет)"""
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        with open(path, "rb") as f:
+            if f.read(len(SERIES_MAGIC)) != SERIES_MAGIC:
+                raise ValueError(f"Неизвестный формат файла ряда: {path}")
+        return (size - len(SERIES_MAGIC)) // SERIES_DTYPE.itemsize
+
+    def _replace(self, path: Path, records: np.ndarray) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(SERIES_MAGIC)
+                f.write(records.tobytes())
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+if __name__ == "__main__":
+    from sqlalchemy import select
+
+    from app.core.database_sync import SessionLocal
+    from app.models.portfolio import Portfolio
+
+    session = SessionLocal()
+    try:
+        ids = list(session.execute(select(Portfolio.id).where(Portfolio.is_active == True)).scalars())
+        SeriesStore().sync_from_snapshots(session, ids)
+    finally:
+        session.close()
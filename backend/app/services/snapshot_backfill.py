@@ -0,0 +1,374 @@
+"""
+Восстановление истории снимков портфеля воспроизведением транзакций.
+
+Для портфелей, импортированных с многолетней историей брокера, снимки
+до даты импорта строятся векторно, без прохода по дням:
+
+- изменения количества раскладываются в матрицу (даты x инструменты) и
+  накапливаются cumsum;
+- цены и курсы валют из prices переносятся вперед по датам (ffill);
+- денежный остаток ведется по валютам как cumsum всех операций
+  (пополнения, выводы, покупки, продажи, дивиденды, купоны, налоги,
+  комиссии). Если в импорте нет пополнений и остаток уходит в минус,
+  недостающая сумма считается неявным пополнением;
+- стоимость = позиции x цены x курс + остатки x курс, в базовой валюте
+  портфеля; стоимость вложений - накопленные чистые пополнения.
+
+Даты оценки - дни, на которые есть цены или операции. Портфели
+считаются параллельно в пуле процессов, снимки записываются пачками
+(и сливаются в хранилище рядов, если оно включено).
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from datetime import time as day_time
+from decimal import Decimal
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.money import MONEY_DIGITS, from_units, to_units
+from app.models.instrument import Instrument
+from app.models.portfolio import Portfolio, PortfolioSnapshot
+from app.models.transaction import TransactionType
+from app.repositories.portfolio import PortfolioRepository
+from app.repositories.price import PriceRepository
+from app.repositories.transaction import TransactionRepository
+from app.services.metric_state import PortfolioMetricStateService, snapshot_cash_flows
+from app.services.series_store import SeriesStore, series_records
+
+
+# Знак влияния операции на денежный остаток (gross - сумма без знака)
+CASH_SIGNS = {
+    TransactionType.DEPOSIT: 1,
+    TransactionType.SELL: 1,
+    TransactionType.DIVIDEND: 1,
+    TransactionType.COUPON: 1,
+    TransactionType.WITHDRAWAL: -1,
+    TransactionType.BUY: -1,
+    TransactionType.TAX: -1,
+    TransactionType.FEE: -1,
+}
+EXTERNAL_TYPES = (TransactionType.DEPOSIT, TransactionType.WITHDRAWAL)
+
+# Цены до первой операции, от которых переносится последнее значение
+PRICE_LOOKBACK = timedelta(days=31)
+
+
+@dataclass
+class ReplayInput:
+    """Данные одного портфеля для воспроизведения (дни - номера дней от эпохи)"""
+    portfolio_id: int
+    days: np.ndarray                  # (D,) дни оценки по возрастанию
+    instrument_currency: np.ndarray   # (I,) индекс валюты инструмента
+    base_currency: int
+    quote_currency: int               # валюта котировки курсов (курс 1)
+    n_currencies: int
+    change_day: np.ndarray
+    change_instrument: np.ndarray
+    change_quantity: np.ndarray
+    price_day: np.ndarray
+    price_instrument: np.ndarray
+    price_close: np.ndarray
+    cash_day: np.ndarray
+    cash_currency: np.ndarray
+    cash_amount: np.ndarray           # со знаком, за вычетом комиссий и налогов
+    cash_external: np.ndarray         # (bool) пополнение или вывод
+    fx_day: np.ndarray
+    fx_currency: np.ndarray
+    fx_rate: np.ndarray
+
+
+@dataclass
+class ReplayResult:
+    """Дневные ряды в базовой валюте портфеля"""
+    portfolio_id: int
+    days: np.ndarray
+    values: np.ndarray
+    contributions: np.ndarray         # накопленные чистые пополнения
+    flows: np.ndarray                 # чистые пополнения дня
+    positions_count: np.ndarray
+    unpriced_days: int
+
+
+@dataclass
+class BackfillReport:
+    """Итог восстановления истории"""
+    portfolios: int
+    snapshots: int
+    seconds: float
+
+
+def _accumulate(days: np.ndarray, event_days: np.ndarray, columns: np.ndarray,
+                amounts: np.ndarray, n_columns: int) -> np.ndarray:
+    """Приращения по (дата, колонка); событие действует с первой даты оценки не раньше его дня"""
+    rows = np.searchsorted(days, event_days, side="left")
+    keep = rows < len(days)
+    deltas = np.zeros((len(days), n_columns))
+    np.add.at(deltas, (rows[keep], columns[keep]), amounts[keep])
+    return deltas
+
+
+def _forward_fill(days: np.ndarray, observed_days: np.ndarray, columns: np.ndarray,
+                  observed: np.ndarray, n_columns: int) -> np.ndarray:
+    """
+    Матрица (D, n) последних известных значений на каждую дату. Наблюдения
+    до первой даты попадают в служебную строку и переносятся вперед.
+    """
+    rows = np.searchsorted(days, observed_days, side="right")
+    matrix = np.full((len(days) + 1, n_columns), np.nan)
+
+    # Из нескольких наблюдений в одной ячейке берется последнее (входы упорядочены по времени)
+    keys = (rows * n_columns + columns)[::-1]
+    _, last = np.unique(keys, return_index=True)
+    last = len(keys) - 1 - last
+    matrix[rows[last], columns[last]] = observed[last]
+
+    source = np.where(~np.isnan(matrix), np.arange(len(days) + 1)[:, None], 0)
+    np.maximum.accumulate(source, axis=0, out=source)
+    return matrix[source, np.arange(n_columns)][1:]
+
+
+def replay(data: ReplayInput) -> ReplayResult:
+    """Дневные стоимость и пополнения портфеля по его операциям"""
+    n_instruments = len(data.instrument_currency)
+    positions = np.cumsum(
+        _accumulate(data.days, data.change_day, data.change_instrument, data.change_quantity, n_instruments),
+        axis=0
+    )
+    prices = _forward_fill(data.days, data.price_day, data.price_instrument, data.price_close, n_instruments)
+    fx = _forward_fill(data.days, data.fx_day, data.fx_currency, data.fx_rate, data.n_currencies)
+    fx[:, data.quote_currency] = 1.0
+
+    # Позиции в валюте котировки; без цены или курса - не оцениваются
+    held = np.abs(positions) > 1e-12
+    position_values = positions * prices * fx[:, data.instrument_currency]
+    unpriced = held & np.isnan(position_values)
+    value = np.where(held & ~unpriced, position_values, 0.0).sum(axis=1)
+
+    # Остатки по валютам; отрицательный остаток покрывается неявным пополнением
+    running = np.cumsum(
+        _accumulate(data.days, data.cash_day, data.cash_currency, data.cash_amount, data.n_currencies),
+        axis=0
+    )
+    implied = np.maximum.accumulate(np.maximum(-running, 0.0), axis=0)
+    cash = running + implied
+    external = _accumulate(
+        data.days, data.cash_day[data.cash_external], data.cash_currency[data.cash_external],
+        data.cash_amount[data.cash_external], data.n_currencies
+    ) + np.diff(implied, axis=0, prepend=0.0)
+
+    with np.errstate(invalid="ignore"):
+        cash_value = np.where(cash != 0, cash * fx, 0.0)
+        flow_value = np.where(external != 0, external * fx, 0.0)
+    base_rate = fx[:, data.base_currency]
+    values = (value + np.nan_to_num(cash_value).sum(axis=1)) / base_rate
+    flows = np.nan_to_num(flow_value).sum(axis=1) / base_rate
+
+    return ReplayResult(
+        portfolio_id=data.portfolio_id,
+        days=data.days,
+        values=values,
+        contributions=np.cumsum(flows),
+        flows=flows,
+        positions_count=held.sum(axis=1),
+        unpriced_days=int((unpriced.any(axis=1) | np.isnan(cash_value).any(axis=1)).sum()),
+    )
+
+
+def _day_numbers(moments: Iterable[datetime]) -> np.ndarray:
+    return np.array([m.date() for m in moments], dtype="datetime64[D]").astype(np.int64)
+
+
+def _day_start(day: int) -> datetime:
+    return datetime.combine(
+        date(1970, 1, 1) + timedelta(days=int(day)), day_time.min, tzinfo=timezone.utc
+    )
+
+
+class SnapshotBackfillService:
+    """Восстановление снимков портфелей до первого существующего снимка"""
+
+    def __init__(self,
+                 db: Session,
+                 max_workers: Optional[int] = None,
+                 quote_currency: str = settings.DEFAULT_CURRENCY,
+                 series_store: Optional[SeriesStore] = None):
+        self.db = db
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.quote_currency = quote_currency
+        self.series_store = series_store if series_store is not None else SeriesStore.from_settings()
+        self.portfolio_repo = PortfolioRepository(db)
+        self.transaction_repo = TransactionRepository(db)
+        self.price_repo = PriceRepository(db)
+
+    def backfill(self, portfolio_ids: Sequence[int], end_date: Optional[date] = None) -> BackfillReport:
+        """
+        Построить снимки портфелей с первой операции до дня перед первым
+        существующим снимком (или до end_date / вчерашнего дня) и
+        пересчитать накопленное состояние метрик.
+        """
+        started = time.perf_counter()
+        end_date = end_date or datetime.now(timezone.utc).date() - timedelta(days=1)
+        portfolios = snapshots = 0
+
+        inputs = (self._load(portfolio_id, end_date) for portfolio_id in portfolio_ids)
+        inputs = (data for data in inputs if data is not None)
+
+        if len(portfolio_ids) > 1 and self.max_workers > 1:
+            workers = min(self.max_workers, len(portfolio_ids))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending: Deque[Future] = deque()
+                for data in inputs:
+                    if len(pending) >= 2 * workers:
+                        snapshots += self._write(pending.popleft().result())
+                        portfolios += 1
+                    pending.append(executor.submit(replay, data))
+                while pending:
+                    snapshots += self._write(pending.popleft().result())
+                    portfolios += 1
+        else:
+            for data in inputs:
+                snapshots += self._write(replay(data))
+                portfolios += 1
+
+        report = BackfillReport(portfolios=portfolios, snapshots=snapshots, seconds=time.perf_counter() - started)
+        logger.info(
+            f"Восстановление истории: {portfolios} портфелей, {snapshots} снимков за {report.seconds:.2f} с"
+        )
+        return report
+
+    def _load(self, portfolio_id: int, end_date: date) -> Optional[ReplayInput]:
+        portfolio = self.db.get(Portfolio, portfolio_id)
+        if portfolio is None:
+            return None
+
+        first_snapshot = self.db.execute(
+            select(func.min(PortfolioSnapshot.snapshot_date))
+            .where(PortfolioSnapshot.portfolio_id == portfolio_id)
+        ).scalar()
+        if first_snapshot is not None:
+            end_date = min(end_date, first_snapshot.date() - timedelta(days=1))
+        end = datetime.combine(end_date, day_time.max, tzinfo=timezone.utc)
+
+        ledger = self.transaction_repo.get_cash_ledger(portfolio_id, end)
+        if not ledger:
+            return None
+        changes = self.transaction_repo.get_position_changes(portfolio_id, end)
+        start = datetime.combine(ledger[0][0].date(), day_time.min, tzinfo=timezone.utc)
+
+        instrument_ids = sorted({instrument_id for instrument_id, _, _ in changes})
+        instrument_index = {instrument_id: i for i, instrument_id in enumerate(instrument_ids)}
+        instrument_currencies = dict(self.db.execute(
+            select(Instrument.id, Instrument.currency).where(Instrument.id.in_(instrument_ids))
+        ).all()) if instrument_ids else {}
+
+        currencies = sorted(
+            {portfolio.base_currency, self.quote_currency}
+            | set(instrument_currencies.values())
+            | {currency for _, _, currency, *_ in ledger}
+        )
+        currency_index = {currency: i for i, currency in enumerate(currencies)}
+
+        prices = self.price_repo.get_closes(instrument_ids, [(start - PRICE_LOOKBACK, end)])
+        fx = self.price_repo.get_fx_closes(currencies, self.quote_currency, start - PRICE_LOOKBACK, end)
+
+        ledger_days = _day_numbers(ts for ts, *_ in ledger)
+        price_days = _day_numbers(ts for _, ts, _ in prices)
+        days = np.unique(np.concatenate([ledger_days, price_days]))
+        days = days[days >= ledger_days[0]]
+
+        signs = np.array([CASH_SIGNS.get(kind, 0) for _, kind, *_ in ledger], dtype=np.float64)
+        return ReplayInput(
+            portfolio_id=portfolio_id,
+            days=days,
+            instrument_currency=np.array(
+                [currency_index[instrument_currencies.get(i, portfolio.base_currency)] for i in instrument_ids],
+                dtype=np.int64
+            ),
+            base_currency=currency_index[portfolio.base_currency],
+            quote_currency=currency_index[self.quote_currency],
+            n_currencies=len(currencies),
+            change_day=_day_numbers(ts for _, ts, _ in changes),
+            change_instrument=np.array([instrument_index[i] for i, _, _ in changes], dtype=np.int64),
+            change_quantity=np.array([float(q) for _, _, q in changes], dtype=np.float64),
+            price_day=price_days,
+            price_instrument=np.array([instrument_index[i] for i, _, _ in prices], dtype=np.int64),
+            price_close=np.array([float(close) for _, _, close in prices], dtype=np.float64),
+            cash_day=ledger_days,
+            cash_currency=np.array([currency_index[currency] for _, _, currency, *_ in ledger], dtype=np.int64),
+            cash_amount=signs * np.array([float(gross) for *_, gross, _, _ in ledger])
+            - np.array([float(fee or 0) + float(tax or 0) for *_, fee, tax in ledger]),
+            cash_external=np.array([kind in EXTERNAL_TYPES for _, kind, *_ in ledger]),
+            fx_day=_day_numbers(ts for _, ts, _ in fx),
+            fx_currency=np.array([currency_index[currency] for currency, _, _ in fx], dtype=np.int64),
+            fx_rate=np.array([float(rate) for _, _, rate in fx], dtype=np.float64),
+        )
+
+    def _later_flows(self, portfolio_id: int, after: datetime) -> Dict[datetime, Decimal]:
+        """
+        Внешние потоки снимков портфеля позже after (снимки вне диапазона
+        восстановления): состояние метрик пересчитывается по всем снимкам.
+        """
+        # SQLite возвращает naive datetime
+        snapshot_dates = [
+            moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+            for moment in self.db.execute(
+                select(PortfolioSnapshot.snapshot_date)
+                .where(PortfolioSnapshot.portfolio_id == portfolio_id)
+                .order_by(PortfolioSnapshot.snapshot_date)
+            ).scalars()
+        ]
+        flows = snapshot_cash_flows(
+            snapshot_dates,
+            [(ts, amount) for _, ts, amount in self.transaction_repo.get_external_flows([portfolio_id])]
+        )
+        return {moment: amount for moment, amount in flows.items() if moment > after}
+
+    def _write(self, result: ReplayResult) -> int:
+        """Записать снимки и пересчитать состояние метрик; возвращает число снимков"""
+        rows: List[Dict[str, Any]] = []
+        flows: Dict[datetime, Any] = {}
+        for day, value, invested, flow, count in zip(
+            result.days, result.values, result.contributions, result.flows, result.positions_count
+        ):
+            if not np.isfinite(value) or value < 0:
+                continue
+            total_value = to_units(round(float(value), MONEY_DIGITS), MONEY_DIGITS)
+            total_cost = max(to_units(round(float(invested), MONEY_DIGITS), MONEY_DIGITS), 0)
+            snapshot_date = _day_start(day)
+            rows.append({
+                "portfolio_id": result.portfolio_id,
+                "snapshot_date": snapshot_date,
+                "total_value": from_units(total_value, MONEY_DIGITS),
+                "total_cost": from_units(total_cost, MONEY_DIGITS),
+                "total_pnl": from_units(total_value - total_cost, MONEY_DIGITS),
+                "positions_count": int(count),
+            })
+            if flow:
+                flows[snapshot_date] = from_units(to_units(round(float(flow), MONEY_DIGITS), MONEY_DIGITS), MONEY_DIGITS)
+
+        if result.unpriced_days:
+            logger.warning(
+                f"Портфель {result.portfolio_id}: {result.unpriced_days} дней с позициями без цены или курса"
+            )
+        self.portfolio_repo.upsert_snapshots(rows)
+        if rows:
+            flows.update(self._later_flows(result.portfolio_id, rows[-1]["snapshot_date"]))
+            PortfolioMetricStateService(self.db).rebuild(result.portfolio_id, flows)
+        self.db.commit()
+        if rows and self.series_store is not None:
+            self.series_store.append(result.portfolio_id, series_records(
+                [row["snapshot_date"] for row in rows],
+                [row["total_value"] for row in rows],
+                [row["total_cost"] for row in rows]
+            ))
+        return len(rows)
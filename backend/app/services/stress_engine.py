@@ -0,0 +1,301 @@
+"""
+Векторный Monte Carlo стресс-тестинг портфеля.
+
+Ковариационная матрица дневных доходностей оценивается по историческим
+ценам, сценарий задает сдвиг средних и преобразование ковариации на
+горизонте стресса. Шоки генерируются как mu + L @ z (L - множитель
+Холецкого) блоками ограниченного размера; для распределения доходности
+портфеля достаточно проекции z @ (L.T @ w), полная матрица шоков активов
+восстанавливается только для хвостовых путей (вклад в ES).
+
+Пути разбиты на блоки фиксированного размера SEED_BLOCK_PATHS, каждый со
+своим SeedSequence, порожденным от общего seed; блоки памяти и задачи
+процессов состоят из целых блоков путей. Поэтому результат воспроизводим
+и не зависит ни от числа процессов, ни от бюджета памяти max_chunk_bytes.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.logging import logger
+from app.services.analytics_engine import RiskCalculator
+
+
+STRESS_CHUNK_BYTES = 64 * 1024 * 1024       # Бюджет памяти на блок нормальных шоков
+SEED_BLOCK_PATHS = 1024                     # Путей на один SeedSequence (не зависит от бюджета памяти)
+DEFAULT_CONFIDENCE_LEVELS = (0.95, 0.99, 0.999)
+SCENARIO_TYPES = ("market_crash", "volatility_spike", "correlation_breakdown", "custom")
+
+
+@dataclass(frozen=True)
+class ScenarioParameters:
+    """Параметры распределения шоков сценария на горизонте стресса"""
+    mean: np.ndarray              # Сдвиг доходностей активов (n_assets,)
+    cholesky: np.ndarray          # Нижнетреугольный множитель ковариации (n_assets, n_assets)
+    tail_df: Optional[float]      # Степени свободы t-распределения (None - нормальное)
+
+
+def estimate_covariance(historical_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Оценить средние и ковариацию дневных доходностей по матрице цен.
+
+    Returns:
+        (средние доходности (n_assets,), ковариационная матрица (n_assets, n_assets))
+    """
+    prices = historical_data.to_numpy(dtype=np.float64)
+    if prices.shape[0] < 3:
+        raise ValueError("Недостаточно истории для оценки ковариации")
+
+    returns = prices[1:] / prices[:-1] - 1.0
+    returns = returns[np.isfinite(returns).all(axis=1)]
+    if returns.shape[0] < 2:
+        raise ValueError("Недостаточно истории для оценки ковариации")
+
+    mean = returns.mean(axis=0)
+    covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+    return mean, covariance
+
+
+def robust_cholesky(covariance: np.ndarray) -> np.ndarray:
+    """
+    Множитель Холецкого для ковариации, не обязательно строго положительно
+    определенной (вырожденная история, ручные корреляции сценария).
+    """
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh((covariance + covariance.T) / 2)
+        scale = max(float(np.abs(eigenvalues).max()), 1e-16)
+        eigenvalues = np.clip(eigenvalues, scale * 1e-10, None)
+        repaired = (eigenvectors * eigenvalues) @ eigenvectors.T
+        return np.linalg.cholesky(repaired)
+
+
+def scenario_parameters(scenario: Dict[str, Any],
+                        symbols: Sequence[str],
+                        mean: np.ndarray,
+                        covariance: np.ndarray) -> ScenarioParameters:
+    """
+    Построить распределение шоков для сценария.
+
+    Общие ключи сценария: horizon_days (по умолчанию 1), tail_df.
+    - market_crash: magnitude - сдвиг всех активов (по умолчанию -20%);
+    - volatility_spike: multiplier - множитель волатильности (по умолчанию 2);
+    - correlation_breakdown: correlation - целевая попарная корреляция
+      (по умолчанию 0, активы движутся независимо), strength - доля смешения;
+    - custom: asset_shocks - сдвиги по активам, multiplier - множитель волатильности.
+    """
+    scenario_type = scenario.get("type")
+    if scenario_type not in SCENARIO_TYPES:
+        raise ValueError(f"Неизвестный тип сценария: {scenario_type}")
+
+    horizon = float(scenario.get("horizon_days", 1))
+    shift = mean * horizon
+    cov = covariance * horizon
+
+    if scenario_type == "market_crash":
+        shift = shift + scenario.get("magnitude", -0.20)
+
+    elif scenario_type == "volatility_spike":
+        cov = cov * scenario.get("multiplier", 2.0) ** 2
+
+    elif scenario_type == "correlation_breakdown":
+        std = np.sqrt(np.diag(cov))
+        safe_std = np.where(std > 0, std, 1.0)
+        correlation = cov / np.outer(safe_std, safe_std)
+        target = np.full_like(correlation, scenario.get("correlation", 0.0))
+        np.fill_diagonal(target, 1.0)
+        strength = scenario.get("strength", 1.0)
+        correlation = (1 - strength) * correlation + strength * target
+        cov = correlation * np.outer(std, std)
+
+    elif scenario_type == "custom":
+        asset_shocks = scenario.get("asset_shocks", {})
+        shift = shift + np.array([asset_shocks.get(symbol, 0.0) for symbol in symbols])
+        cov = cov * scenario.get("multiplier", 1.0) ** 2
+
+    tail_df = scenario.get("tail_df")
+    if tail_df is not None and tail_df <= 2:
+        raise ValueError("Число степеней свободы tail_df должно быть больше 2")
+
+    return ScenarioParameters(
+        mean=np.asarray(shift, dtype=np.float64),
+        cholesky=robust_cholesky(cov),
+        tail_df=tail_df
+    )
+
+
+def _simulate_chunk(task: Tuple[List[Tuple[np.random.SeedSequence, int]], ScenarioParameters, np.ndarray, int]
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Смоделировать блок памяти из последовательных блоков путей
+    [(SeedSequence, число путей)].
+
+    Returns:
+        (доходности портфеля (n,), сумма шоков активов (n_assets,),
+         доходности tail_size худших путей, шоки активов на этих путях)
+    """
+    blocks, params, weights, tail_size = task
+    n_paths = sum(size for _, size in blocks)
+
+    z = np.empty((n_paths, weights.shape[0]))
+    offset = 0
+    for seed, size in blocks:
+        rng = np.random.default_rng(seed)
+        block = z[offset:offset + size]
+        block[:] = rng.standard_normal((size, weights.shape[0]))
+        if params.tail_df:
+            # Многомерное t: общий масштаб на путь, дисперсия сохраняется
+            df = params.tail_df
+            block *= np.sqrt((df - 2) / rng.chisquare(df, size))[:, None]
+        offset += size
+
+    # r = mu + L z  =>  w.r = w.mu + z.(L.T w), без умножения на всю матрицу
+    portfolio = z @ (params.cholesky.T @ weights)
+    portfolio += float(params.mean @ weights)
+    shock_sum = z.sum(axis=0) @ params.cholesky.T + n_paths * params.mean
+
+    tail_size = min(tail_size, n_paths)
+    tail = np.argpartition(portfolio, tail_size - 1)[:tail_size]
+    tail_shocks = z[tail] @ params.cholesky.T + params.mean
+    return portfolio, shock_sum, portfolio[tail], tail_shocks
+
+
+class MonteCarloStressEngine:
+    """Monte Carlo стресс-тест портфеля с коррелированными шоками"""
+
+    def __init__(self,
+                 n_paths: int = 100_000,
+                 seed: Optional[int] = None,
+                 confidence_levels: Iterable[float] = DEFAULT_CONFIDENCE_LEVELS,
+                 max_workers: int = 1,
+                 max_chunk_bytes: int = STRESS_CHUNK_BYTES):
+        if n_paths < 2:
+            raise ValueError("Число путей должно быть не меньше 2")
+
+        self.n_paths = int(n_paths)
+        self.seed = seed
+        self.confidence_levels = tuple(sorted(confidence_levels))
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_chunk_bytes = max_chunk_bytes
+
+    def run(self,
+            portfolio_weights: Dict[str, float],
+            historical_data: pd.DataFrame,
+            stress_scenarios: List[Dict]) -> Dict[str, Dict[str, Any]]:
+        """
+        Прогнать сценарии и вернуть распределение доходности портфеля по каждому.
+
+        VaR/CVaR считаются как в RiskCalculator: квантиль доходности
+        (отрицательное значение - убыток) и среднее хвоста за ним.
+        Активы портфеля без истории получают нулевой шок.
+        """
+        symbols = [symbol for symbol in portfolio_weights if symbol in historical_data.columns]
+        if not symbols:
+            raise ValueError("Нет исторических данных по активам портфеля")
+
+        mean, covariance = estimate_covariance(historical_data[symbols])
+        weights = np.array([portfolio_weights[symbol] for symbol in symbols], dtype=np.float64)
+
+        executor = None
+        if self.max_workers > 1:
+            # Один пул на все сценарии: старт процессов не повторяется
+            executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            return self._run_scenarios(portfolio_weights, symbols, weights, mean, covariance,
+                                       stress_scenarios, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _run_scenarios(self,
+                       portfolio_weights: Dict[str, float],
+                       symbols: List[str],
+                       weights: np.ndarray,
+                       mean: np.ndarray,
+                       covariance: np.ndarray,
+                       stress_scenarios: List[Dict],
+                       executor: Optional[ProcessPoolExecutor]) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        # Отдельная ветка SeedSequence на сценарий: добавление сценария не меняет остальные
+        scenario_seeds = np.random.SeedSequence(self.seed).spawn(len(stress_scenarios))
+        for scenario, scenario_seed in zip(stress_scenarios, scenario_seeds):
+            params = scenario_parameters(scenario, symbols, mean, covariance)
+            portfolio, shock_sum, tail_returns, tail_shocks = self._simulate(
+                params, weights, scenario_seed, executor
+            )
+
+            mean_shocks = shock_sum / self.n_paths
+            individual = dict.fromkeys(portfolio_weights, 0.0)
+            individual.update(zip(symbols, mean_shocks.tolist()))
+            contributions = dict.fromkeys(portfolio_weights, 0.0)
+            contributions.update(zip(symbols, (tail_shocks.mean(axis=0) * weights).tolist()))
+
+            results[scenario["name"]] = {
+                "portfolio_impact": float(portfolio.mean()),
+                "individual_impacts": individual,
+                "var": {level: RiskCalculator.calculate_var(portfolio, level)
+                        for level in self.confidence_levels},
+                "cvar": {level: RiskCalculator.calculate_cvar(portfolio, level)
+                         for level in self.confidence_levels},
+                "es_contributions": contributions,
+                "worst_return": float(tail_returns.min()),
+                "paths": self.n_paths,
+                "scenario_description": scenario.get("description", "")
+            }
+
+        return results
+
+    def _simulate(self,
+                  params: ScenarioParameters,
+                  weights: np.ndarray,
+                  seed: np.random.SeedSequence,
+                  executor: Optional[ProcessPoolExecutor] = None
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Прогнать пути блоками (последовательно или в пуле процессов) и собрать результат"""
+        n_assets = weights.shape[0]
+        block_sizes = [SEED_BLOCK_PATHS] * (self.n_paths // SEED_BLOCK_PATHS)
+        if self.n_paths % SEED_BLOCK_PATHS:
+            block_sizes.append(self.n_paths % SEED_BLOCK_PATHS)
+        blocks = list(zip(seed.spawn(len(block_sizes)), block_sizes))
+
+        # Блок памяти - целое число блоков путей (не меньше одного)
+        blocks_per_chunk = max(1, self.max_chunk_bytes // (n_assets * 8 * SEED_BLOCK_PATHS))
+
+        # Худшие пути для вклада в ES на минимальном уровне доверия
+        tail_size = max(1, int(np.ceil(self.n_paths * (1 - self.confidence_levels[0]))))
+        tasks = [
+            (blocks[start:start + blocks_per_chunk], params, weights, tail_size)
+            for start in range(0, len(blocks), blocks_per_chunk)
+        ]
+
+        if executor is None or len(tasks) == 1:
+            return self._merge(map(_simulate_chunk, tasks), n_assets, tail_size)
+
+        merged = self._merge(executor.map(_simulate_chunk, tasks), n_assets, tail_size)
+        logger.info(f"Стресс-тест: {self.n_paths} путей, {len(tasks)} блоков на {self.max_workers} процессах")
+        return merged
+
+    @staticmethod
+    def _merge(chunks, n_assets: int, tail_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Склеить блоки, удерживая в памяти только tail_size худших путей"""
+        portfolio_parts = []
+        shock_sum = np.zeros(n_assets)
+        tail_returns = np.empty(0)
+        tail_shocks = np.empty((0, n_assets))
+
+        for portfolio, chunk_sum, chunk_tail_returns, chunk_tail_shocks in chunks:
+            portfolio_parts.append(portfolio)
+            shock_sum += chunk_sum
+            tail_returns = np.concatenate([tail_returns, chunk_tail_returns])
+            tail_shocks = np.concatenate([tail_shocks, chunk_tail_shocks])
+            if tail_returns.shape[0] > tail_size:
+                keep = np.argpartition(tail_returns, tail_size - 1)[:tail_size]
+                tail_returns, tail_shocks = tail_returns[keep], tail_shocks[keep]
+
+        return np.concatenate(portfolio_parts), shock_sum, tail_returns, tail_shocks
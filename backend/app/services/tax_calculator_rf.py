@@ -8,12 +8,22 @@
 - Зачет убытков между операциями
 """
 
+from collections import deque
 from datetime import date, datetime
 from decimal import Decimal
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+from app.core.money import (
+    MONEY_DIGITS,
+    PRICE_DIGITS,
+    QUANTITY_DIGITS,
+    from_units,
+    mul_div,
+    to_units,
+    value_units,
+)
 from app.models.transaction import Transaction
 from app.models.portfolio import Portfolio
 
@@ -207,62 +217,64 @@ class TaxCalculatorRF:
             return SecurityType.STOCK
     
     def _calculate_stock_pnl(self, transactions: List[Transaction]) -> Decimal:
-        """Рассчитать прибыль/убыток по акциям методом FIFO."""
-        positions = {}
-        total_pnl = Decimal("0")
+        """
+        Рассчитать прибыль/убыток по акциям методом FIFO.
+        
+        Расчет идет в целых единицах app.core.money (количества 1e-8,
+        суммы 1e-4), в Decimal переводится только итог. Выручка и комиссии
+        делятся между лотами по накопленному закрытому количеству, поэтому
+        доли в сумме точно равны исходным значениям.
+        """
+        positions: Dict[str, deque] = {}
+        total_pnl = 0
         
         for transaction in sorted(transactions, key=lambda x: x.date):
-            symbol = transaction.symbol
-            
-            if symbol not in positions:
-                positions[symbol] = []
+            lots = positions.setdefault(transaction.symbol, deque())
             
             if transaction.type == "buy":
-                # Покупка - добавляем в позицию
-                positions[symbol].append({
-                    "quantity": transaction.quantity,
-                    "price": transaction.price,
-                    "date": transaction.date,
-                    "commission": transaction.commission or Decimal("0")
-                })
+                # Покупка - добавляем лот [количество, цена, остаток комиссии]
+                lots.append([
+                    to_units(transaction.quantity, QUANTITY_DIGITS),
+                    to_units(transaction.price, PRICE_DIGITS),
+                    to_units(transaction.commission or Decimal("0"), MONEY_DIGITS)
+                ])
             
             elif transaction.type == "sell":
-                # Продажа - закрываем позиции FIFO
-                remaining_qty = transaction.quantity
-                sell_revenue = transaction.quantity * transaction.price
-                sell_commission = transaction.commission or Decimal("0")
+                # Продажа - закрываем лоты FIFO
+                sell_qty = to_units(transaction.quantity, QUANTITY_DIGITS)
+                if sell_qty <= 0:
+                    continue
+                sell_revenue = value_units(sell_qty, to_units(transaction.price, PRICE_DIGITS))
+                sell_commission = to_units(transaction.commission or Decimal("0"), MONEY_DIGITS)
                 
-                while remaining_qty > 0 and positions[symbol]:
-                    position = positions[symbol][0]
+                closed_total = 0
+                allocated_revenue = allocated_commission = 0
+                while closed_total < sell_qty and lots:
+                    lot = lots[0]
+                    closed_qty = min(lot[0], sell_qty - closed_total)
+                    closed_total += closed_qty
                     
-                    if position["quantity"] <= remaining_qty:
-                        # Закрываем позицию полностью
-                        closed_qty = position["quantity"]
-                        buy_cost = closed_qty * position["price"] + position["commission"]
-                        sell_part = (closed_qty / transaction.quantity) * sell_revenue
-                        sell_comm_part = (closed_qty / transaction.quantity) * sell_commission
-                        
-                        pnl = sell_part - buy_cost - sell_comm_part
-                        total_pnl += pnl
-                        
-                        remaining_qty -= closed_qty
-                        positions[symbol].pop(0)
+                    # Доли выручки и комиссии продажи по накопленному количеству
+                    revenue = mul_div(closed_total, sell_revenue, sell_qty)
+                    commission = mul_div(closed_total, sell_commission, sell_qty)
+                    sell_part = revenue - allocated_revenue
+                    sell_comm_part = commission - allocated_commission
+                    allocated_revenue, allocated_commission = revenue, commission
+                    
+                    buy_cost = value_units(closed_qty, lot[1])
+                    if closed_qty == lot[0]:
+                        # Закрываем лот полностью
+                        buy_comm_part = lot[2]
+                        lots.popleft()
                     else:
-                        # Частично закрываем позицию
-                        closed_qty = remaining_qty
-                        buy_cost = closed_qty * position["price"]
-                        buy_comm_part = (closed_qty / position["quantity"]) * position["commission"]
-                        sell_part = (closed_qty / transaction.quantity) * sell_revenue
-                        sell_comm_part = (closed_qty / transaction.quantity) * sell_commission
-                        
-                        pnl = sell_part - buy_cost - buy_comm_part - sell_comm_part
-                        total_pnl += pnl
-                        
-                        position["quantity"] -= closed_qty
-                        position["commission"] -= buy_comm_part
-                        remaining_qty = Decimal("0")
-        
-        return total_pnl
+                        # Частично закрываем лот
+                        buy_comm_part = mul_div(closed_qty, lot[2], lot[0])
+                        lot[0] -= closed_qty
+                        lot[2] -= buy_comm_part
+                    
+                    total_pnl += sell_part - buy_cost - buy_comm_part - sell_comm_part
+        
+        return from_units(total_pnl, MONEY_DIGITS)
     
     def _calculate_bond_pnl(self, transactions: List[Transaction]) -> Decimal:
         """Рассчитать прибыль/убыток по облигациям."""
@@ -0,0 +1,302 @@
+"""
+Ежедневная оценка всех портфелей и запись снимков PortfolioSnapshot.
+
+Стоимость считается set-based запросами, а не по портфелю: позиции всех
+счетов (holdings + accounts) соединяются с последней ценой инструмента и
+курсами валют (валютные инструменты) - за текущий день из last_prices,
+за прошлые даты из истории prices, - агрегируются до (портфель,
+инструмент) в базовой валюте портфеля; второй запрос дает денежные
+остатки счетов. Строки читаются потоком в порядке портфелей, итоги,
+распределение по классам активов и топ-10 позиций собираются в целых
+единицах app.core.money, снимки записываются пачками
+INSERT ... ON CONFLICT (portfolio_id, snapshot_date).
+
+Портфель, в котором хотя бы у одной позиции нет цены или курса, в этот
+день не получает снимка: неполная стоимость попала бы в состояние метрик
+как настоящая доходность (append-only TWR после нулевого снимка остался
+бы нулевым навсегда). Накопленное состояние метрик (metric_state)
+дополняется снимками дня с внешними потоками дня; метрики по горизонтам пересчитывает
+MetricsMaterializer.
+Если включено хранилище рядов (SERIES_STORE_DIR), стоимость дня
+дописывается и в него.
+"""
+
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from datetime import time as day_time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.money import MONEY_DIGITS, QUANTITY_DIGITS, from_units, to_units
+from app.models.account import Account
+from app.models.holding import Holding
+from app.models.instrument import Instrument
+from app.models.portfolio import Portfolio
+from app.repositories.portfolio import PortfolioRepository
+from app.repositories.price import PriceRepository
+from app.services.metric_state import PortfolioMetricStateService
+from app.services.series_store import SeriesStore, series_records
+
+
+TOP_POSITIONS = 10
+DEFAULT_BATCH_SIZE = 1000
+CASH_ALLOCATION = "cash"
+
+
+@dataclass
+class ValuationReport:
+    """Итог ежедневной оценки"""
+    snapshot_date: datetime
+    portfolios: int
+    positions: int
+    unpriced_positions: int
+    seconds: float
+    skipped_portfolios: int = 0
+
+
+@dataclass
+class _PortfolioValuation:
+    """Накопитель оценки одного портфеля (суммы в единицах 1e-4)"""
+    portfolio_id: int
+    value: int = 0
+    cost: int = 0
+    cash: int = 0
+    unpriced: int = 0
+    positions: List[Tuple[int, Dict[str, Any]]] = field(default_factory=list)
+    allocation: Dict[str, int] = field(default_factory=dict)
+
+    def add_position(self, row) -> None:
+        value = to_units(row.value, MONEY_DIGITS)
+        self.value += value
+        self.cost += to_units(row.cost, MONEY_DIGITS)
+        self.allocation[row.instrument_type.value] = self.allocation.get(row.instrument_type.value, 0) + value
+        self.positions.append((value, {
+            "instrument_id": row.instrument_id,
+            "ticker": row.ticker,
+            "name": row.name,
+            "quantity": float(from_units(to_units(row.quantity, QUANTITY_DIGITS), QUANTITY_DIGITS)),
+            "value": float(from_units(value, MONEY_DIGITS)),
+        }))
+
+    def snapshot(self, snapshot_date: datetime) -> Dict[str, Any]:
+        total_value = self.value + self.cash
+        total_cost = self.cost + self.cash
+        allocation = dict(self.allocation)
+        if self.cash:
+            allocation[CASH_ALLOCATION] = self.cash
+
+        top = sorted(self.positions, key=lambda item: item[0], reverse=True)[:TOP_POSITIONS]
+        for value, position in top:
+            position["weight"] = round(value / total_value * 100, 4) if total_value else 0.0
+
+        return {
+            "portfolio_id": self.portfolio_id,
+            "snapshot_date": snapshot_date,
+            "total_value": from_units(total_value, MONEY_DIGITS),
+            "total_cost": from_units(total_cost, MONEY_DIGITS),
+            "total_pnl": from_units(total_value - total_cost, MONEY_DIGITS),
+            "positions_count": len(self.positions),
+            "asset_allocation": {
+                key: round(value / total_value * 100, 2) if total_value else 0.0
+                for key, value in allocation.items()
+            },
+            "top_positions": [position for _, position in top],
+        }
+
+
+class DailyValuationService:
+    """Оценка всех активных портфелей на дату"""
+
+    def __init__(self,
+                 db: Session,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 quote_currency: str = settings.DEFAULT_CURRENCY,
+                 series_store: Optional[SeriesStore] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.quote_currency = quote_currency
+        self.series_store = series_store if series_store is not None else SeriesStore.from_settings()
+        self.portfolio_repo = PortfolioRepository(db)
+        self.price_repo = PriceRepository(db)
+
+    def run(self, valuation_date: Optional[date] = None) -> ValuationReport:
+        """
+        Оценить портфели по ценам на конец valuation_date и сохранить
+        снимки. Повторный запуск за ту же дату перезаписывает снимки.
+        """
+        started = time.perf_counter()
+        valuation_date = valuation_date or datetime.now(timezone.utc).date()
+        snapshot_date = datetime.combine(valuation_date, day_time.min, tzinfo=timezone.utc)
+        as_of = datetime.combine(valuation_date, day_time.max, tzinfo=timezone.utc)
+
+        # Текущий день оценивается по last_prices, прошлые даты - по истории на конец дня
+        price_as_of = None if valuation_date >= datetime.now(timezone.utc).date() else as_of
+        
+        cash = self._cash_balances(price_as_of)
+        batch: List[Dict[str, Any]] = []
+        totals: List[Tuple[int, Any, Any]] = []
+        portfolios = positions = unpriced = skipped = 0
+
+        for valuation in self._valuations(price_as_of, cash):
+            portfolios += 1
+            positions += len(valuation.positions)
+            unpriced += valuation.unpriced
+            if valuation.unpriced:
+                logger.warning(
+                    f"Портфель {valuation.portfolio_id}: {valuation.unpriced} позиций без цены или курса, снимок пропущен"
+                )
+                skipped += 1
+                continue
+            snapshot = valuation.snapshot(snapshot_date)
+            if snapshot["total_value"] < 0:
+                logger.warning(f"Отрицательная стоимость портфеля {valuation.portfolio_id}, снимок пропущен")
+                continue
+            batch.append(snapshot)
+            totals.append((valuation.portfolio_id, snapshot["total_value"], snapshot["total_cost"]))
+            if len(batch) >= self.batch_size:
+                self.portfolio_repo.upsert_snapshots(batch, self.batch_size)
+                batch = []
+
+        self.portfolio_repo.upsert_snapshots(batch, self.batch_size)
+        self.db.commit()
+
+        PortfolioMetricStateService(self.db).append_snapshots(
+            snapshot_date, [(portfolio_id, total_value) for portfolio_id, total_value, _ in totals]
+        )
+        self.db.commit()
+        
+        if self.series_store is not None:
+            for portfolio_id, total_value, total_cost in totals:
+                self.series_store.append(portfolio_id, series_records([valuation_date], [total_value], [total_cost]))
+
+        report = ValuationReport(
+            snapshot_date=snapshot_date,
+            portfolios=portfolios,
+            positions=positions,
+            unpriced_positions=unpriced,
+            seconds=time.perf_counter() - started,
+            skipped_portfolios=skipped
+        )
+        logger.info(
+            f"Оценка портфелей на {valuation_date}: {portfolios} портфелей, {positions} позиций "
+            f"({unpriced} без цены или курса, пропущено снимков: {skipped}) за {report.seconds:.2f} с"
+        )
+        return report
+
+    def _valuations(self, as_of: Optional[datetime], cash: Dict[int, int]) -> Iterator[_PortfolioValuation]:
+        """Оценки портфелей по потоку строк позиций, упорядоченному по портфелю"""
+        current: Optional[_PortfolioValuation] = None
+
+        for row in self.db.execute(self._positions_query(as_of)).yield_per(self.batch_size):
+            if current is None or current.portfolio_id != row.portfolio_id:
+                if current is not None:
+                    yield current
+                current = self._start(row.portfolio_id, cash)
+            if row.value is None:
+                current.unpriced += 1
+            else:
+                current.add_position(row)
+
+        if current is not None:
+            yield current
+
+        # Портфели только с денежным остатком
+        for portfolio_id in sorted(cash):
+            yield self._start(portfolio_id, cash)
+
+    @staticmethod
+    def _start(portfolio_id: int, cash: Dict[int, int]) -> _PortfolioValuation:
+        return _PortfolioValuation(
+            portfolio_id=portfolio_id, cash=cash.pop(portfolio_id, 0)
+        )
+
+    def _positions_query(self, as_of: Optional[datetime]):
+        """
+        Позиции всех активных портфелей в базовой валюте портфеля:
+        (portfolio_id, instrument_id, ticker, name, instrument_type, quantity, value, cost).
+        Позиция без цены или курса возвращается с value = NULL.
+        Без as_of - по текущим ценам last_prices.
+        """
+        held = select(Holding.instrument_id).where(Holding.quantity > 0)
+        if as_of is None:
+            latest = self.price_repo.last_price_subquery(held)
+        else:
+            latest = self.price_repo.latest_price_subquery(as_of, held)
+        fx = self.price_repo.fx_rate_cte(self.quote_currency, as_of)
+        fx_price, fx_cost, fx_base = fx.alias("fx_price"), fx.alias("fx_cost"), fx.alias("fx_base")
+
+        return (
+            select(
+                Account.portfolio_id,
+                Holding.instrument_id,
+                Instrument.ticker,
+                Instrument.name,
+                Instrument.instrument_type,
+                func.sum(Holding.quantity).label("quantity"),
+                func.sum(Holding.quantity * latest.c.close * fx_price.c.rate / fx_base.c.rate).label("value"),
+                func.sum(Holding.quantity * Holding.avg_price * fx_cost.c.rate / fx_base.c.rate).label("cost"),
+            )
+            .join(Account, Account.id == Holding.account_id)
+            .join(Portfolio, Portfolio.id == Account.portfolio_id)
+            .join(Instrument, Instrument.id == Holding.instrument_id)
+            .outerjoin(latest, latest.c.instrument_id == Holding.instrument_id)
+            .outerjoin(fx_price, fx_price.c.currency == latest.c.currency)
+            .outerjoin(fx_cost, fx_cost.c.currency == Holding.currency)
+            .outerjoin(fx_base, fx_base.c.currency == Portfolio.base_currency)
+            .where(
+                and_(
+                    Holding.quantity > 0,
+                    Account.is_active == True,
+                    Portfolio.is_active == True
+                )
+            )
+            .group_by(
+                Account.portfolio_id, Holding.instrument_id,
+                Instrument.ticker, Instrument.name, Instrument.instrument_type
+            )
+            .order_by(Account.portfolio_id)
+        )
+
+    def _cash_balances(self, as_of: Optional[datetime]) -> Dict[int, int]:
+        """Денежные остатки счетов по портфелям в базовой валюте (единицы 1e-4)"""
+        fx = self.price_repo.fx_rate_cte(self.quote_currency, as_of)
+        fx_cash, fx_base = fx.alias("fx_cash"), fx.alias("fx_base")
+
+        stmt = (
+            select(
+                Account.portfolio_id,
+                func.sum(Account.cash_balance * fx_cash.c.rate / fx_base.c.rate)
+            )
+            .join(Portfolio, Portfolio.id == Account.portfolio_id)
+            .join(fx_cash, fx_cash.c.currency == Account.currency)
+            .join(fx_base, fx_base.c.currency == Portfolio.base_currency)
+            .where(
+                and_(
+                    Account.cash_balance.is_not(None),
+                    Account.cash_balance != 0,
+                    Account.is_active == True,
+                    Portfolio.is_active == True
+                )
+            )
+            .group_by(Account.portfolio_id)
+        )
+        return {
+            portfolio_id: to_units(amount, MONEY_DIGITS)
+            for portfolio_id, amount in self.db.execute(stmt)
+            if amount is not None
+        }
+
+
+if __name__ == "__main__":
+    from app.core.database_sync import SessionLocal
+
+    session = SessionLocal()
+    try:
+        DailyValuationService(session).run()
+    finally:
+        session.close()
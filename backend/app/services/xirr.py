@@ -0,0 +1,190 @@
+"""
+Расчет XIRR (внутренней нормы доходности для нерегулярных потоков).
+
+Решается уравнение NPV(r) = Σ a_i (1 + r)^(-t_i) = 0, где t_i - доля года
+от первого потока. Доли года считаются один раз, NPV и его производная
+dNPV/dr = -Σ t_i a_i (1 + r)^(-t_i - 1) - векторно на массивах NumPy.
+Основной метод - Ньютон; если он не сошелся, корень ищется методом Брента
+на найденном интервале со сменой знака. Пакетный режим решает Ньютоном
+сразу матрицу потоков тысяч портфелей, на скалярный путь уходят только
+несошедшиеся строки.
+"""
+
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy.optimize import brentq
+
+
+DAYS_IN_YEAR = 365.25
+DEFAULT_GUESS = 0.1
+NEWTON_TOLERANCE = 1e-10
+NEWTON_MAX_ITERATIONS = 50
+MIN_RATE = -0.999999          # Ставка не может быть -100% и ниже
+
+# Узлы для поиска интервала со сменой знака NPV
+_BRACKET_GRID = np.concatenate([
+    -1 + np.logspace(-6, 0, 25)[:-1],
+    np.linspace(0, 1, 11),
+    np.logspace(0.1, 4, 25),
+])
+
+DateLike = Union[date, datetime, np.datetime64]
+
+
+def year_fractions(dates: Sequence[DateLike], base: Optional[DateLike] = None) -> np.ndarray:
+    """Доли года от base (по умолчанию - самой ранней даты) до каждой даты"""
+    days = np.array(
+        [d.date() if isinstance(d, datetime) else d for d in dates], dtype="datetime64[D]"
+    ).astype(np.int64)
+    origin = days.min() if base is None else np.datetime64(
+        base.date() if isinstance(base, datetime) else base, "D"
+    ).astype(np.int64)
+    return (days - origin) / DAYS_IN_YEAR
+
+
+def xnpv(rate: float, amounts: np.ndarray, times: np.ndarray) -> float:
+    return float(np.sum(amounts * np.power(1.0 + rate, -times)))
+
+
+def _has_root(amounts: np.ndarray) -> bool:
+    """Корень возможен только при потоках обоих знаков"""
+    return bool((amounts > 0).any() and (amounts < 0).any())
+
+
+def _newton(amounts: np.ndarray, times: np.ndarray, guess: float) -> Optional[float]:
+    rate = guess
+    for _ in range(NEWTON_MAX_ITERATIONS):
+        discount = np.power(1.0 + rate, -times)
+        value = np.sum(amounts * discount)
+        derivative = -np.sum(times * amounts * discount) / (1.0 + rate)
+        if derivative == 0 or not np.isfinite(derivative):
+            return None
+        step = value / derivative
+        new_rate = rate - step
+        # Шаг за -100% укорачивается: ставка остается в области определения
+        if new_rate <= MIN_RATE:
+            new_rate = (rate + MIN_RATE) / 2
+        if abs(new_rate - rate) < NEWTON_TOLERANCE * max(1.0, abs(rate)):
+            return new_rate if np.isfinite(new_rate) else None
+        rate = new_rate
+    return None
+
+
+def _brent(amounts: np.ndarray, times: np.ndarray) -> Optional[float]:
+    """Брент на первом интервале сетки, где NPV меняет знак"""
+    with np.errstate(over="ignore", invalid="ignore"):
+        values = (amounts[None, :] * np.power(1.0 + _BRACKET_GRID[:, None], -times[None, :])).sum(axis=1)
+    finite = np.isfinite(values)
+    signs = np.sign(values)
+    changes = np.nonzero(finite[:-1] & finite[1:] & (signs[:-1] * signs[1:] < 0))[0]
+    if changes.size == 0:
+        exact = np.nonzero(finite & (values == 0))[0]
+        return float(_BRACKET_GRID[exact[0]]) if exact.size else None
+
+    i = changes[0]
+    return float(brentq(xnpv, _BRACKET_GRID[i], _BRACKET_GRID[i + 1], args=(amounts, times), xtol=1e-12))
+
+
+def xirr(amounts: Sequence[float],
+         dates: Optional[Sequence[DateLike]] = None,
+         times: Optional[np.ndarray] = None,
+         guess: float = DEFAULT_GUESS) -> Optional[float]:
+    """
+    XIRR как доля в год.
+
+    Args:
+        amounts: потоки со знаком (вложения отрицательные, получения положительные)
+        dates: даты потоков, либо times - готовые доли года
+
+    Returns:
+        Ставка или None, если корня нет (потоки одного знака) или он не найден
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    times = year_fractions(dates) if times is None else np.asarray(times, dtype=np.float64)
+    if amounts.shape[0] < 2 or not _has_root(amounts):
+        return None
+
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        rate = _newton(amounts, times, guess)
+    if rate is None or abs(xnpv(rate, amounts, times)) > 1e-6 * np.abs(amounts).sum():
+        rate = _brent(amounts, times)
+    return rate
+
+
+def pack_cash_flows(flows: Iterable[Tuple[Sequence[DateLike], Sequence[float]]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Упаковать потоки нескольких портфелей в матрицы (P, K) с нулевым
+    дополнением: нулевые потоки не меняют NPV.
+    """
+    flows = list(flows)
+    width = max((len(amounts) for _, amounts in flows), default=0)
+    amounts = np.zeros((len(flows), width))
+    times = np.zeros((len(flows), width))
+    for i, (dates, values) in enumerate(flows):
+        if len(values):
+            amounts[i, :len(values)] = np.asarray(values, dtype=np.float64)
+            times[i, :len(values)] = year_fractions(dates)
+    return amounts, times
+
+
+def xirr_batch(amounts: np.ndarray,
+               times: np.ndarray,
+               guess: float = DEFAULT_GUESS) -> np.ndarray:
+    """
+    XIRR для матрицы потоков (P, K) одним векторным Ньютоном.
+
+    Returns:
+        (P,) ставки; NaN, если корня нет
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    n = amounts.shape[0]
+    rates = np.full(n, guess)
+    result = np.full(n, np.nan)
+
+    solvable = ((amounts > 0).any(axis=1) & (amounts < 0).any(axis=1))
+    active = solvable.copy()
+    scale = np.abs(amounts).sum(axis=1)
+
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        for _ in range(NEWTON_MAX_ITERATIONS):
+            if not active.any():
+                break
+            index = np.nonzero(active)[0]
+            a, t, r = amounts[index], times[index], rates[index]
+            discount = np.power(1.0 + r[:, None], -t)
+            value = (a * discount).sum(axis=1)
+            derivative = -(t * a * discount).sum(axis=1) / (1.0 + r)
+
+            new_rate = r - value / derivative
+            new_rate = np.where(new_rate <= MIN_RATE, (r + MIN_RATE) / 2, new_rate)
+            failed = ~np.isfinite(new_rate) | (derivative == 0)
+            converged = ~failed & (np.abs(new_rate - r) < NEWTON_TOLERANCE * np.maximum(1.0, np.abs(r)))
+
+            rates[index] = np.where(failed, r, new_rate)
+            done = index[converged]
+            result[done] = rates[done]
+            active[index[converged | failed]] = False
+
+        # Проверка корня: NPV должен быть близок к нулю
+        found = np.nonzero(np.isfinite(result))[0]
+        residual = np.abs((amounts[found] * np.power(1.0 + result[found][:, None], -times[found])).sum(axis=1))
+        result[found[residual > 1e-6 * scale[found]]] = np.nan
+
+    # Несошедшиеся строки - скалярный путь с методом Брента
+    for i in np.nonzero(solvable & ~np.isfinite(result))[0]:
+        rate = _brent(amounts[i], times[i])
+        if rate is not None:
+            result[i] = rate
+
+    return result
+
+
+def xirr_many(flows: Iterable[Tuple[Sequence[DateLike], Sequence[float]]]) -> List[Optional[float]]:
+    """XIRR для списка (даты, потоки) в пакетном режиме"""
+    amounts, times = pack_cash_flows(flows)
+    if amounts.shape[0] == 0:
+        return []
+    return [None if np.isnan(rate) else float(rate) for rate in xirr_batch(amounts, times)]
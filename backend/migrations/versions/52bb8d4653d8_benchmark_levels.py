@@ -0,0 +1,40 @@
+"""Benchmark levels
+
+Revision ID: 52bb8d4653d8
+Revises: c3e81f4d9a60
+Create Date: 2026-10-16 19:00:00.000000+03:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '52bb8d4653d8'
+down_revision: Union[str, Sequence[str], None] = 'c3e81f4d9a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Значения индексов-бенчмарков по датам
+    op.create_table(
+        'benchmark_levels',
+        sa.Column('benchmark_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.DateTime(), nullable=False),
+        sa.Column('level', sa.Numeric(20, 8), nullable=False),
+        sa.ForeignKeyConstraint(['benchmark_id'], ['benchmarks.id'], name='fk_benchmark_levels_benchmark_id_benchmarks'),
+        sa.PrimaryKeyConstraint('benchmark_id', 'ts', name='pk_benchmark_levels'),
+    )
+    op.create_index('ix_benchmark_levels_ts', 'benchmark_levels', ['ts'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    op.drop_index('ix_benchmark_levels_ts', table_name='benchmark_levels')
+    op.drop_table('benchmark_levels')
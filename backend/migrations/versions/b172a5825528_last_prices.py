@@ -0,0 +1,56 @@
+"""Last prices
+
+Revision ID: b172a5825528
+Revises: abc0c0d12a15
+Create Date: 2026-10-16 12:00:00.000000+03:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b172a5825528'
+down_revision: Union[str, Sequence[str], None] = 'abc0c0d12a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Последняя цена каждого инструмента (обновляется при загрузке цен)
+    op.create_table(
+        'last_prices',
+        sa.Column('instrument_id', sa.Integer(), sa.ForeignKey('instruments.id'), primary_key=True),
+        sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('close', sa.DECIMAL(20, 8), nullable=False),
+        sa.Column('currency', sa.String(3), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    # Первичное заполнение из истории: иначе до следующей загрузки цен
+    # читатели last_prices не видят цену ни одного инструмента
+    if not sa.inspect(op.get_bind()).has_table('prices'):
+        return
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "INSERT INTO last_prices (instrument_id, ts, close, currency) "
+            "SELECT DISTINCT ON (instrument_id) instrument_id, ts, close, currency "
+            "FROM prices ORDER BY instrument_id, ts DESC"
+        )
+    else:
+        op.execute(
+            "INSERT INTO last_prices (instrument_id, ts, close, currency) "
+            "SELECT p.instrument_id, p.ts, p.close, p.currency FROM prices p "
+            "JOIN (SELECT instrument_id, max(ts) AS ts FROM prices GROUP BY instrument_id) latest "
+            "ON latest.instrument_id = p.instrument_id AND latest.ts = p.ts"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    op.drop_table('last_prices')
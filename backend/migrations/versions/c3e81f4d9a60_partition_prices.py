@@ -0,0 +1,116 @@
+"""Partition prices by month
+
+Revision ID: c3e81f4d9a60
+Revises: b172a5825528
+Create Date: 2026-10-16 18:00:00.000000+03:00
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e81f4d9a60'
+down_revision: Union[str, Sequence[str], None] = 'b172a5825528'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции создаются на год вперед, дальше - при загрузке цен
+MONTHS_AHEAD = 12
+
+
+def _next_month(year: int, month: int):
+    return year + month // 12, month % 12 + 1
+
+
+def _create_prices(partitioned: bool) -> None:
+    op.execute(
+        "CREATE TABLE prices ("
+        "instrument_id INTEGER NOT NULL, "
+        "ts TIMESTAMP WITH TIME ZONE NOT NULL, "
+        "close NUMERIC(20, 8) NOT NULL, "
+        "currency VARCHAR(3) NOT NULL, "
+        "source VARCHAR(50) NOT NULL, "
+        "CONSTRAINT pk_prices PRIMARY KEY (instrument_id, ts), "
+        "CONSTRAINT fk_prices_instrument_id_instruments FOREIGN KEY (instrument_id) REFERENCES instruments (id))"
+        + (" PARTITION BY RANGE (ts)" if partitioned else "")
+    )
+
+
+def _rename_existing() -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('prices'):
+        return False
+    # Имена ограничений освобождаются для новой таблицы
+    constraints = [inspector.get_pk_constraint('prices')['name']]
+    constraints += [fk['name'] for fk in inspector.get_foreign_keys('prices')]
+    op.execute("ALTER TABLE prices RENAME TO prices_legacy")
+    for name in filter(None, constraints):
+        op.execute(f"ALTER TABLE prices_legacy RENAME CONSTRAINT {name} TO {name}_legacy")
+    for index in ('ix_prices_ts', 'ix_prices_instrument_ts', 'ix_prices_ts_brin'):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    return True
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    legacy = _rename_existing()
+    _create_prices(partitioned=True)
+
+    start = None
+    if legacy:
+        start = op.get_bind().execute(sa.text("SELECT min(ts AT TIME ZONE 'UTC') FROM prices_legacy")).scalar()
+    today = date.today()
+    year, month = (start.year, start.month) if start is not None else (today.year, today.month)
+    last = (today.year + (today.month - 1 + MONTHS_AHEAD) // 12, (today.month - 1 + MONTHS_AHEAD) % 12 + 1)
+    while (year, month) <= last:
+        end = _next_month(year, month)
+        op.execute(
+            f"CREATE TABLE prices_y{year:04d}m{month:02d} PARTITION OF prices "
+            f"FOR VALUES FROM ('{year:04d}-{month:02d}-01 00:00:00+00') "
+            f"TO ('{end[0]:04d}-{end[1]:02d}-01 00:00:00+00')"
+        )
+        year, month = end
+    op.execute("CREATE TABLE prices_default PARTITION OF prices DEFAULT")
+
+    if legacy:
+        op.execute(
+            "INSERT INTO prices (instrument_id, ts, close, currency, source) "
+            "SELECT instrument_id, ts, close, currency, source FROM prices_legacy"
+        )
+        op.execute("DROP TABLE prices_legacy")
+
+    # Цены загружаются в порядке времени: BRIN по ts компактен и достаточен
+    # для диапазонов по всем инструментам, выборка по инструменту - по PK
+    op.execute("CREATE INDEX ix_prices_ts_brin ON prices USING brin (ts)")
+    op.execute("ANALYZE prices")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE prices RENAME TO prices_partitioned")
+    op.execute("ALTER TABLE prices_partitioned RENAME CONSTRAINT pk_prices TO pk_prices_partitioned")
+    op.execute(
+        "ALTER TABLE prices_partitioned RENAME CONSTRAINT fk_prices_instrument_id_instruments "
+        "TO fk_prices_partitioned_instrument_id_instruments"
+    )
+    op.execute("DROP INDEX IF EXISTS ix_prices_ts_brin")
+    _create_prices(partitioned=False)
+    op.execute(
+        "INSERT INTO prices (instrument_id, ts, close, currency, source) "
+        "SELECT instrument_id, ts, close, currency, source FROM prices_partitioned"
+    )
+    op.execute("DROP TABLE prices_partitioned")
+    op.create_index('ix_prices_ts', 'prices', ['ts'])
+    op.create_index('ix_prices_instrument_ts', 'prices', ['instrument_id', 'ts'])
@@ -0,0 +1,49 @@
+"""Covariance matrices
+
+Revision ID: d487c6f6afbc
+Revises: 52bb8d4653d8
+Create Date: 2026-10-16 19:10:00.000000+03:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd487c6f6afbc'
+down_revision: Union[str, Sequence[str], None] = '52bb8d4653d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Сохраненные оценки ковариации по вселенной инструментов и методу
+    op.create_table(
+        'covariance_matrices',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('universe_hash', sa.String(40), nullable=False),
+        sa.Column('instrument_ids', sa.JSON(), nullable=False),
+        sa.Column('method', sa.String(20), nullable=False),
+        sa.Column('params', sa.JSON(), nullable=True),
+        sa.Column('as_of', sa.Date(), nullable=False),
+        sa.Column('observations', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name='pk_covariance_matrices'),
+    )
+    op.create_index('ix_covariance_matrices_id', 'covariance_matrices', ['id'])
+    op.create_index(
+        'ix_covariance_matrices_universe_method', 'covariance_matrices', ['universe_hash', 'method'], unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    op.drop_index('ix_covariance_matrices_universe_method', table_name='covariance_matrices')
+    op.drop_index('ix_covariance_matrices_id', table_name='covariance_matrices')
+    op.drop_table('covariance_matrices')
@@ -0,0 +1,46 @@
+"""Portfolio metric states
+
+Revision ID: f67374274fe7
+Revises: d487c6f6afbc
+Create Date: 2026-10-16 19:20:00.000000+03:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f67374274fe7'
+down_revision: Union[str, Sequence[str], None] = 'd487c6f6afbc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Накопленное состояние метрик портфеля (обновляется при каждом снимке)
+    op.create_table(
+        'portfolio_metric_states',
+        sa.Column('portfolio_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('mean_return', sa.Float(), nullable=False),
+        sa.Column('m2', sa.Float(), nullable=False),
+        sa.Column('twr_product', sa.Float(), nullable=False),
+        sa.Column('peak', sa.Float(), nullable=False),
+        sa.Column('max_drawdown', sa.Float(), nullable=False),
+        sa.Column('first_snapshot_date', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_snapshot_date', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_value', sa.DECIMAL(20, 4), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['portfolio_id'], ['portfolios.id'], name='fk_portfolio_metric_states_portfolio_id_portfolios'),
+        sa.PrimaryKeyConstraint('portfolio_id', name='pk_portfolio_metric_states'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    op.drop_table('portfolio_metric_states')
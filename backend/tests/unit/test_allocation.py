@@ -0,0 +1,91 @@
+"""Тесты распределения активов одним сгруппированным запросом."""
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models.account import Account, AccountType
+from app.models.holding import Holding
+from app.models.instrument import Instrument, InstrumentType
+from app.models.portfolio import Portfolio
+from app.models.price import Price
+from app.repositories.portfolio import ALLOCATION_DIMENSIONS, PortfolioRepository
+from app.repositories.price import PriceRepository
+
+
+def _price(instrument, close, currency="RUB"):
+    return Price(instrument_id=instrument.id, ts=datetime(2024, 3, 4, 18, tzinfo=timezone.utc),
+                 close=Decimal(close), currency=currency, source="test")
+
+
+class TestAllocation:
+    """Тесты разрезов по текущим ценам."""
+
+    def test_all_dimensions_in_base_currency(self, db_session):
+        portfolio = Portfolio(owner_id=1, name="Распределение")
+        other = Portfolio(owner_id=1, name="Чужой")
+        db_session.add_all([portfolio, other])
+        db_session.flush()
+        broker = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER)
+        closed = Account(portfolio_id=portfolio.id, name="Закрыт", account_type=AccountType.BROKER, is_active=False)
+        foreign = Account(portfolio_id=other.id, name="Другой", account_type=AccountType.BROKER)
+        sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB",
+                          sector="Financials", country="RU")
+        ofz = Instrument(ticker="SU26238", name="ОФЗ", instrument_type=InstrumentType.BOND, currency="RUB",
+                         country="RU")
+        aapl = Instrument(ticker="AAPL", name="Apple", instrument_type=InstrumentType.EQUITY, currency="USD",
+                          sector="Technology", country="US")
+        usd = Instrument(ticker="USD000UTSTOM", name="Доллар", instrument_type=InstrumentType.CURRENCY, currency="RUB")
+        db_session.add_all([broker, closed, foreign, sber, ofz, aapl, usd])
+        db_session.flush()
+        db_session.add_all([
+            Holding(account_id=broker.id, instrument_id=sber.id, quantity=Decimal(10), avg_price=Decimal(250), currency="RUB"),
+            Holding(account_id=broker.id, instrument_id=ofz.id, quantity=Decimal(2), avg_price=Decimal(950), currency="RUB"),
+            Holding(account_id=broker.id, instrument_id=aapl.id, quantity=Decimal(1), avg_price=Decimal(150), currency="USD"),
+            Holding(account_id=closed.id, instrument_id=sber.id, quantity=Decimal(100), avg_price=Decimal(1), currency="RUB"),
+            Holding(account_id=foreign.id, instrument_id=sber.id, quantity=Decimal(100), avg_price=Decimal(1), currency="RUB"),
+            _price(sber, "300"), _price(aapl, "170", currency="USD"), _price(usd, "90"),
+        ])
+        db_session.flush()
+        PriceRepository(db_session).refresh_last_prices()
+        db_session.commit()
+
+        total, breakdowns = PortfolioRepository(db_session).get_allocation(portfolio.id)
+
+        # SBER 10 x 300, ОФЗ без цены - по цене покупки 2 x 950, AAPL 170 USD x 90
+        assert float(total) == pytest.approx(3000 + 1900 + 15300)
+        assert {k: float(v) for k, v in breakdowns["asset_class"].items()} == pytest.approx(
+            {"equity": 18300, "bond": 1900}
+        )
+        assert {k: float(v) for k, v in breakdowns["sector"].items()} == pytest.approx(
+            {"Financials": 3000, "unknown": 1900, "Technology": 15300}
+        )
+        assert {k: float(v) for k, v in breakdowns["country"].items()} == pytest.approx({"RU": 4900, "US": 15300})
+        assert {k: float(v) for k, v in breakdowns["currency"].items()} == pytest.approx({"RUB": 4900, "USD": 15300})
+
+    def test_empty_portfolio(self, db_session):
+        portfolio = Portfolio(owner_id=1, name="Пустой")
+        db_session.add(portfolio)
+        db_session.commit()
+
+        total, breakdowns = PortfolioRepository(db_session).get_allocation(portfolio.id)
+
+        assert total == 0
+        assert breakdowns == {name: {} for name in ALLOCATION_DIMENSIONS}
+
+    def test_postgresql_grouping_sets(self):
+        executed = []
+        session = SimpleNamespace(
+            get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")),
+            execute=lambda stmt: executed.append(stmt) or []
+        )
+
+        PortfolioRepository(session).get_allocation(1)
+
+        sql = str(executed[0].compile(dialect=postgresql.dialect()))
+        assert len(executed) == 1
+        assert ("GROUP BY GROUPING SETS((positions.asset_class), (positions.sector), "
+                "(positions.country), (positions.currency), ())") in sql
@@ -0,0 +1,192 @@
+"""Тесты для аналитического движка (риск-метрики)."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.services.analytics_engine import AnalyticsEngine, RiskCalculator, iter_rolling_metrics
+
+
+def _random_values(n: int, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 100.0 * np.cumprod(1.0 + rng.normal(0.0005, 0.01, n))
+
+
+class TestRiskCalculatorKernel:
+    """Тесты векторного ядра RiskCalculator."""
+
+    def test_returns_array_matches_loop(self):
+        """Доходности через np.diff совпадают с поэлементным расчетом."""
+        prices = [100.0, 110.0, 99.0, 120.0]
+        expected = [(prices[i] - prices[i - 1]) / prices[i - 1] for i in range(1, len(prices))]
+
+        assert RiskCalculator.returns_array(np.array(prices)) == pytest.approx(expected)
+        assert RiskCalculator.calculate_returns(prices) == pytest.approx(expected)
+
+    def test_drawdown_array_running_peak(self):
+        """Просадка считается от накопленного максимума."""
+        drawdowns = RiskCalculator.drawdown_array([100.0, 120.0, 90.0, 130.0, 117.0])
+
+        assert drawdowns.tolist() == pytest.approx([0.0, 0.0, 0.25, 0.0, 0.1])
+        assert RiskCalculator.calculate_max_drawdown([100.0, 120.0, 90.0]) == pytest.approx(0.25)
+
+    @pytest.mark.parametrize("n", [2, 7, 250, 2520])
+    def test_var_matches_numpy_percentile(self, n):
+        """VaR через частичную сортировку совпадает с np.percentile."""
+        returns = RiskCalculator.returns_array(_random_values(n + 1, seed=n))
+
+        assert RiskCalculator.calculate_var(returns, 0.95) == pytest.approx(np.percentile(returns, 5))
+        assert RiskCalculator.calculate_var(returns, 0.99) == pytest.approx(np.percentile(returns, 1))
+
+    def test_metrics_array_full_set(self):
+        """Ядро заполняет все поля RiskMetrics, включая метрики бенчмарка."""
+        values = _random_values(300)
+        returns = RiskCalculator.returns_array(values)
+        benchmark = np.random.default_rng(7).normal(0, 0.01, returns.shape[0])
+
+        metrics = RiskCalculator.calculate_metrics_array(values, 365, benchmark)
+
+        naive_drawdowns = [
+            (max(values[:i + 1]) - values[i]) / max(values[:i + 1]) for i in range(len(values))
+        ]
+        assert metrics.average_drawdown == pytest.approx(np.mean(naive_drawdowns))
+        assert metrics.max_drawdown == pytest.approx(max(naive_drawdowns))
+        assert metrics.volatility == pytest.approx(np.std(returns, ddof=1) * np.sqrt(252))
+        assert metrics.cvar_95 == pytest.approx(returns[returns <= np.percentile(returns, 5)].mean())
+        assert metrics.beta == pytest.approx(
+            np.cov(returns, benchmark)[0][1] / np.var(benchmark, ddof=1)
+        )
+        assert metrics.correlation == pytest.approx(np.corrcoef(returns, benchmark)[0][1])
+        assert metrics.positive_periods + metrics.negative_periods <= returns.shape[0]
+
+    def test_metrics_array_insufficient_data(self):
+        """Для одной точки ядро возвращает None."""
+        assert RiskCalculator.calculate_metrics_array(np.array([100.0]), 0) is None
+
+
+class TestAnalyticsEngineMetrics:
+    """Тесты AnalyticsEngine.calculate_portfolio_metrics."""
+
+    def test_accepts_ndarray_and_list(self):
+        """Списочный и ndarray входы дают одинаковый результат."""
+        values = _random_values(60)
+        dates = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(len(values))]
+        engine = AnalyticsEngine()
+
+        from_array = asyncio.run(engine.calculate_portfolio_metrics(values, dates))
+        from_list = asyncio.run(engine.calculate_portfolio_metrics(values.tolist(), dates))
+
+        assert from_array == from_list
+        assert from_array.period_days == 59
+
+    def test_benchmark_length_mismatch_ignored(self):
+        """Бенчмарк несовпадающей длины не используется."""
+        values = _random_values(30)
+        dates = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(len(values))]
+
+        metrics = asyncio.run(
+            AnalyticsEngine().calculate_portfolio_metrics(values, dates, [0.01] * 5)
+        )
+
+        assert metrics.beta is None
+        assert metrics.correlation is None
+
+
+class TestBatchMetrics:
+    """Тесты пакетного расчета метрик (портфели × даты)."""
+
+    def setup_method(self):
+        rng = np.random.default_rng(11)
+        self.dates = [datetime(2020, 1, 1) + timedelta(days=i) for i in range(120)]
+        self.values = 100.0 * np.cumprod(1.0 + rng.normal(0.0003, 0.01, (6, 120)), axis=1)
+        self.benchmark = 1000.0 * np.cumprod(1.0 + rng.normal(0.0002, 0.008, 120))
+        self.mask = np.ones_like(self.values, dtype=bool)
+        self.mask[1, :40] = False          # Портфель открыт позже
+        self.mask[2, 90:] = False          # История обрывается
+        self.mask[3, ::7] = False          # Пропуски внутри истории
+        self.mask[4, :] = False            # Нет данных
+        self.mask[4, 10] = True
+
+    def test_matches_single_portfolio_kernel(self):
+        """Строка пакета совпадает с расчетом по сжатой истории портфеля."""
+        results = asyncio.run(AnalyticsEngine().calculate_batch_metrics(
+            self.values, self.dates, self.mask, self.benchmark, max_chunk_bytes=1
+        ))
+
+        for row in (0, 1, 2, 3, 5):
+            idx = np.nonzero(self.mask[row])[0]
+            bench = self.benchmark[idx]
+            expected = RiskCalculator.calculate_metrics_array(
+                self.values[row, idx],
+                (self.dates[idx[-1]] - self.dates[idx[0]]).days,
+                bench[1:] / bench[:-1] - 1.0,
+            )
+            for field, value in expected.__dict__.items():
+                assert getattr(results[row], field) == pytest.approx(value), (row, field)
+
+    def test_insufficient_history_returns_empty_metrics(self):
+        """Портфель с одной точкой получает пустые метрики."""
+        engine = AnalyticsEngine()
+        results = asyncio.run(engine.calculate_batch_metrics(self.values, self.dates, self.mask))
+
+        assert results[4] == engine._empty_metrics()
+        assert len(results) == self.values.shape[0]
+
+    def test_dates_shape_validated(self):
+        """Число дат должно совпадать с числом столбцов."""
+        with pytest.raises(ValueError):
+            asyncio.run(AnalyticsEngine().calculate_batch_metrics(self.values, self.dates[:-1]))
+
+
+class TestRollingMetrics:
+    """Тесты потокового расчета скользящих метрик."""
+
+    def test_matches_full_window_recalculation(self):
+        """Инкрементальные метрики совпадают с пересчетом каждого окна."""
+        values = _random_values(200, seed=3)
+        benchmark = _random_values(200, seed=4)
+        dates = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(len(values))]
+        window = 21
+
+        points = list(iter_rolling_metrics(values, dates, window=window, benchmark_values=benchmark))
+
+        returns = RiskCalculator.returns_array(values)
+        bench_returns = RiskCalculator.returns_array(benchmark)
+        assert len(points) == len(returns) - window + 1
+
+        for point in points[::17]:
+            end = dates.index(point.date)
+            r = returns[end - window:end]
+            b = bench_returns[end - window:end]
+            window_values = values[end - window:end + 1]
+            assert point.volatility == pytest.approx(np.std(r, ddof=1) * np.sqrt(252))
+            assert point.beta == pytest.approx(np.cov(r, b)[0][1] / np.var(b, ddof=1))
+            assert point.correlation == pytest.approx(np.corrcoef(r, b)[0][1])
+            assert point.window_return == pytest.approx(window_values[-1] / window_values[0] - 1)
+            assert point.drawdown == pytest.approx(1 - window_values[-1] / window_values.max())
+
+    def test_cash_flows_and_aligned_benchmark_returns(self):
+        """Пополнение не дает всплеска доходности; доходности бенчмарка равносильны уровням."""
+        values = _random_values(120, seed=5)
+        benchmark = _random_values(120, seed=6)
+        dates = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(len(values))]
+        flows = np.zeros(len(values) - 1)
+        flows[59] = values[59] * 0.5
+        deposited = values.copy()
+        deposited[60:] += flows[59] * values[60:] / values[59]
+
+        expected = list(iter_rolling_metrics(values, dates, window=21, benchmark_values=benchmark))
+        points = list(iter_rolling_metrics(deposited, dates, window=21, cash_flows=flows,
+                                           benchmark_returns=RiskCalculator.returns_array(benchmark)))
+
+        assert [p.volatility for p in points] == pytest.approx([p.volatility for p in expected])
+        assert [p.window_return for p in points] == pytest.approx([p.window_return for p in expected])
+        assert [p.drawdown for p in points] == pytest.approx([p.drawdown for p in expected], abs=1e-12)
+        assert [p.beta for p in points] == pytest.approx([p.beta for p in expected])
+
+    def test_window_validated(self):
+        """Окно меньше двух доходностей недопустимо."""
+        with pytest.raises(ValueError):
+            list(iter_rolling_metrics([1.0, 2.0, 3.0], [1, 2, 3], window=1))
@@ -0,0 +1,179 @@
+"""Тесты атрибуции доходности по Бринсону."""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.core.cache import LRUTTLCache
+from app.models.account import Account, AccountType
+from app.models.instrument import Instrument, InstrumentType
+from app.models.price import Price
+from app.models.transaction import Transaction, TransactionType
+from app.repositories.benchmark import BenchmarkRepository
+from app.services.attribution import (
+    CASH_SEGMENT,
+    AttributionService,
+    add_cash_segment,
+    attribute,
+    brinson_fachler,
+    portfolio_segments,
+    segment_membership,
+)
+
+
+def _segment_data(periods: int = 250, segments: int = 5, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    wp = rng.dirichlet(np.ones(segments), periods)
+    wb = rng.dirichlet(np.ones(segments))
+    rp = rng.normal(0.0005, 0.01, (periods, segments))
+    rb = rng.normal(0.0004, 0.01, (periods, segments))
+    return wp, rp, wb, rb
+
+
+class TestBrinsonEngine:
+    """Тесты векторизованного ядра."""
+
+    def test_single_period_effects_sum_to_active_return(self):
+        wp, rp, wb, rb = _segment_data(periods=1)
+        allocation, selection, interaction, total_p, total_b = brinson_fachler(wp, rp, wb[None, :], rb)
+
+        assert total_p[0] == pytest.approx(wp[0] @ rp[0])
+        assert total_b[0] == pytest.approx(wb @ rb[0])
+        assert (allocation + selection + interaction).sum() == pytest.approx(total_p[0] - total_b[0])
+        assert selection[0] == pytest.approx(wb * (rp[0] - rb[0]))
+
+    def test_linked_effects_sum_to_compounded_difference(self):
+        """Связанные по Карино эффекты в сумме дают разницу накопленных доходностей."""
+        wp, rp, wb, rb = _segment_data()
+
+        result = attribute(wp, rp, wb, rb)
+
+        expected_p = np.prod(1 + (wp * rp).sum(axis=1)) - 1
+        expected_b = np.prod(1 + rb @ wb) - 1
+        linked = result["allocation"] + result["selection"] + result["interaction"]
+        assert result["portfolio_return"] == pytest.approx(expected_p)
+        assert result["benchmark_return"] == pytest.approx(expected_b)
+        assert linked.sum() == pytest.approx(expected_p - expected_b, abs=1e-12)
+
+    def test_missing_segments(self):
+        """Сегмент без позиций - только эффект распределения; без бенчмарка - без распределения."""
+        wp = np.array([[0.7, 0.0, 0.3]])
+        rp = np.array([[0.02, np.nan, 0.05]])
+        wb = np.array([[0.5, 0.5, 0.0]])
+        rb = np.array([[0.01, -0.01, np.nan]])
+
+        allocation, selection, interaction, total_p, total_b = brinson_fachler(wp, rp, wb, rb)
+
+        assert selection[0, 1] == 0 and interaction[0, 1] == 0
+        assert allocation[0, 2] == 0
+        assert (allocation + selection + interaction).sum() == pytest.approx(total_p[0] - total_b[0])
+
+    def test_uninvested_periods_keep_identity(self):
+        """Подпериоды без позиций уходят в cash, связанные эффекты дают R_p - R_b."""
+        wp, rp, wb, rb = _segment_data(periods=50)
+        wp[:20] = 0.0
+        rp[:20] = np.nan
+
+        segments, wp_cash, rp_cash = add_cash_segment(list("abcde"), wp, rp)
+        rb_cash = np.hstack([rb, np.zeros((50, 1))])
+        result = attribute(wp_cash, rp_cash, np.append(wb, 0.0), rb_cash)
+
+        expected_p = np.prod(1 + np.nan_to_num(wp * rp).sum(axis=1)) - 1
+        linked = result["allocation"] + result["selection"] + result["interaction"]
+        assert segments[-1] == CASH_SEGMENT
+        assert wp_cash.sum(axis=1) == pytest.approx(np.ones(50))
+        assert result["portfolio_return"] == pytest.approx(expected_p)
+        assert linked.sum() == pytest.approx(result["portfolio_return"] - result["benchmark_return"], abs=1e-12)
+
+    def test_portfolio_segments_aggregate_positions(self):
+        segments, membership = segment_membership(["equity", "bond", "equity", None])
+        values = np.array([[100.0, 200.0, 300.0, 400.0]])
+        returns = np.array([[0.1, 0.0, -0.1, 0.05]])
+
+        weights, segment_returns = portfolio_segments(values, returns, membership)
+
+        assert segments == ["bond", "equity", "unknown"]
+        assert weights[0] == pytest.approx([0.2, 0.4, 0.4])
+        assert segment_returns[0] == pytest.approx([0.0, (10 - 30) / 400, 0.05])
+
+
+class TestAttributionService:
+    """Тесты загрузки данных портфеля и кэша."""
+
+    def test_attribution_from_positions_and_indexes(self, db_session):
+        start = datetime(2024, 1, 1)
+        account = Account(portfolio_id=1, name="Брокерский", account_type=AccountType.BROKER)
+        equity = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        bond = Instrument(ticker="SU26238", name="ОФЗ", instrument_type=InstrumentType.BOND, currency="RUB")
+        db_session.add_all([account, equity, bond])
+        db_session.flush()
+
+        db_session.add_all([
+            Transaction(account_id=account.id, instrument_id=equity.id, ts=start, transaction_type=TransactionType.BUY,
+                        quantity=Decimal(10), price=Decimal(100), gross=Decimal(1000), currency="RUB"),
+            Transaction(account_id=account.id, instrument_id=bond.id, ts=start, transaction_type=TransactionType.BUY,
+                        quantity=Decimal(10), price=Decimal(100), gross=Decimal(1000), currency="RUB"),
+        ])
+        equity_prices, bond_prices = [100, 110, 121], [100, 100, 101]
+        for day in range(3):
+            ts = start + timedelta(days=day)
+            db_session.add_all([
+                Price(instrument_id=equity.id, ts=ts, close=Decimal(equity_prices[day]), currency="RUB", source="test"),
+                Price(instrument_id=bond.id, ts=ts, close=Decimal(bond_prices[day]), currency="RUB", source="test"),
+            ])
+
+        repo = BenchmarkRepository(db_session)
+        imoex = repo.create("Индекс МосБиржи", "IMOEX")
+        rgbi = repo.create("Индекс гособлигаций", "RGBI")
+        repo.upsert_levels(imoex.id, [(start + timedelta(days=i), Decimal(v)) for i, v in enumerate([1000, 1050, 1050])])
+        repo.upsert_levels(rgbi.id, [(start + timedelta(days=i), Decimal(v)) for i, v in enumerate([100, 101, 102])])
+        db_session.flush()
+
+        cache = LRUTTLCache()
+        service = AttributionService(db_session, cache=cache)
+        policy = {"equity": (0.6, imoex.id), "bond": (0.4, rgbi.id)}
+        result = service.attribute(1, policy, "asset_class", date(2024, 1, 1), date(2024, 1, 3))
+
+        portfolio_periods = [0.5 * 0.10 + 0.5 * 0.0, (1100 * 0.10 + 1000 * 0.01) / 2100]
+        benchmark_periods = [0.6 * 0.05 + 0.4 * 0.01, 0.6 * 0.0 + 0.4 * (102 / 101 - 1)]
+        assert result.segments == ["bond", "equity"]
+        assert result.periods == 2
+        assert result.portfolio_return == pytest.approx(np.prod(1 + np.array(portfolio_periods)) - 1)
+        assert result.benchmark_return == pytest.approx(np.prod(1 + np.array(benchmark_periods)) - 1)
+        assert (result.allocation + result.selection + result.interaction).sum() == pytest.approx(result.active_return)
+
+        assert service.attribute(1, policy, "asset_class", date(2024, 1, 1), date(2024, 1, 3)) is result
+        assert cache.hits == 1
+
+        with pytest.raises(ValueError):
+            service.attribute(1, policy, "industry")
+
+    def test_interval_starts_at_first_position(self, db_session):
+        start = datetime(2024, 1, 1)
+        account = Account(portfolio_id=1, name="Брокерский", account_type=AccountType.BROKER)
+        equity = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        db_session.add_all([account, equity])
+        db_session.flush()
+        db_session.add(Transaction(account_id=account.id, instrument_id=equity.id, ts=start + timedelta(days=2),
+                                   transaction_type=TransactionType.BUY, quantity=Decimal(10), price=Decimal(100),
+                                   gross=Decimal(1000), currency="RUB"))
+        for day, close in enumerate([90, 95, 100, 110, 99]):
+            db_session.add(Price(instrument_id=equity.id, ts=start + timedelta(days=day), close=Decimal(close),
+                                 currency="RUB", source="test"))
+        repo = BenchmarkRepository(db_session)
+        imoex = repo.create("Индекс МосБиржи", "IMOEX")
+        repo.upsert_levels(imoex.id, [(start + timedelta(days=i), Decimal(v))
+                                      for i, v in enumerate([900, 1000, 1000, 1050, 1000])])
+        db_session.flush()
+
+        result = AttributionService(db_session, cache=LRUTTLCache()).attribute(
+            1, {"equity": (1.0, imoex.id)}, "asset_class", date(2024, 1, 1), date(2024, 1, 5)
+        )
+
+        assert result.start_date == date(2024, 1, 3)
+        assert result.periods == 2
+        assert result.portfolio_return == pytest.approx(99 / 100 - 1)
+        assert result.benchmark_return == pytest.approx(0.0)
+        assert (result.allocation + result.selection + result.interaction).sum() == pytest.approx(result.active_return)
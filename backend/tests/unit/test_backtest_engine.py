@@ -0,0 +1,172 @@
+"""Тесты для событийного движка бектестинга."""
+
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.analytics_engine import AnalyticsEngine
+from app.services.backtest_engine import (
+    BacktestEngine,
+    MarketWindow,
+    create_buy_and_hold_strategy,
+    create_rebalancing_strategy,
+    window_strategy,
+)
+
+
+@pytest.fixture
+def price_data():
+    rng = np.random.default_rng(21)
+    values = 100.0 * np.cumprod(1.0 + rng.normal(0.0003, 0.015, (250, 3)), axis=0)
+    return pd.DataFrame(
+        values,
+        columns=["SBER", "GAZP", "LKOH"],
+        index=pd.date_range("2023-01-02", periods=250, freq="B"),
+    )
+
+
+class TestBacktestEngine:
+    """Тесты BacktestEngine."""
+
+    def test_buy_and_hold_final_capital(self, price_data):
+        """Купи и держи: итоговый капитал равен стоимости купленных долей."""
+        weights = {"SBER": 0.5, "GAZP": 0.3, "LKOH": 0.2}
+        strategy = create_buy_and_hold_strategy(list(weights), weights)
+
+        result = BacktestEngine().run(strategy, price_data, initial_capital=1000000)
+
+        first, last = price_data.iloc[0], price_data.iloc[-1]
+        expected = sum(1000000 * w / first[s] * last[s] for s, w in weights.items())
+        assert result.final_capital == pytest.approx(expected)
+        assert len(result.drawdown_series) == len(price_data) + 1
+        assert result.max_drawdown == pytest.approx(max(result.drawdown_series))
+
+    def test_window_is_readonly_view(self, price_data):
+        """Стратегия получает read-only окно без копирования цен."""
+        seen = []
+
+        @window_strategy
+        def strategy(window: MarketWindow):
+            seen.append((len(window), window.prices.flags.writeable, window.positions.flags.writeable))
+            assert window.prices.shape == (window.index + 1, 3)
+            return None
+
+        BacktestEngine().run(strategy, price_data)
+
+        assert seen[-1] == (len(price_data), False, False)
+        assert all(not prices_writable for _, prices_writable, _ in seen)
+
+    def test_rebalancing_never_overdraws_cash(self, price_data):
+        """Ребалансировка к весам не уводит кэш в минус."""
+        weights = {"SBER": 0.6, "GAZP": 0.4, "LKOH": 0.3}  # Сумма весов > 1
+        strategy = create_rebalancing_strategy(list(weights), weights, rebalance_frequency=20)
+
+        result = BacktestEngine().run(strategy, price_data)
+
+        assert result.final_capital != result.initial_capital
+        assert min(result.equity_curve.portfolio_values) > 0
+
+    def test_fifo_trade_stats(self):
+        """Продажа матчится с самыми ранними лотами."""
+        trades = np.array([
+            [0, 0, 10.0, 100.0],   # Лот 1
+            [1, 0, 10.0, 200.0],   # Лот 2
+            [2, 0, -10.0, 150.0],  # FIFO: против лота 1 - прибыль
+            [3, 0, -10.0, 150.0],  # FIFO: против лота 2 - убыток
+        ])
+
+        assert BacktestEngine.fifo_trade_stats(trades) == (1, 1)
+
+    def test_legacy_strategy_adapter(self, price_data):
+        """Стратегии старого формата выполняются через адаптер."""
+        def legacy(data, positions, cash):
+            if len(data) == 1:
+                return {"SBER": {"action": "BUY", "amount": cash / 2}}
+            if len(data) == 100:
+                return {"SBER": {"action": "SELL", "shares": positions["SBER"]}}
+            return {}
+
+        result = asyncio.run(AnalyticsEngine().backtest_strategy(legacy, price_data))
+
+        sber = price_data["SBER"]
+        expected = 500000 + 500000 / sber.iloc[0] * sber.iloc[99]
+        assert result.final_capital == pytest.approx(expected)
+        assert result.total_trades == 1
+
+
+class TestBacktestSweep:
+    """Тесты перебора параметров и walk-forward."""
+
+    def test_walk_forward_splits(self):
+        """Окна сдвигаются на длину out-of-sample и не выходят за историю."""
+        from app.services.backtest_sweep import walk_forward_splits
+
+        assert walk_forward_splits(100, 40, 20) == [(0, 40, 60), (20, 60, 80), (40, 80, 100)]
+        assert walk_forward_splits(50, 40, 20) == []
+
+    def test_grid_ranked_and_matches_engine(self, price_data):
+        """Таблица ранжирована, а результаты совпадают с прямым прогоном."""
+        from app.services.backtest_sweep import BacktestSweepRunner, build_parameter_grid
+
+        weights = {"SBER": 0.5, "GAZP": 0.5}
+        grid = build_parameter_grid([weights], [5, 20], [0.0, 0.1])
+        table = BacktestSweepRunner(price_data, max_workers=1).run_grid(grid)
+
+        assert list(table["rank"]) == [1, 2, 3, 4]
+        assert table["sharpe_ratio"].is_monotonic_decreasing
+
+        best = table.iloc[0]
+        direct = BacktestEngine().run(
+            create_rebalancing_strategy(list(weights), weights, int(best["rebalance_frequency"]), best["threshold"]),
+            price_data,
+        )
+        assert best["final_capital"] == pytest.approx(direct.final_capital)
+
+    def test_walk_forward_out_of_sample_table(self, price_data):
+        """Walk-forward возвращает по строке out-of-sample на фолд."""
+        from app.services.backtest_sweep import BacktestSweepRunner, build_parameter_grid
+
+        grid = build_parameter_grid([{"SBER": 1.0}, {"GAZP": 0.5, "LKOH": 0.5}], [10], [0.05])
+        table = BacktestSweepRunner(price_data, max_workers=1).run_walk_forward(grid, 100, 50)
+
+        assert list(table["fold"]) == [0, 1, 2]
+        assert set(table["split"]) == {"out_of_sample"}
+        assert "in_sample_sharpe_ratio" in table.columns
+
+    def test_process_pool_matches_serial_run(self, price_data):
+        """Пул процессов дает ту же таблицу, что и прогон в одном процессе."""
+        from app.services.backtest_sweep import BacktestSweepRunner, build_parameter_grid
+
+        grid = build_parameter_grid([{"SBER": 0.5, "GAZP": 0.5}, {"LKOH": 1.0}], [5, 20], [0.0, 0.1])
+        parallel = BacktestSweepRunner(price_data, max_workers=2).run_grid(grid)
+        serial = BacktestSweepRunner(price_data, max_workers=1).run_grid(grid)
+
+        pd.testing.assert_frame_equal(parallel, serial)
+
+    def test_worker_closes_shared_memory_on_error(self, price_data, monkeypatch):
+        """Подключение воркера к общей памяти закрывается и при ошибке задачи."""
+        from app.services import backtest_sweep
+
+        attached = []
+
+        class TrackedMemory(backtest_sweep.shared_memory.SharedMemory):
+            def __init__(self, name=None, create=False, size=0):
+                super().__init__(name=name, create=create, size=size)
+                if not create:
+                    attached.append(self)
+
+        def failing(task):
+            raise RuntimeError("сбой задачи")
+
+        runner = backtest_sweep.BacktestSweepRunner(price_data, max_workers=1)
+        grid = backtest_sweep.build_parameter_grid([{"SBER": 1.0}], [5], [0.0])
+        monkeypatch.setattr(backtest_sweep.shared_memory, "SharedMemory", TrackedMemory)
+        monkeypatch.setattr(backtest_sweep, "_run_task", failing)
+
+        with pytest.raises(RuntimeError):
+            runner.run_grid(grid)
+
+        assert len(attached) == 1 and attached[0]._buf is None
+        assert "prices" not in backtest_sweep._worker_state
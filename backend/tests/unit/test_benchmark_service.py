@@ -0,0 +1,128 @@
+"""Тесты рядов бенчмарков и кэша выровненных доходностей."""
+
+import asyncio
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.core.cache import LRUTTLCache
+from app.models.portfolio import PortfolioBenchmark
+from app.repositories.benchmark import BenchmarkRepository
+from app.services.analytics_engine import AnalyticsEngine, RiskCalculator
+from app.services.benchmark_service import (
+    BenchmarkSeriesService,
+    align_as_of,
+    composite_returns,
+    to_day_array,
+)
+
+
+class TestAlignment:
+    """Тесты as-of выравнивания и составного бенчмарка."""
+
+    def test_align_as_of_takes_last_known_level(self):
+        """На дату берется последнее значение не позже нее, устаревшее - NaN."""
+        level_dates = to_day_array([date(2024, 1, 1), date(2024, 1, 3), date(2024, 1, 20)])
+        levels = np.array([100.0, 102.0, 110.0])
+        targets = to_day_array([date(2023, 12, 31), date(2024, 1, 2), date(2024, 1, 5), date(2024, 1, 15)])
+
+        aligned = align_as_of(level_dates, levels, targets, max_staleness_days=7)
+
+        assert np.isnan(aligned[0])
+        assert aligned[1:3].tolist() == [100.0, 102.0]
+        assert np.isnan(aligned[3])
+
+    def test_composite_renormalizes_missing_components(self):
+        """Без данных по одному индексу период считается по остальным."""
+        aligned = np.array([
+            [100.0, 110.0, 121.0],
+            [np.nan, 50.0, 45.0],
+        ])
+
+        returns = composite_returns(aligned, np.array([0.6, 0.4]))
+
+        assert returns.tolist() == pytest.approx([0.10, 0.6 * 0.10 + 0.4 * -0.10])
+
+
+class TestLRUTTLCache:
+    """Тесты LRU+TTL кэша."""
+
+    def test_ttl_and_lru_eviction(self):
+        """Запись истекает по TTL, при переполнении вытесняется самая давняя."""
+        now = [0.0]
+        cache = LRUTTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1          # "a" становится самой свежей
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+
+        now[0] = 11.0
+        assert cache.get("a") is None
+        assert len(cache) == 1
+
+
+class TestBenchmarkSeriesService:
+    """Тесты загрузки бенчмарков из БД."""
+
+    def test_composite_portfolio_benchmark_cached(self, db_session):
+        """Составной бенчмарк портфеля выравнивается и берется из кэша повторно."""
+        repo = BenchmarkRepository(db_session)
+        imoex = repo.create("Индекс МосБиржи", "IMOEX")
+        spx = repo.create("S&P 500", "SPX", currency="USD")
+        start = datetime(2024, 1, 1)
+        # IMOEX без выходных, S&P с пропуском - оба выравниваются as-of
+        repo.upsert_levels(imoex.id, [(start + timedelta(days=i), Decimal(3000 + 10 * i)) for i in range(10)])
+        repo.upsert_levels(spx.id, [(start + timedelta(days=i), Decimal(4000 + 20 * i)) for i in (0, 1, 4, 5, 6)])
+        db_session.add_all([
+            PortfolioBenchmark(portfolio_id=1, benchmark_id=imoex.id, weight=Decimal("0.7")),
+            PortfolioBenchmark(portfolio_id=1, benchmark_id=spx.id, weight=Decimal("0.3")),
+        ])
+        db_session.flush()
+
+        cache = LRUTTLCache()
+        service = BenchmarkSeriesService(db_session, cache=cache)
+        dates = [start + timedelta(days=i) for i in (0, 2, 5)]
+
+        returns = service.portfolio_returns(1, dates)
+
+        imoex_returns = [3020 / 3000 - 1, 3050 / 3020 - 1]
+        spx_returns = [4020 / 4000 - 1, 4100 / 4020 - 1]
+        assert returns.tolist() == pytest.approx(
+            [0.7 * i + 0.3 * s for i, s in zip(imoex_returns, spx_returns)]
+        )
+        assert service.portfolio_returns(1, dates) is returns
+        assert cache.hits == 1
+
+        service.store_levels(spx.id, [(start + timedelta(days=2), Decimal(4040))])
+        assert len(cache) == 0
+
+    def test_portfolio_without_benchmark(self, db_session):
+        """Без назначенного бенчмарка возвращается None."""
+        assert BenchmarkSeriesService(db_session, cache=LRUTTLCache()).portfolio_returns(999, [date(2024, 1, 1)]) is None
+
+
+class TestEngineBenchmarkSeries:
+    """Тесты передачи ряда значений индекса в AnalyticsEngine."""
+
+    def test_levels_series_aligned_to_dates(self):
+        """Ряд значений индекса выравнивается на даты портфеля вместо проверки длины."""
+        rng = np.random.default_rng(3)
+        dates = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(60)]
+        values = 100.0 * np.cumprod(1.0 + rng.normal(0, 0.01, 60))
+        index_levels = pd.Series(
+            1000.0 * np.cumprod(1.0 + rng.normal(0, 0.01, 90)),
+            index=pd.date_range("2023-12-01", periods=90, freq="D"),
+        )
+
+        metrics = asyncio.run(AnalyticsEngine().calculate_portfolio_metrics(values, dates, index_levels))
+
+        aligned = index_levels.reindex(pd.DatetimeIndex(dates), method="ffill").to_numpy()
+        expected = RiskCalculator.calculate_metrics_array(values, 59, aligned[1:] / aligned[:-1] - 1)
+        assert metrics.beta == pytest.approx(expected.beta)
+        assert metrics.correlation == pytest.approx(expected.correlation)
@@ -0,0 +1,122 @@
+"""Тесты сервиса ковариационных матриц."""
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from sqlalchemy import event
+
+from app.core.cache import LRUTTLCache
+from app.models.price import Price
+from app.services.covariance_service import (
+    CovarianceService,
+    EwmaCovarianceState,
+    LedoitWolfCovarianceState,
+    universe_hash,
+)
+
+
+def _returns(n: int = 300, p: int = 12, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    mixing = np.eye(p) + 0.3 * rng.normal(size=(p, p))
+    return rng.normal(0.0005, 0.01, (n, p)) @ mixing
+
+
+def _reference_ledoit_wolf(x: np.ndarray) -> np.ndarray:
+    """Прямая формула Ledoit-Wolf по всей матрице наблюдений."""
+    n, p = x.shape
+    x = x - x.mean(axis=0)
+    sample = x.T @ x / n
+    mu = np.trace(sample) / p
+    delta = np.sum((sample - mu * np.eye(p)) ** 2) / p
+    beta = (np.sum((x ** 2).T @ (x ** 2)) / n - np.sum(sample ** 2)) / (n * p)
+    shrinkage = min(beta, delta) / delta
+    return (1 - shrinkage) * sample + shrinkage * mu * np.eye(p)
+
+
+class TestCovarianceStates:
+    """Тесты инкрементальных оценок."""
+
+    def test_ledoit_wolf_rank1_matches_direct_formula(self):
+        """Rank-1 обновления дают ту же оценку, что и расчет по всей истории."""
+        x = _returns()
+        state = LedoitWolfCovarianceState(x.shape[1])
+        state.update_many(x[:200])
+        for row in x[200:]:
+            state.update(row)
+
+        assert state.covariance() == pytest.approx(_reference_ledoit_wolf(x), rel=1e-9, abs=1e-15)
+
+    def test_ewma_matches_recursive_definition(self):
+        """EWMA совпадает с рекурсивной экспоненциальной ковариацией."""
+        x = _returns(50, 3)
+        decay = 0.9
+        state = EwmaCovarianceState(3, decay)
+        state.update_many(x)
+
+        mean, cov = x[0], np.zeros((3, 3))
+        for row in x[1:]:
+            new_mean = decay * mean + (1 - decay) * row
+            cov = decay * cov + (1 - decay) * np.outer(row - new_mean, row - mean)
+            mean = new_mean
+        assert state.cov == pytest.approx(cov)
+
+    def test_universe_hash_order_independent(self):
+        assert universe_hash([3, 1, 2]) == universe_hash([1, 2, 3, 3])
+
+
+class TestCovarianceService:
+    """Тесты сохранения и ежедневного обновления."""
+
+    def _add_prices(self, db_session, prices: np.ndarray, start: date, ids):
+        for day, row in enumerate(prices):
+            ts = datetime.combine(start + timedelta(days=day), datetime.min.time()).replace(tzinfo=timezone.utc)
+            for instrument_id, close in zip(ids, row):
+                db_session.add(Price(instrument_id=instrument_id, ts=ts, close=Decimal(f"{close:.6f}"),
+                                     currency="RUB", source="test"))
+        db_session.flush()
+
+    def test_daily_update_equals_full_build(self, db_session):
+        """Инкрементальное обновление совпадает с построением по всей истории."""
+        ids = [1, 2, 3]
+        prices = 100.0 * np.cumprod(1.0 + _returns(41, 3, seed=5), axis=0)
+        start = date(2024, 1, 1)
+        self._add_prices(db_session, prices[:31], start, ids)
+
+        service = CovarianceService(db_session, cache=LRUTTLCache())
+        service.build(ids, "ledoit_wolf", end_date=start + timedelta(days=30))
+
+        self._add_prices(db_session, prices[31:], start + timedelta(days=31), ids)
+        assert service.update_daily(start + timedelta(days=40)) == 1
+
+        updated = service.get(ids, "ledoit_wolf")
+        rebuilt = CovarianceService(db_session, cache=LRUTTLCache()).build(
+            ids, "ewma", end_date=start + timedelta(days=40)
+        )
+        full = LedoitWolfCovarianceState(3)
+        full.update_many(prices[1:] / prices[:-1] - 1)
+
+        assert updated.observations == 40
+        assert updated.as_of == start + timedelta(days=40)
+        assert updated.covariance.dtype == np.float32
+        assert updated.covariance == pytest.approx(full.covariance(), rel=1e-4)
+        assert rebuilt.correlation().diagonal() == pytest.approx(np.ones(3))
+
+    def test_build_is_committed(self, db_session):
+        """Матрица, построенная по запросу, фиксируется самим сервисом до записи в кэш."""
+        ids = [1, 2]
+        start = date(2024, 1, 1)
+        self._add_prices(db_session, 100.0 * np.cumprod(1.0 + _returns(10, 2), axis=0), start, ids)
+        cache = LRUTTLCache()
+        cached_at_commit = []
+        event.listen(db_session, "after_commit", lambda session: cached_at_commit.append(len(cache)))
+
+        CovarianceService(db_session, cache=cache).build(ids, "ewma", end_date=start + timedelta(days=9))
+
+        assert cached_at_commit == [0]
+        assert len(cache) == 1
+
+    def test_unknown_method_rejected(self, db_session):
+        with pytest.raises(ValueError):
+            CovarianceService(db_session, cache=LRUTTLCache()).build([1, 2], "sample")
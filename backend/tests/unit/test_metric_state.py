@@ -0,0 +1,113 @@
+"""Тесты инкрементального состояния метрик портфеля."""
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.models.account import Account, AccountType
+from app.models.portfolio import Portfolio, PortfolioMetricState, PortfolioSnapshot
+from app.models.transaction import Transaction, TransactionType
+from app.services.metric_state import PortfolioMetricStateService, apply_snapshot
+from app.services.valuation import DailyValuationService
+
+
+def _values(n: int = 120, seed: int = 4) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.round(100000 * np.cumprod(1 + rng.normal(0.0005, 0.012, n)), 4)
+
+
+class TestPortfolioMetricState:
+    """Тесты O(1) обновления и кэшированных колонок Portfolio."""
+
+    def _portfolio(self, db_session) -> Portfolio:
+        portfolio = Portfolio(owner_id=1, name="Метрики")
+        db_session.add(portfolio)
+        db_session.flush()
+        return portfolio
+
+    def _snapshot(self, db_session, portfolio_id, snapshot_date, value):
+        db_session.add(PortfolioSnapshot(
+            portfolio_id=portfolio_id, snapshot_date=snapshot_date,
+            total_value=Decimal(str(value)), total_cost=Decimal("0"), total_pnl=Decimal("0")
+        ))
+        db_session.flush()
+
+    def test_appends_match_full_history(self, db_session):
+        """Накопленные метрики совпадают с расчетом по всему ряду."""
+        portfolio = self._portfolio(db_session)
+        service = PortfolioMetricStateService(db_session, risk_free_rate=0.0)
+        values = _values()
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for day, value in enumerate(values):
+            service.append_snapshot(portfolio.id, start + timedelta(days=day), Decimal(str(value)))
+
+        returns = values[1:] / values[:-1] - 1
+        drawdown = 1 - values / np.maximum.accumulate(values)
+        db_session.refresh(portfolio)
+
+        assert float(portfolio.volatility) == pytest.approx(np.std(returns, ddof=1) * np.sqrt(252) * 100, rel=1e-6)
+        assert float(portfolio.max_drawdown) == pytest.approx(drawdown.max() * 100, rel=1e-6)
+        assert float(portfolio.twr_inception) == pytest.approx((values[-1] / values[0] - 1) * 100, rel=1e-6)
+        assert float(portfolio.sharpe_ratio) == pytest.approx(
+            returns.mean() * 252 / (np.std(returns, ddof=1) * np.sqrt(252)), rel=1e-5
+        )
+        assert portfolio.metrics_calculated_at is None  # остальные метрики - за MetricsMaterializer
+
+    def test_cash_flow_excluded_from_return(self):
+        """Пополнение не считается доходностью и не снимает просадку."""
+        state = PortfolioMetricState(portfolio_id=1, count=0, mean_return=0.0, m2=0.0,
+                                     twr_product=1.0, peak=1.0, max_drawdown=0.0)
+        start = datetime(2024, 1, 1)
+        apply_snapshot(state, start, Decimal("1000"))
+        apply_snapshot(state, start + timedelta(days=1), Decimal("900"))
+        apply_snapshot(state, start + timedelta(days=2), Decimal("1900"), cash_flow=Decimal("1000"))
+
+        assert state.twr_product == pytest.approx(0.9)
+        assert state.max_drawdown == pytest.approx(0.1)
+        assert state.count == 2
+
+    def test_out_of_order_snapshot_rebuilds(self, db_session):
+        """Снимок задним числом приводит к пересчету по всем снимкам."""
+        portfolio = self._portfolio(db_session)
+        service = PortfolioMetricStateService(db_session)
+        start = datetime(2024, 1, 1)
+        for day, value in ((0, 100), (2, 110), (3, 99)):
+            self._snapshot(db_session, portfolio.id, start + timedelta(days=day), value)
+            service.append_snapshot(portfolio.id, start + timedelta(days=day), Decimal(value))
+
+        self._snapshot(db_session, portfolio.id, start + timedelta(days=1), 120)
+        state = service.append_snapshot(portfolio.id, start + timedelta(days=1), Decimal(120))
+
+        assert state.count == 3
+        assert state.twr_product == pytest.approx(0.99)
+        assert state.max_drawdown == pytest.approx(1 - 99 / 120)
+
+    def test_daily_valuation_appends_with_flows(self, db_session):
+        """Ежедневная оценка дополняет состояние; пополнение дня не доходность."""
+        portfolio = self._portfolio(db_session)
+        account = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER,
+                          cash_balance=Decimal("1000"))
+        db_session.add(account)
+        db_session.commit()
+        valuation = DailyValuationService(db_session)
+        valuation.run(date(2024, 3, 4))
+
+        db_session.add(Transaction(
+            account_id=account.id, ts=datetime(2024, 3, 5, 10, tzinfo=timezone.utc),
+            transaction_type=TransactionType.DEPOSIT, gross=Decimal("500"), currency="RUB"
+        ))
+        account.cash_balance = Decimal("1500")
+        db_session.commit()
+        valuation.run(date(2024, 3, 5))
+
+        state = PortfolioMetricStateService(db_session).get(portfolio.id)
+        assert (state.count, state.last_value) == (1, Decimal("1500"))
+        assert state.twr_product == pytest.approx(1.0)
+
+        valuation.run(date(2024, 3, 5))  # повтор дня - пересчет с потоками из транзакций
+
+        db_session.refresh(state)
+        assert state.count == 1
+        assert state.twr_product == pytest.approx(1.0)
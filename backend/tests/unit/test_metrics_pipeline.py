@@ -0,0 +1,115 @@
+"""Тесты пакетной материализации метрик портфелей."""
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models.account import Account, AccountType
+from app.models.portfolio import Portfolio, PortfolioSnapshot
+from app.models.transaction import Transaction, TransactionType
+from app.repositories.portfolio import PortfolioRepository
+from app.services.metrics_pipeline import METRIC_HORIZONS, MetricsMaterializer, series_metrics
+from app.services.portfolio_analytics import CashFlow, PortfolioAnalyticsService, PricePoint
+from app.services.xirr import xirr
+
+
+def _series(days: int = 1500, seed: int = 5):
+    rng = np.random.default_rng(seed)
+    day_numbers = np.arange(days, dtype=np.int64) + 18000
+    values = 100000 * np.cumprod(1 + rng.normal(0.0004, 0.01, days))
+    flow_days = np.sort(rng.choice(day_numbers[1:], 40, replace=False))
+    flow_amounts = rng.uniform(-3000, 5000, 40)
+    return day_numbers, values, flow_days, flow_amounts
+
+
+class TestSeriesMetrics:
+    """Тесты векторного расчета метрик ряда."""
+
+    def test_twr_matches_analytics_service(self):
+        days, values, flow_days, flow_amounts = _series()
+        to_date = lambda d: date(1970, 1, 1) + timedelta(days=int(d))
+
+        metrics = series_metrics(days, values, flow_days, flow_amounts)
+
+        expected = PortfolioAnalyticsService().calculate_twr_horizons(
+            [PricePoint(date=to_date(d), value=Decimal(str(v))) for d, v in zip(days, values)],
+            [CashFlow(date=to_date(d), amount=Decimal(str(a))) for d, a in zip(flow_days, flow_amounts)],
+            METRIC_HORIZONS
+        )
+        for name in (*METRIC_HORIZONS, "twr_inception"):
+            assert metrics[name] == pytest.approx(float(expected[name]), rel=1e-9)
+
+    def test_short_history(self):
+        metrics = series_metrics(np.array([1]), np.array([100.0]), np.array([], dtype=np.int64), np.array([]))
+        assert all(value is None for value in metrics.values())
+
+
+class TestMetricsMaterializer:
+    """Тесты выборки, загрузки и записи."""
+
+    def _portfolio(self, db_session, name, calculated_at=None):
+        portfolio = Portfolio(owner_id=1, name=name, metrics_calculated_at=calculated_at)
+        db_session.add(portfolio)
+        db_session.flush()
+        account = Account(portfolio_id=portfolio.id, name="Счет", account_type=AccountType.BROKER)
+        db_session.add(account)
+        db_session.flush()
+        return portfolio, account
+
+    def test_run_updates_only_stale_portfolios(self, db_session):
+        now = datetime(2024, 7, 1, tzinfo=timezone.utc)
+        start = datetime(2024, 1, 1)
+        stale, account = self._portfolio(db_session, "Устаревший")
+        empty, _ = self._portfolio(db_session, "Без истории")
+        fresh, _ = self._portfolio(db_session, "Свежий", calculated_at=now - timedelta(hours=1))
+        # Колонки состояния метрик материализация не трогает
+        stale.twr_inception, stale.volatility, stale.max_drawdown = Decimal("7"), Decimal("12.5"), Decimal("3")
+
+        values = [1000, 1050, 2100, 2200]
+        for day, value in enumerate(values):
+            db_session.add(PortfolioSnapshot(
+                portfolio_id=stale.id, snapshot_date=start + timedelta(days=30 * day),
+                total_value=Decimal(value), total_cost=Decimal("0"), total_pnl=Decimal("0")
+            ))
+        db_session.add(Transaction(
+            account_id=account.id, ts=start + timedelta(days=45), transaction_type=TransactionType.DEPOSIT,
+            gross=Decimal("1000"), currency="RUB"
+        ))
+        db_session.commit()
+
+        report = MetricsMaterializer(db_session, max_workers=1, chunk_size=2).run(now=now)
+
+        assert (report.portfolios, report.with_history, report.chunks) == (2, 1, 1)
+        for portfolio in (stale, empty, fresh):
+            db_session.refresh(portfolio)
+
+        assert (stale.twr_inception, stale.volatility, stale.max_drawdown) == (Decimal("7"), Decimal("12.5"), Decimal("3"))
+        assert float(stale.twr_1m) == pytest.approx((2200 / 2100 - 1) * 100, abs=1e-6)
+        expected_xirr = xirr([-1000, -1000, 2200], [start, start + timedelta(days=45), start + timedelta(days=90)])
+        assert float(stale.xirr) == pytest.approx(expected_xirr * 100, abs=1e-5)
+        assert stale.metrics_calculated_at is not None
+
+        assert empty.twr_1m is None and empty.metrics_calculated_at is not None
+        assert fresh.twr_1m is None
+
+        assert PortfolioRepository(db_session).get_stale_portfolio_ids(now - timedelta(hours=20)) == []
+
+    def test_postgresql_update_from_values(self):
+        """В PostgreSQL блок записывается одним UPDATE ... FROM (VALUES ...)."""
+        executed = []
+        session = SimpleNamespace(
+            get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")),
+            execute=lambda stmt, *args: executed.append(stmt),
+            flush=lambda: None
+        )
+        rows = [{"id": i, "twr_1y": Decimal("1.5"), "xirr": None} for i in (1, 2)]
+
+        PortfolioRepository(session).bulk_update_metrics(rows)
+
+        sql = str(executed[0].compile(dialect=postgresql.dialect()))
+        assert len(executed) == 1
+        assert "FROM (VALUES" in sql and "CAST(v.xirr AS DECIMAL(10, 6))" in sql
@@ -0,0 +1,88 @@
+"""Тесты целочисленного представления денежных сумм."""
+
+from decimal import ROUND_HALF_EVEN, Decimal
+
+import numpy as np
+import pytest
+
+from app.core.money import (
+    MONEY_DIGITS,
+    PRICE_DIGITS,
+    QUANTITY_DIGITS,
+    from_units,
+    mul_div,
+    round_div,
+    to_units,
+    to_units_array,
+    value_units,
+    value_units_array,
+)
+from app.services.tax_calculator_rf import TaxCalculatorRF
+
+
+class TestMoneyUnits:
+    """Тесты преобразований и округления."""
+
+    def test_round_trip_and_half_even(self):
+        assert to_units(Decimal("12.34567891"), QUANTITY_DIGITS) == 1234567891
+        assert from_units(1234567891, QUANTITY_DIGITS) == Decimal("12.34567891")
+        assert to_units(Decimal("0.00005"), MONEY_DIGITS) == 0
+        assert to_units(Decimal("0.00015"), MONEY_DIGITS) == 2
+        assert to_units(0.1, MONEY_DIGITS) == 1000
+        assert [round_div(n, 2) for n in (1, 3, -1, -3)] == [0, 2, 0, -2]
+
+    def test_array_value_matches_decimal(self):
+        """Стоимость массивов int64 совпадает с Decimal до последней единицы."""
+        rng = np.random.default_rng(1)
+        quantities = rng.integers(-10 ** 13, 10 ** 13, 5000)
+        prices = rng.integers(0, 10 ** 13, 5000)
+        quantities[:500] = 5 * 10 ** 7  # половина лота - проверка ничьих
+
+        values = value_units_array(quantities, prices)
+
+        for q, p, v in zip(quantities.tolist(), prices.tolist(), values.tolist()):
+            exact = from_units(q, QUANTITY_DIGITS) * from_units(p, PRICE_DIGITS)
+            assert from_units(v, MONEY_DIGITS) == exact.quantize(Decimal("0.0001"), ROUND_HALF_EVEN)
+            assert v == value_units(q, p)
+
+    def test_overflow_is_reported(self):
+        with pytest.raises(OverflowError):
+            to_units_array([Decimal("1e12")], QUANTITY_DIGITS)
+
+
+class TestFifoInUnits:
+    """FIFO налогового калькулятора в целых единицах."""
+
+    def _tx(self, kind, quantity, price, commission="0", day=1):
+        class Tx:
+            pass
+        tx = Tx()
+        tx.symbol, tx.type, tx.date = "SBER", kind, day
+        tx.quantity, tx.price, tx.commission = Decimal(quantity), Decimal(price), Decimal(commission)
+        return tx
+
+    def test_partial_lots_allocate_commissions_exactly(self):
+        """Доли комиссий по лотам в сумме равны исходным комиссиям."""
+        transactions = [
+            self._tx("buy", "3", "100", commission="1", day=1),
+            self._tx("buy", "3", "110", commission="1", day=2),
+            self._tx("sell", "7", "120", commission="1", day=3),
+        ]
+
+        pnl = TaxCalculatorRF()._calculate_stock_pnl(transactions)
+
+        # Закрыто 6 из 7: выручка 720 минус доля комиссии продажи 6/7
+        sell_commission = Decimal(mul_div(6, 10000, 7)).scaleb(-MONEY_DIGITS)
+        assert pnl == Decimal("720") - Decimal("630") - Decimal("2") - sell_commission
+
+    def test_fractional_quantities(self):
+        transactions = [
+            self._tx("buy", "0.12345678", "50000", day=1),
+            self._tx("sell", "0.1", "51000", day=2),
+            self._tx("sell", "0.02345678", "49000", day=3),
+        ]
+
+        pnl = TaxCalculatorRF()._calculate_stock_pnl(transactions)
+
+        # Выручка второй продажи 1149.38222 округляется до 1149.3822
+        assert pnl == Decimal("100") + Decimal("1149.3822") - Decimal("1172.839")
@@ -0,0 +1,121 @@
+"""Тесты оптимизатора эффективной границы."""
+
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+
+from app.core.cache import LRUTTLCache
+from app.services.portfolio_optimizer import (
+    EfficientFrontierOptimizer,
+    OptimizationConstraints,
+    ParametricQP,
+)
+
+
+def _universe(n: int = 12, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0.0005, 0.01, (400, n)) @ (np.eye(n) + 0.2 * rng.normal(size=(n, n)))
+    return x.mean(axis=0), np.cov(x.T)
+
+
+def _reference(mu, cov, risk_aversion, cap, bond_mask=None, bond_bounds=None):
+    """Решение той же задачи через SLSQP."""
+    n = len(mu)
+    P = cov / np.mean(np.diag(cov))
+    constraints = [{"type": "eq", "fun": lambda w: w.sum() - 1}]
+    if bond_mask is not None:
+        constraints += [
+            {"type": "ineq", "fun": lambda w: bond_mask @ w - bond_bounds[0]},
+            {"type": "ineq", "fun": lambda w: bond_bounds[1] - bond_mask @ w},
+        ]
+    result = minimize(
+        lambda w: 0.5 * w @ P @ w - risk_aversion * mu @ w, np.full(n, 1 / n), method="SLSQP",
+        bounds=[(0, cap)] * n, constraints=constraints, options={"ftol": 1e-14, "maxiter": 1000}
+    )
+    return result.x
+
+
+class TestEfficientFrontier:
+    """Тесты построения границы."""
+
+    def test_points_match_reference_solver(self):
+        """Точки границы совпадают с решением SLSQP при ограничениях на веса и классы."""
+        mu, cov = _universe()
+        classes = ["STOCK"] * 6 + ["BOND"] * 6
+        constraints = OptimizationConstraints(max_weight=0.2, asset_class_bounds=(("BOND", 0.3, 0.6),))
+
+        frontier = EfficientFrontierOptimizer(cache=LRUTTLCache()).frontier(
+            range(12), mu, cov, classes, constraints, n_points=15
+        )
+
+        bond_mask = np.array([c == "BOND" for c in classes], dtype=float)
+        for point in frontier.points[:8]:
+            expected = _reference(mu * 252, cov * 252, point.risk_aversion, 0.2, bond_mask, (0.3, 0.6))
+            assert point.weights == pytest.approx(expected, abs=1e-4)
+            assert point.weights.sum() == pytest.approx(1.0)
+            assert point.weights.max() <= 0.2 + 1e-6
+            assert 0.3 - 1e-6 <= bond_mask @ point.weights <= 0.6 + 1e-6
+
+    def test_frontier_ordered_and_profiles(self):
+        """Граница упорядочена по риску, агрессивный профиль рискованнее консервативного."""
+        mu, cov = _universe()
+        frontier = EfficientFrontierOptimizer(cache=LRUTTLCache()).frontier(range(12), mu, cov)
+
+        volatility = [point.volatility for point in frontier.points]
+        returns = [point.expected_return for point in frontier.points]
+        assert volatility == sorted(volatility)
+        assert returns == pytest.approx(sorted(returns), abs=1e-9)
+        conservative = frontier.for_risk_tolerance("conservative")
+        aggressive = frontier.for_risk_tolerance("aggressive")
+        assert conservative.volatility < aggressive.volatility
+        assert frontier.for_risk_tolerance("aggressive", investment_horizon=15).volatility >= aggressive.volatility
+
+    def test_infeasible_cap_rejected(self):
+        mu, cov = _universe(4)
+        with pytest.raises(ValueError):
+            EfficientFrontierOptimizer(cache=LRUTTLCache()).frontier(
+                range(4), mu, cov, constraints=OptimizationConstraints(max_weight=0.2)
+            )
+
+
+class TestFrontierCache:
+    """Тесты кэша и теплого старта."""
+
+    def test_cached_per_version_and_warm_started(self):
+        """Та же версия данных - из кэша, новая версия - теплый старт и меньше итераций."""
+        mu, cov = _universe()
+        optimizer = EfficientFrontierOptimizer(cache=LRUTTLCache())
+        constraints = OptimizationConstraints(max_weight=0.3)
+
+        cold = optimizer.frontier(range(12), mu, cov, constraints=constraints, data_version=1)
+        assert optimizer.frontier(range(12), mu, cov, constraints=constraints, data_version=1) is cold
+
+        warm = optimizer.frontier(range(12), mu * 1.01, cov, constraints=constraints, data_version=2)
+        fresh = EfficientFrontierOptimizer(cache=LRUTTLCache()).frontier(
+            range(12), mu * 1.01, cov, constraints=constraints
+        )
+
+        assert warm.iterations < cold.iterations
+        assert warm.min_variance().weights == pytest.approx(fresh.min_variance().weights, abs=1e-5)
+        assert warm.max_sharpe().sharpe_ratio == pytest.approx(fresh.max_sharpe().sharpe_ratio, rel=1e-4)
+
+    def test_unconverged_frontier_not_cached(self, monkeypatch):
+        """Точки, не сошедшиеся и после холодного старта, помечают границу и не попадают в кэш."""
+        mu, cov = _universe()
+        solve = ParametricQP.solve
+        calls = []
+
+        def limited(qp, q, warm=None, **kwargs):
+            calls.append(warm is not None)
+            return solve(qp, q, warm, max_iterations=30)
+
+        monkeypatch.setattr(ParametricQP, "solve", limited)
+        cache = LRUTTLCache()
+        frontier = EfficientFrontierOptimizer(cache=cache).frontier(
+            range(12), mu, cov, constraints=OptimizationConstraints(max_weight=0.3), data_version=1
+        )
+
+        assert not frontier.converged
+        assert len(cache) == 0
+        # После неудачи с теплого старта та же точка решается с нуля
+        assert calls[1:3] == [True, False]
@@ -0,0 +1,110 @@
+"""Тесты пакетной загрузки цен."""
+
+import io
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from app.core.cache import LRUTTLCache
+from app.models.instrument import Instrument, InstrumentType
+from app.models.price import LastPrice, Price
+from app.repositories.price import PriceRepository, price_partition_name
+from app.services import scenario_replay
+from app.services.covariance_service import CovarianceService
+from app.services.price_ingest import PriceIngestService
+from app.services.quotes import quotes_version
+
+
+def _row(instrument_id, day, close, hour=18):
+    return {"instrument_id": instrument_id, "ts": datetime(2024, 3, day, hour, tzinfo=timezone.utc),
+            "close": Decimal(close), "currency": "RUB", "source": "test"}
+
+
+@pytest.fixture
+def instruments(db_session):
+    sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+    aapl = Instrument(ticker="AAPL", name="Apple", instrument_type=InstrumentType.EQUITY, currency="USD")
+    db_session.add_all([sber, aapl])
+    db_session.commit()
+    return sber.id, aapl.id
+
+
+class TestPriceIngestService:
+    """Тесты загрузки пачками, идемпотентности и разбора CSV."""
+
+    def test_batches_are_idempotent(self, db_session, instruments):
+        sber, aapl = instruments
+        rows = [_row(sber, day, 300 + day) for day in range(1, 11)] + [_row(aapl, 4, "170")]
+        service = PriceIngestService(db_session, batch_size=4)
+
+        report = service.ingest(rows)
+        again = service.ingest(rows)
+
+        assert (report.rows, report.batches) == (11, 3)
+        assert again.rows == 11
+        assert db_session.execute(select(func.count()).select_from(Price)).scalar() == 11
+        last = {row.instrument_id: row.close for row in db_session.execute(select(LastPrice)).scalars()}
+        assert last == {sber: Decimal("310"), aapl: Decimal("170")}
+
+    def test_last_row_wins_within_batch(self, db_session, instruments):
+        sber, _ = instruments
+        version = quotes_version()
+
+        PriceIngestService(db_session).ingest([_row(sber, 4, "300"), _row(sber, 4, "301"), _row(sber, 4, "302", hour=19)])
+
+        closes = db_session.execute(select(Price.close).order_by(Price.ts)).scalars().all()
+        assert closes == [Decimal("301"), Decimal("302")]
+        assert quotes_version() > version
+
+    def test_updates_covariance_and_scenario_caches(self, db_session, instruments):
+        sber, aapl = instruments
+        service = PriceIngestService(db_session)
+        service.ingest([_row(sber, day, 300 + day % 3) for day in range(1, 8)]
+                       + [_row(aapl, day, 170 - day % 4) for day in range(1, 8)])
+        CovarianceService(db_session, cache=LRUTTLCache()).build([sber, aapl], "ledoit_wolf", end_date=date(2024, 3, 7))
+
+        scenario_replay._matrix_cache[("stale",)] = None
+        service.ingest([_row(sber, 8, "305"), _row(aapl, 8, "171")])
+
+        estimate = CovarianceService(db_session, cache=LRUTTLCache()).get([sber, aapl], "ledoit_wolf")
+        assert (estimate.as_of, estimate.observations) == (date(2024, 3, 8), 7)
+        assert len(scenario_replay._matrix_cache) == 0
+
+    def test_csv_by_ticker(self, db_session, instruments):
+        sber, aapl = instruments
+        stream = io.StringIO(
+            "ticker,ts,close\n"
+            "SBER,2024-03-04,300.5\n"
+            "AAPL,2024-03-04T21:00:00+03:00,170\n"
+            "UNKNOWN,2024-03-04,1\n"
+        )
+
+        report = PriceIngestService(db_session).ingest_csv(stream, source="moex")
+
+        assert (report.rows, report.skipped) == (2, 1)
+        prices = {p.instrument_id: p for p in db_session.execute(select(Price)).scalars()}
+        assert prices[sber].close == Decimal("300.5")
+        assert prices[aapl].currency == "USD"
+        assert prices[aapl].ts.replace(tzinfo=timezone.utc) == datetime(2024, 3, 4, 18, tzinfo=timezone.utc)
+
+    def test_postgresql_monthly_partitions(self):
+        executed = []
+        session = SimpleNamespace(execute=lambda stmt: executed.append(stmt))
+        repo = PriceRepository(session)
+
+        created = repo.ensure_partitions([(2031, 12), (2031, 12), (2032, 1)])
+        retried = repo.ensure_partitions([(2032, 1)])  # не зафиксировано - проверяется снова
+        repo.remember_partitions(created)
+        again = repo.ensure_partitions([(2032, 1)])
+
+        sql = [str(stmt.compile(dialect=postgresql.dialect())) for stmt in executed]
+        assert created == ["prices_y2031m12", "prices_y2032m01"]
+        assert (retried, again) == (["prices_y2032m01"], [])
+        assert price_partition_name(2031, 12) == "prices_y2031m12"
+        assert sql[0] == ("CREATE TABLE IF NOT EXISTS prices_y2031m12 PARTITION OF prices "
+                          "FOR VALUES FROM ('2031-12-01T00:00:00+00:00') TO ('2032-01-01T00:00:00+00:00')")
+        assert len(sql) == 3
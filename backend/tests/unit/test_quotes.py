@@ -0,0 +1,99 @@
+"""Тесты текущих котировок: last_prices и процессного кэша."""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from app.core.cache import LRUTTLCache
+from app.models.account import Account, AccountType
+from app.models.holding import Holding
+from app.models.instrument import Instrument, InstrumentType
+from app.models.portfolio import Portfolio, PortfolioSnapshot
+from app.models.price import LastPrice, Price
+from app.repositories.price import PriceRepository
+from app.services.price_ingest import PriceIngestService
+from app.services.quotes import QuoteService
+from app.services.valuation import DailyValuationService
+
+
+def _row(instrument_id, day, close, currency="RUB"):
+    return {"instrument_id": instrument_id, "ts": datetime(2024, 3, day, 18, tzinfo=timezone.utc),
+            "close": Decimal(close), "currency": currency, "source": "test"}
+
+
+@pytest.fixture
+def instruments(db_session):
+    sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+    gazp = Instrument(ticker="GAZP", name="Газпром", instrument_type=InstrumentType.EQUITY, currency="RUB")
+    db_session.add_all([sber, gazp])
+    db_session.commit()
+    return sber.id, gazp.id
+
+
+class TestQuoteService:
+    """Тесты загрузки цен, материализации и кэша."""
+
+    def test_ingest_updates_last_prices_only_forward(self, db_session, instruments):
+        sber, gazp = instruments
+        service = QuoteService(db_session, cache=LRUTTLCache())
+        ingest = PriceIngestService(db_session)
+
+        ingest.ingest([_row(sber, 4, "300"), _row(sber, 5, "310"), _row(gazp, 4, "150")])
+        ingest.ingest([_row(sber, 1, "250"), _row(gazp, 4, "151")])  # история и исправление
+
+        assert len(db_session.execute(select(Price)).scalars().all()) == 4
+        assert service.get_prices([sber, gazp]) == {sber: Decimal("310"), gazp: Decimal("151")}
+        assert service.get_quote(sber).ts.day == 5
+
+    def test_cache_reads_through_and_invalidates_on_ingest(self, db_session, instruments):
+        sber, gazp = instruments
+        cache = LRUTTLCache()
+        service = QuoteService(db_session, cache=cache)
+        ingest = PriceIngestService(db_session)
+        ingest.ingest([_row(sber, 4, "300")])
+
+        assert service.get_prices([sber, gazp]) == {sber: Decimal("300")}
+        misses = cache.misses
+        assert service.get_prices([sber, gazp]) == {sber: Decimal("300")}
+        assert cache.misses == misses  # оба инструмента, включая без цены, из кэша
+
+        ingest.ingest([_row(sber, 5, "320"), _row(gazp, 5, "160")])
+
+        assert service.get_prices([sber, gazp]) == {sber: Decimal("320"), gazp: Decimal("160")}
+
+    def test_refresh_from_history(self, db_session, instruments):
+        sber, gazp = instruments
+        db_session.add_all([Price(**_row(sber, 1, "250")), Price(**_row(sber, 3, "270")),
+                            Price(**_row(gazp, 2, "140"))])
+        db_session.flush()
+
+        PriceRepository(db_session).refresh_last_prices()
+
+        last = {row.instrument_id: row.close for row in db_session.execute(select(LastPrice)).scalars()}
+        assert last == {sber: Decimal("270"), gazp: Decimal("140")}
+
+    def test_current_day_valuation_reads_last_prices(self, db_session, instruments):
+        sber, _ = instruments
+        portfolio = Portfolio(owner_id=1, name="Сегодня")
+        db_session.add(portfolio)
+        db_session.flush()
+        account = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER)
+        db_session.add(account)
+        db_session.flush()
+        db_session.add(Holding(account_id=account.id, instrument_id=sber, quantity=Decimal(10),
+                               avg_price=Decimal(250), currency="RUB"))
+        # Цена только в last_prices: текущая оценка не читает историю prices
+        db_session.add(LastPrice(instrument_id=sber, ts=datetime.now(timezone.utc), close=Decimal(300), currency="RUB"))
+        db_session.commit()
+
+        today = DailyValuationService(db_session).run(datetime.now(timezone.utc).date())
+        past = DailyValuationService(db_session).run(date(2024, 3, 5))
+
+        snapshots = db_session.execute(
+            select(PortfolioSnapshot).order_by(PortfolioSnapshot.snapshot_date)
+        ).scalars().all()
+        # На прошлую дату истории цен нет - снимок пропущен, а не записан нулевым
+        assert (today.skipped_portfolios, past.skipped_portfolios) == (0, 1)
+        assert [float(s.total_value) for s in snapshots] == [3000.0]
@@ -0,0 +1,105 @@
+"""Тесты risk parity и HRP распределений."""
+
+import numpy as np
+import pytest
+
+from app.core.cache import LRUTTLCache
+from app.services.risk_parity import (
+    RiskParityEngine,
+    cluster_tree,
+    recursive_bisection,
+    risk_contributions,
+    risk_parity_weights,
+)
+
+
+def _covariance(n: int = 20, seed: int = 2) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 0.01, (500, n)) @ (np.eye(n) + 0.2 * rng.normal(size=(n, n)))
+    return np.cov(x.T)
+
+
+def _reference_hrp(covariance: np.ndarray, order) -> np.ndarray:
+    """Рекурсивная бисекция в исходной формулировке (списки индексов)."""
+    weights = np.ones(len(order))
+    clusters = [list(order)]
+    while clusters:
+        clusters = [c[start:end] for c in clusters for start, end in ((0, len(c) // 2), (len(c) // 2, len(c)))
+                    if len(c) > 1]
+        for i in range(0, len(clusters), 2):
+            variances = []
+            for items in (clusters[i], clusters[i + 1]):
+                ivp = 1 / np.diag(covariance)[items]
+                ivp /= ivp.sum()
+                variances.append(ivp @ covariance[np.ix_(items, items)] @ ivp)
+            alpha = 1 - variances[0] / sum(variances)
+            weights[clusters[i]] *= alpha
+            weights[clusters[i + 1]] *= 1 - alpha
+    return weights
+
+
+class TestRiskParity:
+    """Тесты равного вклада в риск."""
+
+    def test_equal_risk_contributions(self):
+        covariance = _covariance()
+        weights = risk_parity_weights(covariance)
+
+        assert weights.sum() == pytest.approx(1.0)
+        assert (weights > 0).all()
+        assert risk_contributions(weights, covariance) == pytest.approx(np.full(20, 0.05), abs=1e-9)
+
+    def test_custom_budgets(self):
+        covariance = _covariance(4)
+        budgets = np.array([0.4, 0.3, 0.2, 0.1])
+
+        weights = risk_parity_weights(covariance, budgets)
+
+        assert risk_contributions(weights, covariance) == pytest.approx(budgets, abs=1e-9)
+
+    def test_diagonal_covariance_is_inverse_volatility(self):
+        volatility = np.array([0.1, 0.2, 0.4])
+        weights = risk_parity_weights(np.diag(volatility ** 2))
+
+        expected = (1 / volatility) / (1 / volatility).sum()
+        assert weights == pytest.approx(expected)
+
+
+class TestHierarchicalRiskParity:
+    """Тесты HRP."""
+
+    def test_bisection_matches_reference(self):
+        covariance = _covariance()
+        tree = cluster_tree(list(range(20)), covariance)
+
+        weights = recursive_bisection(covariance, tree.order)
+
+        assert sorted(tree.order.tolist()) == list(range(20))
+        assert weights.sum() == pytest.approx(1.0)
+        assert weights == pytest.approx(_reference_hrp(covariance, tree.order))
+
+    def test_correlated_block_clustered_together(self):
+        """Сильно коррелированные инструменты стоят рядом в квази-диагональном порядке."""
+        rng = np.random.default_rng(0)
+        factor = rng.normal(0, 0.01, (500, 1))
+        x = rng.normal(0, 0.01, (500, 6))
+        x[:, [0, 3, 5]] += 3 * factor
+        tree = cluster_tree(list(range(6)), np.cov(x.T))
+
+        positions = {int(item): i for i, item in enumerate(tree.order)}
+        block = sorted(positions[i] for i in (0, 3, 5))
+        assert block[-1] - block[0] == 2
+
+    def test_tree_cached_between_reweights(self):
+        """Повторный расчет берет дерево из кэша и пересчитывает только бисекцию."""
+        covariance = _covariance()
+        cache = LRUTTLCache()
+        engine = RiskParityEngine(cache=cache)
+
+        first = engine.hrp(range(100, 120), covariance)
+        shifted = covariance * 1.1
+        second = engine.hrp(range(100, 120), shifted)
+
+        assert cache.hits == 1
+        assert second == pytest.approx(first)
+        assert len(cache) == 1
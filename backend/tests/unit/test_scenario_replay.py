@@ -0,0 +1,111 @@
+"""Тесты библиотеки исторических стресс-сценариев."""
+
+import asyncio
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models.instrument import Instrument, InstrumentType
+from app.models.price import Price
+from app.services.analytics_engine import AnalyticsEngine
+from app.services.scenario_replay import (
+    HISTORICAL_SCENARIOS,
+    HistoricalScenario,
+    HistoricalScenarioLibrary,
+    build_scenario_matrix,
+    clear_scenario_cache,
+    resolve_scenarios,
+)
+
+
+SCENARIO = HistoricalScenario(key="test", name="Тест", start=date(2020, 3, 2), end=date(2020, 3, 6))
+
+
+@pytest.fixture
+def prices():
+    index = pd.to_datetime(["2020-02-27", "2020-02-28", "2020-03-03", "2020-03-06", "2020-03-09"])
+    return pd.DataFrame(
+        {
+            "SBER": [100.0, 98.0, 90.0, 80.0, 70.0],
+            "GAZP": [50.0, np.nan, np.nan, 45.0, 40.0],    # Пропуски - берется цена as-of
+            "NEW": [np.nan, np.nan, np.nan, 10.0, 11.0],   # Нет цены до начала эпизода
+        },
+        index=index,
+    )
+
+
+class TestScenarioMatrix:
+    """Тесты построения и оценки матрицы сценариев."""
+
+    def test_as_of_returns(self, prices):
+        """Доходность считается от последней цены до начала эпизода до цены на конец."""
+        matrix = build_scenario_matrix(prices, [SCENARIO])
+
+        assert matrix.returns.dtype == np.float32
+        assert matrix.returns[0].tolist() == pytest.approx([80 / 98 - 1, 45 / 50 - 1, 0.0])
+        assert matrix.covered[0].tolist() == [True, True, False]
+
+    def test_stale_prices_not_used(self, prices):
+        """Слишком старая цена не считается котировкой на дату сценария."""
+        matrix = build_scenario_matrix(prices, [SCENARIO], max_staleness_days=3)
+
+        assert matrix.covered[0].tolist() == [True, False, False]
+
+    def test_evaluate_is_weighted_sum(self, prices):
+        """Влияние на портфель - скалярное произведение доходностей на веса."""
+        matrix = build_scenario_matrix(prices, [SCENARIO])
+        weights = {"SBER": 0.5, "GAZP": 0.3, "NEW": 0.2}
+
+        result = matrix.evaluate(weights)["test"]
+
+        assert result["portfolio_impact"] == pytest.approx(0.5 * (80 / 98 - 1) + 0.3 * (45 / 50 - 1))
+        assert result["coverage"] == pytest.approx(0.8)
+        assert result["individual_impacts"]["NEW"] == 0.0
+
+    def test_unknown_scenario_rejected(self):
+        """Неизвестный ключ сценария - ошибка."""
+        with pytest.raises(ValueError):
+            resolve_scenarios(["crash_1929"])
+
+    def test_stress_test_portfolio_replays_history(self):
+        """stress_test_portfolio проигрывает исторический эпизод по переданным ценам."""
+        index = pd.bdate_range("2020-01-01", "2020-04-30")
+        prices = pd.DataFrame({"SBER": np.linspace(100, 60, len(index))}, index=index)
+        covid = HISTORICAL_SCENARIOS["covid_2020"]
+
+        result = asyncio.run(AnalyticsEngine().stress_test_portfolio(
+            {"SBER": 1.0}, prices, [{"name": "Март 2020", "type": "historical", "scenario": "covid_2020"}]
+        ))
+
+        before = prices["SBER"][prices.index < pd.Timestamp(covid.start)].iloc[-1]
+        after = prices["SBER"][prices.index <= pd.Timestamp(covid.end)].iloc[-1]
+        assert result["Март 2020"]["portfolio_impact"] == pytest.approx(after / before - 1, rel=1e-6)
+
+
+class TestHistoricalScenarioLibrary:
+    """Тесты загрузки сценариев из таблицы prices."""
+
+    def test_replay_from_prices_table_cached(self, db_session):
+        """Матрица строится по таблице prices и переиспользуется из кэша."""
+        clear_scenario_cache()
+        instrument = Instrument(ticker="SBER", name="Сбербанк",
+                                instrument_type=InstrumentType.EQUITY, currency="RUB")
+        db_session.add(instrument)
+        db_session.flush()
+        for ts, close in [(datetime(2014, 11, 28), "50"), (datetime(2014, 12, 16), "40"),
+                          (datetime(2014, 12, 30), "45")]:
+            db_session.add(Price(instrument_id=instrument.id, ts=ts.replace(tzinfo=timezone.utc),
+                                 close=Decimal(close), currency="RUB", source="test"))
+        db_session.flush()
+
+        library = HistoricalScenarioLibrary(db_session)
+        result = library.replay({instrument.id: 1.0}, ["rub_2014", "covid_2020"])
+
+        assert result["rub_2014"]["portfolio_impact"] == pytest.approx(45 / 50 - 1)
+        assert result["covid_2020"]["coverage"] == 0.0
+        assert library.get_matrix([instrument.id], ["rub_2014", "covid_2020"]) is \
+            library.get_matrix([instrument.id], ["rub_2014", "covid_2020"])
+        clear_scenario_cache()
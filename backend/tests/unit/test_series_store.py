@@ -0,0 +1,82 @@
+"""Тесты колоночного хранилища рядов стоимости."""
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.models.portfolio import Portfolio, PortfolioSnapshot
+from app.services.series_store import SERIES_DTYPE, SERIES_MAGIC, SeriesStore, day_number, series_records
+
+
+START = date(2005, 1, 1)
+
+
+def _records(days, base=1000):
+    return series_records(
+        [START + timedelta(days=d) for d in days],
+        [Decimal(base + d) for d in days],
+        [Decimal(base) for _ in days]
+    )
+
+
+class TestSeriesStore:
+    """Тесты чтения, дозаписи и слияния рядов."""
+
+    def test_memory_mapped_read_of_long_series(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        days = range(20 * 365)
+        store.write(1, _records(days))
+
+        records = store.read(1)
+        dates, values = store.values(1, START + timedelta(days=100), START + timedelta(days=109))
+
+        assert isinstance(records, np.memmap) and len(records) == 20 * 365
+        assert store.path(1).stat().st_size == len(SERIES_MAGIC) + 20 * 365 * SERIES_DTYPE.itemsize
+        assert dates.tolist()[0] == START + timedelta(days=100)
+        assert values.tolist() == [1000.0 + d for d in range(100, 110)]
+        assert len(store.read(2)) == 0
+
+    def test_append_replaces_last_day_and_merges_history(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        store.append(1, _records([10, 11, 12]))
+
+        store.append(1, _records([12, 13], base=2000))  # дозапись с заменой последнего дня
+        store.append(1, _records([5, 11], base=3000))  # восстановленная история
+
+        records = store.read(1)
+        assert records["day"].tolist() == [day_number(START) + d for d in (5, 10, 11, 12, 13)]
+        assert (records["value"] // 10000).tolist() == [3005, 1010, 3011, 2012, 2013]
+
+    def test_torn_tail_is_ignored_and_overwritten(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        store.append(1, _records([1, 2]))
+        with open(store.path(1), "ab") as f:
+            f.write(b"\x01\x02\x03")
+
+        assert len(store.read(1)) == 2
+        store.append(1, _records([3]))
+        assert store.path(1).stat().st_size == len(SERIES_MAGIC) + 3 * SERIES_DTYPE.itemsize
+
+    def test_sync_from_snapshots(self, db_session, tmp_path):
+        portfolio = Portfolio(owner_id=1, name="Ряд")
+        db_session.add(portfolio)
+        db_session.flush()
+        for day in range(3):
+            db_session.add(PortfolioSnapshot(
+                portfolio_id=portfolio.id,
+                snapshot_date=datetime(2024, 1, 1 + day, tzinfo=timezone.utc),
+                total_value=Decimal("100.1234") + day, total_cost=Decimal(100), total_pnl=Decimal(day)
+            ))
+        db_session.commit()
+        store = SeriesStore(str(tmp_path))
+
+        assert store.sync_from_snapshots(db_session, [portfolio.id, portfolio.id + 1]) == 3
+        records = store.read(portfolio.id)
+        assert records["value"].tolist() == [1001234, 1011234, 1021234]
+        assert records["cost"].tolist() == [1000000] * 3
+
+    def test_requires_directory(self):
+        with pytest.raises(ValueError):
+            SeriesStore()
@@ -0,0 +1,142 @@
+"""Тесты восстановления истории снимков по транзакциям."""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app.models.account import Account, AccountType
+from app.models.instrument import Instrument, InstrumentType
+from app.models.portfolio import Portfolio, PortfolioMetricState, PortfolioSnapshot
+from app.models.price import Price
+from app.models.transaction import Transaction, TransactionType
+from app.services.snapshot_backfill import ReplayInput, SnapshotBackfillService, replay
+
+
+def _empty(dtype=np.float64):
+    return np.array([], dtype=dtype)
+
+
+class TestReplayKernel:
+    """Тесты векторного воспроизведения."""
+
+    def test_matches_day_by_day_loop(self):
+        rng = np.random.default_rng(2)
+        days = np.arange(100, 400, dtype=np.int64)
+        n = 20
+        change_day = np.sort(rng.integers(95, 400, 300))
+        change_instrument = rng.integers(0, n, 300)
+        change_quantity = rng.integers(1, 50, 300).astype(float)
+        price_day = np.repeat(np.arange(80, 400, 3), n)
+        price_instrument = np.tile(np.arange(n), len(price_day) // n)
+        price_close = rng.uniform(10, 100, len(price_day))
+        data = ReplayInput(
+            portfolio_id=1, days=days, instrument_currency=np.zeros(n, dtype=np.int64),
+            base_currency=0, quote_currency=0, n_currencies=1,
+            change_day=change_day, change_instrument=change_instrument, change_quantity=change_quantity,
+            price_day=price_day, price_instrument=price_instrument, price_close=price_close,
+            cash_day=np.array([100]), cash_currency=np.array([0]), cash_amount=np.array([1000.0]),
+            cash_external=np.array([True]),
+            fx_day=_empty(np.int64), fx_currency=_empty(np.int64), fx_rate=_empty(),
+        )
+
+        result = replay(data)
+
+        for i in (0, 57, 150, 299):
+            day = days[i]
+            quantities = np.zeros(n)
+            np.add.at(quantities, change_instrument[change_day <= day], change_quantity[change_day <= day])
+            last_price = {}
+            for d, k, p in zip(price_day, price_instrument, price_close):
+                if d <= day:
+                    last_price[k] = p
+            expected = sum(quantities[k] * last_price[k] for k in range(n) if quantities[k])
+            assert result.values[i] == pytest.approx(expected + 1000.0)
+        assert result.contributions[-1] == pytest.approx(1000.0)
+
+    def test_negative_cash_is_implied_deposit(self):
+        """Покупка без пополнения в импорте - неявное пополнение на ее сумму."""
+        data = ReplayInput(
+            portfolio_id=1, days=np.array([10, 11, 12]), instrument_currency=np.array([0]),
+            base_currency=0, quote_currency=0, n_currencies=1,
+            change_day=np.array([10]), change_instrument=np.array([0]), change_quantity=np.array([10.0]),
+            price_day=np.array([10, 12]), price_instrument=np.array([0, 0]), price_close=np.array([100.0, 110.0]),
+            cash_day=np.array([10, 11]), cash_currency=np.array([0, 0]), cash_amount=np.array([-1000.0, 50.0]),
+            cash_external=np.array([False, False]),
+            fx_day=_empty(np.int64), fx_currency=_empty(np.int64), fx_rate=_empty(),
+        )
+
+        result = replay(data)
+
+        assert result.values.tolist() == pytest.approx([1000.0, 1050.0, 1150.0])
+        assert result.flows.tolist() == pytest.approx([1000.0, 0.0, 0.0])
+
+
+class TestSnapshotBackfillService:
+    """Тесты загрузки, записи и пересчета состояния."""
+
+    def test_backfill_before_first_snapshot(self, db_session):
+        portfolio = Portfolio(owner_id=1, name="Импорт")
+        db_session.add(portfolio)
+        db_session.flush()
+        account = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER)
+        sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        aapl = Instrument(ticker="AAPL", name="Apple", instrument_type=InstrumentType.EQUITY, currency="USD")
+        usd = Instrument(ticker="USD000UTSTOM", name="Доллар", instrument_type=InstrumentType.CURRENCY, currency="RUB")
+        db_session.add_all([account, sber, aapl, usd])
+        db_session.flush()
+
+        def ts(day):
+            return datetime(2023, 1, day, 12, tzinfo=timezone.utc)
+
+        def tx(day, kind, gross, instrument=None, quantity=None, currency="RUB", fee=None):
+            return Transaction(account_id=account.id, instrument_id=instrument and instrument.id, ts=ts(day),
+                               transaction_type=kind, quantity=quantity and Decimal(quantity),
+                               gross=Decimal(gross), fee=fee and Decimal(fee), currency=currency)
+
+        db_session.add_all([
+            tx(2, TransactionType.DEPOSIT, 10000),
+            tx(3, TransactionType.BUY, 3000, sber, 10, fee=3),
+            tx(4, TransactionType.BUY, 100, aapl, 1, currency="USD"),
+            tx(5, TransactionType.DIVIDEND, 200, sber),
+            tx(6, TransactionType.SELL, 1650, sber, 5),
+            tx(9, TransactionType.DEPOSIT, 5000),
+        ])
+        for day, close in ((2, 290), (3, 300), (5, 310), (6, 330), (9, 340)):
+            db_session.add(Price(instrument_id=sber.id, ts=ts(day), close=Decimal(close), currency="RUB", source="t"))
+        db_session.add(Price(instrument_id=aapl.id, ts=ts(4), close=Decimal(100), currency="USD", source="t"))
+        db_session.add(Price(instrument_id=usd.id, ts=datetime(2022, 12, 30, tzinfo=timezone.utc),
+                             close=Decimal(70), currency="RUB", source="t"))
+        db_session.add(PortfolioSnapshot(portfolio_id=portfolio.id, snapshot_date=ts(9), total_value=Decimal(1),
+                                         total_cost=Decimal(0), total_pnl=Decimal(0)))
+        db_session.commit()
+
+        report = SnapshotBackfillService(db_session, max_workers=1).backfill([portfolio.id], date(2023, 2, 1))
+
+        snapshots = db_session.execute(
+            select(PortfolioSnapshot).where(PortfolioSnapshot.portfolio_id == portfolio.id)
+            .order_by(PortfolioSnapshot.snapshot_date)
+        ).scalars().all()
+        by_day = {s.snapshot_date.day: s for s in snapshots}
+
+        assert report.snapshots == 5
+        assert sorted(by_day) == [2, 3, 4, 5, 6, 9]
+        assert float(by_day[9].total_value) == 1  # существующий снимок не тронут
+
+        # 3 янв: 10 SBER по 300, остаток 10000 - 3000 - 3
+        assert float(by_day[3].total_value) == pytest.approx(3000 + 6997)
+        # 4 янв: покупка AAPL за 100 USD без долларового остатка - неявное пополнение по курсу 70
+        assert float(by_day[4].total_value) == pytest.approx(3000 + 6997 + 7000)
+        assert float(by_day[4].total_cost) == pytest.approx(17000)
+        # 6 янв: 5 SBER по 330, AAPL 100 USD, рубли 6997 + 200 + 1650
+        assert float(by_day[6].total_value) == pytest.approx(5 * 330 + 7000 + 6997 + 200 + 1650)
+        assert by_day[6].positions_count == 2
+
+        state = db_session.get(PortfolioMetricState, portfolio.id)
+        assert state.count == 5
+        assert state.twr_product == pytest.approx(
+            (9997 / 10000) * (16997 / (9997 + 7000)) * (17297 / 16997) * (17497 / 17297) * (1 / (17497 + 5000)),
+            rel=1e-9
+        )  # пополнение 9 янв после импорта - поток существующего снимка
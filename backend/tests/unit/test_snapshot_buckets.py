@@ -0,0 +1,81 @@
+"""Тесты выборки и прореживания снимков портфеля."""
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models.portfolio import Portfolio, PortfolioSnapshot
+from app.repositories.portfolio import PortfolioRepository
+
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)  # среда
+
+
+@pytest.fixture
+def portfolio_id(db_session):
+    portfolio = Portfolio(owner_id=1, name="История")
+    db_session.add(portfolio)
+    db_session.flush()
+    db_session.add_all([
+        PortfolioSnapshot(
+            portfolio_id=portfolio.id, snapshot_date=START + timedelta(days=day),
+            total_value=Decimal(1000 + day), total_cost=Decimal(1000), total_pnl=Decimal(day)
+        )
+        for day in range(3 * 365)
+    ])
+    db_session.commit()
+    return portfolio.id
+
+
+class TestSnapshotBuckets:
+    """Тесты порядка, прореживания и выбора разрешения."""
+
+    def test_get_snapshots_ascending_without_cap(self, db_session, portfolio_id):
+        repo = PortfolioRepository(db_session)
+
+        snapshots = repo.get_snapshots(portfolio_id)
+        latest = repo.get_snapshots(portfolio_id, limit=10)
+
+        assert len(snapshots) == 3 * 365
+        assert snapshots[0].snapshot_date.date() == START.date()
+        assert all(a.snapshot_date < b.snapshot_date for a, b in zip(snapshots, snapshots[1:]))
+        assert [s.total_value for s in latest] == [Decimal(1000 + day) for day in range(3 * 365 - 10, 3 * 365)]
+
+    def test_weekly_and_monthly_take_last_of_bucket(self, db_session, portfolio_id):
+        repo = PortfolioRepository(db_session)
+        end = START + timedelta(days=59)
+
+        _, weekly = repo.get_snapshot_buckets(portfolio_id, START, end, resolution="weekly")
+        _, monthly = repo.get_snapshot_buckets(portfolio_id, START, end, resolution="monthly")
+
+        # Недели с понедельника: воскресенье 5 янв, 12 янв, ... и последняя неполная неделя
+        assert weekly[0].snapshot_date.date().isoformat() == "2020-01-05"
+        assert all(s.snapshot_date.weekday() == 6 for s in weekly[:-1])
+        assert weekly[-1].snapshot_date.date() == end.date()
+        assert [s.snapshot_date.date().isoformat() for s in monthly] == ["2020-01-31", "2020-02-29"]
+
+    def test_auto_respects_point_budget(self, db_session, portfolio_id):
+        repo = PortfolioRepository(db_session)
+
+        assert repo.get_snapshot_buckets(portfolio_id, resolution="auto", max_points=2000)[0] == "daily"
+        resolution, weekly = repo.get_snapshot_buckets(portfolio_id, resolution="auto", max_points=200)
+        resolution_monthly, monthly = repo.get_snapshot_buckets(portfolio_id, resolution="auto", max_points=100)
+
+        assert resolution == "weekly" and len(weekly) <= 200
+        assert resolution_monthly == "monthly" and len(monthly) == 36
+        assert monthly[-1].snapshot_date.date() == (START + timedelta(days=3 * 365 - 1)).date()
+
+    def test_unknown_resolution(self, db_session, portfolio_id):
+        with pytest.raises(ValueError):
+            PortfolioRepository(db_session).get_snapshot_buckets(portfolio_id, resolution="hourly")
+
+    def test_postgresql_uses_date_trunc(self):
+        session = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")))
+
+        bucket = PortfolioRepository(session)._snapshot_bucket("weekly")
+
+        sql = str(bucket.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        assert sql == "date_trunc('week', portfolio_snapshots.snapshot_date)"
@@ -0,0 +1,112 @@
+"""Тесты Monte Carlo стресс-тестирования."""
+
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.analytics_engine import AnalyticsEngine
+from app.services.stress_engine import (
+    MonteCarloStressEngine,
+    estimate_covariance,
+    robust_cholesky,
+    scenario_parameters,
+)
+
+
+@pytest.fixture
+def historical_data():
+    rng = np.random.default_rng(5)
+    returns = rng.multivariate_normal(
+        [0.0005, 0.0003, 0.0001],
+        [[1.0e-4, 0.6e-4, 0.2e-4], [0.6e-4, 2.0e-4, 0.3e-4], [0.2e-4, 0.3e-4, 0.5e-4]],
+        500,
+    )
+    return pd.DataFrame(
+        100.0 * np.cumprod(1.0 + returns, axis=0),
+        columns=["SBER", "GAZP", "OFZ"],
+    )
+
+
+WEIGHTS = {"SBER": 0.5, "GAZP": 0.3, "OFZ": 0.2}
+
+
+class TestStressEngine:
+    """Тесты MonteCarloStressEngine."""
+
+    def test_normal_var_matches_analytic(self, historical_data):
+        """VaR нормального сценария совпадает с аналитическим квантилем."""
+        mean, covariance = estimate_covariance(historical_data)
+        weights = np.array(list(WEIGHTS.values()))
+        scenario = {"name": "vol", "type": "volatility_spike", "multiplier": 3.0, "horizon_days": 10}
+
+        result = MonteCarloStressEngine(n_paths=200_000, seed=1).run(
+            WEIGHTS, historical_data, [scenario]
+        )["vol"]
+
+        sigma = np.sqrt(weights @ covariance @ weights * 10) * 3.0
+        mu = weights @ mean * 10
+        assert result["var"][0.95] == pytest.approx(mu - 1.6449 * sigma, rel=0.02)
+        assert result["var"][0.99] == pytest.approx(mu - 2.3263 * sigma, rel=0.02)
+        assert result["cvar"][0.99] < result["var"][0.99]
+        assert sum(result["es_contributions"].values()) == pytest.approx(result["cvar"][0.95], rel=1e-3)
+
+    def test_seeded_and_independent_of_chunking(self, historical_data):
+        """Результат воспроизводим и не зависит от размера блока."""
+        scenarios = [{"name": "crash", "type": "market_crash", "magnitude": -0.3, "tail_df": 4}]
+
+        whole = MonteCarloStressEngine(n_paths=5000, seed=7).run(WEIGHTS, historical_data, scenarios)
+        chunked = MonteCarloStressEngine(n_paths=5000, seed=7, max_chunk_bytes=24 * 512).run(
+            WEIGHTS, historical_data, scenarios
+        )
+        again = MonteCarloStressEngine(n_paths=5000, seed=7, max_chunk_bytes=24 * 512).run(
+            WEIGHTS, historical_data, scenarios
+        )
+
+        assert chunked == again
+        assert chunked["crash"]["var"] == whole["crash"]["var"]
+        assert chunked["crash"]["cvar"] == pytest.approx(whole["crash"]["cvar"], rel=1e-12)
+        assert chunked["crash"]["portfolio_impact"] == pytest.approx(whole["crash"]["portfolio_impact"], rel=1e-12)
+        assert whole["crash"]["portfolio_impact"] == pytest.approx(-0.3, abs=0.01)
+        assert chunked["crash"]["portfolio_impact"] == pytest.approx(-0.3, abs=0.01)
+
+    def test_correlation_breakdown_target(self, historical_data):
+        """Разрыв корреляций подменяет корреляционную матрицу, сохраняя дисперсии."""
+        mean, covariance = estimate_covariance(historical_data)
+        params = scenario_parameters(
+            {"type": "correlation_breakdown", "correlation": 0.0}, list(WEIGHTS), mean, covariance
+        )
+
+        shocked = params.cholesky @ params.cholesky.T
+        assert shocked == pytest.approx(np.diag(np.diag(covariance)))
+
+    def test_robust_cholesky_singular(self):
+        """Вырожденная ковариация не ломает разложение."""
+        covariance = np.ones((3, 3))
+
+        factor = robust_cholesky(covariance)
+
+        assert factor @ factor.T == pytest.approx(covariance, abs=1e-6)
+
+    def test_unknown_scenario_rejected(self, historical_data):
+        """Неизвестный тип сценария - ошибка, а не нулевой шок."""
+        with pytest.raises(ValueError):
+            MonteCarloStressEngine(n_paths=10, seed=1).run(
+                WEIGHTS, historical_data, [{"name": "x", "type": "meteor"}]
+            )
+
+    def test_analytics_engine_delegates(self, historical_data):
+        """AnalyticsEngine.stress_test_portfolio сохраняет формат ответа."""
+        weights = dict(WEIGHTS, UNKNOWN=0.1)
+        scenario = {"name": "custom", "type": "custom", "asset_shocks": {"SBER": -0.5},
+                    "description": "Санкции"}
+
+        result = asyncio.run(AnalyticsEngine().stress_test_portfolio(
+            weights, historical_data, [scenario], n_paths=20_000, seed=3
+        ))["custom"]
+
+        assert result["scenario_description"] == "Санкции"
+        assert result["individual_impacts"]["UNKNOWN"] == 0.0
+        assert result["individual_impacts"]["SBER"] == pytest.approx(-0.5, abs=0.01)
+        assert result["portfolio_impact"] == pytest.approx(-0.25, abs=0.01)
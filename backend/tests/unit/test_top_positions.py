@@ -0,0 +1,126 @@
+"""Тесты выборки крупнейших позиций в БД."""
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models.account import Account, AccountType
+from app.models.holding import Holding
+from app.models.instrument import Instrument, InstrumentType
+from app.models.portfolio import Portfolio
+from app.models.price import Price
+from app.repositories.portfolio import PortfolioRepository
+from app.repositories.price import PriceRepository
+
+
+def _price(instrument, day, close, currency="RUB"):
+    return Price(instrument_id=instrument.id, ts=datetime(2024, 3, day, 18, tzinfo=timezone.utc),
+                 close=Decimal(close), currency=currency, source="test")
+
+
+class TestTopPositions:
+    """Тесты стоимости, сортировки и keyset-пагинации."""
+
+    @pytest.fixture
+    def portfolio_id(self, db_session):
+        portfolio = Portfolio(owner_id=1, name="Позиции")
+        db_session.add(portfolio)
+        db_session.flush()
+        broker = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER)
+        iis = Account(portfolio_id=portfolio.id, name="ИИС", account_type=AccountType.IRA)
+        sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        gazp = Instrument(ticker="GAZP", name="Газпром", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        aapl = Instrument(ticker="AAPL", name="Apple", instrument_type=InstrumentType.EQUITY, currency="USD")
+        new = Instrument(ticker="NEW", name="Без котировок", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        usd = Instrument(ticker="USD000UTSTOM", name="Доллар", instrument_type=InstrumentType.CURRENCY, currency="RUB")
+        db_session.add_all([broker, iis, sber, gazp, aapl, new, usd])
+        db_session.flush()
+        db_session.add_all([
+            Holding(account_id=broker.id, instrument_id=sber.id, quantity=Decimal(10), avg_price=Decimal(250), currency="RUB"),
+            Holding(account_id=iis.id, instrument_id=sber.id, quantity=Decimal(10), avg_price=Decimal(270), currency="RUB"),
+            Holding(account_id=broker.id, instrument_id=gazp.id, quantity=Decimal(100), avg_price=Decimal(180), currency="RUB"),
+            Holding(account_id=broker.id, instrument_id=aapl.id, quantity=Decimal(1), avg_price=Decimal(150), currency="USD"),
+            Holding(account_id=iis.id, instrument_id=new.id, quantity=Decimal(5), avg_price=Decimal(100), currency="RUB"),
+            _price(sber, 1, "200"), _price(sber, 4, "300"),
+            _price(gazp, 4, "150"),
+            _price(aapl, 4, "170", currency="USD"),
+            _price(usd, 4, "90"),
+        ])
+        db_session.flush()
+        PriceRepository(db_session).refresh_last_prices()
+        db_session.commit()
+        return portfolio.id
+
+    def test_values_weights_and_order(self, db_session, portfolio_id):
+        rows, total = PortfolioRepository(db_session).get_top_positions(portfolio_id, limit=10)
+
+        assert total == 4
+        assert [row["ticker"] for row in rows] == ["AAPL", "GAZP", "SBER", "NEW"]
+        by_ticker = {row["ticker"]: row for row in rows}
+        # SBER: 20 шт. по текущей цене 300, вложено 10 x 250 + 10 x 270
+        assert float(by_ticker["SBER"]["market_value"]) == pytest.approx(6000)
+        assert float(by_ticker["SBER"]["pnl"]) == pytest.approx(800)
+        assert float(by_ticker["SBER"]["pnl_percent"]) == pytest.approx(800 / 5200 * 100)
+        assert float(by_ticker["SBER"]["avg_price"]) == pytest.approx(260)
+        # AAPL в рублях по курсу 90, NEW без цены - по цене покупки
+        assert float(by_ticker["AAPL"]["market_value"]) == pytest.approx(15300)
+        assert by_ticker["NEW"]["market_price"] is None
+        assert float(by_ticker["NEW"]["pnl"]) == 0
+        total_value = 6000 + 15000 + 15300 + 500
+        assert float(by_ticker["GAZP"]["weight"]) == pytest.approx(15000 / total_value * 100)
+
+    def test_keyset_pagination(self, db_session, portfolio_id):
+        repo = PortfolioRepository(db_session)
+
+        pages, after = [], None
+        while True:
+            rows, _ = repo.get_top_positions(portfolio_id, sort_by="pnl_percent", limit=3, after=after)
+            pages.append([row["ticker"] for row in rows])
+            if len(rows) < 3:
+                break
+            after = (rows[-1]["sort_key"], rows[-1]["instrument_id"])
+
+        assert pages == [["SBER", "AAPL", "NEW"], ["GAZP"]]
+
+    def test_unvalued_position_pages_with_zero_key(self, db_session, portfolio_id):
+        account = db_session.query(Account).filter_by(portfolio_id=portfolio_id, name="Брокер").one()
+        bond = Instrument(ticker="XS123", name="Еврооблигация", instrument_type=InstrumentType.BOND, currency="EUR")
+        db_session.add(bond)
+        db_session.flush()
+        # Ни цены, ни курса EUR - стоимость позиции неизвестна
+        db_session.add(Holding(account_id=account.id, instrument_id=bond.id, quantity=Decimal(2),
+                               avg_price=Decimal(1000), currency="EUR"))
+        db_session.commit()
+        repo = PortfolioRepository(db_session)
+
+        pages, after = [], None
+        while True:
+            rows, _ = repo.get_top_positions(portfolio_id, limit=2, after=after)
+            pages.append([row["ticker"] for row in rows])
+            if len(rows) < 2:
+                break
+            after = (Decimal(str(rows[-1]["sort_key"])), rows[-1]["instrument_id"])
+
+        assert pages == [["AAPL", "GAZP"], ["SBER", "NEW"], ["XS123"]]
+        assert rows[0]["market_value"] is None and rows[0]["sort_key"] == 0
+
+    def test_unknown_sort_key(self, db_session):
+        with pytest.raises(ValueError):
+            PortfolioRepository(db_session).get_top_positions(1, sort_by="ticker")
+
+    def test_postgresql_keyset_query(self):
+        executed = []
+        session = SimpleNamespace(
+            get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")),
+            execute=lambda stmt: executed.append(stmt) or []
+        )
+
+        PortfolioRepository(session).get_top_positions(1, limit=5, after=(Decimal("100"), 7))
+
+        sql = str(executed[0].compile(dialect=postgresql.dialect()))
+        assert "FROM last_prices" in sql and "FROM prices" not in sql
+        assert "WHERE (coalesce(ranked.market_value, " in sql and "ranked.instrument_id) <" in sql
+        assert "LIMIT" in sql
@@ -0,0 +1,69 @@
+"""Тесты расчета TWR по нескольким горизонтам."""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.services.portfolio_analytics import (
+    TWR_HORIZONS,
+    CashFlow,
+    PortfolioAnalyticsService,
+    PricePoint,
+)
+
+
+def _history(days: int = 2000, seed: int = 11):
+    rng = np.random.default_rng(seed)
+    start = date(2019, 1, 1)
+    values = 100000 * np.cumprod(1 + rng.normal(0.0004, 0.01, days))
+    points = [PricePoint(date=start + timedelta(days=i), value=Decimal(str(round(v, 4))))
+              for i, v in enumerate(values)]
+    flows = [CashFlow(date=start + timedelta(days=int(d)), amount=Decimal(str(round(a, 2))))
+             for d, a in zip(rng.integers(1, days, 150), rng.uniform(-5000, 5000, 150))]
+    return points, flows
+
+
+class TestTwrHorizons:
+    """Тесты однопроходного расчета всех горизонтов."""
+
+    def test_horizons_match_single_period(self):
+        points, flows = _history()
+        service = PortfolioAnalyticsService()
+
+        result = service.calculate_twr_horizons(points, flows)
+
+        assert set(result) == set(TWR_HORIZONS) | {"twr_inception"}
+        for name, days in TWR_HORIZONS.items():
+            expected = service.calculate_twr(points, flows, days)
+            assert result[name] is not None
+            assert float(result[name]) == pytest.approx(float(expected), rel=1e-9)
+        inception = service.calculate_twr(points, flows, (points[-1].date - points[0].date).days)
+        assert float(result["twr_inception"]) == pytest.approx(float(inception), rel=1e-9)
+
+    def test_cash_flow_excluded_and_long_horizon_annualized(self):
+        """Пополнение не дает доходности; горизонт больше года - в годовых."""
+        start = date(2020, 1, 1)
+        points = [
+            PricePoint(date=start, value=Decimal("1000")),
+            PricePoint(date=start + timedelta(days=365), value=Decimal("1100")),
+            PricePoint(date=start + timedelta(days=730), value=Decimal("2210")),
+        ]
+        flows = [CashFlow(date=start + timedelta(days=400), amount=Decimal("1000"))]
+
+        result = PortfolioAnalyticsService().calculate_twr_horizons(points, flows, {"twr_2y": 730})
+
+        growth = 1.1 * 2210 / 2100
+        assert float(result["twr_2y"]) == pytest.approx((growth ** (365.25 / 730) - 1) * 100)
+
+    def test_zero_value_does_not_break_prefix(self):
+        """Нулевая стоимость обнуляет только горизонты, которые ее захватывают."""
+        start = date(2024, 1, 1)
+        values = [100, 0, 50, 55, 60]
+        points = [PricePoint(date=start + timedelta(days=i), value=Decimal(v)) for i, v in enumerate(values)]
+
+        result = PortfolioAnalyticsService().calculate_twr_horizons(points, [], {"short": 2, "long": 4})
+
+        assert float(result["short"]) == pytest.approx((60 / 50 - 1) * 100)
+        assert result["long"] == Decimal("-100")
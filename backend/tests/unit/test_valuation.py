@@ -0,0 +1,127 @@
+"""Тесты ежедневной оценки портфелей."""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from app.models.account import Account, AccountType
+from app.models.holding import Holding
+from app.models.instrument import Instrument, InstrumentType
+from app.models.portfolio import Portfolio, PortfolioMetricState, PortfolioSnapshot
+from app.models.price import Price
+from app.services.valuation import DailyValuationService
+
+
+def _price(instrument, day, close, currency="RUB"):
+    return Price(instrument_id=instrument.id, ts=datetime(2024, 3, day, 18, tzinfo=timezone.utc),
+                 close=Decimal(close), currency=currency, source="test")
+
+
+class TestDailyValuation:
+    """Тесты set-based оценки и записи снимков."""
+
+    @pytest.fixture
+    def universe(self, db_session):
+        portfolio = Portfolio(owner_id=1, name="Оценка")
+        usd_portfolio = Portfolio(owner_id=1, name="Долларовый", base_currency="USD")
+        unpriced_portfolio = Portfolio(owner_id=1, name="Без цены")
+        db_session.add_all([portfolio, usd_portfolio, unpriced_portfolio])
+        db_session.flush()
+
+        broker = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER,
+                         cash_balance=Decimal("500"))
+        iis = Account(portfolio_id=portfolio.id, name="ИИС", account_type=AccountType.IRA)
+        usd_account = Account(portfolio_id=usd_portfolio.id, name="USD", account_type=AccountType.BROKER,
+                              currency="USD", cash_balance=Decimal("10"))
+        other = Account(portfolio_id=unpriced_portfolio.id, name="Прочее", account_type=AccountType.BROKER)
+        sber = Instrument(ticker="SBER", name="Сбербанк", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        ofz = Instrument(ticker="SU26238", name="ОФЗ", instrument_type=InstrumentType.BOND, currency="RUB")
+        aapl = Instrument(ticker="AAPL", name="Apple", instrument_type=InstrumentType.EQUITY, currency="USD")
+        usd = Instrument(ticker="USD000UTSTOM", name="Доллар", instrument_type=InstrumentType.CURRENCY, currency="RUB")
+        new = Instrument(ticker="NEW", name="Без котировок", instrument_type=InstrumentType.EQUITY, currency="RUB")
+        db_session.add_all([broker, iis, usd_account, other, sber, ofz, aapl, usd, new])
+        db_session.flush()
+
+        db_session.add_all([
+            Holding(account_id=broker.id, instrument_id=sber.id, quantity=Decimal(10), avg_price=Decimal(250), currency="RUB"),
+            Holding(account_id=iis.id, instrument_id=sber.id, quantity=Decimal(5), avg_price=Decimal(280), currency="RUB"),
+            Holding(account_id=iis.id, instrument_id=ofz.id, quantity=Decimal(2), avg_price=Decimal(950), currency="RUB"),
+            Holding(account_id=broker.id, instrument_id=aapl.id, quantity=Decimal(1), avg_price=Decimal(150), currency="USD"),
+            Holding(account_id=usd_account.id, instrument_id=sber.id, quantity=Decimal(90), avg_price=Decimal(200), currency="RUB"),
+            Holding(account_id=other.id, instrument_id=new.id, quantity=Decimal(1), avg_price=Decimal(1), currency="RUB"),
+            _price(sber, 1, "290"), _price(sber, 4, "300"), _price(sber, 10, "999"),
+            _price(ofz, 2, "960"),
+            _price(aapl, 4, "170", currency="USD"),
+            _price(usd, 1, "88"), _price(usd, 4, "90"),
+        ])
+        db_session.commit()
+        return portfolio, usd_portfolio, unpriced_portfolio
+
+    def _snapshot(self, db_session, portfolio_id):
+        return db_session.execute(
+            select(PortfolioSnapshot).where(PortfolioSnapshot.portfolio_id == portfolio_id)
+        ).scalar_one()
+
+    def test_values_positions_cash_and_currencies(self, db_session, universe):
+        portfolio, usd_portfolio, unpriced_portfolio = universe
+
+        report = DailyValuationService(db_session).run(date(2024, 3, 5))
+
+        assert (report.portfolios, report.positions, report.unpriced_positions) == (3, 4, 1)
+        assert report.skipped_portfolios == 1
+
+        snapshot = self._snapshot(db_session, portfolio.id)
+        value = 15 * 300 + 2 * 960 + 170 * 90 + 500
+        cost = 10 * 250 + 5 * 280 + 2 * 950 + 150 * 90 + 500
+        assert snapshot.total_value == pytest.approx(Decimal(value))
+        assert snapshot.total_cost == pytest.approx(Decimal(cost))
+        assert snapshot.total_pnl == pytest.approx(Decimal(value - cost))
+        assert snapshot.positions_count == 3
+        assert snapshot.asset_allocation == {
+            "equity": round((4500 + 15300) / value * 100, 2),
+            "bond": round(1920 / value * 100, 2),
+            "cash": round(500 / value * 100, 2),
+        }
+        assert [p["ticker"] for p in snapshot.top_positions] == ["AAPL", "SBER", "SU26238"]
+        assert snapshot.top_positions[1]["quantity"] == 15
+
+        usd_snapshot = self._snapshot(db_session, usd_portfolio.id)
+        assert float(usd_snapshot.total_value) == pytest.approx(90 * 300 / 90 + 10)
+
+        # Без цены позиции снимок и состояние метрик не пишутся
+        assert db_session.execute(
+            select(PortfolioSnapshot).where(PortfolioSnapshot.portfolio_id == unpriced_portfolio.id)
+        ).scalar_one_or_none() is None
+        assert db_session.get(PortfolioMetricState, unpriced_portfolio.id) is None
+        assert db_session.get(PortfolioMetricState, portfolio.id) is not None
+
+    def test_partially_unpriced_portfolio_skipped(self, db_session, universe):
+        portfolio = universe[0]
+        account = db_session.execute(select(Account).where(Account.name == "ИИС")).scalar_one()
+        new_id = db_session.execute(select(Instrument.id).where(Instrument.ticker == "NEW")).scalar_one()
+        db_session.add(Holding(account_id=account.id, instrument_id=new_id, quantity=Decimal(3),
+                               avg_price=Decimal(10), currency="RUB"))
+        db_session.commit()
+
+        report = DailyValuationService(db_session).run(date(2024, 3, 5))
+
+        assert (report.unpriced_positions, report.skipped_portfolios) == (2, 2)
+        assert db_session.execute(
+            select(PortfolioSnapshot).where(PortfolioSnapshot.portfolio_id == portfolio.id)
+        ).scalar_one_or_none() is None
+
+    def test_rerun_overwrites_snapshot(self, db_session, universe):
+        portfolio = universe[0]
+        service = DailyValuationService(db_session, batch_size=1)
+        service.run(date(2024, 3, 5))
+
+        db_session.add(Price(instrument_id=db_session.execute(
+            select(Instrument.id).where(Instrument.ticker == "SU26238")).scalar_one(),
+            ts=datetime(2024, 3, 5, 12, tzinfo=timezone.utc), close=Decimal(1000), currency="RUB", source="test"))
+        db_session.commit()
+        service.run(date(2024, 3, 5))
+
+        snapshot = self._snapshot(db_session, portfolio.id)
+        assert float(snapshot.total_value) == pytest.approx(15 * 300 + 2 * 1000 + 170 * 90 + 500)
@@ -0,0 +1,130 @@
+"""Тесты расчета XIRR."""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.services.portfolio_analytics import CashFlow, PortfolioAnalyticsService, calculate_xirr
+from app.services.xirr import pack_cash_flows, xirr, xirr_batch, xirr_many, xnpv, year_fractions
+
+
+def _random_flows(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    flows = []
+    for _ in range(count):
+        k = int(rng.integers(2, 30))
+        days = np.sort(rng.integers(0, 1500, k))
+        amounts = -rng.uniform(100, 1000, k)
+        amounts[-1] = -amounts[:-1].sum() * rng.uniform(0.6, 2.0)
+        flows.append(([date(2020, 1, 1) + timedelta(days=int(d)) for d in days], amounts))
+    return flows
+
+
+class TestXirr:
+    """Тесты скалярного решателя."""
+
+    def test_single_period_matches_closed_form(self):
+        """Вложение и получение через год: XIRR = итог / вложение - 1."""
+        rate = xirr([-1000, 1150], [date(2023, 1, 1), date(2024, 1, 1)], guess=0.5)
+        assert rate == pytest.approx(1150 ** (365.25 / 365) / 1000 ** (365.25 / 365) - 1, rel=1e-9)
+
+    def test_root_zeroes_npv(self):
+        dates = [date(2024, 1, 1), date(2024, 6, 1), date(2024, 12, 1)]
+        amounts = [-10000, -5000, 18000]
+
+        rate = xirr(amounts, dates)
+
+        assert xnpv(rate, np.array(amounts, float), year_fractions(dates)) == pytest.approx(0, abs=1e-6)
+
+    def test_no_root(self):
+        """Потоки одного знака или без корня NPV - None."""
+        dates = [date(2020, 1, 1), date(2021, 1, 1), date(2022, 1, 1)]
+        assert xirr([100, 200], dates[:2]) is None
+        assert xirr([-100, 300, -250], dates) is None
+
+    def test_brent_fallback_for_deep_loss(self):
+        """Почти полная потеря: Ньютон от 10% не сходится, корень находит Брент."""
+        dates = [date(2020, 1, 1), date(2020, 3, 1), date(2021, 1, 1)]
+        amounts = np.array([-1000.0, -1000.0, 0.5])
+
+        rate = xirr(amounts, dates)
+
+        assert -1 < rate < -0.99
+        assert xnpv(rate, amounts, year_fractions(dates)) == pytest.approx(0, abs=1e-6)
+
+
+class TestXirrBatch:
+    """Тесты пакетного режима."""
+
+    def test_batch_matches_scalar(self):
+        flows = _random_flows(300)
+        flows.append(([date(2020, 1, 1), date(2021, 1, 1)], np.array([100.0, 200.0])))
+
+        rates = xirr_many(flows)
+
+        assert rates[-1] is None
+        for (dates, amounts), rate in zip(flows[:-1], rates[:-1]):
+            assert rate == pytest.approx(xirr(amounts, dates), rel=1e-8, abs=1e-10)
+
+    def test_padding_does_not_change_result(self):
+        amounts, times = pack_cash_flows(_random_flows(5, seed=3))
+        padded = np.hstack([amounts, np.zeros((5, 7))])
+        padded_times = np.hstack([times, np.full((5, 7), 3.0)])
+
+        assert xirr_batch(padded, padded_times) == pytest.approx(xirr_batch(amounts, times))
+
+
+class TestAnalyticsServiceXirr:
+    """Тесты обвязки PortfolioAnalyticsService."""
+
+    def test_module_helper_and_cash_flow_method(self):
+        flows = [
+            {"date": date(2024, 1, 1), "amount": -10000.00},
+            {"date": date(2024, 6, 1), "amount": -5000.00},
+            {"date": date(2024, 12, 1), "amount": 18000.00},
+        ]
+        rate = calculate_xirr(flows)
+
+        result = PortfolioAnalyticsService().calculate_xirr_from_cash_flows(
+            [CashFlow(date=f["date"], amount=Decimal(str(f["amount"]))) for f in flows]
+        )
+
+        assert rate > 0.2
+        assert float(result) == pytest.approx(rate * 100)
+
+    def test_performance_xirr_ignores_trades(self, db_session):
+        """Покупки и продажи внутри портфеля не входят в потоки XIRR."""
+        from datetime import datetime, timezone
+
+        from app.api.v1.endpoints.analytics import _performance_xirr
+        from app.models.account import Account, AccountType
+        from app.models.portfolio import Portfolio
+        from app.models.transaction import Transaction, TransactionType
+        from app.repositories.transaction import TransactionRepository
+        from app.services.portfolio_analytics import PricePoint
+
+        portfolio = Portfolio(owner_id=1, name="XIRR")
+        db_session.add(portfolio)
+        db_session.flush()
+        account = Account(portfolio_id=portfolio.id, name="Брокер", account_type=AccountType.BROKER)
+        db_session.add(account)
+        db_session.flush()
+        for day, kind, gross in ((1, TransactionType.DEPOSIT, 1000), (2, TransactionType.BUY, 900),
+                                 (183, TransactionType.DEPOSIT, 500), (200, TransactionType.SELL, 400)):
+            db_session.add(Transaction(
+                account_id=account.id, ts=datetime(2023, 1, 1, 12, tzinfo=timezone.utc) + timedelta(days=day),
+                transaction_type=kind, gross=Decimal(gross), currency="RUB"
+            ))
+        db_session.commit()
+
+        start = date(2023, 1, 2)
+        end = start + timedelta(days=365)
+        rate = _performance_xirr(
+            PortfolioAnalyticsService(), TransactionRepository(db_session), portfolio.id,
+            PricePoint(date=start, value=Decimal(1000)), PricePoint(date=end, value=Decimal(1650))
+        )
+
+        expected = xirr([-1000, -500, 1650], [start, date(2023, 7, 3), end])
+        assert float(rate) == pytest.approx(expected * 100)